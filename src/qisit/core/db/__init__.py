@@ -27,6 +27,8 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.schema import DropTable
 
+from qisit.core.db import item_cache
+
 Base = declarative_base()
 """ The base class for the ORM mappings """
 
@@ -65,7 +67,11 @@ def _set_dialect(dbapi_connection, connection_record):
 def get_or_add_item(session_: sql.orm.session, table: Base, name: str, filter_args=None, *args, **kwargs):
     """
     Returns an already existing database object or creates if it's not existing. Useful for importing recipes or
-    creating items  on the fly (when the user adds a new recipe)
+    creating items  on the fly (when the user adds a new recipe).
+
+    The items are cached per session (see item_cache.ItemCache), so asking for the same item again won't hit the
+    database. New items are created with an "INSERT ... ON CONFLICT DO NOTHING" (or the dialect's equivalent) where
+    possible.
 
     Args:
         session_ (): Database session
@@ -79,16 +85,70 @@ def get_or_add_item(session_: sql.orm.session, table: Base, name: str, filter_ar
         Either an existing object or a newly created one
     """
 
-    if not filter_args:
-        the_item = session_.query(table).filter(table.name == name).first()
-    else:
-        the_item = session_.query(table).filter(*filter_args).first()
+    return item_cache.get_or_add_item(session_, table, name, filter_args, *args, **kwargs)
+
+
+def get_or_add_items(session_: sql.orm.session, table: Base, names, **kwargs) -> dict:
+    """
+    Batch version of get_or_add_item: Resolves all names with (at most) one SELECT and one INSERT
+
+    Args:
+        session_ (): Database session
+        table (): The table
+        names (): The names
+        **kwargs (): keyword args to pass to __init__
+
+    Returns:
+        A dictionary name -> (existing or newly created) object
+    """
+
+    return item_cache.get_or_add_items(session_, table, names, **kwargs)
+
+
+_uncommitted_key = "qisit_uncommitted_changes"
+""" Set in session.info when changes have been flushed, but not yet committed """
+
+
+def has_uncommitted_changes(session_: sql.orm.session) -> bool:
+    """
+    Are there any changes other sessions (connections) can't see yet?
+
+    Args:
+        session_ (): Database session
+
+    Returns:
+        True if there are pending or flushed, but not yet committed changes
+    """
+
+    if session_.new or session_.dirty or session_.deleted:
+        return True
+
+    connection = session_.connection()
+    if connection.dialect.name == "sqlite":
+        # No BEGIN is emitted (see _set_dialect), SQLite itself knows best whether there's an open transaction
+        # (a savepoint)
+        return connection.connection.in_transaction
+    return session_.info.get(_uncommitted_key, False)
+
+
+@event.listens_for(sql.orm.Session, "after_flush")
+def _flushed(session_: sql.orm.Session, flush_context):
+    session_.info[_uncommitted_key] = True
+
+
+@item_cache.listens_for_insert
+def _inserted(session_: sql.orm.Session, table, items: list):
+    session_.info[_uncommitted_key] = True
+
+
+@event.listens_for(sql.orm.Session, "after_bulk_delete")
+@event.listens_for(sql.orm.Session, "after_bulk_update")
+def _bulk_operation(update_context):
+    update_context.session.info[_uncommitted_key] = True
 
-    if the_item:
-        return the_item
 
-    # Doesn't exist (yet), so create it
-    new_item = table(name, *args, **kwargs)
-    session_.add(new_item)
-    session_.merge(new_item)
-    return new_item
+@event.listens_for(sql.orm.Session, "after_transaction_end")
+def _transaction_ended(session_: sql.orm.Session, transaction):
+    """ The outermost transaction has been committed or rolled back """
+    if transaction.parent is None:
+        session_.info.pop(_uncommitted_key, None)
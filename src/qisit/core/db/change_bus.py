@@ -0,0 +1,233 @@
+""" Notifies the models about the changes made by the session: which items of which table have been changed """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import typing
+import weakref
+
+from sqlalchemy import event, orm
+
+from qisit.core.db import item_cache
+
+
+class ChangeBus(object):
+    """
+    Turns the session's flushes into change notifications: the table, the kind of change and the ids of the items.
+    Instead of reloading themselves after every edit the models subscribe to the tables they display and apply the
+    changes.
+
+    The changes are collected by the flushes and published when the transaction (or savepoint) is committed. After a
+    rollback it's unknown what has been undone, so every table changed since the last commit is reset (rolling back
+    the outermost transaction: every table changed since it started). Subscribers
+    are called by deliver() - usually scheduled by the GUI's event loop (see scheduler): While the commit is running
+    the session can't be used for queries.
+
+    There's one bus per session, stored in the session's info dictionary. Nothing is collected until it has been
+    created.
+    """
+
+    class Change(typing.NamedTuple):
+        """ A single change notification """
+        table: typing.Any
+        """ The table (the mapped class) """
+        kind: str
+        """ INSERT, UPDATE, DELETE or RESET """
+        ids: typing.FrozenSet[int]
+        """ The ids of the changed items (empty for RESET) """
+
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+    RESET = "reset"
+    """ Anything in the table might have been changed """
+
+    _info_key = "qisit_change_bus"
+    """ The key in session.info """
+
+    scheduler: typing.Callable[[typing.Callable[[], None]], None] = None
+    """ Schedules the delivery of published changes (called with deliver). None: Call deliver() yourself """
+
+    def __init__(self):
+        self._subscribers = []
+        self._pending = {}
+        self._published = {}
+        # Tables published by savepoints. Rolling back the outermost transaction undoes their changes, too
+        self._unsaved_tables = set()
+        self._scheduled = False
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "ChangeBus":
+        """
+        Returns the session's bus, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The bus
+        """
+
+        bus = session_.info.get(cls._info_key)
+        if bus is None:
+            bus = cls()
+            session_.info[cls._info_key] = bus
+        return bus
+
+    def subscribe(self, callback: typing.Callable[[typing.List[Change]], None], *tables):
+        """
+        Subscribes to the changes of the tables. Bound methods are referenced weakly, a model that is gone doesn't
+        have to unsubscribe. Subscribers are called in the order they have subscribed.
+
+        Args:
+            callback (): Called with the list of changes
+            *tables (): The tables. None given: all tables
+
+        Returns:
+
+        """
+
+        reference = weakref.WeakMethod(callback) if hasattr(callback, "__self__") else (lambda: callback)
+        self._subscribers.append((reference, frozenset(tables)))
+
+    def unsubscribe(self, callback: typing.Callable[[typing.List[Change]], None]):
+        """ No more notifications for the callback """
+        self._subscribers = [(reference, tables) for reference, tables in self._subscribers
+                             if reference() is not None and reference() != callback]
+
+    def add(self, table, kind: str, ids: typing.Iterable[int] = ()):
+        """
+        Adds a change. It will be published with the next commit
+
+        Args:
+            table (): The table
+            kind (): The kind of change
+            ids (): The ids
+
+        Returns:
+
+        """
+
+        self._pending.setdefault((table, kind), set()).update(ids)
+
+    def _publish(self, committed: bool, outermost: bool):
+        """ The transaction (or savepoint) has been committed or rolled back """
+
+        tables = {table for table, kind in self._pending}
+        if committed:
+            for key, ids in self._pending.items():
+                self._published.setdefault(key, set()).update(ids)
+            self._unsaved_tables = set() if outermost else self._unsaved_tables | tables
+        else:
+            if outermost:
+                tables |= self._unsaved_tables
+                self._unsaved_tables = set()
+            for table in tables:
+                self._published.setdefault((table, self.RESET), set())
+        self._pending = {}
+        if not self._published:
+            return
+
+        scheduler = type(self).scheduler
+        if scheduler is not None and not self._scheduled:
+            self._scheduled = True
+            scheduler(self.deliver)
+
+    def deliver(self):
+        """
+        Calls the subscribers with the published changes
+
+        Returns:
+
+        """
+
+        self._scheduled = False
+        published, self._published = self._published, {}
+        # Within a table: a reset comes first (there's nothing to apply after it), then inserts, updates and deletes
+        order = {self.RESET: 0, self.INSERT: 1, self.UPDATE: 2, self.DELETE: 3}
+        changes = [self.Change(table, kind, frozenset(ids)) for (table, kind), ids in
+                   sorted(published.items(), key=lambda item: (item[0][0].__name__, order[item[0][1]]))]
+        if not changes:
+            return
+
+        for reference, tables in list(self._subscribers):
+            callback = reference()
+            if callback is None:
+                continue
+            relevant = [change for change in changes if not tables or change.table in tables]
+            if relevant:
+                callback(relevant)
+        self._subscribers = [(reference, tables) for reference, tables in self._subscribers if reference() is not None]
+
+
+def _bus(session_: orm.Session) -> typing.Optional[ChangeBus]:
+    return session_.info.get(ChangeBus._info_key)
+
+
+def _identity(item) -> typing.Any:
+    """ The item's primary key (a tuple if there's more than one column) """
+    identity = orm.object_mapper(item).primary_key_from_instance(item)
+    return identity[0] if len(identity) == 1 else tuple(identity)
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _collect_after_flush(session_: orm.Session, flush_context):
+    bus = _bus(session_)
+    if bus is None:
+        return
+
+    for items, kind in ((session_.new, ChangeBus.INSERT), (session_.dirty, ChangeBus.UPDATE),
+                        (session_.deleted, ChangeBus.DELETE)):
+        changed = {}
+        for item in items:
+            if kind == ChangeBus.UPDATE and not session_.is_modified(item):
+                continue
+            changed.setdefault(type(item), set()).add(_identity(item))
+        for table, ids in changed.items():
+            bus.add(table, kind, ids)
+
+
+@item_cache.listens_for_insert
+def _collect_after_insert(session_: orm.Session, table, items: list):
+    """ get_or_add_item inserts with a core statement, bypassing the flush """
+    bus = _bus(session_)
+    if bus is not None:
+        bus.add(table, ChangeBus.INSERT, (_identity(item) for item in items))
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _reset_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging items in the data editor) """
+    bus = _bus(update_context.session)
+    if bus is not None:
+        bus.add(update_context.mapper.class_, ChangeBus.RESET)
+
+
+@event.listens_for(orm.Session, "after_commit")
+def _publish_after_commit(session_: orm.Session):
+    bus = _bus(session_)
+    if bus is not None:
+        transaction = session_.transaction
+        bus._publish(committed=True, outermost=transaction is None or transaction.parent is None)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _publish_after_rollback(session_: orm.Session, previous_transaction):
+    bus = _bus(session_)
+    if bus is not None:
+        bus._publish(committed=False, outermost=previous_transaction.parent is None)
@@ -25,4 +25,6 @@ from .ingredient_unit import IngredientUnit
 from .meta import Meta
 from .recipe import Recipe
 from .recipe_image import RecipeImage
+from .recipe_signature import RecipeSignature
+from .recipe_summary import RecipeSummary
 from .yield_unit_name import YieldUnitName
@@ -15,6 +15,8 @@
 #  You should have received a copy of the GNU General Public License
 #   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
 
+import typing
+
 import sqlalchemy as sql
 from sqlalchemy.orm import relationship
 
@@ -54,6 +56,21 @@ class Category(db.Base):
 
         return db.get_or_add_item(session_=session_, table=Category, name=name)
 
+    @classmethod
+    def get_or_add_categories(cls, session_: sql.orm.session, names: typing.Iterable[str]) -> dict:
+        """
+        Batch version of get_or_add_category, resolving all names at once
+
+        Args:
+            session_ (): The database session.
+            names (): The titles of the categories
+
+        Returns:
+            A dictionary name -> category object
+        """
+
+        return db.get_or_add_items(session_=session_, table=Category, names=names)
+
     def __init__(self, name: str):
         """
         Creates a new category
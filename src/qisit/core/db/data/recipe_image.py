@@ -18,6 +18,7 @@
 import sqlalchemy as sql
 from sqlalchemy.orm import relationship, deferred
 from qisit.core import db
+from qisit.core.db.image_store import StoredBlob
 from .recipe import Recipe
 
 
@@ -39,10 +40,10 @@ class RecipeImage(db.Base):
     position = sql.Column(sql.Integer, nullable=False)
     """ The position in the recipe's image list. The main image is at main_image_pos """
 
-    image = deferred(sql.Column(sql.LargeBinary, nullable=False))
-    """ The image in full size """
+    image = deferred(sql.Column(StoredBlob, nullable=False))
+    """ The image in full size (kept in the ImageStore, if there's one) """
 
-    thumbnail = deferred(sql.Column(sql.LargeBinary, nullable=False))
+    thumbnail = deferred(sql.Column(StoredBlob, nullable=False))
     """ The thumbnail for the image"""
 
     description = sql.Column(sql.String(255), nullable=True, default=None)
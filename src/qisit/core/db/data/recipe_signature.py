@@ -0,0 +1,151 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import typing
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+
+from qisit.core import db
+from .ingredient import Ingredient
+from .ingredient_list_entry import IngredientListEntry
+from .recipe import Recipe
+
+
+class RecipeSignature(db.Base):
+    """
+    The (MinHash) signature of a recipe's title, ingredients and instructions, used for finding near duplicate recipes
+    (see qisit.core.db.duplicate_finder). The signatures are computed lazily - the flush events just delete the
+    signatures of changed recipes, they will be recomputed the next time duplicates are searched for.
+    """
+    __tablename__ = "recipe_signature"
+
+    _delete_chunk_size = 500
+    """ Number of signatures deleted per statement (SQLite has an upper limit for the number of parameters) """
+
+    recipe_id = sql.Column(sql.Integer, sql.ForeignKey("recipe.id", ondelete="CASCADE", onupdate="CASCADE"),
+                           primary_key=True)
+    """ The recipe """
+
+    version = sql.Column(sql.SmallInteger, nullable=False)
+    """ The version of the algorithm that computed the signature. Signatures of other versions are recomputed """
+
+    signature = sql.Column(sql.LargeBinary, nullable=True)
+    """ The signature. NULL if there's nothing to compute a signature of (neither ingredients nor instructions) """
+
+    @classmethod
+    def create_if_missing(cls, session_: orm.Session) -> bool:
+        """
+        Databases created by older versions don't have the signature table. Create it - it will be filled as soon as
+        it's needed
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            True if the table has been created
+        """
+
+        connection = session_.connection(mapper=sql.inspect(cls))
+        if connection.dialect.has_table(connection, cls.__tablename__):
+            return False
+
+        cls.__table__.create(connection)
+        session_.commit()
+        return True
+
+    @classmethod
+    def invalidate(cls, session_: orm.Session, recipe_ids: typing.Iterable[int] = None):
+        """
+        Deletes the signatures of the given recipes (or all signatures)
+
+        Args:
+            session_ (): The session
+            recipe_ids (): The recipes' ids. None: all recipes
+
+        Returns:
+
+        """
+
+        table = cls.__table__
+        if recipe_ids is None:
+            session_.execute(table.delete())
+            return
+
+        recipe_ids = sorted(set(recipe_ids))
+        for start in range(0, len(recipe_ids), cls._delete_chunk_size):
+            session_.execute(
+                table.delete().where(table.c.recipe_id.in_(recipe_ids[start:start + cls._delete_chunk_size])))
+
+
+def _recipes_using(session_: orm.Session, ingredient_ids: typing.Iterable[int]) -> typing.Set[int]:
+    """ The ids of all recipes containing the ingredients """
+    the_query = sql.select([IngredientListEntry.recipe_id]).where(
+        IngredientListEntry.ingredient_id.in_(list(ingredient_ids)))
+    return {row[0] for row in session_.execute(the_query)}
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _invalidate_after_flush(session_: orm.Session, flush_context):
+    """ Delete the signatures of recipes whose title, instructions or ingredients have been changed """
+
+    recipe_ids = set()
+    renamed_ingredients = set()
+    for item in session_.dirty:
+        if isinstance(item, Recipe):
+            attributes = sql.inspect(item).attrs
+            if attributes.title.history.has_changes() or attributes.instructions.history.has_changes():
+                recipe_ids.add(item.id)
+        elif isinstance(item, Ingredient) and sql.inspect(item).attrs.name.history.has_changes():
+            renamed_ingredients.add(item.id)
+
+    # New recipes don't have a signature yet, deleted ones are taken care of by the foreign key
+    for item in list(session_.new) + list(session_.dirty) + list(session_.deleted):
+        if isinstance(item, IngredientListEntry):
+            recipe_ids.add(item.recipe_id)
+            recipe_ids.update(sql.inspect(item).attrs.recipe_id.history.deleted or ())
+
+    if renamed_ingredients:
+        recipe_ids.update(_recipes_using(session_, renamed_ingredients))
+    recipe_ids.discard(None)
+    if recipe_ids:
+        RecipeSignature.invalidate(session_, recipe_ids)
+
+
+@event.listens_for(orm.Session, "after_bulk_update")
+def _invalidate_after_bulk_update(update_context):
+    """
+    Merging ingredients in the data editor moves all entries to the target ingredient - invalidate the recipes
+    containing the target. Other bulk updates on ingredient lists (there aren't any) invalidate everything
+    """
+
+    if update_context.mapper.class_ is not IngredientListEntry:
+        return
+
+    values = {getattr(key, "key", key): value for key, value in update_context.values.items()}
+    if set(values) == {"ingredient_id"}:
+        RecipeSignature.invalidate(update_context.session,
+                                   _recipes_using(update_context.session, [values["ingredient_id"]]))
+    elif not set(values) <= {"unit_id", "amount", "range_amount", "optional"}:
+        RecipeSignature.invalidate(update_context.session)
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+def _invalidate_after_bulk_delete(update_context):
+    """ There's no way to tell which recipes have lost ingredients """
+    if update_context.mapper.class_ is IngredientListEntry:
+        RecipeSignature.invalidate(update_context.session)
@@ -0,0 +1,278 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import typing
+
+import sqlalchemy as sql
+from sqlalchemy import event, func, orm
+
+from qisit.core import db
+from .author import Author
+from .category import Category
+from .category_list import CategoryList
+from .cuisine import Cuisine
+from .recipe import Recipe
+from .recipe_image import RecipeImage
+from .yield_unit_name import YieldUnitName
+
+
+class RecipeSummary(db.Base):
+    """
+    Denormalized, read only copy of everything the recipe list displays - one row per recipe. The categories are
+    already concatenated, the names of author, cuisine and yield unit are copied and every sortable column has an
+    index (the string columns as lower case sort keys). The table is kept up to date by the session's flush events,
+    see refresh() and rebuild(). Never change it directly.
+    """
+    __tablename__ = "recipe_summary"
+
+    key_length = 255
+    """ Maximum length of the sort keys """
+
+    _info_key = "qisit_recipe_summary"
+    """ The key in session.info for the recipes that have to be refreshed after the flush """
+
+    _refresh_chunk_size = 500
+    """ Number of recipes refreshed per statement (SQLite has an upper limit for the number of parameters) """
+
+    recipe_id = sql.Column(sql.Integer, sql.ForeignKey("recipe.id", ondelete="CASCADE", onupdate="CASCADE"),
+                           primary_key=True)
+    """ The recipe """
+
+    author_id = sql.Column(sql.Integer, nullable=True, index=True)
+    """ Copy of recipe.author_id (for filtering) """
+
+    cuisine_id = sql.Column(sql.Integer, nullable=True, index=True)
+    """ Copy of recipe.cuisine_id (for filtering) """
+
+    thumbnail_id = sql.Column(sql.Integer, nullable=True)
+    """ The id of the recipe's main image (if any) """
+
+    title = sql.Column(sql.String(255), nullable=False)
+    """ The recipe's title """
+
+    title_key = sql.Column(sql.String(key_length), nullable=False, index=True)
+    """ Sort key for the title """
+
+    categories = sql.Column(sql.Text, nullable=True)
+    """ The names of all categories, comma separated """
+
+    categories_key = sql.Column(sql.String(key_length), nullable=True, index=True)
+    """ Sort key for the categories """
+
+    cuisine = sql.Column(sql.String(255), nullable=True)
+    """ The cuisine's name """
+
+    cuisine_key = sql.Column(sql.String(key_length), nullable=True, index=True)
+    """ Sort key for the cuisine """
+
+    author = sql.Column(sql.String(255), nullable=True)
+    """ The author's name """
+
+    author_key = sql.Column(sql.String(key_length), nullable=True, index=True)
+    """ Sort key for the author """
+
+    yields = sql.Column(sql.Float, nullable=False, index=True)
+    """ Copy of recipe.yields """
+
+    yield_unit_name = sql.Column(sql.String(255), nullable=True)
+    """ The name of the yield unit """
+
+    rating = sql.Column(sql.SmallInteger, nullable=True, index=True)
+    """ Copy of recipe.rating """
+
+    preparation_time = sql.Column(sql.Integer, nullable=True, index=True)
+    """ Copy of recipe.preparation_time """
+
+    cooking_time = sql.Column(sql.Integer, nullable=True, index=True)
+    """ Copy of recipe.cooking_time """
+
+    total_time = sql.Column(sql.Integer, nullable=True, index=True)
+    """ Copy of recipe.total_time """
+
+    last_cooked = sql.Column(sql.Date, nullable=True, index=True)
+    """ Copy of recipe.last_cooked """
+
+    last_modified = sql.Column(sql.Date, nullable=False, index=True)
+    """ Copy of recipe.last_modified """
+
+    @classmethod
+    def _summary_query(cls) -> sql.sql.Select:
+        """ The query computing the summary rows from the normalized tables """
+
+        # db.group_concat might have been replaced (PostgreSQL), so this has to be evaluated on every call
+        categories = db.group_concat(Category.name)
+
+        def sort_key(column):
+            return func.substr(func.lower(column), 1, cls.key_length)
+
+        the_join = Recipe.__table__.outerjoin(Author.__table__).outerjoin(Cuisine.__table__).outerjoin(
+            YieldUnitName.__table__).outerjoin(RecipeImage.__table__,
+                                               sql.and_(RecipeImage.recipe_id == Recipe.id,
+                                                        RecipeImage.position == RecipeImage.main_image_pos)).outerjoin(
+            CategoryList.__table__).outerjoin(Category.__table__)
+
+        return sql.select([Recipe.id, Recipe.author_id, Recipe.cuisine_id, RecipeImage.id, Recipe.title,
+                           sort_key(Recipe.title), categories, sort_key(categories), Cuisine.name,
+                           sort_key(Cuisine.name), Author.name, sort_key(Author.name), Recipe.yields,
+                           YieldUnitName.name, Recipe.rating, Recipe.preparation_time, Recipe.cooking_time,
+                           Recipe.total_time, Recipe.last_cooked, Recipe.last_modified]).select_from(
+            the_join).group_by(Recipe.id, Author.id, Cuisine.id, YieldUnitName.id, RecipeImage.id)
+
+    @classmethod
+    def _insert_statement(cls, the_query: sql.sql.Select):
+        table = cls.__table__
+        return table.insert().from_select(
+            [table.c.recipe_id, table.c.author_id, table.c.cuisine_id, table.c.thumbnail_id, table.c.title,
+             table.c.title_key, table.c.categories, table.c.categories_key, table.c.cuisine, table.c.cuisine_key,
+             table.c.author, table.c.author_key, table.c.yields, table.c.yield_unit_name, table.c.rating,
+             table.c.preparation_time, table.c.cooking_time, table.c.total_time, table.c.last_cooked,
+             table.c.last_modified], the_query)
+
+    @classmethod
+    def create_if_missing(cls, session_: orm.Session) -> bool:
+        """
+        Databases created by older versions don't have the summary table. Create and fill it.
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            True if the table has been created
+        """
+
+        bind = session_.get_bind(mapper=sql.inspect(cls))
+        if bind.dialect.has_table(session_.connection(mapper=sql.inspect(cls)), cls.__tablename__):
+            return False
+
+        cls.__table__.create(session_.connection(mapper=sql.inspect(cls)))
+        cls.rebuild(session_)
+        session_.commit()
+        return True
+
+    @classmethod
+    def rebuild(cls, session_: orm.Session):
+        """
+        Throws away the complete table and recomputes it from scratch (two statements)
+
+        Args:
+            session_ (): The session
+
+        Returns:
+
+        """
+
+        session_.execute(cls.__table__.delete())
+        session_.execute(cls._insert_statement(cls._summary_query()))
+
+    @classmethod
+    def refresh(cls, session_: orm.Session, recipe_ids: typing.Iterable[int]):
+        """
+        Recomputes the summary of the given recipes. Recipes that don't exist (anymore) will be removed from the
+        summary.
+
+        Args:
+            session_ (): The session
+            recipe_ids (): The recipes' ids
+
+        Returns:
+
+        """
+
+        recipe_ids = sorted(set(recipe_ids))
+        table = cls.__table__
+        for start in range(0, len(recipe_ids), cls._refresh_chunk_size):
+            chunk = recipe_ids[start:start + cls._refresh_chunk_size]
+            session_.execute(table.delete().where(table.c.recipe_id.in_(chunk)))
+            session_.execute(cls._insert_statement(cls._summary_query().where(Recipe.id.in_(chunk))))
+
+
+_lookup_tables = {
+    Author: Recipe.author_id,
+    Cuisine: Recipe.cuisine_id,
+    YieldUnitName: Recipe.yield_unit_id,
+    Category: None
+}
+""" The tables whose names are part of the summary and the recipe's foreign key (None: via category_list) """
+
+
+def _recipes_using(session_: orm.Session, item) -> typing.List[int]:
+    """ The ids of all recipes displaying the (lookup) item """
+    foreign_key = _lookup_tables[type(item)]
+    if foreign_key is None:
+        the_query = sql.select([CategoryList.recipe_id]).where(CategoryList.category_id == item.id)
+    else:
+        the_query = sql.select([Recipe.id]).where(foreign_key == item.id)
+    return [row[0] for row in session_.execute(the_query)]
+
+
+@event.listens_for(orm.Session, "before_flush")
+def _collect_before_flush(session_: orm.Session, flush_context, instances):
+    """
+    Collects the recipes affected by the flush. The ids of new recipes (and images) aren't known yet, so the objects
+    themselves are stored and resolved after the flush. Recipes referencing a deleted or renamed lookup item have
+    to be queried now - after the flush the foreign keys might have already been set to NULL (or the category_list
+    entries deleted)
+    """
+
+    pending = session_.info.setdefault(RecipeSummary._info_key, {"ids": set(), "objects": []})
+    with session_.no_autoflush:
+        for item in session_.new:
+            if isinstance(item, (Recipe, RecipeImage)):
+                pending["objects"].append(item)
+
+        for item in session_.dirty:
+            if isinstance(item, (Recipe, RecipeImage)):
+                pending["objects"].append(item)
+            elif type(item) in _lookup_tables and sql.inspect(item).attrs.name.history.has_changes():
+                pending["ids"].update(_recipes_using(session_, item))
+
+        for item in session_.deleted:
+            if isinstance(item, Recipe):
+                pending["ids"].add(item.id)
+            elif isinstance(item, RecipeImage):
+                pending["ids"].add(item.recipe_id)
+            elif type(item) in _lookup_tables:
+                pending["ids"].update(_recipes_using(session_, item))
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _refresh_after_flush(session_: orm.Session, flush_context):
+    """ Everything has been written, update the summary of the affected recipes """
+    pending = session_.info.pop(RecipeSummary._info_key, None)
+    if pending is None:
+        return
+
+    recipe_ids = pending["ids"]
+    for item in pending["objects"]:
+        recipe_ids.add(item.id if isinstance(item, Recipe) else item.recipe_id)
+    recipe_ids.discard(None)
+
+    if recipe_ids:
+        RecipeSummary.refresh(session_, recipe_ids)
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _rebuild_after_bulk_operation(update_context):
+    """
+    Query.update()/Query.delete() bypass the flush and there's no (reliable) way to tell which recipes are affected.
+    These are rare operations (merging items in the data editor), so simply rebuild the summary
+    """
+
+    if update_context.mapper.class_ in (Recipe, RecipeImage, CategoryList) or \
+            update_context.mapper.class_ in _lookup_tables:
+        RecipeSummary.rebuild(update_context.session)
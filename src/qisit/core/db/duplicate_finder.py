@@ -0,0 +1,338 @@
+""" Find near duplicate recipes in the whole library (MinHash signatures, bucketed by locality sensitive hashing) """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import operator
+import re
+import typing
+import zlib
+from array import array
+
+import sqlalchemy as sql
+from sqlalchemy import orm
+
+from qisit.core.db import data
+
+
+class DuplicateFinder(object):
+    """
+    Each recipe is reduced to a set of shingles: the words of its title, the names of its ingredients and all runs of
+    three consecutive words of its instructions. Two recipes are near duplicates if their sets are similar enough
+    (Jaccard similarity).
+
+    Comparing every recipe with every other one is out of question, so each set is condensed into a short MinHash
+    signature (one permutation hashing: every shingle is hashed once, the hash selects one of the signature's bins
+    and the bin keeps the smallest value). The fraction of equal bins of two signatures estimates the Jaccard
+    similarity of the sets. The signatures are split into bands, recipes whose signatures are equal in at least one
+    band end up in the same bucket - only those are compared.
+
+    The signatures are stored in the database (data.RecipeSignature) and only computed for new or changed recipes.
+    """
+
+    signature_version = 1
+    """ Change this whenever the shingles or the signature change, the stored signatures will be recomputed """
+
+    signature_size = 64
+    """ Number of bins """
+
+    bands = 16
+    """ Number of LSH bands. Two recipes become candidates at about (1 / bands) ** (bands / signature_size) """
+
+    max_bucket_size = 50
+    """ Larger buckets (hundreds of recipes with the same title) are only compared with their first recipe """
+
+    _word_pattern = re.compile(r"\w+")
+
+    _empty = 0xFFFFFFFF
+    """ Value of an empty bin """
+
+    def __init__(self, threshold: float = 0.6):
+        """
+        Init
+
+        Args:
+            threshold (): The minimum (estimated) Jaccard similarity of duplicates
+        """
+
+        self.threshold = threshold
+
+    @classmethod
+    def words(cls, text: typing.Optional[str]) -> typing.List[str]:
+        """ The normalized (lower case, no punctuation) words of the text """
+        if not text:
+            return []
+        return cls._word_pattern.findall(text.casefold())
+
+    @classmethod
+    def ingredient_shingle(cls, name: str) -> typing.Optional[str]:
+        """ The shingle of an ingredient (None if the name consists of punctuation only) """
+        words = cls.words(name)
+        return f"i:{' '.join(words)}" if words else None
+
+    @classmethod
+    def text_shingles(cls, title: str, instructions: typing.Optional[str]) -> typing.Set[str]:
+        """ The shingles of the recipe's title and instructions """
+        shingles = {f"t:{word}" for word in cls.words(title)}
+        instruction_words = cls.words(instructions)
+        shingles.update(f"x:{' '.join(instruction_words[start:start + 3])}"
+                        for start in range(max(len(instruction_words) - 2, 0)))
+        return shingles
+
+    @classmethod
+    def shingles(cls, title: str, ingredient_names: typing.Iterable[str], instructions: typing.Optional[str]) -> \
+            typing.Set[str]:
+        """
+        The recipe's set of shingles. The prefixes keep shingles of different origin apart
+
+        Args:
+            title (): The recipe's title
+            ingredient_names (): The names of the recipe's ingredients
+            instructions (): The recipe's instructions (Markdown)
+
+        Returns:
+            The shingles
+        """
+
+        shingles = cls.text_shingles(title, instructions)
+        shingles.update(cls.ingredient_shingle(name) for name in ingredient_names)
+        shingles.discard(None)
+        return shingles
+
+    @staticmethod
+    def shingle_hash(shingle: str) -> int:
+        """ A (stable - Python's hash() isn't) 32 bit hash value """
+        return zlib.crc32(shingle.encode("utf-8"))
+
+    @classmethod
+    def signature(cls, shingles: typing.Iterable[str]) -> typing.Optional[bytes]:
+        """
+        Computes the MinHash signature of the shingles
+
+        Args:
+            shingles (): The shingles
+
+        Returns:
+            The signature (signature_size 32 bit values) or None if there are no shingles
+        """
+
+        return cls._signature({cls.shingle_hash(shingle) for shingle in shingles})
+
+    @classmethod
+    def _signature(cls, hash_values: typing.Iterable[int]) -> typing.Optional[bytes]:
+        """ The signature of the shingles' hash values """
+
+        size = cls.signature_size
+        empty = cls._empty
+        bins = [empty] * size
+        for hash_value in hash_values:
+            # The bin is taken from the low bits, the value from the remaining ones
+            the_bin = hash_value % size
+            value = hash_value // size
+            if value < bins[the_bin]:
+                bins[the_bin] = value
+
+        filled = [the_bin for the_bin in range(size) if bins[the_bin] != empty]
+        if not filled:
+            return None
+
+        # Densification: An empty bin borrows the value of the next filled bin (to the right), offset by the distance.
+        # Otherwise two empty bins would count as a match
+        signature = array("I", bins)
+        offset = (empty // size) + 1
+        next_filled = filled[0] + size
+        for the_bin in reversed(range(size)):
+            if bins[the_bin] == empty:
+                distance = next_filled - the_bin
+                signature[the_bin] = (bins[next_filled % size] + distance * offset) & empty
+            else:
+                next_filled = the_bin
+        return signature.tobytes()
+
+    @classmethod
+    def similarity(cls, signature: bytes, other_signature: bytes) -> float:
+        """ The estimated Jaccard similarity of the recipes """
+        return cls._matching_bins(array("I", signature), array("I", other_signature)) / cls.signature_size
+
+    @staticmethod
+    def _matching_bins(first: array, second: array) -> int:
+        return sum(map(operator.eq, first, second))
+
+    def _missing(self, the_query: sql.sql.Select, recipe_id: sql.Column) -> sql.sql.Select:
+        """ Restricts the query to recipes without an up to date signature """
+        signature = data.RecipeSignature
+        return the_query.where(~sql.exists().where(sql.and_(signature.recipe_id == recipe_id,
+                                                            signature.version == self.signature_version)))
+
+    def update_signatures(self, session_: orm.Session) -> int:
+        """
+        Computes the signatures of all recipes that don't have an (up to date) signature yet
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The number of computed signatures
+        """
+
+        entry = data.IngredientListEntry
+        table = data.RecipeSignature.__table__
+
+        # Each ingredient is normalized and hashed only once
+        ingredient_hashes = {}
+        for ingredient_id, name in session_.execute(
+                sql.select([data.Ingredient.id, data.Ingredient.name]).where(data.Ingredient.is_group == False)):
+            shingle = self.ingredient_shingle(name)
+            if shingle is not None:
+                ingredient_hashes[ingredient_id] = self.shingle_hash(shingle)
+
+        # Two more queries for all recipes, no matter how many are missing
+        recipe_hashes = {}
+        for recipe_id, ingredient_id in session_.execute(
+                self._missing(sql.select([entry.recipe_id, entry.ingredient_id]), entry.recipe_id)):
+            hash_value = ingredient_hashes.get(ingredient_id)
+            if hash_value is not None:
+                recipe_hashes.setdefault(recipe_id, set()).add(hash_value)
+
+        rows = []
+        for recipe_id, title, instructions in session_.execute(
+                self._missing(sql.select([data.Recipe.id, data.Recipe.title, data.Recipe.instructions]),
+                              data.Recipe.id)):
+            hash_values = recipe_hashes.get(recipe_id, set())
+            hash_values.update(self.shingle_hash(shingle) for shingle in self.text_shingles(title, instructions))
+            rows.append({"recipe_id": recipe_id, "version": self.signature_version,
+                         "signature": self._signature(hash_values)})
+
+        # The savepoint makes it a single transaction (instead of one per row)
+        with session_.begin_nested():
+            session_.execute(table.delete().where(table.c.version != self.signature_version))
+            if rows:
+                session_.execute(table.insert(), rows)
+        return len(rows)
+
+    def clusters(self, session_: orm.Session) -> typing.List[typing.List[int]]:
+        """
+        Finds the clusters of near duplicate recipes. Missing signatures are computed (and stored) first
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The clusters (the recipes' ids, sorted), the largest first
+        """
+
+        self.update_signatures(session_)
+
+        signatures = {recipe_id: signature for recipe_id, signature in session_.execute(
+            sql.select([data.RecipeSignature.recipe_id, data.RecipeSignature.signature]).where(
+                data.RecipeSignature.signature != None))}
+
+        # Slices of the raw bytes are perfectly good bucket keys
+        band_length = len(next(iter(signatures.values()))) // self.bands if signatures else 0
+        buckets = {}
+        for recipe_id, signature in signatures.items():
+            for band in range(self.bands):
+                key = (band, signature[band * band_length:(band + 1) * band_length])
+                buckets.setdefault(key, []).append(recipe_id)
+        vectors = {recipe_id: array("I", signature) for recipe_id, signature in signatures.items()}
+        min_matching_bins = self.threshold * self.signature_size
+
+        # Union find
+        parents = {}
+
+        def find(recipe_id: int) -> int:
+            root = parents.setdefault(recipe_id, recipe_id)
+            while parents[root] != root:
+                root = parents[root]
+            while recipe_id != root:
+                parents[recipe_id], recipe_id = root, parents[recipe_id]
+            return root
+
+        compared = set()
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            pairs = ((members[0], other) for other in members[1:]) if len(members) > self.max_bucket_size else (
+                (first, second) for position, first in enumerate(members) for second in members[position + 1:])
+            for first, second in pairs:
+                if (first, second) in compared:
+                    continue
+                compared.add((first, second))
+                if self._matching_bins(vectors[first], vectors[second]) >= min_matching_bins:
+                    first_root, second_root = find(first), find(second)
+                    if first_root != second_root:
+                        parents[max(first_root, second_root)] = min(first_root, second_root)
+
+        clusters = {}
+        for recipe_id in parents:
+            clusters.setdefault(find(recipe_id), []).append(recipe_id)
+        return sorted((sorted(cluster) for cluster in clusters.values()), key=lambda cluster: (-len(cluster), cluster))
+
+    @staticmethod
+    def merge(session_: orm.Session, target_id: int, source_ids: typing.Collection[int]):
+        """
+        Merges the source recipes into the target: The target gets the sources' categories and images (appended to
+        its own), the sources are deleted. Set based (one UPDATE of the categories, one of the images, one DELETE of
+        the sources). Doesn't commit.
+
+        Args:
+            session_ (): The session
+            target_id (): The recipe that remains
+            source_ids (): The recipes that are merged into the target (and deleted)
+
+        Returns:
+
+        """
+
+        source_ids = [source_id for source_id in source_ids if source_id != target_id]
+        if not source_ids:
+            return
+        source_order = {source_id: position for position, source_id in enumerate(source_ids)}
+
+        # Every category only once. The categories that aren't moved are deleted together with their recipes
+        category_list = data.CategoryList
+        target_categories = set()
+        moved_categories = {}
+        for recipe_id, category_id in session_.query(category_list.recipe_id, category_list.category_id).filter(
+                category_list.recipe_id.in_([target_id] + source_ids)).order_by(category_list.category_id):
+            if recipe_id == target_id:
+                target_categories.add(category_id)
+            else:
+                moved_categories.setdefault(category_id, recipe_id)
+        moved_categories = [(recipe_id, category_id) for category_id, recipe_id in moved_categories.items()
+                            if category_id not in target_categories]
+
+        # Query.update()/delete() (instead of plain SQL) so the indexes and caches are notified
+        if moved_categories:
+            session_.query(category_list).filter(
+                sql.tuple_(category_list.recipe_id, category_list.category_id).in_(moved_categories)).update(
+                {category_list.recipe_id: target_id}, synchronize_session=False)
+
+        # The images keep their order, the positions stay contiguous
+        image = data.RecipeImage
+        images = sorted(session_.query(image.id, image.recipe_id, image.position).filter(
+            image.recipe_id.in_(source_ids)), key=lambda row: (source_order[row.recipe_id], row.position))
+        if images:
+            last_position = session_.query(sql.func.max(image.position)).filter(image.recipe_id == target_id).scalar()
+            first_position = 0 if last_position is None else last_position + 1
+            positions = {row.id: first_position + number for number, row in enumerate(images)}
+            session_.query(image).filter(image.id.in_(positions)).update(
+                {image.recipe_id: target_id, image.position: sql.case(positions, value=image.id)},
+                synchronize_session=False)
+
+        session_.query(data.Recipe).filter(data.Recipe.id.in_(source_ids)).delete(synchronize_session=False)
+        session_.expire_all()
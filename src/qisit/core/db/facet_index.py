@@ -0,0 +1,281 @@
+""" An in-memory index of the recipe's categories, authors and cuisines for counting filter results """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import typing
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+
+from qisit.core.db import data
+
+
+def bitset(ids: typing.Iterable[int]) -> int:
+    """
+    Creates a bitset (a plain python int, bit n set <=> id n is in the set)
+
+    Args:
+        ids (): The ids
+
+    Returns:
+        The bitset
+    """
+
+    ids = list(ids)
+    if not ids:
+        return 0
+
+    # Setting the bits one by one in an int would copy the whole (growing) int each time
+    buffer = bytearray(max(ids) // 8 + 1)
+    for id_ in ids:
+        buffer[id_ >> 3] |= 1 << (id_ & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def popcount(bits: int) -> int:
+    """ The number of ids in the bitset """
+    return bin(bits).count("1")
+
+
+class FacetIndex(object):
+    """
+    One bitset of recipe ids for each category, author and cuisine. Combining filters is a matter of a few bitwise
+    ANDs and ORs, so the number of recipes for every filter item (under the current filter) can be computed without
+    asking the database.
+
+    There's one index per session (stored in the session's info dictionary). It's updated on every flush. Whenever it
+    can't be updated (rollback, Query.update()/delete()) it's marked as stale and reloaded from the database the next
+    time it's used.
+    """
+
+    _info_key = "qisit_facet_index"
+    """ The key in session.info """
+
+    facet_tables = (data.Category, data.Cuisine, data.Author)
+    """ The tables the recipes can be filtered by """
+
+    def __init__(self):
+        self._facets = {table: {} for table in self.facet_tables}
+        self._recipes = 0
+        self.stale = True
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "FacetIndex":
+        """
+        Returns the session's index, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The index
+        """
+
+        index = session_.info.get(cls._info_key)
+        if index is None:
+            index = cls()
+            session_.info[cls._info_key] = index
+        return index
+
+    @staticmethod
+    def _facet_query(table, recipe_ids: typing.Collection[int] = None) -> sql.sql.Select:
+        """ (recipe id, item id) of the table """
+        if table == data.Category:
+            the_query = sql.select([data.CategoryList.recipe_id, data.CategoryList.category_id])
+            recipe_column = data.CategoryList.recipe_id
+        else:
+            foreign_key = data.Recipe.author_id if table == data.Author else data.Recipe.cuisine_id
+            the_query = sql.select([data.Recipe.id, foreign_key]).where(foreign_key.isnot(None))
+            recipe_column = data.Recipe.id
+
+        if recipe_ids is not None:
+            the_query = the_query.where(recipe_column.in_(recipe_ids))
+        return the_query
+
+    def count(self, session_: orm.Session, filters: typing.Dict[typing.Any, typing.Set[int]] = None) -> int:
+        """
+        The number of recipes matching the filters
+
+        Args:
+            session_ (): The session
+            filters (): table -> set of selected ids, see matching()
+
+        Returns:
+            The number
+        """
+
+        bits = self.matching(session_, filters)
+        return popcount(self._recipes if bits is None else bits)
+
+    def counts(self, session_: orm.Session, table, filters: typing.Dict[typing.Any, typing.Set[int]] = None) -> \
+            typing.Dict[int, typing.Tuple[int, int]]:
+        """
+        The number of recipes for every item of the table. The selection of the table itself is ignored, i.e. the
+        count is the number of recipes the user would get by (additionally) selecting the item
+
+        Args:
+            session_ (): The session
+            table (): The table (data.Category, data.Cuisine or data.Author)
+            filters (): table -> set of selected ids, see matching()
+
+        Returns:
+            item id -> (number of recipes matching the other filters, total number of recipes)
+        """
+
+        bits = self.matching(session_, filters, exclude=table)
+        result = {}
+        for item_id, item_bits in self._facets[table].items():
+            total = popcount(item_bits)
+            result[item_id] = (total if bits is None else popcount(item_bits & bits), total)
+        return result
+
+    def invalidate(self):
+        """ Mark the index as stale. It will be reloaded the next time it's used """
+        self.stale = True
+
+    def load(self, session_: orm.Session):
+        """
+        (Re)loads the complete index from the database. One query per table
+
+        Args:
+            session_ (): The session
+
+        Returns:
+
+        """
+
+        for table in self.facet_tables:
+            item_recipes = {}
+            for recipe_id, item_id in session_.execute(self._facet_query(table)):
+                item_recipes.setdefault(item_id, []).append(recipe_id)
+            self._facets[table] = {item_id: bitset(recipe_ids) for item_id, recipe_ids in item_recipes.items()}
+
+        self._recipes = bitset(row[0] for row in session_.execute(sql.select([data.Recipe.id])))
+        self.stale = False
+
+    def matching(self, session_: orm.Session, filters: typing.Dict[typing.Any, typing.Set[int]] = None,
+                 exclude=None) -> typing.Optional[int]:
+        """
+        The recipes matching the filters. Items of the same table are ORed, tables are ANDed - exactly as
+        RecipeTableModel's filters.
+
+        Args:
+            session_ (): The session (for reloading a stale index)
+            filters (): table -> set of selected ids. An empty set means no filter
+            exclude (): Ignore the filter of this table
+
+        Returns:
+            The bitset of the matching recipes or None if no filter is active
+        """
+
+        if self.stale:
+            self.load(session_)
+
+        bits = None
+        for table, item_ids in (filters or {}).items():
+            if table == exclude or not item_ids:
+                continue
+            table_bits = 0
+            for item_id in item_ids:
+                table_bits |= self._facets[table].get(item_id, 0)
+            bits = table_bits if bits is None else bits & table_bits
+        return bits
+
+    def remove_items(self, table, item_ids: typing.Iterable[int]):
+        """ The items have been deleted """
+        for item_id in item_ids:
+            self._facets[table].pop(item_id, None)
+
+    def update_recipes(self, session_: orm.Session, recipe_ids: typing.Collection[int]):
+        """
+        Updates (or removes) the recipes in the index. The recipes' current state is read from the database
+
+        Args:
+            session_ (): The session
+            recipe_ids (): The ids of the changed (or deleted) recipes
+
+        Returns:
+
+        """
+
+        if not recipe_ids:
+            return
+
+        mask = bitset(recipe_ids)
+        existing = bitset(row[0] for row in session_.execute(
+            sql.select([data.Recipe.id]).where(data.Recipe.id.in_(recipe_ids))))
+        self._recipes = (self._recipes & ~mask) | existing
+
+        for table in self.facet_tables:
+            item_recipes = {}
+            for recipe_id, item_id in session_.execute(self._facet_query(table, recipe_ids)):
+                item_recipes.setdefault(item_id, []).append(recipe_id)
+
+            facet = self._facets[table]
+            for item_id in list(facet):
+                facet[item_id] &= ~mask
+                if not facet[item_id] and item_id not in item_recipes:
+                    del facet[item_id]
+            for item_id, ids in item_recipes.items():
+                facet[item_id] = facet.get(item_id, 0) | bitset(ids)
+
+
+def _loaded_index(session_: orm.Session) -> typing.Optional[FacetIndex]:
+    """ The session's index - if there's an index worth updating """
+    index = session_.info.get(FacetIndex._info_key)
+    if index is None or index.stale:
+        return None
+    return index
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _update_after_flush(session_: orm.Session, flush_context):
+    """ Update the changed recipes and drop deleted items """
+    index = _loaded_index(session_)
+    if index is None:
+        return
+
+    recipe_ids = set()
+    for item in list(session_.new) + list(session_.dirty):
+        if isinstance(item, data.Recipe):
+            recipe_ids.add(item.id)
+
+    for item in session_.deleted:
+        if isinstance(item, data.Recipe):
+            recipe_ids.add(item.id)
+        elif isinstance(item, index.facet_tables):
+            index.remove_items(type(item), [item.id])
+    recipe_ids.discard(None)
+    index.update_recipes(session_, recipe_ids)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _invalidate_after_rollback(session_: orm.Session, previous_transaction):
+    """ The rollback might have undone some of the changes """
+    index = _loaded_index(session_)
+    if index is not None:
+        index.invalidate()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _invalidate_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging items in the data editor) """
+    index = _loaded_index(update_context.session)
+    if index is not None and update_context.mapper.class_ in (data.Recipe, data.CategoryList) + index.facet_tables:
+        index.invalidate()
@@ -0,0 +1,405 @@
+""" Keeps the images outside the database, in a content addressed directory (optional) """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import mmap
+import os
+import tempfile
+import typing
+from collections import Counter
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+
+from qisit.core import db
+
+
+class ImageStore(object):
+    """
+    A directory of blobs (images, thumbnails), each stored in a file named by the SHA-256 of its content. The database
+    only holds a reference (see reference()) - the blob columns are of type StoredBlob, which writes the blobs into the
+    active store and reads them back transparently. Identical blobs are stored once, no matter how many rows use them.
+
+    A blob's reference count is the number of rows referencing it. It's counted (one query), not stored, so it can't
+    drift - rows deleted by the database itself (ON DELETE CASCADE, Query.delete()) count as well. The blobs a
+    session's transaction no longer references (changed or deleted rows, noted before the flush or the bulk operation)
+    are removed when the outermost transaction ends - if no other row references them. collect() without any digests
+    checks all blobs, migrate() does so when it's done.
+
+    Larger blobs are memory mapped when read: the value is a memoryview of the file's mapping. Small ones (thumbnails)
+    are read, each mapping would keep a file descriptor open.
+
+    The store is optional: as long as there's no active store (see active) the blobs are kept in the database. Once
+    activated the blobs still in the database are readable, migrate() moves them out.
+    """
+
+    reference_prefix = b"qisit-image-store:"
+    """ References start with this, blobs (JPEG, PNG, ...) never do """
+
+    reference_length = len(reference_prefix) + hashlib.sha256().digest_size * 2
+    """ The length of a reference """
+
+    active = None
+    """ The store the blob columns are written to and read from (None: the blobs are kept in the database) """
+
+    def __init__(self, root: str, mmap_threshold: int = 64 * 1024):
+        """
+        Init
+
+        Args:
+            root (): The directory (created if necessary)
+            mmap_threshold (): Blobs at least as large as this are memory mapped when read
+        """
+
+        self.root = root
+        self.mmap_threshold = mmap_threshold
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def for_engine(cls, engine: Engine, create: bool = False) -> typing.Optional["ImageStore"]:
+        """
+        The store of a database: the directory next to the database file ("recipes.db" -> "recipes.db.images")
+
+        Args:
+            engine (): The database's engine
+            create (): Create the store if it doesn't exist yet
+
+        Returns:
+            The store or None if it doesn't exist (or the database isn't a SQLite file)
+        """
+
+        url = engine.url
+        if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+            return None
+        root = os.path.abspath(url.database) + ".images"
+        if not create and not os.path.isdir(root):
+            return None
+        return cls(root)
+
+    @classmethod
+    def is_reference(cls, value: typing.Any) -> bool:
+        """ Is the (column's) value a reference to a stored blob? """
+        return isinstance(value, (bytes, bytearray, memoryview)) and len(value) == cls.reference_length and \
+            bytes(value[:len(cls.reference_prefix)]) == cls.reference_prefix
+
+    @classmethod
+    def reference(cls, digest: str) -> bytes:
+        """ The reference to the blob (stored in the database instead of the blob) """
+        return cls.reference_prefix + digest.encode("ascii")
+
+    @classmethod
+    def digest(cls, reference: bytes) -> str:
+        """ The digest (the file's name) of the referenced blob """
+        return bytes(reference[len(cls.reference_prefix):]).decode("ascii")
+
+    def path(self, digest: str) -> str:
+        """ The blob's file. The files are spread over 256 subdirectories """
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, blob: bytes) -> bytes:
+        """
+        Stores the blob (unless it's already stored)
+
+        Args:
+            blob (): The blob
+
+        Returns:
+            The reference
+        """
+
+        digest = hashlib.sha256(blob).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # Written under a temporary name, so the file is either complete or not there at all
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+            try:
+                with os.fdopen(file_descriptor, "wb") as file:
+                    file.write(blob)
+                os.replace(temporary_path, path)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+        return self.reference(digest)
+
+    def get(self, reference: bytes) -> typing.Union[bytes, memoryview]:
+        """
+        Reads a blob
+
+        Args:
+            reference (): The blob's reference
+
+        Returns:
+            The blob (a memoryview of the mapped file if it's large enough)
+        """
+
+        with open(self.path(self.digest(reference)), "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < self.mmap_threshold or size == 0:
+                return file.read()
+            # The mapping stays valid after the file has been closed (and even after it has been deleted)
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def digests(self) -> typing.Set[str]:
+        """ The digests of all stored blobs """
+        digests = set()
+        for directory in os.scandir(self.root):
+            if directory.is_dir():
+                digests.update(entry.name for entry in os.scandir(directory.path)
+                               if len(entry.name) == hashlib.sha256().digest_size * 2)
+        return digests
+
+    @classmethod
+    def stored_columns(cls) -> typing.List[sql.Column]:
+        """ All columns (of all tables) whose blobs are stored """
+        return [column for table in db.Base.metadata.tables.values() for column in table.columns
+                if isinstance(column.type, StoredBlob)]
+
+    @classmethod
+    def head(cls, column: sql.Column) -> sql.sql.ColumnElement:
+        """ The first bytes of the column's values - the references. The blobs still in the database aren't read """
+        return sql.func.substr(sql.type_coerce(column, sql.LargeBinary), 1, cls.reference_length)
+
+    @classmethod
+    def reference_counts(cls, connection, digests: typing.Collection[str] = None) -> typing.Counter[str]:
+        """
+        The number of rows referencing each blob
+
+        Args:
+            connection (): A connection or session
+            digests (): Count the references of these blobs only. Default: all blobs
+
+        Returns:
+            Digest -> number of references
+        """
+
+        counts = Counter()
+        for column in cls.stored_columns():
+            if digests is None:
+                head = cls.head(column)
+                for value, count in connection.execute(sql.select([head, sql.func.count()]).group_by(head)):
+                    if cls.is_reference(value):
+                        counts[cls.digest(value)] += count
+                continue
+
+            raw_column = sql.type_coerce(column, sql.LargeBinary)
+            references = [cls.reference(digest) for digest in digests]
+            for start in range(0, len(references), 500):
+                for value, count in connection.execute(sql.select([raw_column, sql.func.count()]).where(
+                        raw_column.in_(references[start:start + 500])).group_by(raw_column)):
+                    counts[cls.digest(value)] += count
+        return counts
+
+    def collect(self, connection, digests: typing.Collection[str] = None) -> int:
+        """
+        Removes the blobs no longer referenced by any row
+
+        Args:
+            connection (): A connection or session. It must see the committed data
+            digests (): Only these blobs are checked. Default: all stored blobs (the complete directory is read)
+
+        Returns:
+            The number of removed blobs
+        """
+
+        referenced = self.reference_counts(connection, digests)
+        removed = 0
+        for digest in self.digests() if digests is None else digests:
+            if not referenced[digest]:
+                try:
+                    os.unlink(self.path(digest))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def migrate(self, session_: orm.Session, batch_size: int = 50) -> typing.Tuple[int, int]:
+        """
+        Moves the blobs still kept in the database into the store, committing after each batch (so it can be
+        interrupted and restarted). Identical blobs end up in the same file. Finally all blobs no longer referenced
+        are removed (see collect()).
+
+        Args:
+            session_ (): The session
+            batch_size (): The number of rows per batch
+
+        Returns:
+            (Number of moved blobs, number of bytes moved out of the database)
+        """
+
+        moved = 0
+        moved_bytes = 0
+        for column in self.stored_columns():
+            table = column.table
+            primary_key = list(table.primary_key.columns)[0]
+            raw_column = sql.type_coerce(column, sql.LargeBinary)
+            head = sql.func.substr(raw_column, 1, len(self.reference_prefix))
+            ids = [row_id for row_id, in session_.execute(
+                sql.select([primary_key]).where(head != self.reference_prefix).order_by(primary_key))]
+
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start:start + batch_size]
+                for row_id, blob in session_.execute(
+                        sql.select([primary_key, raw_column]).where(primary_key.in_(batch))).fetchall():
+                    if self.is_reference(blob):
+                        continue
+                    session_.execute(table.update().where(primary_key == row_id).values(
+                        {column.name: self.put(blob)}))
+                    moved += 1
+                    moved_bytes += len(blob)
+                session_.commit()
+        self.collect(session_)
+        return moved, moved_bytes
+
+
+class StoredBlob(sql.types.TypeDecorator):
+    """
+    A blob column whose values are kept in the active ImageStore (if there's one). Reads return the blob, no matter
+    where it's kept
+    """
+
+    impl = sql.LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        store = ImageStore.active
+        if value is None or store is None or ImageStore.is_reference(value):
+            return value
+        return store.put(bytes(value))
+
+    def process_result_value(self, value, dialect):
+        if not ImageStore.is_reference(value):
+            return value
+        if ImageStore.active is None:
+            raise ValueError("The images are kept in an image store, but there's no active store")
+        return ImageStore.active.get(value)
+
+
+_dereferenced_key = "qisit_image_store_dereferenced"
+""" In session.info: the digests of the blobs the session's transaction has stopped referencing (maybe unused now) """
+
+_written_key = "qisit_image_store_written"
+""" Set in session.info when the session's transaction has stored blobs. Rolled back, they might be unused """
+
+_sweep_key = "qisit_image_store_sweep"
+""" Set in session.info when the unused blobs are unknown (rolled back blobs): all blobs are checked """
+
+
+def _stored_columns_by_table() -> typing.Dict[sql.Table, typing.List[sql.Column]]:
+    columns = {}
+    for column in ImageStore.stored_columns():
+        columns.setdefault(column.table, []).append(column)
+    return columns
+
+
+def _note_dereferenced(session_: orm.Session, column: sql.Column, whereclause):
+    """ The blobs of the rows about to be changed or deleted might be no longer referenced afterwards """
+    digests = session_.info.setdefault(_dereferenced_key, set())
+    head = ImageStore.head(column)
+    for value, in session_.execute(sql.select([head]).where(whereclause)):
+        if ImageStore.is_reference(value):
+            digests.add(ImageStore.digest(value))
+
+
+@event.listens_for(orm.Session, "before_flush")
+def _note_changes(session_: orm.Session, flush_context, instances):
+    if ImageStore.active is None:
+        return
+
+    stored_columns = _stored_columns_by_table()
+    # column -> the ids of the changed or deleted rows
+    changed_ids = {}
+    for item in list(session_.new) + list(session_.dirty) + list(session_.deleted):
+        state = sql.inspect(item)
+        columns = stored_columns.get(state.mapper.local_table, ())
+        for column in columns:
+            changed = state.attrs[state.mapper.get_property_by_column(column).key].history.has_changes()
+            if changed:
+                session_.info[_written_key] = True
+            if state.has_identity and (changed or item in session_.deleted):
+                changed_ids.setdefault(column, []).append(state.identity[0])
+
+    for column, ids in changed_ids.items():
+        primary_key = list(column.table.primary_key.columns)[0]
+        for start in range(0, len(ids), 500):
+            _note_dereferenced(session_, column, primary_key.in_(ids[start:start + 500]))
+
+
+@event.listens_for(orm.Query, "before_compile_update")
+def _note_bulk_update(query: orm.Query, update_context):
+    if ImageStore.active is None:
+        return
+
+    mapper = update_context.mapper
+    keys = {getattr(key, "key", key) for key in update_context.values}
+    for column in _stored_columns_by_table().get(mapper.local_table, ()):
+        if column.key in keys or mapper.get_property_by_column(column).key in keys:
+            query.session.info[_written_key] = True
+            _note_dereferenced(query.session, column, query.whereclause if query.whereclause is not None else
+                               sql.true())
+
+
+@event.listens_for(orm.Query, "before_compile_delete")
+def _note_bulk_delete(query: orm.Query, delete_context):
+    """ The deleted rows' blobs and the blobs of the rows deleted by the database (ON DELETE CASCADE) """
+    if ImageStore.active is None:
+        return
+
+    table = delete_context.mapper.local_table
+    whereclause = query.whereclause if query.whereclause is not None else sql.true()
+    stored_columns = _stored_columns_by_table()
+    for column in stored_columns.get(table, ()):
+        _note_dereferenced(query.session, column, whereclause)
+
+    for stored_table, columns in stored_columns.items():
+        for foreign_key in stored_table.foreign_keys:
+            if foreign_key.ondelete != "CASCADE":
+                continue
+            parent_table = foreign_key.column.table
+            if parent_table is table:
+                deleted = sql.select([foreign_key.column]).where(whereclause)
+                for column in columns:
+                    _note_dereferenced(query.session, column, foreign_key.parent.in_(deleted))
+            elif any(other.ondelete == "CASCADE" and other.column.table is table
+                     for other in parent_table.foreign_keys):
+                # A cascade of cascades - not worth following
+                query.session.info[_sweep_key] = True
+
+
+@event.listens_for(orm.Session, "after_rollback")
+def _note_rollback(session_: orm.Session):
+    """ The blobs stored by the transaction (or savepoint) might be unused now """
+    if session_.info.get(_written_key):
+        session_.info[_sweep_key] = True
+
+
+@event.listens_for(orm.Session, "after_transaction_end")
+def _collect_after_transaction(session_: orm.Session, transaction):
+    """ The outermost transaction has been committed or rolled back: the database's state is final """
+    if transaction.parent is not None:
+        return
+    digests = session_.info.pop(_dereferenced_key, None)
+    sweep = session_.info.pop(_sweep_key, False)
+    session_.info.pop(_written_key, None)
+    store = ImageStore.active
+    if store is not None and (digests or sweep):
+        # The session can't be used right now
+        with session_.get_bind().connect() as connection:
+            store.collect(connection, None if sweep else digests)
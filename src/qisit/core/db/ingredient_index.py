@@ -0,0 +1,321 @@
+""" An inverted index ingredient -> recipes for filtering recipes by their ingredients """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import typing
+from array import array
+from enum import IntEnum
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+
+from qisit.core.db import data
+
+
+class IngredientFilter(object):
+    """ Filter recipes by their ingredients: "All recipes containing onion and garlic, but no cilantro" """
+
+    def __init__(self):
+        self.include = set()
+        """ The ids of the ingredients the recipe has to contain (all of them) """
+
+        self.exclude = set()
+        """ The ids of the ingredients the recipe mustn't contain (none of them) """
+
+        self.optional = True
+        """ Do optional ingredients count? If not, a recipe with "optional: cilantro" doesn't contain cilantro """
+
+        self.alternatives = True
+        """
+        Do alternative ingredients count? If not, a recipe with "milk or cream" contains neither milk nor cream (both
+        can be replaced by something else)
+        """
+
+    @property
+    def active(self) -> bool:
+        return bool(self.include or self.exclude)
+
+    def clear(self):
+        self.include.clear()
+        self.exclude.clear()
+
+
+class IngredientIndex(object):
+    """
+    Inverted index: ingredient -> sorted arrays of recipe ids. There's one array for each Usage, so optional or
+    alternative ingredients can be taken into account (or not).
+
+    There's one index per session (stored in the session's info dictionary). It's updated on every flush. Whenever it
+    can't be updated (rollback, Query.update()/delete()) it's marked as stale and reloaded from the database the next
+    time it's used.
+    """
+
+    class Usage(IntEnum):
+        """ How the ingredient is used in the recipe. If it's used more than once, the lowest value counts """
+        REQUIRED = 0
+        ALTERNATIVE = 1
+        OPTIONAL = 2
+
+    _info_key = "qisit_ingredient_index"
+    """ The key in session.info """
+
+    def __init__(self):
+        self._postings = {}
+        self._recipe_ingredients = {}
+        self.stale = True
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "IngredientIndex":
+        """
+        Returns the session's index, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The index
+        """
+
+        index = session_.info.get(cls._info_key)
+        if index is None:
+            index = cls()
+            session_.info[cls._info_key] = index
+        return index
+
+    @classmethod
+    def recipe_usages(cls, entries: typing.Iterable[typing.Tuple[int, int, bool]]) -> typing.Dict[int, "Usage"]:
+        """
+        Determines how the ingredients are used in a recipe
+
+        Args:
+            entries (): (ingredient_id, position, optional) of all the recipe's ingredient list entries
+
+        Returns:
+            ingredient id -> usage
+        """
+
+        entry = data.IngredientListEntry
+        entries = [(ingredient_id, position, optional) for ingredient_id, position, optional in entries
+                   if position >= 0 and not entry.is_group(position)]
+
+        # Ingredients with "or" alternatives below them can be replaced, too
+        replaceable = {(position // entry.GROUP_INGREDIENT_FACTOR) * entry.GROUP_INGREDIENT_FACTOR
+                       for ingredient_id, position, optional in entries
+                       if position % entry.GROUP_INGREDIENT_FACTOR != 0}
+
+        usages = {}
+        for ingredient_id, position, optional in entries:
+            if optional:
+                usage = cls.Usage.OPTIONAL
+            elif position % entry.GROUP_INGREDIENT_FACTOR != 0 or position in replaceable:
+                usage = cls.Usage.ALTERNATIVE
+            else:
+                usage = cls.Usage.REQUIRED
+            usages[ingredient_id] = min(usage, usages.get(ingredient_id, usage))
+        return usages
+
+    @staticmethod
+    def _entry_query(recipe_ids: typing.Collection[int] = None) -> sql.sql.Select:
+        the_query = sql.select([data.IngredientListEntry.recipe_id, data.IngredientListEntry.ingredient_id,
+                                data.IngredientListEntry.position, data.IngredientListEntry.optional])
+        if recipe_ids is not None:
+            the_query = the_query.where(data.IngredientListEntry.recipe_id.in_(recipe_ids))
+        return the_query.order_by(data.IngredientListEntry.recipe_id)
+
+    def _read_recipes(self, session_: orm.Session, recipe_ids: typing.Collection[int] = None) -> \
+            typing.Dict[int, typing.Dict[int, "Usage"]]:
+        """ recipe id -> (ingredient id -> usage) """
+        entries = {}
+        for recipe_id, ingredient_id, position, optional in session_.execute(self._entry_query(recipe_ids)):
+            entries.setdefault(recipe_id, []).append((ingredient_id, position, optional))
+        return {recipe_id: self.recipe_usages(recipe_entries) for recipe_id, recipe_entries in entries.items()}
+
+    def containing(self, session_: orm.Session, ingredient_id: int, optional: bool = True,
+                   alternatives: bool = True) -> typing.Set[int]:
+        """
+        The recipes containing the ingredient
+
+        Args:
+            session_ (): The session (for reloading a stale index)
+            ingredient_id (): The ingredient
+            optional (): Count optional ingredients
+            alternatives (): Count alternative ingredients
+
+        Returns:
+            The ids of the recipes
+        """
+
+        if self.stale:
+            self.load(session_)
+
+        postings = self._postings.get(ingredient_id)
+        if postings is None:
+            return set()
+
+        recipes = set(postings[self.Usage.REQUIRED])
+        if alternatives:
+            recipes.update(postings[self.Usage.ALTERNATIVE])
+        if optional:
+            recipes.update(postings[self.Usage.OPTIONAL])
+        return recipes
+
+    def invalidate(self):
+        """ Mark the index as stale. It will be reloaded the next time it's used """
+        self.stale = True
+
+    def load(self, session_: orm.Session):
+        """
+        (Re)loads the complete index from the database (one query)
+
+        Args:
+            session_ (): The session
+
+        Returns:
+
+        """
+
+        postings = {}
+        self._recipe_ingredients = self._read_recipes(session_)
+
+        # The recipes are sorted by id, so are the arrays
+        for recipe_id in sorted(self._recipe_ingredients):
+            for ingredient_id, usage in self._recipe_ingredients[recipe_id].items():
+                if ingredient_id not in postings:
+                    postings[ingredient_id] = tuple(array("l") for usage_ in self.Usage)
+                postings[ingredient_id][usage].append(recipe_id)
+
+        self._postings = postings
+        self.stale = False
+
+    def matching(self, session_: orm.Session, ingredient_filter: IngredientFilter) -> \
+            typing.Tuple[typing.Optional[typing.Set[int]], typing.Set[int]]:
+        """
+        The recipes matching the filter
+
+        Args:
+            session_ (): The session (for reloading a stale index)
+            ingredient_filter (): The filter
+
+        Returns:
+            (The ids of the matching recipes or None if there are no included ingredients (i.e. every recipe that isn't
+            excluded), the ids of the excluded recipes)
+        """
+
+        def containing(ingredient_id: int) -> typing.Set[int]:
+            return self.containing(session_, ingredient_id, optional=ingredient_filter.optional,
+                                   alternatives=ingredient_filter.alternatives)
+
+        excluded = set()
+        for ingredient_id in ingredient_filter.exclude:
+            excluded.update(containing(ingredient_id))
+
+        if not ingredient_filter.include:
+            return None, excluded
+
+        # Start with the smallest set - the result can't get any larger
+        included = sorted((containing(ingredient_id) for ingredient_id in ingredient_filter.include), key=len)
+        recipes = included[0].intersection(*included[1:])
+        return recipes - excluded, excluded
+
+    def remove_ingredients(self, ingredient_ids: typing.Iterable[int]):
+        """ The ingredients have been deleted """
+        for ingredient_id in ingredient_ids:
+            self._postings.pop(ingredient_id, None)
+
+    def update_recipes(self, session_: orm.Session, recipe_ids: typing.Collection[int]):
+        """
+        Updates (or removes) the recipes in the index. The recipes' current ingredients are read from the database
+
+        Args:
+            session_ (): The session
+            recipe_ids (): The ids of the changed (or deleted) recipes
+
+        Returns:
+
+        """
+
+        if not recipe_ids:
+            return
+
+        current = self._read_recipes(session_, recipe_ids)
+        for recipe_id in recipe_ids:
+            # Remove the old postings...
+            for ingredient_id, usage in self._recipe_ingredients.pop(recipe_id, {}).items():
+                postings = self._postings.get(ingredient_id)
+                if postings is None:
+                    continue
+                position = bisect.bisect_left(postings[usage], recipe_id)
+                if position < len(postings[usage]) and postings[usage][position] == recipe_id:
+                    postings[usage].pop(position)
+
+            # ...and add the new ones
+            if recipe_id in current:
+                self._recipe_ingredients[recipe_id] = current[recipe_id]
+                for ingredient_id, usage in current[recipe_id].items():
+                    if ingredient_id not in self._postings:
+                        self._postings[ingredient_id] = tuple(array("l") for usage_ in self.Usage)
+                    recipes = self._postings[ingredient_id][usage]
+                    recipes.insert(bisect.bisect_left(recipes, recipe_id), recipe_id)
+
+
+def _loaded_index(session_: orm.Session) -> typing.Optional[IngredientIndex]:
+    """ The session's index - if there's an index worth updating """
+    index = session_.info.get(IngredientIndex._info_key)
+    if index is None or index.stale:
+        return None
+    return index
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _update_after_flush(session_: orm.Session, flush_context):
+    """ Update the recipes whose ingredient lists have been changed """
+    index = _loaded_index(session_)
+    if index is None:
+        return
+
+    recipe_ids = set()
+    for item in list(session_.new) + list(session_.dirty) + list(session_.deleted):
+        if isinstance(item, data.IngredientListEntry):
+            recipe_ids.add(item.recipe_id)
+            # The entry might have been moved to another recipe
+            history = sql.inspect(item).attrs.recipe_id.history
+            recipe_ids.update(history.deleted or ())
+        elif isinstance(item, data.Recipe) and item in session_.deleted:
+            recipe_ids.add(item.id)
+        elif isinstance(item, data.Ingredient) and item in session_.deleted:
+            index.remove_ingredients([item.id])
+    recipe_ids.discard(None)
+    index.update_recipes(session_, recipe_ids)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _invalidate_after_rollback(session_: orm.Session, previous_transaction):
+    """ The rollback might have undone some of the changes """
+    index = _loaded_index(session_)
+    if index is not None:
+        index.invalidate()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _invalidate_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging ingredients in the data editor) """
+    index = _loaded_index(update_context.session)
+    if index is not None and update_context.mapper.class_ in (data.Recipe, data.IngredientListEntry, data.Ingredient):
+        index.invalidate()
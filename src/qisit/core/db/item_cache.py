@@ -0,0 +1,442 @@
+""" A per-session cache for the name based lookup tables (Category, Author, Ingredient...) """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import typing
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+from sqlalchemy.dialects import postgresql
+
+
+class ItemCache(object):
+    """
+    A name -> object cache for the tables that are looked up by name (Category, Author, Cuisine, YieldUnitName,
+    Ingredient, IngredientUnit). There's one cache per session (stored in the session's info dictionary) and one
+    dictionary per table. The cache is filled lazily, i.e. only items that have been asked for will be cached.
+
+    The cache is cleared whenever the session is rolled back (the cached objects might not exist anymore) and single
+    entries are evicted when the item is renamed or deleted.
+    """
+
+    _info_key = "qisit_item_cache"
+    """ The key in session.info """
+
+    def __init__(self):
+        self._tables = {}
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "ItemCache":
+        """
+        Returns the session's cache, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The cache
+        """
+
+        cache = session_.info.get(cls._info_key)
+        if cache is None:
+            cache = cls()
+            session_.info[cls._info_key] = cache
+        return cache
+
+    @classmethod
+    def natural_key_columns(cls, table) -> typing.Tuple[str, ...]:
+        """
+        The columns that identify an item (besides the primary key). This is the unique constraint containing the
+        name, for example ("name",) for Category or ("name", "is_group") for Ingredient
+
+        Args:
+            table (): The table (data.Category, ...)
+
+        Returns:
+            The column names
+        """
+
+        for constraint in table.__table__.constraints:
+            if isinstance(constraint, sql.UniqueConstraint):
+                column_names = tuple(column.name for column in constraint.columns)
+                if "name" in column_names:
+                    return column_names
+        return "name",
+
+    @classmethod
+    def natural_key(cls, table, name: str, **kwargs) -> tuple:
+        """
+        Builds the cache key for an item
+
+        Args:
+            table (): The table
+            name (): The item's name
+            **kwargs (): The other values of the natural key (for example is_group). Missing values will be
+                replaced by the column's default
+
+        Returns:
+            The key
+        """
+
+        key = []
+        for column_name in cls.natural_key_columns(table):
+            if column_name == "name":
+                key.append(name)
+            elif column_name in kwargs:
+                key.append(kwargs[column_name])
+            else:
+                default = table.__table__.c[column_name].default
+                key.append(default.arg if default is not None and default.is_scalar else None)
+        return tuple(key)
+
+    def clear(self):
+        """ Clear the complete cache """
+        self._tables.clear()
+
+    def clear_table(self, table):
+        """ Clear the cache of a single table """
+        self._tables.pop(table, None)
+
+    def evict(self, item):
+        """
+        Removes an item from the cache (if it's cached)
+
+        Args:
+            item (): The item
+
+        Returns:
+
+        """
+        table_cache = self._tables.get(type(item))
+        if table_cache:
+            for key in [key for key, cached_item in table_cache.items() if cached_item is item]:
+                del table_cache[key]
+
+    def get(self, table, key: tuple):
+        """
+        Returns the cached item. Items that have been deleted or detached from the session in the meantime will be
+        evicted.
+
+        Args:
+            table (): The table
+            key (): The natural key
+
+        Returns:
+            The item or None
+        """
+
+        table_cache = self._tables.get(table)
+        if not table_cache:
+            return None
+
+        item = table_cache.get(key)
+        if item is None:
+            return None
+
+        state = sql.inspect(item)
+        if state.persistent or state.pending:
+            return item
+
+        del table_cache[key]
+        return None
+
+    def is_cached_table(self, table) -> bool:
+        return table in self._tables
+
+    def put(self, table, key: tuple, item):
+        self._tables.setdefault(table, {})[key] = item
+
+
+def _column_values(item) -> dict:
+    """ The column values of a (transient) item suitable for a core INSERT """
+    mapper = sql.inspect(type(item))
+    state_dict = sql.inspect(item).dict
+    values = {}
+    for column_property in mapper.column_attrs:
+        if column_property.key in state_dict and state_dict[column_property.key] is not None:
+            values[column_property.columns[0].name] = state_dict[column_property.key]
+    return values
+
+
+def _insert_ignore(session_: orm.Session, table, rows: typing.Dict[tuple, dict]) -> typing.Optional[dict]:
+    """
+    Inserts the rows using the dialect's "insert or ignore" flavour
+
+    Args:
+        session_ (): The session
+        table (): The table
+        rows (): The rows to insert (natural key -> column values)
+
+    Returns:
+        A dictionary natural key -> primary key of the rows actually inserted (rows that already existed are missing)
+        or None if the dialect doesn't support an upsert.
+    """
+
+    db_table = table.__table__
+    dialect_name = session_.get_bind(mapper=sql.inspect(table)).dialect.name
+    key_columns = ItemCache.natural_key_columns(table)
+
+    if dialect_name == "postgresql":
+        # One statement for all rows. Skipped rows won't be returned, hence the natural key in RETURNING
+        statement = postgresql.insert(db_table).values(list(rows.values())).on_conflict_do_nothing().returning(
+            db_table.c.id, *[db_table.c[column_name] for column_name in key_columns])
+        return {tuple(row[1:]): row[0] for row in session_.execute(statement)}
+
+    # MySQL isn't supported: INSERT IGNORE turns NOT NULL and truncation errors into warnings (and inserts a coerced
+    # row) and the rowcount of ON DUPLICATE KEY UPDATE can't tell an inserted from an existing row
+    if dialect_name == "sqlite":
+        statement = db_table.insert().prefix_with("OR IGNORE")
+    else:
+        return None
+
+    # No RETURNING here - lastrowid is only meaningful if the row really has been inserted
+    primary_keys = {}
+    for key, row_values in rows.items():
+        result = session_.execute(statement, row_values)
+        if result.rowcount == 1:
+            primary_keys[key] = result.inserted_primary_key[0]
+    return primary_keys
+
+
+def _make_persistent(session_: orm.Session, item, primary_key: int):
+    """ Attaches an item that has been inserted by a core statement to the session without reloading it """
+
+    # A stale object (deleted row, rolled back savepoint) might still occupy the identity. Since the row has been
+    # just inserted, the stale object is simply reloaded
+    existing = session_.identity_map.get(sql.inspect(type(item)).identity_key_from_primary_key((primary_key,)))
+    if existing is not None:
+        session_.refresh(existing)
+        return existing
+
+    item.id = primary_key
+    orm.make_transient_to_detached(item)
+    session_.add(item)
+    return item
+
+
+_insert_listeners = []
+
+
+def listens_for_insert(listener: typing.Callable[[orm.Session, typing.Any, list], None]):
+    """
+    Decorator registering a listener for the items inserted by a core statement. Those inserts bypass the flush, so
+    everything maintained in after_flush has to listen here, too.
+
+    Args:
+        listener (): Called with the session, the table and the inserted (now persistent) items
+
+    Returns:
+        The listener
+    """
+
+    _insert_listeners.append(listener)
+    return listener
+
+
+def _inserted(session_: orm.Session, table, items: list):
+    """ Tells the listeners about the items inserted by a core statement """
+    if items:
+        for listener in _insert_listeners:
+            listener(session_, table, items)
+
+
+def _query_by_keys(session_: orm.Session, table, keys: typing.Iterable[tuple]) -> dict:
+    """ Loads all items matching the natural keys with one SELECT. Returns a dict key -> item """
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    key_columns = ItemCache.natural_key_columns(table)
+    names = {key[key_columns.index("name")] for key in keys}
+    found = {}
+    for item in session_.query(table).filter(table.name.in_(names)):
+        key = tuple(getattr(item, column_name) for column_name in key_columns)
+        found[key] = item
+    return {key: found[key] for key in keys if key in found}
+
+
+def get_or_add_item(session_: orm.Session, table, name: str, filter_args=None, *args, **kwargs):
+    """
+    Cached version of get or add. See db.get_or_add_item
+
+    Args:
+        session_ (): The session
+        table (): The table
+        name (): The name
+        filter_args (): Optional filter to use instead of the name (only used when querying the database)
+        *args (): args to pass to __init__
+        **kwargs (): keyword args
+
+    Returns:
+        The existing or newly created item
+    """
+
+    cache = ItemCache.for_session(session_)
+    key = ItemCache.natural_key(table, name, **kwargs)
+
+    item = cache.get(table, key)
+    if item is not None:
+        return item
+
+    new_item = table(name, *args, **kwargs)
+
+    # Pending objects that haven't been created by this method won't be found by the upsert
+    if session_.autoflush:
+        session_.flush()
+
+    # Try the upsert first: when the item doesn't exist (which is the usual case when importing or if the item
+    # isn't in the cache) there's exactly one statement, without any additional SELECT
+    primary_keys = None
+    if name is not None:
+        primary_keys = _insert_ignore(session_, table, {key: _column_values(new_item)})
+
+    if primary_keys and key in primary_keys:
+        item = _make_persistent(session_, new_item, primary_keys[key])
+        _inserted(session_, table, [item])
+    else:
+        if not filter_args:
+            item = session_.query(table).filter(table.name == name).first()
+        else:
+            item = session_.query(table).filter(*filter_args).first()
+
+        if item is None:
+            # Either the dialect doesn't support upserts or SQLite ignored the insert because of another constraint
+            # (NOT NULL, CHECK,...). In the latter case the flush will raise the appropriate exception
+            session_.add(new_item)
+            item = new_item
+
+    cache.put(table, key, item)
+    return item
+
+
+def get_or_add_items(session_: orm.Session, table, names: typing.Iterable[str], **kwargs) -> dict:
+    """
+    Batch version of get_or_add_item. Resolves all names at once - one SELECT for all names that aren't cached and one
+    INSERT for all names that don't exist yet.
+
+    Args:
+        session_ (): The session
+        table (): The table
+        names (): The names. Duplicates will be ignored
+        **kwargs (): keyword args to pass to __init__ (the same for every item)
+
+    Returns:
+        A dictionary name -> item
+    """
+
+    cache = ItemCache.for_session(session_)
+    result = {}
+    missing = {}
+
+    for name in names:
+        if name in result or name in missing:
+            continue
+        key = ItemCache.natural_key(table, name, **kwargs)
+        item = cache.get(table, key)
+        if item is not None:
+            result[name] = item
+        else:
+            missing[name] = key
+
+    if not missing:
+        return result
+
+    if session_.autoflush:
+        session_.flush()
+
+    # 1. Everything that's already there
+    found = _query_by_keys(session_, table, missing.values())
+    new_items = {}
+    for name, key in missing.items():
+        if key in found:
+            result[name] = found[key]
+            cache.put(table, key, found[key])
+        else:
+            new_items[name] = table(name, **kwargs)
+
+    if not new_items:
+        return result
+
+    # 2. The rest will be inserted. The table might have been altered between the SELECT and the INSERT (by another
+    # connection), hence the "ignore" and the second SELECT for the ignored rows
+    primary_keys = _insert_ignore(session_, table, {missing[name]: _column_values(new_items[name])
+                                                    for name in new_items if name is not None})
+
+    if primary_keys is None:
+        for name in new_items:
+            result[name] = get_or_add_item(session_, table, name, None, **kwargs)
+        return result
+
+    ignored = []
+    inserted = []
+    for name, new_item in new_items.items():
+        key = missing[name]
+        if key in primary_keys:
+            result[name] = _make_persistent(session_, new_item, primary_keys[key])
+            cache.put(table, key, result[name])
+            inserted.append(result[name])
+        else:
+            ignored.append(name)
+    _inserted(session_, table, inserted)
+
+    if ignored:
+        found = _query_by_keys(session_, table, [missing[name] for name in ignored])
+        for name in ignored:
+            key = missing[name]
+            if key in found:
+                result[name] = found[key]
+                cache.put(table, key, found[key])
+            else:
+                # SQLite ignored it because of another constraint violation. The flush will raise it
+                session_.add(new_items[name])
+                result[name] = new_items[name]
+
+    return result
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _clear_after_rollback(session_: orm.Session, previous_transaction):
+    """ A rollback (even of a savepoint) might remove the cached items """
+    cache = session_.info.get(ItemCache._info_key)
+    if cache is not None:
+        cache.clear()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _clear_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session. There's no way to tell which items are affected """
+    cache = update_context.session.info.get(ItemCache._info_key)
+    if cache is not None:
+        cache.clear_table(update_context.mapper.class_)
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _evict_after_flush(session_: orm.Session, flush_context):
+    """ Deleted or renamed items have to be removed from the cache """
+    cache = session_.info.get(ItemCache._info_key)
+    if cache is None:
+        return
+
+    for item in session_.deleted:
+        if cache.is_cached_table(type(item)):
+            cache.evict(item)
+
+    for item in session_.dirty:
+        if cache.is_cached_table(type(item)) and sql.inspect(item).attrs.name.history.has_changes():
+            cache.evict(item)
@@ -0,0 +1,269 @@
+""" Suggest items (ingredients, authors, ...) that are probably the same and merge them """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+import typing
+import unicodedata
+
+import sqlalchemy as sql
+from sqlalchemy import func, orm
+
+from qisit.core.db import data
+
+
+class MergeSuggestions(object):
+    """
+    Groups the items of a table whose names are (probably) variants of each other - "onion", "Onions" and
+    "Onion, red" or "Julia Child" and "Child, Julia".
+
+    1.) Every name is reduced to a normalized key: lower case, no accents, no punctuation, plurals cut off, the words
+        sorted. Names with the same key are grouped right away.
+    2.) The remaining typos ("tomatoe", "tomato") are found by comparing the keys' edit distance. Comparing every key
+        with every other one would take ages, so only keys sharing enough trigrams are compared (a trigram index with
+        prefix filtering: only the rarest trigrams of a key are looked up). Typos don't chain - a group's keys are all
+        close to the group's first key.
+    """
+
+    class Item(typing.NamedTuple):
+        """ An item of a suggested group """
+        id: int
+        name: str
+        usage: int
+        """ Number of recipes (or ingredient list entries) using the item """
+
+    tables = (data.Ingredient, data.Author, data.Cuisine, data.IngredientUnit, data.YieldUnitName)
+    """ The tables that can be analysed """
+
+    _word_pattern = re.compile(r"\w+")
+
+    _digit_pattern = re.compile(r"\d+")
+
+    def __init__(self, max_distance_ratio: float = 0.2, max_distance: int = 2):
+        """
+        Init
+
+        Args:
+            max_distance_ratio (): The maximum edit distance relative to the length of the (longer) key
+            max_distance (): The maximum edit distance, no matter how long the keys are
+        """
+
+        self.max_distance_ratio = max_distance_ratio
+        self.max_distance = max_distance
+
+    @classmethod
+    def normalized_key(cls, name: str) -> str:
+        """
+        The normalized key of a name
+
+        Args:
+            name (): The name
+
+        Returns:
+            The key ("Onions, Red" -> "onion red")
+        """
+
+        decomposed = unicodedata.normalize("NFKD", name.casefold())
+        without_accents = "".join(character for character in decomposed if not unicodedata.combining(character))
+        words = []
+        for word in cls._word_pattern.findall(without_accents):
+            # A very rough singular - good enough for finding candidates, the user decides anyway
+            if len(word) > 4 and word.endswith("es") and word[-3] in "hosx":
+                word = word[:-2]
+            elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+                word = word[:-1]
+            words.append(word)
+        return " ".join(sorted(words))
+
+    @staticmethod
+    def trigrams(key: str) -> typing.Set[str]:
+        """ The trigrams of the key, padded so short keys have trigrams, too """
+        padded = f"  {key} "
+        return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+    @staticmethod
+    def edit_distance(first: str, second: str, limit: int) -> int:
+        """
+        The Levenshtein distance of the strings
+
+        Args:
+            first (): First string
+            second (): Second string
+            limit (): Stop as soon as the distance exceeds the limit
+
+        Returns:
+            The distance (or limit + 1 if it exceeds the limit)
+        """
+
+        if abs(len(first) - len(second)) > limit:
+            return limit + 1
+        if len(first) > len(second):
+            first, second = second, first
+
+        previous = list(range(len(first) + 1))
+        for row, second_character in enumerate(second, start=1):
+            current = [row]
+            for column, first_character in enumerate(first, start=1):
+                current.append(min(previous[column] + 1, current[column - 1] + 1,
+                                   previous[column - 1] + (first_character != second_character)))
+            if min(current) > limit:
+                return limit + 1
+            previous = current
+        return previous[-1]
+
+    @staticmethod
+    def _items_query(table) -> sql.sql.Select:
+        """ id, name, usage and the partition (items of different partitions are never grouped) of each item """
+
+        entry = data.IngredientListEntry
+        if table is data.Ingredient:
+            return sql.select([table.id, table.name, func.count(entry.id), table.is_group]).select_from(
+                table.__table__.outerjoin(entry.__table__)).group_by(table.id)
+        if table is data.IngredientUnit:
+            # CLDR units have generated names, units of different types can't be the same
+            return sql.select([table.id, table.name, func.count(entry.id), table.type_]).select_from(
+                table.__table__.outerjoin(entry.__table__)).where(
+                sql.and_(table.cldr == False, table.type_ != table.UnitType.GROUP)).group_by(table.id)
+        return sql.select([table.id, table.name, func.count(data.Recipe.id), sql.null()]).select_from(
+            table.__table__.outerjoin(data.Recipe.__table__)).group_by(table.id)
+
+    def _similar_keys(self, keys: typing.Iterable[str]) -> typing.List[typing.Tuple[str, str]]:
+        """ The pairs of keys within the edit distance """
+
+        keys = sorted(keys)
+        key_trigrams = [self.trigrams(key) for key in keys]
+        frequency = {}
+        for trigrams in key_trigrams:
+            for trigram in trigrams:
+                frequency[trigram] = frequency.get(trigram, 0) + 1
+
+        # Every edit destroys at most three trigrams, so two keys within an edit distance of k share all but 3 * k
+        # trigrams. Prefix filtering: if the trigrams are sorted by frequency, the two keys share at least one of
+        # their first 3 * k + 1 (the rarest) trigrams. So only these have to be indexed and looked up.
+        index = {}
+        pairs = []
+        for position, (key, trigrams) in enumerate(zip(keys, key_trigrams)):
+            # The largest possible edit distance of the key and any other key
+            max_distance = min(int(self.max_distance_ratio * len(key) / (1.0 - self.max_distance_ratio) + 1e-9),
+                               self.max_distance)
+            ordered = sorted(trigrams, key=lambda trigram: (frequency[trigram], trigram))
+
+            candidates = set()
+            for trigram in ordered[:3 * max_distance + 1]:
+                candidates.update(index.get(trigram, ()))
+                index.setdefault(trigram, []).append(position)
+
+            for candidate in candidates:
+                other_key = keys[candidate]
+                limit = self._limit(key, other_key)
+                if limit > 0 and abs(len(key) - len(other_key)) <= limit and \
+                        len(trigrams & key_trigrams[candidate]) >= max(len(trigrams),
+                                                                       len(key_trigrams[candidate])) - 3 * limit and \
+                        self.is_typo(key, other_key):
+                    pairs.append((other_key, key))
+        return pairs
+
+    def _limit(self, key: str, other_key: str) -> int:
+        """ The maximum edit distance of the keys """
+        return min(int(self.max_distance_ratio * max(len(key), len(other_key))), self.max_distance)
+
+    def is_typo(self, key: str, other_key: str) -> bool:
+        """ True if the keys are within the edit distance. Numbers have to be equal ("Gas Mark 4" != "Gas Mark 5") """
+
+        limit = self._limit(key, other_key)
+        return limit > 0 and self._digit_pattern.findall(key) == self._digit_pattern.findall(other_key) and \
+            self.edit_distance(key, other_key, limit) <= limit
+
+    def groups(self, session_: orm.Session, table) -> typing.List[typing.List[Item]]:
+        """
+        Finds the groups of items that are probably the same
+
+        Args:
+            session_ (): The session
+            table (): One of the tables
+
+        Returns:
+            The groups, each sorted by usage (the best merge target first). The largest groups first
+        """
+
+        keys = {}
+        for item_id, name, usage, partition in session_.execute(self._items_query(table)):
+            keys.setdefault((partition, self.normalized_key(name)), []).append(self.Item(item_id, name, usage))
+
+        # Union find over the keys
+        parents = {}
+
+        def find(key: tuple) -> tuple:
+            root = parents.setdefault(key, key)
+            while parents[root] != root:
+                root = parents[root]
+            while key != root:
+                parents[key], key = root, parents[key]
+            return root
+
+        for partition in {partition for partition, key in keys}:
+            for first, second in self._similar_keys(key for key_partition, key in keys if key_partition == partition):
+                first_root, second_root = find((partition, first)), find((partition, second))
+                # Typos must not chain ("paste" - "pasta" - "pastas" - "pastry"...): Groups are only joined if
+                # their first keys are close enough, too
+                if first_root != second_root and self.is_typo(first_root[1], second_root[1]):
+                    parents[second_root] = first_root
+
+        grouped = {}
+        for key, items in keys.items():
+            grouped.setdefault(find(key), []).extend(items)
+
+        groups = [sorted(items, key=lambda item: (-item.usage, len(item.name), item.id))
+                  for items in grouped.values() if len(items) > 1]
+        groups.sort(key=lambda items: (-len(items), -sum(item.usage for item in items), items[0].name))
+        return groups
+
+    @staticmethod
+    def merge(session_: orm.Session, table, target_id: int, source_ids: typing.Collection[int]):
+        """
+        Merges the source items into the target (set based: one UPDATE of the references, one DELETE of the
+        sources). Doesn't commit.
+
+        Args:
+            session_ (): The session
+            table (): The table
+            target_id (): The item that remains
+            source_ids (): The items that are merged into the target (and deleted)
+
+        Returns:
+
+        """
+
+        source_ids = [source_id for source_id in source_ids if source_id != target_id]
+        if not source_ids:
+            return
+
+        references = {
+            data.Ingredient: data.IngredientListEntry.ingredient_id,
+            data.IngredientUnit: data.IngredientListEntry.unit_id,
+            data.Author: data.Recipe.author_id,
+            data.Cuisine: data.Recipe.cuisine_id,
+            data.YieldUnitName: data.Recipe.yield_unit_id
+        }
+        reference = references[table]
+
+        # Query.update()/delete() (instead of plain SQL) so the indexes and caches are notified
+        session_.query(reference.class_).filter(reference.in_(source_ids)).update(
+            {reference: target_id}, synchronize_session=False)
+        session_.query(table).filter(table.id.in_(source_ids)).delete(synchronize_session=False)
+        session_.expire_all()
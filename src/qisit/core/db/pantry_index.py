@@ -0,0 +1,455 @@
+""" Rank recipes by how many of their ingredients are on hand ("What can I cook with what's in my pantry?") """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import struct
+import sys
+import typing
+from array import array
+
+import sqlalchemy as sql
+from sqlalchemy import event, func, orm
+
+from qisit.core.db import data
+
+
+class PantryIndex(object):
+    """
+    Computes the coverage of all recipes for a given set of ingredients: The fraction of the recipe's (non optional)
+    ingredients that are on hand.
+
+    Each recipe is a list of slots (one per ingredient line, groups don't count), each slot a list of options
+    (the ingredient and its "or" alternatives), each option a set of ingredients (an alternative and its "and"
+    items). A slot is satisfied if all ingredients of at least one option are on hand.
+
+    For the computation the options are stored as a sparse option x ingredient matrix in compressed column format
+    (ingredient -> options), so only the options containing one of the ingredients on hand have to be looked at.
+
+    There's one index per session. The recipes are kept up to date by the flush events, the matrix is rebuilt
+    lazily. Optionally the recipes can be cached on disk - the cache is only used if the ingredient lists haven't
+    been changed in the meantime (see fingerprint()). The cache is a header followed by records of 64 bit integers
+    (see _records()). Changed recipes are appended as new records, a later record of a recipe replaces the earlier
+    ones. When the file has grown too large it's rewritten.
+    """
+
+    class Coverage(typing.NamedTuple):
+        """ The result for a single recipe """
+        recipe_id: int
+        coverage: float
+        missing: int
+
+    _info_key = "qisit_pantry_index"
+    """ The key in session.info """
+
+    file_version = 2
+    """ Version of the disk cache's format """
+
+    _file_header = struct.Struct("<8sqqq")
+    """ Magic, version, the fingerprint (number of entries, hash) """
+
+    _file_magic = b"QPANTRY\0"
+
+    _hash_modulus = 2147483647
+    """ 2^31 - 1: The product of two hashes fits into 64 bits """
+
+    def __init__(self):
+        self.cache_path = None
+        """ Where to cache the recipes on disk (None: no disk cache) """
+
+        self.stale = True
+
+        self._recipes = {}
+        self._matrix = None
+        self._saved = False
+        # The recipes changed since the cache has been written. If the cache is valid (it holds the recipes as they
+        # were before these changes) only they are appended
+        self._changed_ids = set()
+        self._cache_valid = False
+        # Size of the records in the cache and after the last rewrite (number of integers)
+        self._cache_size = 0
+        self._compacted_size = 0
+
+    @classmethod
+    def for_session(cls, session_: orm.Session, cache_path: str = None) -> "PantryIndex":
+        """
+        Returns the session's index, creating it if necessary
+
+        Args:
+            session_ (): The session
+            cache_path (): Where to cache the index on disk (None: Don't)
+
+        Returns:
+            The index
+        """
+
+        index = session_.info.get(cls._info_key)
+        if index is None:
+            index = cls()
+            session_.info[cls._info_key] = index
+        if cache_path is not None:
+            index.cache_path = cache_path
+        return index
+
+    @classmethod
+    def recipe_slots(cls, entries: typing.Iterable[typing.Tuple[int, int, bool]]) -> \
+            typing.Tuple[typing.Tuple[typing.Tuple[int, ...], ...], ...]:
+        """
+        Resolves the recipe's ingredient list into slots and options (see class description)
+
+        Args:
+            entries (): (ingredient_id, position, optional) of all the recipe's ingredient list entries
+
+        Returns:
+            The non optional slots. Each one a tuple of options, each option a tuple of ingredient ids
+        """
+
+        entry = data.IngredientListEntry
+        slots = {}
+        optional_slots = set()
+
+        for ingredient_id, position, optional in entries:
+            if position < 0 or entry.is_group(position):
+                continue
+
+            slot = position // entry.GROUP_INGREDIENT_FACTOR
+            # An "and" item belongs to its alternative
+            option = (position // entry.GROUP_INGREDIENT_ALTERNATIVE_FACTOR) * \
+                     entry.GROUP_INGREDIENT_ALTERNATIVE_FACTOR
+            slots.setdefault(slot, {}).setdefault(option, set()).add(ingredient_id)
+
+            # If the ingredient itself is optional, so are its alternatives
+            if optional and position % entry.GROUP_INGREDIENT_FACTOR == 0:
+                optional_slots.add(slot)
+
+        return tuple(tuple(tuple(sorted(ingredients)) for option, ingredients in sorted(options.items()))
+                     for slot, options in sorted(slots.items()) if slot not in optional_slots)
+
+    @classmethod
+    def fingerprint(cls, session_: orm.Session) -> typing.Tuple[int, int]:
+        """
+        A fingerprint of the complete ingredient lists (one aggregate query): The number of entries and the sum of
+        the row hashes. A row hash is the product of two column hashes - (id, ingredient) and (recipe, position,
+        optional) - so moving values from one row to another (swapping positions or ingredients, for example) changes
+        the sum, too. If the fingerprint differs from the cached one, the disk cache is outdated
+        """
+
+        entry = data.IngredientListEntry
+        modulus = cls._hash_modulus
+        first_hash = (entry.id * 2654435761 + func.coalesce(entry.ingredient_id, 0)) % modulus
+        second_hash = (entry.recipe_id * 40503 + entry.position * 7 + sql.case([(entry.optional, 1)], else_=0)) % \
+            modulus
+        count, row_hashes = session_.execute(sql.select([
+            func.count(entry.id), func.coalesce(func.sum(first_hash * second_hash % modulus), 0)])).first()
+        return int(count), int(row_hashes)
+
+    def _build_matrix(self):
+        """ Builds the option x ingredient matrix from the recipes """
+
+        option_slot = array("l")
+        option_size = array("l")
+        slot_recipe = array("l")
+        recipe_slots = {}
+
+        ingredient_options = {}
+        for recipe_id, slots in self._recipes.items():
+            if not slots:
+                continue
+            recipe_slots[recipe_id] = len(slots)
+            for options in slots:
+                slot = len(slot_recipe)
+                slot_recipe.append(recipe_id)
+                for ingredients in options:
+                    option = len(option_slot)
+                    option_slot.append(slot)
+                    option_size.append(len(ingredients))
+                    for ingredient_id in ingredients:
+                        ingredient_options.setdefault(ingredient_id, []).append(option)
+
+        # Compressed columns: The options of ingredient i are indices[indptr[column[i]]:indptr[column[i] + 1]]
+        columns = {}
+        indptr = array("l", [0])
+        indices = array("l")
+        for ingredient_id, options in ingredient_options.items():
+            columns[ingredient_id] = len(columns)
+            indices.extend(options)
+            indptr.append(len(indices))
+
+        self._matrix = (columns, indptr, indices, option_slot, option_size, slot_recipe, recipe_slots)
+
+    def _read_recipes(self, session_: orm.Session, recipe_ids: typing.Collection[int] = None) -> dict:
+        """ recipe id -> slots """
+        entry = data.IngredientListEntry
+        the_query = sql.select([entry.recipe_id, entry.ingredient_id, entry.position, entry.optional])
+        if recipe_ids is not None:
+            the_query = the_query.where(entry.recipe_id.in_(recipe_ids))
+
+        entries = {}
+        for recipe_id, ingredient_id, position, optional in session_.execute(the_query):
+            entries.setdefault(recipe_id, []).append((ingredient_id, position, optional))
+        return {recipe_id: self.recipe_slots(recipe_entries) for recipe_id, recipe_entries in entries.items()}
+
+    def coverage(self, session_: orm.Session, ingredient_ids: typing.Iterable[int]) -> typing.List[Coverage]:
+        """
+        Ranks all recipes by the coverage of their ingredients
+
+        Args:
+            session_ (): The session (for loading a stale index)
+            ingredient_ids (): The ingredients on hand
+
+        Returns:
+            All recipes with at least one (non optional) ingredient, the best covered recipes first. Ties are broken
+            by the number of missing ingredients, then by the id
+        """
+
+        if self.stale:
+            self.load(session_)
+        if self._matrix is None:
+            self._build_matrix()
+            if not self._saved:
+                self.save(session_)
+        columns, indptr, indices, option_slot, option_size, slot_recipe, recipe_slots = self._matrix
+
+        # How many ingredients of each option are on hand
+        option_hits = {}
+        for ingredient_id in set(ingredient_ids):
+            column = columns.get(ingredient_id)
+            if column is None:
+                continue
+            for option in indices[indptr[column]:indptr[column + 1]]:
+                option_hits[option] = option_hits.get(option, 0) + 1
+
+        satisfied_slots = {option_slot[option] for option, hits in option_hits.items() if hits == option_size[option]}
+        satisfied = dict.fromkeys(recipe_slots, 0)
+        for slot in satisfied_slots:
+            satisfied[slot_recipe[slot]] += 1
+
+        result = [self.Coverage(recipe_id, satisfied[recipe_id] / number_of_slots,
+                                number_of_slots - satisfied[recipe_id])
+                  for recipe_id, number_of_slots in recipe_slots.items()]
+        result.sort(key=lambda coverage: (-coverage.coverage, coverage.missing, coverage.recipe_id))
+        return result
+
+    def invalidate(self):
+        """ Mark the index as stale. It will be reloaded the next time it's used """
+        self.stale = True
+
+    def load(self, session_: orm.Session):
+        """
+        Loads the index - from the disk cache if it's up to date, otherwise from the database
+
+        Args:
+            session_ (): The session
+
+        Returns:
+
+        """
+
+        self._matrix = None
+        self._saved = False
+        self._changed_ids = set()
+        self._cache_valid = False
+        fingerprint = self.fingerprint(session_)
+
+        if self.cache_path is not None and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, "rb") as cache_file:
+                    magic, version, *cached_fingerprint = self._file_header.unpack(
+                        cache_file.read(self._file_header.size))
+                    if magic == self._file_magic and version == self.file_version and \
+                            tuple(cached_fingerprint) == fingerprint:
+                        values = array("q")
+                        values.frombytes(cache_file.read())
+                        if sys.byteorder != "little":
+                            values.byteswap()
+                        self._recipes = self._parse_records(values)
+                        self._saved = self._cache_valid = True
+                        self._cache_size = self._compacted_size = len(values)
+                        self.stale = False
+                        return
+            except (OSError, struct.error, ValueError, IndexError):
+                # A broken cache is no reason to fail. It will be overwritten
+                pass
+
+        self._recipes = self._read_recipes(session_)
+        self.stale = False
+
+    @staticmethod
+    def _records(recipes: typing.Iterable[typing.Tuple[int, typing.Optional[tuple]]]) -> array:
+        """
+        The cache's records: recipe id, number of slots (-1: the recipe has been deleted), then for each slot the
+        number of options and for each option the number of ingredients followed by the ingredient ids
+        """
+
+        values = array("q")
+        for recipe_id, slots in recipes:
+            values.append(recipe_id)
+            if slots is None:
+                values.append(-1)
+                continue
+            values.append(len(slots))
+            for options in slots:
+                values.append(len(options))
+                for ingredients in options:
+                    values.append(len(ingredients))
+                    values.extend(ingredients)
+        return values
+
+    @staticmethod
+    def _parse_records(values: array) -> dict:
+        """ recipe id -> slots. The reverse of _records() """
+        recipes = {}
+        position = 0
+        while position < len(values):
+            recipe_id, number_of_slots = values[position], values[position + 1]
+            position += 2
+            if number_of_slots < 0:
+                recipes.pop(recipe_id, None)
+                continue
+            slots = []
+            for slot in range(number_of_slots):
+                options = []
+                for option in range(values[position]):
+                    number_of_ingredients = values[position + 1]
+                    ingredients = tuple(values[position + 2:position + 2 + number_of_ingredients])
+                    if len(ingredients) != number_of_ingredients:
+                        raise ValueError("Truncated cache")
+                    options.append(ingredients)
+                    position += 1 + number_of_ingredients
+                position += 1
+                slots.append(tuple(options))
+            recipes[recipe_id] = tuple(slots)
+        return recipes
+
+    def save(self, session_: orm.Session):
+        """
+        Writes the recipes to the disk cache (if there's one). If the cache is up to date except for the recipes
+        changed since, only they are appended
+
+        Args:
+            session_ (): The session (for the fingerprint)
+
+        Returns:
+
+        """
+
+        if self.cache_path is None or self.stale:
+            return
+
+        header = self._file_header.pack(self._file_magic, self.file_version, *self.fingerprint(session_))
+        try:
+            if self._cache_valid and os.path.exists(self.cache_path):
+                values = self._records((recipe_id, self._recipes.get(recipe_id)) for recipe_id in self._changed_ids)
+                # Rewritten when more than half of it are outdated records
+                if self._cache_size + len(values) <= 2 * self._compacted_size + 1024:
+                    if sys.byteorder != "little":
+                        values.byteswap()
+                    # Append, then update the header. If it crashes in between the fingerprint won't match
+                    with open(self.cache_path, "r+b") as cache_file:
+                        cache_file.seek(0, os.SEEK_END)
+                        cache_file.write(values.tobytes())
+                        cache_file.seek(0)
+                        cache_file.write(header)
+                    self._cache_size += len(values)
+                    self._changed_ids = set()
+                    self._saved = True
+                    return
+
+            # Write and rename - a crash while writing mustn't leave a truncated cache behind
+            values = self._records(self._recipes.items())
+            if sys.byteorder != "little":
+                values.byteswap()
+            temp_path = f"{self.cache_path}.tmp"
+            with open(temp_path, "wb") as cache_file:
+                cache_file.write(header)
+                cache_file.write(values.tobytes())
+            os.replace(temp_path, self.cache_path)
+            self._cache_size = self._compacted_size = len(values)
+            self._changed_ids = set()
+            self._cache_valid = True
+            self._saved = True
+        except OSError:
+            self._cache_valid = False
+
+    def update_recipes(self, session_: orm.Session, recipe_ids: typing.Collection[int]):
+        """
+        Updates (or removes) the recipes in the index. The recipes' current ingredients are read from the database
+
+        Args:
+            session_ (): The session
+            recipe_ids (): The ids of the changed (or deleted) recipes
+
+        Returns:
+
+        """
+
+        if not recipe_ids:
+            return
+
+        current = self._read_recipes(session_, recipe_ids)
+        for recipe_id in recipe_ids:
+            if recipe_id in current:
+                self._recipes[recipe_id] = current[recipe_id]
+            else:
+                self._recipes.pop(recipe_id, None)
+        self._changed_ids.update(recipe_ids)
+        self._matrix = None
+        self._saved = False
+
+
+def _loaded_index(session_: orm.Session) -> typing.Optional[PantryIndex]:
+    """ The session's index - if there's an index worth updating """
+    index = session_.info.get(PantryIndex._info_key)
+    if index is None or index.stale:
+        return None
+    return index
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _update_after_flush(session_: orm.Session, flush_context):
+    """ Update the recipes whose ingredient lists have been changed """
+    index = _loaded_index(session_)
+    if index is None:
+        return
+
+    recipe_ids = set()
+    for item in list(session_.new) + list(session_.dirty) + list(session_.deleted):
+        if isinstance(item, data.IngredientListEntry):
+            recipe_ids.add(item.recipe_id)
+            recipe_ids.update(sql.inspect(item).attrs.recipe_id.history.deleted or ())
+        elif isinstance(item, data.Recipe) and item in session_.deleted:
+            recipe_ids.add(item.id)
+    recipe_ids.discard(None)
+    index.update_recipes(session_, recipe_ids)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _invalidate_after_rollback(session_: orm.Session, previous_transaction):
+    """ The rollback might have undone some of the changes """
+    index = _loaded_index(session_)
+    if index is not None:
+        index.invalidate()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _invalidate_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging ingredients in the data editor) """
+    index = _loaded_index(update_context.session)
+    if index is not None and update_context.mapper.class_ in (data.Recipe, data.IngredientListEntry, data.Ingredient):
+        index.invalidate()
@@ -0,0 +1,218 @@
+""" Which recipes have been changed by the flushes - and what of them """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import typing
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+
+from qisit.core.db import data
+
+
+class RecipeChanges(object):
+    """
+    Collects the recipes changed by the session's flushes and for each recipe the aspects that have been changed
+    (title, author, ingredients...). The recipe list uses them to decide whether it has to query the recipes again
+    (a changed author might mean the recipe doesn't match the filter anymore) or whether it's enough to update the
+    rows (a changed rating).
+
+    There's one collector per session, stored in the session's info dictionary. Nothing is collected until it has
+    been created.
+    """
+
+    NEW = "new"
+    """ The recipe has been added """
+
+    DELETED = "deleted"
+    """ The recipe has been deleted """
+
+    INGREDIENTS = "ingredients"
+    """ The recipe's ingredient list has been changed """
+
+    THUMBNAIL = "thumbnail"
+    """ The recipe's images have been changed """
+
+    _info_key = "qisit_recipe_changes"
+    """ The key in session.info """
+
+    recipe_aspects = {
+        "title": "title",
+        "author": "author",
+        "author_id": "author",
+        "cuisine": "cuisine",
+        "cuisine_id": "cuisine",
+        "categories": "categories",
+        "yields": "yields",
+        "yield_unit_id": "yields",
+        "yield_unit_name": "yields",
+        "rating": "rating",
+        "preparation_time": "preparation_time",
+        "cooking_time": "cooking_time",
+        "total_time": "total_time",
+        "last_cooked": "last_cooked",
+        "last_modified": "last_modified",
+        "ingredientlist": INGREDIENTS,
+        "imagelist": THUMBNAIL
+    }
+    """
+    Recipe's attributes -> aspect. The aspects are named after the summary's columns. Other attributes (instructions,
+    notes...) aren't displayed in the list
+    """
+
+    lookup_aspects = {
+        data.Author: ("author", data.Recipe.author_id),
+        data.Cuisine: ("cuisine", data.Recipe.cuisine_id),
+        data.YieldUnitName: ("yields", data.Recipe.yield_unit_id),
+        data.Category: ("categories", None)
+    }
+    """ The tables whose names are displayed, the aspect and the recipe's foreign key (None: via category_list) """
+
+    def __init__(self):
+        self._changes = {}
+        self._everything = False
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "RecipeChanges":
+        """
+        Returns the session's collector, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The collector
+        """
+
+        changes = session_.info.get(cls._info_key)
+        if changes is None:
+            changes = cls()
+            session_.info[cls._info_key] = changes
+        return changes
+
+    def add(self, recipe_id: int, *aspects: str):
+        """
+        Adds the changed aspects of the recipe
+
+        Args:
+            recipe_id (): The recipe
+            *aspects (): The aspects
+
+        Returns:
+
+        """
+
+        if recipe_id is not None and aspects:
+            self._changes.setdefault(recipe_id, set()).update(aspects)
+
+    def everything_changed(self):
+        """ It's unknown what has been changed (rollback, Query.update()/delete()) """
+        self._everything = True
+        self._changes = {}
+
+    def take(self) -> typing.Optional[typing.Dict[int, typing.Set[str]]]:
+        """
+        Returns the changes collected so far and starts collecting anew
+
+        Returns:
+            recipe id -> the changed aspects. None if anything might have been changed
+        """
+
+        changes = None if self._everything else self._changes
+        self._changes = {}
+        self._everything = False
+        return changes
+
+
+def _recipes_using(session_: orm.Session, item) -> typing.List[int]:
+    """ The ids of all recipes displaying the (lookup) item """
+    foreign_key = RecipeChanges.lookup_aspects[type(item)][1]
+    if foreign_key is None:
+        the_query = sql.select([data.CategoryList.recipe_id]).where(data.CategoryList.category_id == item.id)
+    else:
+        the_query = sql.select([data.Recipe.id]).where(foreign_key == item.id)
+    return [row[0] for row in session_.execute(the_query)]
+
+
+@event.listens_for(orm.Session, "before_flush")
+def _collect_before_flush(session_: orm.Session, flush_context, instances):
+    """ The recipes displaying a deleted lookup item have to be queried now - after the flush the reference is gone """
+    changes = session_.info.get(RecipeChanges._info_key)
+    if changes is None:
+        return
+    with session_.no_autoflush:
+        for item in session_.deleted:
+            if type(item) in RecipeChanges.lookup_aspects:
+                aspect = RecipeChanges.lookup_aspects[type(item)][0]
+                for recipe_id in _recipes_using(session_, item):
+                    changes.add(recipe_id, aspect)
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _collect_after_flush(session_: orm.Session, flush_context):
+    """ The ids are known now and the attributes' history is still there """
+    changes = session_.info.get(RecipeChanges._info_key)
+    if changes is None:
+        return
+
+    for item in session_.new:
+        if isinstance(item, data.Recipe):
+            changes.add(item.id, RecipeChanges.NEW)
+        elif isinstance(item, data.IngredientListEntry):
+            changes.add(item.recipe_id, RecipeChanges.INGREDIENTS)
+        elif isinstance(item, data.RecipeImage):
+            changes.add(item.recipe_id, RecipeChanges.THUMBNAIL)
+
+    for item in session_.dirty:
+        if isinstance(item, data.Recipe):
+            state = sql.inspect(item)
+            changes.add(item.id, *{aspect for key, aspect in RecipeChanges.recipe_aspects.items()
+                                   if state.attrs[key].history.has_changes()})
+        elif isinstance(item, data.IngredientListEntry):
+            changes.add(item.recipe_id, RecipeChanges.INGREDIENTS)
+        elif isinstance(item, data.RecipeImage):
+            changes.add(item.recipe_id, RecipeChanges.THUMBNAIL)
+        elif type(item) in RecipeChanges.lookup_aspects and sql.inspect(item).attrs.name.history.has_changes():
+            aspect = RecipeChanges.lookup_aspects[type(item)][0]
+            for recipe_id in _recipes_using(session_, item):
+                changes.add(recipe_id, aspect)
+
+    for item in session_.deleted:
+        if isinstance(item, data.Recipe):
+            changes.add(item.id, RecipeChanges.DELETED)
+        elif isinstance(item, data.IngredientListEntry):
+            changes.add(item.recipe_id, RecipeChanges.INGREDIENTS)
+        elif isinstance(item, data.RecipeImage):
+            changes.add(item.recipe_id, RecipeChanges.THUMBNAIL)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _everything_after_rollback(session_: orm.Session, previous_transaction):
+    """ The rollback might have undone some of the changes """
+    changes = session_.info.get(RecipeChanges._info_key)
+    if changes is not None:
+        changes.everything_changed()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _everything_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging items in the data editor) """
+    changes = update_context.session.info.get(RecipeChanges._info_key)
+    if changes is not None:
+        changes.everything_changed()
@@ -0,0 +1,67 @@
+""" Loads a recipe with everything a recipe window displays in a fixed number of statements """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import typing
+
+from sqlalchemy import orm
+
+from qisit.core.db import data
+
+
+def recipe_graph_options() -> typing.List[orm.Load]:
+    """
+    The loader options for the complete recipe: the many-to-one relationships are joined, the collections are loaded
+    by one SELECT ... IN each (together with their entries' ingredients and units), the thumbnails are undeferred.
+
+    Returns:
+        The options (for Query.options())
+    """
+
+    entry = data.IngredientListEntry
+    return [orm.joinedload(data.Recipe.author), orm.joinedload(data.Recipe.cuisine),
+            orm.joinedload(data.Recipe.yield_unit_name),
+            orm.selectinload(data.Recipe.categories),
+            orm.selectinload(data.Recipe.imagelist).undefer(data.RecipeImage.thumbnail),
+            orm.selectinload(data.Recipe.ingredientlist).joinedload(entry.ingredient),
+            orm.selectinload(data.Recipe.ingredientlist).joinedload(entry.unit)]
+
+
+def load_recipe(session_: orm.Session, recipe_id: int, refresh: bool = False) -> typing.Optional[data.Recipe]:
+    """
+    Loads the recipe with its ingredient list (ingredients, units), images (thumbnails), categories, author, cuisine
+    and yield unit: four statements, no matter how many ingredients or images the recipe has. Lazy loading would
+    cost a query for every relationship and every thumbnail.
+
+    Relationships of a recipe already in the session that have been loaded before aren't read again - unless
+    refresh is set (after a rollback). Don't refresh a recipe with unsaved changes: they'd be overwritten.
+
+    Args:
+        session_ (): The session
+        recipe_id (): The recipe's id
+        refresh (): Read everything again
+
+    Returns:
+        The recipe (or None if there isn't any)
+    """
+
+    query = session_.query(data.Recipe).options(*recipe_graph_options()).filter(data.Recipe.id == recipe_id)
+    if refresh:
+        query = query.populate_existing()
+    return query.one_or_none()
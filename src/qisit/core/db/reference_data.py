@@ -0,0 +1,249 @@
+""" The sorted lists of the reference tables (authors, cuisines, ...) shared by all windows """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import bisect
+import typing
+
+from sqlalchemy import event, orm
+
+from qisit.core.db import data, item_cache
+
+
+class ReferenceData(object):
+    """
+    The lists of authors, categories, cuisines and yield units (sorted case insensitive) and the unit names, shared by
+    all windows. Instead of every combobox and menu querying the table again they're views over these lists.
+
+    Every table has a version which is bumped whenever the table changes. A view compares it with the version it
+    displays and only then takes the new list. The lists are loaded lazily (one query each) and kept up to date by the
+    flushes - the new or renamed items are put into place, the deleted ones removed. Whenever that's not possible
+    (rollback, Query.update()/delete()) the list is dropped and reloaded the next time it's used.
+
+    There's one cache per session, stored in the session's info dictionary.
+    """
+
+    class Entry(typing.NamedTuple):
+        """ An item of a list """
+        id: int
+        name: str
+        item: typing.Any
+        """ The item itself. It might be expired, its name is the entry's """
+
+    tables = (data.Author, data.Category, data.Cuisine, data.YieldUnitName)
+    """ The tables whose lists are kept """
+
+    _info_key = "qisit_reference_data"
+    """ The key in session.info """
+
+    def __init__(self):
+        self._entries = {}
+        # The entries' sort keys (the names in lower case), for bisect
+        self._keys = {}
+        self._unit_names = None
+        self._versions = {table: 0 for table in self.tables + (data.IngredientUnit,)}
+        # Tables changed by flushes since the last commit. Rolling back might undo their changes
+        self._unsaved_tables = set()
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "ReferenceData":
+        """
+        Returns the session's cache, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The cache
+        """
+
+        cache = session_.info.get(cls._info_key)
+        if cache is None:
+            cache = cls()
+            session_.info[cls._info_key] = cache
+        return cache
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return name.lower()
+
+    def entries(self, session_: orm.Session, table) -> typing.List[Entry]:
+        """
+        The table's items, sorted by name (case insensitive)
+
+        Args:
+            session_ (): The session (for loading the list)
+            table (): One of the tables
+
+        Returns:
+            The entries. Don't change the list
+        """
+
+        entries = self._entries.get(table)
+        if entries is None:
+            entries = sorted((self.Entry(item.id, item.name, item) for item in session_.query(table)),
+                             key=lambda entry: self._key(entry.name))
+            self._entries[table] = entries
+            self._keys[table] = [self._key(entry.name) for entry in entries]
+        return entries
+
+    def invalidate(self, table):
+        """ The table has changed in an unknown way. Its list is reloaded the next time it's used """
+        if table is data.IngredientUnit:
+            self._unit_names = None
+        else:
+            self._entries.pop(table, None)
+            self._keys.pop(table, None)
+        self._versions[table] += 1
+
+    def unit_names(self, session_: orm.Session) -> typing.List[str]:
+        """
+        The names of the units (see IngredientUnit.unit_dict), sorted case insensitive
+
+        Args:
+            session_ (): The session (for updating the unit dictionary)
+
+        Returns:
+            The names. Don't change the list
+        """
+
+        if self._unit_names is None:
+            data.IngredientUnit.update_unit_dict(session_)
+            self._unit_names = sorted(data.IngredientUnit.unit_dict, key=str.casefold)
+        return self._unit_names
+
+    def update_items(self, table, items: typing.Iterable[typing.Any], deleted: typing.Iterable[typing.Any]):
+        """
+        Puts the new (or renamed) items into place and removes the deleted ones
+
+        Args:
+            table (): The table
+            items (): The new or changed items
+            deleted (): The deleted items
+
+        Returns:
+
+        """
+
+        entries = self._entries.get(table)
+        changed = False
+        if entries is not None:
+            keys = self._keys[table]
+            for item in items:
+                position = next((position for position, entry in enumerate(entries) if entry.item is item), None)
+                if position is not None:
+                    if entries[position].name == item.name:
+                        continue
+                    del entries[position]
+                    del keys[position]
+                key = self._key(item.name)
+                position = bisect.bisect_right(keys, key)
+                entries.insert(position, self.Entry(item.id, item.name, item))
+                keys.insert(position, key)
+                changed = True
+            for item in deleted:
+                position = next((position for position, entry in enumerate(entries) if entry.item is item), None)
+                if position is not None:
+                    del entries[position]
+                    del keys[position]
+                    changed = True
+        else:
+            # Not loaded, the version tells the views anyway
+            changed = True
+
+        if changed:
+            self._versions[table] += 1
+            self._unsaved_tables.add(table)
+
+    def version(self, table) -> int:
+        """ The table's version, bumped whenever the table changes """
+        return self._versions[table]
+
+
+def _cache(session_: orm.Session) -> typing.Optional[ReferenceData]:
+    return session_.info.get(ReferenceData._info_key)
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _update_after_flush(session_: orm.Session, flush_context):
+    cache = _cache(session_)
+    if cache is None:
+        return
+
+    changed = {}
+    deleted = {}
+    units_changed = False
+    for items, changes in ((list(session_.new) + list(session_.dirty), changed), (session_.deleted, deleted)):
+        for item in items:
+            table = type(item)
+            if table in ReferenceData.tables:
+                changes.setdefault(table, []).append(item)
+            elif table is data.IngredientUnit and (changes is deleted or session_.is_modified(item)):
+                units_changed = True
+
+    if units_changed:
+        cache.invalidate(data.IngredientUnit)
+        cache._unsaved_tables.add(data.IngredientUnit)
+    for table in set(changed) | set(deleted):
+        cache.update_items(table, changed.get(table, ()), deleted.get(table, ()))
+
+
+@item_cache.listens_for_insert
+def _update_after_insert(session_: orm.Session, table, items: list):
+    """ get_or_add_item inserts with a core statement, bypassing the flush """
+    cache = _cache(session_)
+    if cache is None:
+        return
+
+    if table in ReferenceData.tables:
+        cache.update_items(table, items, ())
+    elif table is data.IngredientUnit:
+        cache.invalidate(data.IngredientUnit)
+        cache._unsaved_tables.add(data.IngredientUnit)
+
+
+@event.listens_for(orm.Session, "after_commit")
+def _saved_after_commit(session_: orm.Session):
+    cache = _cache(session_)
+    transaction = session_.transaction
+    if cache is not None and (transaction is None or transaction.parent is None):
+        cache._unsaved_tables = set()
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _invalidate_after_rollback(session_: orm.Session, previous_transaction):
+    """ The rollback might have undone some of the changes """
+    cache = _cache(session_)
+    if cache is None:
+        return
+    for table in cache._unsaved_tables:
+        cache.invalidate(table)
+    if previous_transaction.parent is None:
+        cache._unsaved_tables = set()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _invalidate_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging items in the data editor) """
+    cache = _cache(update_context.session)
+    table = update_context.mapper.class_
+    if cache is not None and (table in ReferenceData.tables or table is data.IngredientUnit):
+        cache.invalidate(table)
+        cache._unsaved_tables.add(table)
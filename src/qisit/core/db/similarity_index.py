@@ -0,0 +1,360 @@
+""" Find recipes similar to a given one (shared ingredients, categories and cuisine) """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+import math
+import typing
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+
+from qisit.core import db
+from qisit.core.db import data
+
+
+class SimilarityIndex(object):
+    """
+    Every recipe is a sparse vector of its (normalized) ingredients, weighted by TF-IDF - rare ingredients (saffron)
+    say more about a recipe than common ones (salt). The similarity of two recipes is the cosine of their vectors,
+    plus a bonus for shared categories (Jaccard) and the same cuisine.
+
+    The vectors are stored as an inverted index (ingredient -> recipes), so only the recipes sharing at least one
+    ingredient with the given recipe are scored. Recipes without any shared ingredient aren't considered similar at
+    all.
+
+    There's one index per session. It's updated on every flush. The IDF weights (and the vector's norms) are a
+    snapshot taken when the index is loaded - changed recipes are weighted with the snapshot's IDF, so the weights
+    drift a bit until the index is reloaded (rollback, bulk operations or invalidate())
+
+    Loading takes a while for large databases, so it can be done by another session (a QueryWorker's, see
+    start_loading()). That session only sees committed data: the recipes changed by this session's current
+    transaction and those changed while loading are re-read when the loaded index is taken over (finish_loading())
+    """
+
+    class Similar(typing.NamedTuple):
+        """ A similar recipe """
+        recipe_id: int
+        score: float
+
+    ingredient_weight = 0.7
+    """ Weight of the ingredient's cosine similarity """
+
+    category_weight = 0.2
+    """ Weight of the shared categories """
+
+    cuisine_weight = 0.1
+    """ Weight of the same cuisine """
+
+    _info_key = "qisit_similarity_index"
+    """ The key in session.info """
+
+    def __init__(self):
+        self._postings = {}
+        self._ingredients = {}
+        self._categories = {}
+        self._cuisines = {}
+        self._idf = {}
+        self._norms = {}
+        self.stale = True
+        # Recipes changed by the current transaction (None: unknown)
+        self._unsaved_ids = None
+        # Recipes changed while the index is loaded by another session (None: not loading or the load is outdated)
+        self._loading_ids = None
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "SimilarityIndex":
+        """
+        Returns the session's index, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The index
+        """
+
+        index = session_.info.get(cls._info_key)
+        if index is None:
+            index = cls()
+            session_.info[cls._info_key] = index
+        return index
+
+    def _idf_of(self, ingredient_id: int) -> float:
+        """ The inverse document frequency. Ingredients that weren't known at the last load get their current one """
+        idf = self._idf.get(ingredient_id)
+        if idf is None:
+            document_frequency = len(self._postings.get(ingredient_id, ())) or 1
+            idf = math.log((len(self._ingredients) + 1) / document_frequency)
+        return idf
+
+    def _norm_of(self, ingredient_ids: typing.Iterable[int]) -> float:
+        return math.sqrt(sum(self._idf_of(ingredient_id) ** 2 for ingredient_id in ingredient_ids))
+
+    @staticmethod
+    def _read_recipes(session_: orm.Session, recipe_ids: typing.Collection[int] = None) -> \
+            typing.Tuple[dict, dict, dict]:
+        """ recipe id -> set of ingredients, recipe id -> set of categories, recipe id -> cuisine """
+
+        entry = data.IngredientListEntry
+        recipe = data.Recipe
+
+        ingredient_query = sql.select([entry.recipe_id, entry.ingredient_id]).where(
+            sql.and_(entry.position >= 0, entry.position % entry.GROUP_FACTOR != 0))
+        category_query = sql.select([data.CategoryList.recipe_id, data.CategoryList.category_id])
+        recipe_query = sql.select([recipe.id, recipe.cuisine_id])
+        if recipe_ids is not None:
+            ingredient_query = ingredient_query.where(entry.recipe_id.in_(recipe_ids))
+            category_query = category_query.where(data.CategoryList.recipe_id.in_(recipe_ids))
+            recipe_query = recipe_query.where(recipe.id.in_(recipe_ids))
+
+        cuisines = {recipe_id: cuisine_id for recipe_id, cuisine_id in session_.execute(recipe_query)}
+        ingredients = {recipe_id: set() for recipe_id in cuisines}
+        for recipe_id, ingredient_id in session_.execute(ingredient_query):
+            ingredients[recipe_id].add(ingredient_id)
+        categories = {}
+        for recipe_id, category_id in session_.execute(category_query):
+            categories.setdefault(recipe_id, set()).add(category_id)
+
+        return ingredients, categories, cuisines
+
+    def invalidate(self):
+        """ Mark the index as stale. It will be reloaded the next time it's used """
+        self.stale = True
+
+    def _lose_track(self):
+        """ Changes have bypassed the session: The changed recipes are unknown, a running load is outdated """
+        self.invalidate()
+        self._unsaved_ids = None
+        self._loading_ids = None
+
+    @classmethod
+    def _loaded(cls, session_: orm.Session) -> "SimilarityIndex":
+        """ A new index, loaded by the given session """
+        index = cls()
+        index.load(session_)
+        return index
+
+    def start_loading(self, session_: orm.Session) -> typing.Optional[typing.Callable[[orm.Session],
+                                                                                       "SimilarityIndex"]]:
+        """
+        Prepares loading the index by another session. The job returned has to be run with that session, its result
+        is passed to finish_loading()
+
+        Args:
+            session_ (): This index's session
+
+        Returns:
+            The job or None if the index can't be loaded by another session (changes of the current transaction
+            that haven't been tracked)
+        """
+
+        if self._unsaved_ids is None:
+            if db.has_uncommitted_changes(session_):
+                return None
+            self._unsaved_ids = set()
+        self._loading_ids = set(self._unsaved_ids)
+        return self._loaded
+
+    def finish_loading(self, session_: orm.Session, loaded: "SimilarityIndex") -> bool:
+        """
+        Takes over an index loaded by another session (see start_loading())
+
+        Args:
+            session_ (): This index's session
+            loaded (): The loaded index
+
+        Returns:
+            False if the loaded index is outdated (bulk operations in the meantime) - it has to be loaded again
+        """
+
+        if self._loading_ids is None:
+            return False
+        changed_ids, self._loading_ids = self._loading_ids, None
+        if self.stale:
+            self._ingredients, self._categories, self._cuisines = loaded._ingredients, loaded._categories, \
+                                                                  loaded._cuisines
+            self._postings, self._idf, self._norms = loaded._postings, loaded._idf, loaded._norms
+            self.stale = False
+            self.update_recipes(session_, changed_ids)
+        return True
+
+    def load(self, session_: orm.Session):
+        """
+        (Re)loads the complete index from the database and takes a new snapshot of the IDF weights
+
+        Args:
+            session_ (): The session
+
+        Returns:
+
+        """
+
+        self._ingredients, self._categories, self._cuisines = self._read_recipes(session_)
+        self._postings = {}
+        for recipe_id, ingredient_ids in self._ingredients.items():
+            for ingredient_id in ingredient_ids:
+                self._postings.setdefault(ingredient_id, set()).add(recipe_id)
+
+        number_of_recipes = len(self._ingredients)
+        self._idf = {ingredient_id: math.log((number_of_recipes + 1) / len(recipes))
+                     for ingredient_id, recipes in self._postings.items()}
+        self._norms = {recipe_id: self._norm_of(ingredient_ids)
+                       for recipe_id, ingredient_ids in self._ingredients.items()}
+        self.stale = False
+
+    def similar(self, session_: orm.Session, recipe_id: int, limit: int = 10) -> typing.List[Similar]:
+        """
+        The recipes most similar to the given one
+
+        Args:
+            session_ (): The session (for loading a stale index)
+            recipe_id (): The recipe
+            limit (): Maximum number of results
+
+        Returns:
+            The similar recipes, the most similar first
+        """
+
+        if self.stale:
+            self.load(session_)
+
+        ingredient_ids = self._ingredients.get(recipe_id)
+        norm = self._norms.get(recipe_id)
+        if not ingredient_ids or not norm:
+            return []
+
+        # Sparse dot products: Only the recipes sharing an ingredient
+        dot_products = {}
+        for ingredient_id in ingredient_ids:
+            weight = self._idf_of(ingredient_id) ** 2
+            if weight == 0.0:
+                # An ingredient used by every recipe
+                continue
+            for other_id in self._postings[ingredient_id]:
+                dot_products[other_id] = dot_products.get(other_id, 0.0) + weight
+        dot_products.pop(recipe_id, None)
+
+        categories = self._categories.get(recipe_id, set())
+        cuisine = self._cuisines.get(recipe_id)
+
+        def score(other_id: int) -> float:
+            other_norm = self._norms.get(other_id)
+            the_score = self.ingredient_weight * dot_products[other_id] / (norm * other_norm) if other_norm else 0.0
+            other_categories = self._categories.get(other_id)
+            if categories and other_categories:
+                the_score += self.category_weight * len(categories & other_categories) / len(
+                    categories | other_categories)
+            if cuisine is not None and self._cuisines.get(other_id) == cuisine:
+                the_score += self.cuisine_weight
+            return the_score
+
+        best = heapq.nlargest(limit, ((score(other_id), -other_id) for other_id in dot_products))
+        return [self.Similar(-negative_id, the_score) for the_score, negative_id in best]
+
+    def update_recipes(self, session_: orm.Session, recipe_ids: typing.Collection[int]):
+        """
+        Updates (or removes) the recipes in the index. The recipes' current state is read from the database
+
+        Args:
+            session_ (): The session
+            recipe_ids (): The ids of the changed (or deleted) recipes
+
+        Returns:
+
+        """
+
+        if not recipe_ids:
+            return
+
+        ingredients, categories, cuisines = self._read_recipes(session_, recipe_ids)
+        for recipe_id in recipe_ids:
+            for ingredient_id in self._ingredients.pop(recipe_id, ()):
+                self._postings[ingredient_id].discard(recipe_id)
+            self._categories.pop(recipe_id, None)
+            self._cuisines.pop(recipe_id, None)
+            self._norms.pop(recipe_id, None)
+
+            if recipe_id in cuisines:
+                self._ingredients[recipe_id] = ingredients[recipe_id]
+                for ingredient_id in ingredients[recipe_id]:
+                    self._postings.setdefault(ingredient_id, set()).add(recipe_id)
+                if recipe_id in categories:
+                    self._categories[recipe_id] = categories[recipe_id]
+                self._cuisines[recipe_id] = cuisines[recipe_id]
+                self._norms[recipe_id] = self._norm_of(ingredients[recipe_id])
+
+
+def _loaded_index(session_: orm.Session) -> typing.Optional[SimilarityIndex]:
+    """ The session's index - if there's an index worth updating """
+    index = session_.info.get(SimilarityIndex._info_key)
+    if index is None or index.stale:
+        return None
+    return index
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _update_after_flush(session_: orm.Session, flush_context):
+    """ Update the recipes whose ingredients, categories or cuisine have been changed """
+    index = session_.info.get(SimilarityIndex._info_key)
+    if index is None:
+        return
+
+    recipe_ids = set()
+    for item in list(session_.new) + list(session_.dirty) + list(session_.deleted):
+        if isinstance(item, data.IngredientListEntry):
+            recipe_ids.add(item.recipe_id)
+            recipe_ids.update(sql.inspect(item).attrs.recipe_id.history.deleted or ())
+        elif isinstance(item, data.Recipe):
+            recipe_ids.add(item.id)
+        elif isinstance(item, (data.Category, data.Cuisine)) and item in session_.deleted:
+            # Rare enough to simply reload everything
+            index._lose_track()
+            return
+    recipe_ids.discard(None)
+    for tracked_ids in (index._unsaved_ids, index._loading_ids):
+        if tracked_ids is not None:
+            tracked_ids.update(recipe_ids)
+    if not index.stale:
+        index.update_recipes(session_, recipe_ids)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _invalidate_after_rollback(session_: orm.Session, previous_transaction):
+    """ The rollback might have undone some of the changes """
+    index = _loaded_index(session_)
+    if index is not None:
+        index.invalidate()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _invalidate_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging items in the data editor) """
+    index = update_context.session.info.get(SimilarityIndex._info_key)
+    if index is not None and update_context.mapper.class_ in (data.Recipe, data.IngredientListEntry, data.Ingredient,
+                                                              data.Category, data.CategoryList, data.Cuisine):
+        index._lose_track()
+
+
+@event.listens_for(orm.Session, "after_transaction_end")
+def _forget_after_transaction(session_: orm.Session, transaction):
+    """ The outermost transaction has been committed or rolled back: Other sessions see the same data now """
+    index = session_.info.get(SimilarityIndex._info_key)
+    if index is not None and transaction.parent is None:
+        index._unsaved_ids = set()
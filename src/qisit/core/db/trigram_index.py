@@ -0,0 +1,282 @@
+""" A trigram index for typo tolerant searching of recipe titles and ingredient names """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import heapq
+import re
+import typing
+import unicodedata
+from array import array
+from collections import Counter
+
+import sqlalchemy as sql
+from sqlalchemy import event, orm
+
+from qisit.core.db import data, item_cache
+
+
+class TrigramIndex(object):
+    """
+    Inverted index: trigram -> array of ids. Every word of a text is padded (two blanks in front, one at the end, so
+    "Vindaloo" becomes "  v", " vi", "vin", ... "oo ") and split into trigrams. A search text matches if enough of its
+    trigrams are found in the text - "vindalo" shares seven of its eight trigrams with "Vindaloo".
+
+    There's one index per session and table (recipe titles, ingredient names), stored in the session's info
+    dictionary. It's updated on every flush. Whenever it can't be updated (rollback, Query.update()/delete()) it's
+    marked as stale and reloaded from the database the next time it's used.
+    """
+
+    class Match(typing.NamedTuple):
+        """ A search result """
+        id: int
+        similarity: float
+        """ The fraction of the search text's trigrams found in the text """
+
+    columns = {
+        data.Recipe: data.Recipe.title,
+        data.Ingredient: data.Ingredient.name
+    }
+    """ The indexed column of each table """
+
+    _word_pattern = re.compile(r"\w+")
+
+    _number_pattern = re.compile(r"\d+")
+
+    def __init__(self, table):
+        self.table = table
+        self._postings = {}
+        self._texts = {}
+        self.stale = True
+
+    @classmethod
+    def for_session(cls, session_: orm.Session, table) -> "TrigramIndex":
+        """
+        Returns the session's index of the table, creating it if necessary
+
+        Args:
+            session_ (): The session
+            table (): data.Recipe or data.Ingredient
+
+        Returns:
+            The index
+        """
+
+        info_key = cls._info_key(table)
+        index = session_.info.get(info_key)
+        if index is None:
+            index = cls(table)
+            session_.info[info_key] = index
+        return index
+
+    @staticmethod
+    def _info_key(table) -> str:
+        """ The key in session.info """
+        return f"qisit_trigram_index_{table.__tablename__}"
+
+    @classmethod
+    def trigrams(cls, text: str) -> typing.Set[str]:
+        """
+        The trigrams of the text (case and accents don't matter)
+
+        Args:
+            text (): The text
+
+        Returns:
+            The trigrams
+        """
+
+        text = text.casefold()
+        try:
+            # Plain ASCII, nothing to strip (str.isascii() needs Python 3.7)
+            text.encode("ascii")
+        except UnicodeEncodeError:
+            decomposed = unicodedata.normalize("NFKD", text)
+            text = "".join(character for character in decomposed if not unicodedata.combining(character))
+        trigrams = set()
+        for word in cls._word_pattern.findall(text):
+            trigrams.update(cls._word_trigrams(word))
+        return trigrams
+
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def _word_trigrams(word: str) -> typing.Tuple[str, ...]:
+        """ The trigrams of a single word. Titles share lots of words, so they're cached """
+        padded = f"  {word} "
+        return tuple(padded[start:start + 3] for start in range(len(padded) - 2))
+
+    def _add(self, item_id: int, text: str):
+        self._texts[item_id] = text
+        for trigram in self.trigrams(text):
+            postings = self._postings.get(trigram)
+            if postings is None:
+                postings = self._postings[trigram] = array("I")
+            postings.append(item_id)
+
+    def _remove(self, item_id: int):
+        text = self._texts.pop(item_id, None)
+        if text is None:
+            return
+        for trigram in self.trigrams(text):
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                postings.remove(item_id)
+                if not postings:
+                    del self._postings[trigram]
+
+    def invalidate(self):
+        """ Mark the index as stale. It will be reloaded the next time it's used """
+        self.stale = True
+
+    def load(self, session_: orm.Session):
+        """
+        (Re)loads the complete index from the database (one query)
+
+        Args:
+            session_ (): The session
+
+        Returns:
+
+        """
+
+        self._postings = {}
+        self._texts = {}
+        column = self.columns[self.table]
+        for item_id, text in session_.execute(sql.select([self.table.id, column]).where(column != None)):
+            self._add(item_id, text)
+        self.stale = False
+
+    def search(self, session_: orm.Session, text: str, limit: int = 50, min_similarity: float = 0.6) -> \
+            typing.List[Match]:
+        """
+        The texts most similar to the search text
+
+        Args:
+            session_ (): The session (for reloading a stale index)
+            text (): The search text
+            limit (): The maximum number of results
+            min_similarity (): The minimum fraction of the search text's trigrams that have to be found
+
+        Returns:
+            The matches, the best first. Of equally good matches the shorter texts come first
+        """
+
+        if self.stale:
+            self.load(session_)
+
+        search_trigrams = self.trigrams(text)
+        if not search_trigrams:
+            return []
+
+        # Counting is done by Counter's C implementation - much faster than any loop
+        counts = Counter()
+        for trigram in search_trigrams:
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                counts.update(postings)
+
+        # Numbers aren't typos: "Recipe 1" mustn't find "Recipe 2". All their trigrams have to be found
+        number_trigrams = self.trigrams(" ".join(self._number_pattern.findall(text)))
+        number_counts = Counter()
+        for trigram in number_trigrams:
+            number_counts.update(self._postings.get(trigram, ()))
+
+        min_count = min_similarity * len(search_trigrams)
+        texts = self._texts
+        best = heapq.nlargest(limit, ((count, -len(texts[item_id]), -item_id) for item_id, count in counts.items()
+                                      if count >= min_count and number_counts[item_id] == len(number_trigrams)))
+        return [self.Match(-negative_id, count / len(search_trigrams)) for count, negative_length, negative_id in best]
+
+    def text(self, item_id: int) -> typing.Optional[str]:
+        """ The indexed text of the item """
+        return self._texts.get(item_id)
+
+    def update_items(self, items: typing.Iterable[typing.Tuple[int, typing.Optional[str]]]):
+        """
+        Updates (or removes) the items
+
+        Args:
+            items (): (id, new text). A text of None removes the item
+
+        Returns:
+
+        """
+
+        for item_id, text in items:
+            self._remove(item_id)
+            if text is not None:
+                self._add(item_id, text)
+
+
+def _loaded_indexes(session_: orm.Session) -> typing.Dict[typing.Any, TrigramIndex]:
+    """ The session's indexes worth updating """
+    indexes = {}
+    for table in TrigramIndex.columns:
+        index = session_.info.get(TrigramIndex._info_key(table))
+        if index is not None and not index.stale:
+            indexes[table] = index
+    return indexes
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _update_after_flush(session_: orm.Session, flush_context):
+    """ Add new, rename changed and remove deleted items """
+    indexes = _loaded_indexes(session_)
+    if not indexes:
+        return
+
+    changes = {table: [] for table in indexes}
+    for item in list(session_.new) + list(session_.dirty) + list(session_.deleted):
+        table = type(item)
+        if table not in indexes:
+            continue
+        if item in session_.deleted:
+            changes[table].append((item.id, None))
+        else:
+            column = TrigramIndex.columns[table]
+            text = getattr(item, column.key)
+            if item in session_.new or indexes[table].text(item.id) != text:
+                changes[table].append((item.id, text))
+
+    for table, items in changes.items():
+        indexes[table].update_items(items)
+
+
+@item_cache.listens_for_insert
+def _update_after_insert(session_: orm.Session, table, items: list):
+    """ get_or_add_item inserts with a core statement, bypassing the flush """
+    index = _loaded_indexes(session_).get(table)
+    if index is not None:
+        column = TrigramIndex.columns[table]
+        index.update_items((item.id, getattr(item, column.key)) for item in items)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _invalidate_after_rollback(session_: orm.Session, previous_transaction):
+    """ The rollback might have undone some of the changes """
+    for index in _loaded_indexes(session_).values():
+        index.invalidate()
+
+
+@event.listens_for(orm.Session, "after_bulk_delete")
+@event.listens_for(orm.Session, "after_bulk_update")
+def _invalidate_after_bulk_operation(update_context):
+    """ Query.delete()/Query.update() bypass the session (merging ingredients in the data editor) """
+    index = _loaded_indexes(update_context.session).get(update_context.mapper.class_)
+    if index is not None:
+        index.invalidate()
@@ -172,9 +172,10 @@ class ImportGourmet(object):
             for gourmet_category in gourmet_category_list:
                 category_list.append(nullify(gourmet_category.category))
 
-        for gourmet_item in category_list:
-            if gourmet_item:
-                qisit_category = data.Category.get_or_add_category(self._qisit, gourmet_item)
+        category_names = [gourmet_item for gourmet_item in category_list if gourmet_item]
+        if category_names:
+            # All categories at once. Duplicates (Gourmet doesn't check for them) are removed by the dictionary
+            for qisit_category in data.Category.get_or_add_categories(self._qisit, category_names).values():
                 qisit_recipe.categories.append(qisit_category)
 
         self._qisit.merge(qisit_recipe)
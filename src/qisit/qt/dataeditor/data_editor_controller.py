@@ -25,6 +25,9 @@ from sqlalchemy import orm
 
 from qisit import translate
 from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.core.db.duplicate_finder import DuplicateFinder
+from qisit.core.db.merge_suggestions import MergeSuggestions
 from qisit.core.util import nullify
 from qisit.core import default_locale
 from qisit.qt import misc
@@ -85,6 +88,9 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
         self._item_model.changed.connect(self.set_modified)
         self._item_model.changeSelection.connect(self.change_selection)
         self._item_model.illegalValue.connect(self.illegal_value)
+        ChangeBus.for_session(self._session).subscribe(
+            self._item_model.apply_changes, data.Author, data.Category, data.Cuisine, data.Ingredient,
+            data.IngredientUnit, data.YieldUnitName, data.Recipe, data.CategoryList, data.IngredientListEntry)
 
         self.dataColumnView.setModel(self._item_model)
 
@@ -102,6 +108,20 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
         self.recipeListLayout = QtWidgets.QVBoxLayout()
         self.recipeListView = QtWidgets.QListView()
         self._recipe_list_model = recipe_list_model.RecipeListModel()
+
+        self._duplicate_finder = DuplicateFinder()
+        self.duplicatesTab = QtWidgets.QWidget()
+        self.duplicatesTreeWidget = QtWidgets.QTreeWidget(self.duplicatesTab)
+        self.findDuplicatesButton = QtWidgets.QPushButton(self.duplicatesTab)
+        self.deleteDuplicatesButton = QtWidgets.QPushButton(self.duplicatesTab)
+        self.mergeDuplicatesButton = QtWidgets.QPushButton(self.duplicatesTab)
+
+        self._merge_suggestions = MergeSuggestions()
+        self.mergeTab = QtWidgets.QWidget()
+        self.mergeTableComboBox = QtWidgets.QComboBox(self.mergeTab)
+        self.findMergesButton = QtWidgets.QPushButton(self.mergeTab)
+        self.mergeButton = QtWidgets.QPushButton(self.mergeTab)
+        self.mergeTreeWidget = QtWidgets.QTreeWidget(self.mergeTab)
         self.init_ui()
 
     def _get_item_for_stackedwidget(self, selected_index: QtCore.QModelIndex):
@@ -117,6 +137,127 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
             the_item = model.get_item(selected_index.row(), column)[0]
         return the_item
 
+    def _init_duplicates_tab(self):
+        """ The tab listing the clusters of near duplicate recipes """
+
+        _translate = self._translate
+
+        button_layout = QtWidgets.QHBoxLayout()
+        button_layout.addWidget(self.findDuplicatesButton)
+        button_layout.addWidget(self.deleteDuplicatesButton)
+        button_layout.addWidget(self.mergeDuplicatesButton)
+        button_layout.addStretch()
+        layout = QtWidgets.QVBoxLayout(self.duplicatesTab)
+        layout.addLayout(button_layout)
+        layout.addWidget(self.duplicatesTreeWidget)
+
+        self.findDuplicatesButton.setText(_translate("DataEditor", "Find Duplicates"))
+        self.deleteDuplicatesButton.setText(_translate("DataEditor", "Delete Checked Recipes"))
+        self.deleteDuplicatesButton.setEnabled(False)
+        self.mergeDuplicatesButton.setText(_translate("DataEditor", "Merge Checked into Selected Recipe"))
+        self.mergeDuplicatesButton.setEnabled(False)
+        self.duplicatesTreeWidget.setHeaderLabels([_translate("DataEditor", "Recipe"),
+                                                   _translate("DataEditor", "Last Modified")])
+        self.duplicatesTreeWidget.setWhatsThis(
+            _translate("DataEditor", "Recipes that look alike - same title words, ingredients and instructions. Check "
+                                     "the recipes to delete, double click a recipe to open it. Merging adds the "
+                                     "categories and images of the checked recipes to the selected one and deletes "
+                                     "them."))
+        self.tabWidget.addTab(self.duplicatesTab, _translate("DataEditor", "Duplicate Recipes"))
+
+        self.findDuplicatesButton.clicked.connect(self.findDuplicatesButton_clicked)
+        self.deleteDuplicatesButton.clicked.connect(self.deleteDuplicatesButton_clicked)
+        self.mergeDuplicatesButton.clicked.connect(self.mergeDuplicatesButton_clicked)
+        self.duplicatesTreeWidget.itemChanged.connect(self.duplicatesTreeWidget_itemChanged)
+        self.duplicatesTreeWidget.currentItemChanged.connect(self.duplicatesTreeWidget_currentItemChanged)
+        self.duplicatesTreeWidget.itemDoubleClicked.connect(self.duplicatesTreeWidget_itemDoubleClicked)
+
+    def _init_merge_tab(self):
+        """ The tab listing the groups of items (ingredients, authors, ...) that are probably the same """
+
+        _translate = self._translate
+
+        for table, name in ((data.Ingredient, _translate("DataEditor", "Ingredients")),
+                            (data.Author, _translate("DataEditor", "Authors")),
+                            (data.Cuisine, _translate("DataEditor", "Cuisine")),
+                            (data.IngredientUnit, _translate("DataEditor", "Ingredient Units")),
+                            (data.YieldUnitName, _translate("DataEditor", "Yield Units"))):
+            self.mergeTableComboBox.addItem(name, MergeSuggestions.tables.index(table))
+
+        button_layout = QtWidgets.QHBoxLayout()
+        button_layout.addWidget(self.mergeTableComboBox)
+        button_layout.addWidget(self.findMergesButton)
+        button_layout.addWidget(self.mergeButton)
+        button_layout.addStretch()
+        layout = QtWidgets.QVBoxLayout(self.mergeTab)
+        layout.addLayout(button_layout)
+        layout.addWidget(self.mergeTreeWidget)
+
+        self.findMergesButton.setText(_translate("DataEditor", "Find Similar Names"))
+        self.mergeButton.setText(_translate("DataEditor", "Merge Checked"))
+        self.mergeButton.setEnabled(False)
+        self.mergeTreeWidget.setHeaderLabels([_translate("DataEditor", "Name"), _translate("DataEditor", "Used")])
+        self.mergeTreeWidget.setWhatsThis(
+            _translate("DataEditor", "Items whose names differ only in case, accents, punctuation, plurals, word order "
+                                     "or a typo. The checked items of each checked group are merged into the first "
+                                     "checked item."))
+        self.tabWidget.addTab(self.mergeTab, _translate("DataEditor", "Merge Suggestions"))
+
+        self.mergeTableComboBox.currentIndexChanged.connect(self.mergeTableComboBox_currentIndexChanged)
+        self.findMergesButton.clicked.connect(self.findMergesButton_clicked)
+        self.mergeButton.clicked.connect(self.mergeButton_clicked)
+        self.mergeTreeWidget.itemChanged.connect(self.mergeTreeWidget_itemChanged)
+
+    def _checked_duplicates(self) -> typing.List[QtWidgets.QTreeWidgetItem]:
+        """ The recipe items the user has checked in the duplicates tab """
+
+        tree = self.duplicatesTreeWidget
+        checked = []
+        for cluster_row in range(tree.topLevelItemCount()):
+            cluster_item = tree.topLevelItem(cluster_row)
+            for recipe_row in range(cluster_item.childCount()):
+                recipe_item = cluster_item.child(recipe_row)
+                if recipe_item.checkState(0) == QtCore.Qt.Checked:
+                    checked.append(recipe_item)
+        return checked
+
+    def _duplicates_merge(self) -> typing.Tuple[typing.Optional[QtWidgets.QTreeWidgetItem],
+                                                typing.List[QtWidgets.QTreeWidgetItem]]:
+        """ The selected recipe item in the duplicates tab and the other checked recipe items of its cluster """
+
+        target_item = self.duplicatesTreeWidget.currentItem()
+        if target_item is None or target_item.parent() is None:
+            # Nothing or a cluster selected
+            return None, []
+        cluster_item = target_item.parent()
+        source_items = [cluster_item.child(recipe_row) for recipe_row in range(cluster_item.childCount())
+                        if cluster_item.child(recipe_row) is not target_item and
+                        cluster_item.child(recipe_row).checkState(0) == QtCore.Qt.Checked]
+        return target_item, source_items
+
+    def _remove_single_duplicates(self):
+        """ A single recipe isn't a cluster of duplicates anymore """
+        tree = self.duplicatesTreeWidget
+        for cluster_row in reversed(range(tree.topLevelItemCount())):
+            if tree.topLevelItem(cluster_row).childCount() < 2:
+                tree.takeTopLevelItem(cluster_row)
+
+    def _checked_merges(self) -> typing.List[typing.List[int]]:
+        """ The checked items' ids of each checked group in the merge tab (groups with less than two are skipped) """
+
+        tree = self.mergeTreeWidget
+        merges = []
+        for group_row in range(tree.topLevelItemCount()):
+            group_item = tree.topLevelItem(group_row)
+            if group_item.checkState(0) != QtCore.Qt.Checked:
+                continue
+            item_ids = [group_item.child(item_row).data(0, QtCore.Qt.UserRole)
+                        for item_row in range(group_item.childCount())
+                        if group_item.child(item_row).checkState(0) == QtCore.Qt.Checked]
+            if len(item_ids) > 1:
+                merges.append(item_ids)
+        return merges
+
     def _load_ui_states(self):
         """
         Loads the previously saved UI stated
@@ -200,6 +341,8 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
 
         self.dataColumnView.setPreviewWidget(self.recipeListView)
 
+        self._init_duplicates_tab()
+        self._init_merge_tab()
         self._load_ui_states()
 
         selected_id = self.unitButtonGroup.checkedId()
@@ -325,6 +468,29 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
 
         self._recipe_list_model.set_recipe_list(recipe_list)
 
+    def deleteDuplicatesButton_clicked(self):
+        """
+        Deletes the checked recipes in the duplicates tab
+
+        Returns:
+
+        """
+
+        checked = self._checked_duplicates()
+        if not checked:
+            return
+
+        self.set_modified()
+        for recipe_item in checked:
+            recipe = self._session.query(data.Recipe).get(recipe_item.data(0, QtCore.Qt.UserRole))
+            if recipe is not None:
+                self._session.delete(recipe)
+            recipe_item.parent().removeChild(recipe_item)
+
+        self._remove_single_duplicates()
+        self.deleteDuplicatesButton.setEnabled(False)
+        self.mergeDuplicatesButton.setEnabled(False)
+
     def deleteIconButton_clicked(self):
         self._ingredient_icon = None
         self.iconLabel.clear()
@@ -374,6 +540,115 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
         self.deleteIconButton.setEnabled(True)
         self.stackedwidget_edited()
 
+    def duplicatesTreeWidget_currentItemChanged(self, current: QtWidgets.QTreeWidgetItem,
+                                                previous: QtWidgets.QTreeWidgetItem):
+        self.mergeDuplicatesButton.setEnabled(len(self._duplicates_merge()[1]) > 0)
+
+    def duplicatesTreeWidget_itemChanged(self, item: QtWidgets.QTreeWidgetItem, column: int):
+        self.deleteDuplicatesButton.setEnabled(len(self._checked_duplicates()) > 0)
+        self.mergeDuplicatesButton.setEnabled(len(self._duplicates_merge()[1]) > 0)
+
+    def duplicatesTreeWidget_itemDoubleClicked(self, item: QtWidgets.QTreeWidgetItem, column: int):
+        recipe_id = item.data(0, QtCore.Qt.UserRole)
+        if recipe_id is not None:
+            recipe = self._session.query(data.Recipe).get(recipe_id)
+            if recipe is not None:
+                self.recipeDoubleClicked.emit(recipe)
+
+    def findDuplicatesButton_clicked(self):
+        """
+        Searches the whole library for near duplicate recipes and lists them in the duplicates tab
+
+        Returns:
+
+        """
+
+        _translate = self._translate
+        tree = self.duplicatesTreeWidget
+
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            # The signatures of changed recipes are recomputed from the database
+            self._session.flush()
+            clusters = self._duplicate_finder.clusters(self._session)
+
+            recipes = {}
+            recipe_ids = [recipe_id for cluster in clusters for recipe_id in cluster]
+            for start in range(0, len(recipe_ids), 500):
+                for recipe_id, title, last_modified in self._session.query(
+                        data.Recipe.id, data.Recipe.title, data.Recipe.last_modified).filter(
+                        data.Recipe.id.in_(recipe_ids[start:start + 500])):
+                    recipes[recipe_id] = (title, last_modified)
+
+            tree.blockSignals(True)
+            tree.clear()
+            for cluster in clusters:
+                cluster_item = QtWidgets.QTreeWidgetItem(tree)
+                cluster_item.setText(0, _translate("DataEditor", "{} ({} recipes)").format(
+                    recipes[cluster[0]][0], len(cluster)))
+                for recipe_id in cluster:
+                    title, last_modified = recipes[recipe_id]
+                    recipe_item = QtWidgets.QTreeWidgetItem(cluster_item)
+                    recipe_item.setText(0, title)
+                    recipe_item.setText(1, last_modified.isoformat() if last_modified else "")
+                    recipe_item.setData(0, QtCore.Qt.UserRole, recipe_id)
+                    recipe_item.setFlags(recipe_item.flags() | QtCore.Qt.ItemIsUserCheckable)
+                    recipe_item.setCheckState(0, QtCore.Qt.Unchecked)
+            tree.expandAll()
+            tree.resizeColumnToContents(0)
+            tree.blockSignals(False)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+        self.deleteDuplicatesButton.setEnabled(False)
+        self.mergeDuplicatesButton.setEnabled(False)
+        if not clusters:
+            Qt.QMessageBox.information(self, _translate("DataEditor", "No Duplicates"),
+                                       _translate("DataEditor", "No duplicate recipes found."))
+
+    def findMergesButton_clicked(self):
+        """
+        Searches the selected table for items that are probably the same and lists them in the merge tab
+
+        Returns:
+
+        """
+
+        _translate = self._translate
+        tree = self.mergeTreeWidget
+        table = MergeSuggestions.tables[self.mergeTableComboBox.currentData()]
+
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            self._session.flush()
+            groups = self._merge_suggestions.groups(self._session, table)
+
+            tree.blockSignals(True)
+            tree.clear()
+            for group in groups:
+                group_item = QtWidgets.QTreeWidgetItem(tree)
+                group_item.setText(0, _translate("DataEditor", "{} ({} items)").format(group[0].name, len(group)))
+                group_item.setText(1, str(sum(item.usage for item in group)))
+                group_item.setFlags(group_item.flags() | QtCore.Qt.ItemIsUserCheckable)
+                group_item.setCheckState(0, QtCore.Qt.Unchecked)
+                for item in group:
+                    child_item = QtWidgets.QTreeWidgetItem(group_item)
+                    child_item.setText(0, item.name)
+                    child_item.setText(1, str(item.usage))
+                    child_item.setData(0, QtCore.Qt.UserRole, item.id)
+                    child_item.setFlags(child_item.flags() | QtCore.Qt.ItemIsUserCheckable)
+                    child_item.setCheckState(0, QtCore.Qt.Checked)
+            tree.expandAll()
+            tree.resizeColumnToContents(0)
+            tree.blockSignals(False)
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+        self.mergeButton.setEnabled(False)
+        if not groups:
+            Qt.QMessageBox.information(self, _translate("DataEditor", "No Suggestions"),
+                                       _translate("DataEditor", "No similar names found."))
+
     def illegal_value(self, error: misc.IllegalValueEntered, value: str):
         """
         The user has entered an illegal value
@@ -482,6 +757,64 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
             self.nameLineEdit.clear()
             self._selected_index = None
 
+    def mergeButton_clicked(self):
+        """
+        Merges the checked items of the checked groups in the merge tab
+
+        Returns:
+
+        """
+
+        merges = self._checked_merges()
+        if not merges:
+            return
+
+        self.set_modified()
+        table = MergeSuggestions.tables[self.mergeTableComboBox.currentData()]
+        for item_ids in merges:
+            self._merge_suggestions.merge(self._session, table, item_ids[0], item_ids[1:])
+
+        tree = self.mergeTreeWidget
+        for group_row in reversed(range(tree.topLevelItemCount())):
+            if tree.topLevelItem(group_row).checkState(0) == QtCore.Qt.Checked:
+                tree.takeTopLevelItem(group_row)
+        self.mergeButton.setEnabled(False)
+
+        # The merged items are gone
+        self._selected_index = None
+        self.dataColumnView.reset()
+        self.load_stackedwidget([])
+
+    def mergeDuplicatesButton_clicked(self):
+        """
+        Merges the checked recipes of the selected recipe's cluster in the duplicates tab into the selected recipe
+
+        Returns:
+
+        """
+
+        target_item, source_items = self._duplicates_merge()
+        if not source_items:
+            return
+
+        self.set_modified()
+        DuplicateFinder.merge(self._session, target_item.data(0, QtCore.Qt.UserRole),
+                              [recipe_item.data(0, QtCore.Qt.UserRole) for recipe_item in source_items])
+        for recipe_item in source_items:
+            recipe_item.parent().removeChild(recipe_item)
+
+        self._remove_single_duplicates()
+        self.deleteDuplicatesButton.setEnabled(len(self._checked_duplicates()) > 0)
+        self.mergeDuplicatesButton.setEnabled(False)
+
+    def mergeTableComboBox_currentIndexChanged(self, index: int):
+        # The suggestions belong to the previous table
+        self.mergeTreeWidget.clear()
+        self.mergeButton.setEnabled(False)
+
+    def mergeTreeWidget_itemChanged(self, item: QtWidgets.QTreeWidgetItem, column: int):
+        self.mergeButton.setEnabled(len(self._checked_merges()) > 0)
+
     def okButton_clicked(self):
         """
         OK button has been clicked - save the values
@@ -576,6 +909,10 @@ class DataEditorController(data_editor.Ui_dataEditor, Qt.QMainWindow):
             self._session.rollback()
 
         self._transaction_started = False
+        self.duplicatesTreeWidget.clear()
+        self.deleteDuplicatesButton.setEnabled(False)
+        self.mergeTreeWidget.clear()
+        self.mergeButton.setEnabled(False)
         self.dataColumnView.reset()
         self._unit_conversion_model.reload_model()
         self.modified = False
@@ -24,6 +24,7 @@ from sqlalchemy import orm, func, text
 
 from qisit import translate
 from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
 from qisit.core.util import nullify
 from qisit.qt import misc
 
@@ -125,6 +126,26 @@ class DataEditorModel(QtCore.QAbstractItemModel):
     def root_row(self) -> int:
         return self._parent_row.get(self.Columns.ROOT, None)
 
+    def apply_changes(self, changes: typing.List[ChangeBus.Change]):
+        """
+        Other windows have changed the data (see ChangeBus). Like new_ingredient_item(): The root items whose lists
+        might have changed are told so, the lists are reloaded when displayed
+
+        Args:
+            changes (): The changes
+
+        Returns:
+
+        """
+
+        tables = {change.table for change in changes}
+        # The number of recipes/ingredient list entries is displayed for every item
+        counts_changed = bool(tables & {data.Recipe, data.CategoryList, data.IngredientListEntry})
+        for row, (table, text, icon) in self._first_column.items():
+            if counts_changed or table in tables:
+                root_index = self.createIndex(row, 0, self.Columns.ROOT)
+                self.dataChanged.emit(root_index, root_index)
+
     def canDropMimeData(self, data: QtCore.QMimeData, action: QtCore.Qt.DropAction, row: int, column: int,
                         parent: QtCore.QModelIndex) -> bool:
 
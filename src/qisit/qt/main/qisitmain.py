@@ -24,6 +24,7 @@ from sqlalchemy import create_engine, exc
 from qisit import translate
 from qisit.core import db
 from qisit.core.db import data
+from qisit.core.db.image_store import ImageStore
 from qisit.core.util import initialize_db, nullify
 from qisit.qt import misc
 from qisit.qt.recipelistwindow.recipe_list_window_controller import RecipeListWindow
@@ -60,6 +61,7 @@ def qtmain():
     app = QtWidgets.QApplication(sys.argv)
     misc.setup_image_filter()
     misc.setup_global_actions()
+    misc.setup_change_bus()
     initialize = False
     db_error = False
     db_open = False
@@ -84,6 +86,16 @@ def qtmain():
             session = db.Session()
             if initialize:
                 initialize_db(session, load_data=True)
+            else:
+                data.RecipeSummary.create_if_missing(session)
+                data.RecipeSignature.create_if_missing(session)
+            # Once created, the image store is used - even if the user has switched it off again. Images already in
+            # the store can't be read otherwise
+            external_images = settings.value("preferences/images/external_store", False, type=bool)
+            ImageStore.active = ImageStore.for_engine(db.engine, create=external_images)
+            if external_images and ImageStore.active is not None:
+                # Only the images not moved yet. Usually none
+                ImageStore.active.migrate(session)
             data.IngredientUnit.update_unit_dict(session)
             db_open = True
             db_error = False
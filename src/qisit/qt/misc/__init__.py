@@ -22,6 +22,7 @@ from enum import IntEnum
 from PyQt5 import Qt, QtCore, QtWidgets
 
 from qisit import translate
+from qisit.core.db.change_bus import ChangeBus
 
 image_filter = None
 whats_this_action = None
@@ -53,6 +54,10 @@ def setup_global_actions():
     global whats_this_action
     whats_this_action = QtWidgets.QWhatsThis.createAction()
 
+def setup_change_bus():
+    """ The change bus delivers the changes once the event loop is back (the commit has finished) """
+    ChangeBus.scheduler = lambda deliver: QtCore.QTimer.singleShot(0, deliver)
+
 class Values(object):
     def __init__(self):
         self.__settings = QtCore.QSettings()
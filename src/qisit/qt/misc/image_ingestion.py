@@ -0,0 +1,215 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import typing
+
+from PyQt5 import QtCore, QtGui
+
+
+class ImageIngestion(QtCore.QObject):
+    """
+    Adds images without freezing the GUI: the files are decoded, scaled and encoded (JPEG) on a thread pool of their
+    own. The decoder is told the final size (QImageReader.setScaledSize), so a large photo is never decoded in full
+    resolution - JPEGs are scaled down while decoding.
+
+    The results are delivered in the GUI's thread, one file at a time, as soon as they're ready (so not necessarily in
+    the order of the files).
+    """
+
+    class Encoded(typing.NamedTuple):
+        """ An encoded image """
+        image: bytes
+        """ The scaled image (JPEG) """
+        thumbnail: bytes
+        """ The thumbnail (JPEG) """
+        thumbnail_image: QtGui.QImage
+        """ The decoded thumbnail (for displaying it right away) """
+
+    imageReady = QtCore.pyqtSignal(str, object)
+    """ The file has been encoded: filename, the Encoded image """
+
+    imageFailed = QtCore.pyqtSignal(str, str)
+    """ The file couldn't be read: filename, error message """
+
+    progress = QtCore.pyqtSignal(int, int)
+    """ Files done, files submitted (of the current batch) """
+
+    _jobFinished = QtCore.pyqtSignal(int, str, object)
+    """ Internal: generation, filename, the Encoded image or the error message. Emitted by the pool's threads """
+
+    class _Job(QtCore.QRunnable):
+        """ Reads, scales and encodes a single file """
+
+        def __init__(self, ingestion: "ImageIngestion", generation: int, filename: str, max_size: QtCore.QSize,
+                     thumb_height: int, jpeg_quality: int):
+            super().__init__()
+            self._ingestion = ingestion
+            self._generation = generation
+            self._filename = filename
+            self._max_size = max_size
+            self._thumb_height = thumb_height
+            self._jpeg_quality = jpeg_quality
+
+        def run(self):
+            if self._generation != self._ingestion._generation:
+                # Cancelled
+                return
+            image, error = ImageIngestion.read(self._filename, self._max_size, self._thumb_height)
+            if image.isNull():
+                result = error
+            else:
+                result = ImageIngestion.encode(image, self._max_size, self._thumb_height, self._jpeg_quality)
+            self._ingestion._jobFinished.emit(self._generation, self._filename, result)
+
+    def __init__(self, parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self._pool = QtCore.QThreadPool(self)
+        self._generation = 0
+        self._submitted = 0
+        self._done = 0
+        self._jobFinished.connect(self._job_finished)
+
+    @property
+    def busy(self) -> bool:
+        """ Are there any files left? """
+        return self._done < self._submitted
+
+    @staticmethod
+    def configured_encoding() -> typing.Tuple[QtCore.QSize, int, int]:
+        """
+        How images are stored, defined by the user (preferences/images)
+
+        Returns:
+            (maximum size, thumbnail height, JPEG quality)
+        """
+
+        settings = QtCore.QSettings()
+        settings.beginGroup("preferences/images")
+        max_size = QtCore.QSize(int(settings.value("max_width", 320)), int(settings.value("max_height", 200)))
+        thumb_height = int(settings.value("thumb_height", 40))
+        jpeg_quality = int(settings.value("jpeg_quality", 80))
+        settings.endGroup()
+        return max_size, thumb_height, jpeg_quality
+
+    @staticmethod
+    def read(source: typing.Union[str, QtCore.QIODevice], max_size: QtCore.QSize, thumb_height: int) -> \
+            typing.Tuple[QtGui.QImage, str]:
+        """
+        Reads the image, already scaled down to the size needed for the image and its thumbnail. Can be called on any
+        thread
+
+        Args:
+            source (): The file (or an opened device)
+            max_size (): The maximum size of the image
+            thumb_height (): The height of the thumbnail
+
+        Returns:
+            The image (a null image in case of an error), the error message
+        """
+
+        image_reader = QtGui.QImageReader(source)
+        size = image_reader.size()
+        if size.isValid():
+            # Large enough for both the image and the thumbnail
+            needed = size.scaled(max_size, QtCore.Qt.KeepAspectRatio)
+            if needed.height() < thumb_height:
+                needed = QtCore.QSize(-(-size.width() * thumb_height // size.height()), thumb_height)
+            if needed.width() < size.width() and needed.height() < size.height():
+                image_reader.setScaledSize(needed)
+        image = image_reader.read()
+        return image, image_reader.errorString()
+
+    @staticmethod
+    def encode(image: QtGui.QImage, max_size: QtCore.QSize, thumb_height: int, jpeg_quality: int) -> "Encoded":
+        """
+        Scales the image and its thumbnail and encodes both. Can be called on any thread
+
+        Args:
+            image (): The image
+            max_size (): The maximum size of the image
+            thumb_height (): The height of the thumbnail
+            jpeg_quality (): The JPEG quality
+
+        Returns:
+            The encoded image
+        """
+
+        scaled_image = image.scaled(max_size, QtCore.Qt.KeepAspectRatio)
+        scaled_thumb = image.scaledToHeight(thumb_height)
+
+        encoded = []
+        for the_image in (scaled_image, scaled_thumb):
+            # A buffer cannot be reused
+            image_buffer = QtCore.QBuffer()
+            image_buffer.open(QtCore.QIODevice.ReadWrite)
+            the_image.save(image_buffer, "JPG", jpeg_quality)
+            encoded.append(bytes(image_buffer.data()))
+            image_buffer.close()
+        return ImageIngestion.Encoded(encoded[0], encoded[1], scaled_thumb)
+
+    def add_files(self, filenames: typing.Iterable[str], max_size: QtCore.QSize, thumb_height: int,
+                  jpeg_quality: int):
+        """
+        Reads, scales and encodes the files in the background. Can be called while a batch is still running, the
+        files are added to it
+
+        Args:
+            filenames (): The files
+            max_size (): The maximum size of the images
+            thumb_height (): The height of the thumbnails
+            jpeg_quality (): The JPEG quality
+
+        Returns:
+
+        """
+
+        if not self.busy:
+            self._submitted = self._done = 0
+        for filename in filenames:
+            self._submitted += 1
+            self._pool.start(self._Job(self, self._generation, filename, max_size, thumb_height, jpeg_quality))
+        self.progress.emit(self._done, self._submitted)
+
+    def cancel(self, wait: bool = False):
+        """
+        Cancels the pending files. The results of the running ones are dropped
+
+        Args:
+            wait (): Wait for the running ones to finish (required before the object is deleted)
+
+        Returns:
+
+        """
+
+        self._generation += 1
+        self._pool.clear()
+        if self.busy:
+            self._submitted = self._done = 0
+            self.progress.emit(0, 0)
+        if wait:
+            self._pool.waitForDone()
+
+    def _job_finished(self, generation: int, filename: str, result: typing.Any):
+        if generation != self._generation:
+            # Cancelled
+            return
+        self._done += 1
+        if isinstance(result, ImageIngestion.Encoded):
+            self.imageReady.emit(filename, result)
+        else:
+            self.imageFailed.emit(filename, result)
+        self.progress.emit(self._done, self._submitted)
@@ -0,0 +1,166 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import typing
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui
+
+
+class ImageLoader(QtCore.QObject):
+    """
+    Decodes images in the background, only as large as they're displayed: QImageReader.setScaledSize tells the
+    decoder the size, JPEGs are scaled down while decoding. The full resolution is only decoded when asked for (zooming).
+
+    The decoded images are kept in an LRU bounded by their size in bytes, keyed by the hash of the image's data and the
+    size they've been decoded for. There's one loader shared by all windows (see shared()) - every window picks the
+    images it has asked for from imageLoaded.
+    """
+
+    imageLoaded = QtCore.pyqtSignal(str, object, QtGui.QImage)
+    """ An image has been decoded: the key, the size asked for (None: full resolution), the image """
+
+    _jobFinished = QtCore.pyqtSignal(str, object, QtGui.QImage)
+    """ Internal: emitted by the pool's threads """
+
+    _shared = None
+
+    class _Job(QtCore.QRunnable):
+        """ Decodes a single image """
+
+        def __init__(self, loader: "ImageLoader", key: str, image: bytes, size: typing.Optional[QtCore.QSize]):
+            super().__init__()
+            self._loader = loader
+            self._key = key
+            self._image = image
+            self._size = size
+
+        def run(self):
+            self._loader._jobFinished.emit(self._key, self._size, ImageLoader.decode(self._image, self._size))
+
+    def __init__(self, capacity_bytes: int = 64 * 1024 * 1024, parent: QtCore.QObject = None):
+        """
+        Init
+
+        Args:
+            capacity_bytes (): The maximum size of the decoded images kept
+            parent (): The parent
+        """
+
+        super().__init__(parent)
+        self._capacity_bytes = capacity_bytes
+        self._images = OrderedDict()
+        self._cached_bytes = 0
+        self._pending = set()
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+        self._jobFinished.connect(self._job_finished)
+
+    @classmethod
+    def shared(cls) -> "ImageLoader":
+        """ The loader shared by all windows """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @staticmethod
+    def key(image: bytes) -> str:
+        """ The key of the image's data """
+        return hashlib.sha1(image).hexdigest()
+
+    @staticmethod
+    def _size_key(size: typing.Optional[QtCore.QSize]) -> typing.Optional[typing.Tuple[int, int]]:
+        return None if size is None else (size.width(), size.height())
+
+    @staticmethod
+    def decode(image: bytes, size: QtCore.QSize = None) -> QtGui.QImage:
+        """
+        Decodes the image. Can be called on any thread
+
+        Args:
+            image (): The image's data
+            size (): The size to fit the image into (it's never scaled up). None: full resolution
+
+        Returns:
+            The image (a null image if it couldn't be decoded)
+        """
+
+        image_buffer = QtCore.QBuffer()
+        image_buffer.setData(image)
+        image_buffer.open(QtCore.QIODevice.ReadOnly)
+        image_reader = QtGui.QImageReader(image_buffer)
+        full_size = image_reader.size()
+        if size is not None and full_size.isValid() and \
+                (full_size.width() > size.width() or full_size.height() > size.height()):
+            image_reader.setScaledSize(full_size.scaled(size, QtCore.Qt.KeepAspectRatio))
+        decoded = image_reader.read()
+        image_buffer.close()
+        return decoded
+
+    def cached(self, key: str, size: QtCore.QSize = None) -> typing.Optional[QtGui.QImage]:
+        """
+        The decoded image, if it's in the cache
+
+        Args:
+            key (): The image's key
+            size (): The size asked for
+
+        Returns:
+            The image or None
+        """
+
+        cache_key = (key, self._size_key(size))
+        image = self._images.get(cache_key)
+        if image is not None:
+            self._images.move_to_end(cache_key)
+        return image
+
+    def load(self, image: bytes, size: QtCore.QSize = None) -> typing.Tuple[str, typing.Optional[QtGui.QImage]]:
+        """
+        Returns the decoded image if it's cached, otherwise it's decoded in the background (see imageLoaded)
+
+        Args:
+            image (): The image's data
+            size (): The size to fit the image into. None: full resolution
+
+        Returns:
+            The key, the image (or None if it's being decoded)
+        """
+
+        key = self.key(image)
+        decoded = self.cached(key, size)
+        cache_key = (key, self._size_key(size))
+        if decoded is None and cache_key not in self._pending:
+            self._pending.add(cache_key)
+            self._pool.start(self._Job(self, key, bytes(image), None if size is None else QtCore.QSize(size)))
+        return key, decoded
+
+    def _job_finished(self, key: str, size: typing.Optional[QtCore.QSize], image: QtGui.QImage):
+        cache_key = (key, self._size_key(size))
+        self._pending.discard(cache_key)
+        if not image.isNull():
+            previous = self._images.pop(cache_key, None)
+            if previous is not None:
+                self._cached_bytes -= previous.sizeInBytes()
+            self._images[cache_key] = image
+            self._cached_bytes += image.sizeInBytes()
+            # The image just decoded is kept, even if it's larger than the capacity
+            while self._cached_bytes > self._capacity_bytes and len(self._images) > 1:
+                evicted_key, evicted = self._images.popitem(last=False)
+                self._cached_bytes -= evicted.sizeInBytes()
+        self.imageLoaded.emit(key, size, image)
@@ -0,0 +1,224 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import multiprocessing
+import os
+import typing
+from concurrent import futures
+
+import sqlalchemy as sql
+from PyQt5 import QtCore, QtGui, QtWidgets
+from sqlalchemy import orm
+
+from qisit import translate
+from qisit.core.db import data
+from qisit.qt.misc.image_ingestion import ImageIngestion
+
+
+def _reencode(image: bytes, thumbnail: bytes, max_size: typing.Tuple[int, int], thumb_height: int,
+              jpeg_quality: int) -> typing.Tuple[typing.Optional[bytes], typing.Optional[bytes]]:
+    """
+    Re-encodes an image and regenerates its thumbnail. Runs in the pool's processes
+
+    Returns:
+        (The new image, the new thumbnail). None if the old one is good enough: it isn't larger than the maximum size
+        (or has the right height) and the new one wouldn't be smaller
+    """
+
+    max_size = QtCore.QSize(*max_size)
+    image_buffer = QtCore.QBuffer()
+    image_buffer.setData(image)
+    image_buffer.open(QtCore.QIODevice.ReadOnly)
+    original_size = QtGui.QImageReader(image_buffer).size()
+    image_buffer.seek(0)
+    decoded, error = ImageIngestion.read(image_buffer, max_size, thumb_height)
+    image_buffer.close()
+    if decoded.isNull():
+        return None, None
+    # Images are only scaled down, never up
+    fits = original_size.width() <= max_size.width() and original_size.height() <= max_size.height()
+    encoded = ImageIngestion.encode(decoded, original_size if fits else max_size, thumb_height, jpeg_quality)
+
+    thumbnail_buffer = QtCore.QBuffer()
+    thumbnail_buffer.setData(thumbnail)
+    thumbnail_buffer.open(QtCore.QIODevice.ReadOnly)
+    thumbnail_size = QtGui.QImageReader(thumbnail_buffer).size()
+    thumbnail_buffer.close()
+
+    new_image = encoded.image
+    if fits and len(new_image) >= len(image):
+        new_image = None
+    new_thumbnail = encoded.thumbnail
+    if thumbnail_size.height() == thumb_height and len(new_thumbnail) >= len(thumbnail):
+        new_thumbnail = None
+    return new_image, new_thumbnail
+
+
+class ImageReencoder(object):
+    """
+    Applies the image preferences (see ImageIngestion.configured_encoding()) to all stored images: larger images are
+    scaled down to the maximum size, the thumbnails are regenerated and both are encoded with the configured JPEG
+    quality. Images within the maximum size are never scaled up and only replaced if the new encoding is smaller - so
+    running the job twice doesn't degrade the images any further.
+
+    The images are decoded and encoded by a pool of processes, in chunks. Each chunk is committed on its own. The
+    position is remembered (in the settings, together with the database and the preferences used), so an aborted job
+    continues where it stopped.
+    """
+
+    class Result(typing.NamedTuple):
+        """ The outcome of a run """
+        processed: int
+        """ The number of images processed (by this run) """
+        replaced: int
+        """ The number of images (or thumbnails) replaced """
+        saved_bytes: int
+        """ The number of bytes saved (by this run) """
+        finished: bool
+        """ False if aborted """
+
+    settings_group = "maintenance/reencode_images"
+    """ Where the position is remembered """
+
+    def __init__(self, session_: orm.Session, progress_dialog: QtWidgets.QProgressDialog = None,
+                 processes: int = None, chunk_size: int = None):
+        """
+        Init
+
+        Args:
+            session_ (): The session. It mustn't have uncommitted changes (the chunks are committed)
+            progress_dialog (): Displays the progress and can abort the job
+            processes (): The number of processes. Default: the number of CPUs
+            chunk_size (): The number of images committed at once. Default: four per process
+        """
+
+        self._session = session_
+        self._progress_dialog = progress_dialog
+        self._processes = processes or os.cpu_count() or 1
+        self._chunk_size = chunk_size or 4 * self._processes
+        self._translate = translate
+
+    def _signature(self, encoding: tuple) -> str:
+        """ The database and the preferences the position is valid for """
+        max_size, thumb_height, jpeg_quality = encoding
+        return f"{self._session.get_bind().url}|{max_size.width()}x{max_size.height()}|{thumb_height}|{jpeg_quality}"
+
+    def _position(self, signature: str) -> int:
+        """ The id of the last image processed by an earlier (aborted) run, 0 if there isn't one """
+        settings = QtCore.QSettings()
+        settings.beginGroup(self.settings_group)
+        position = int(settings.value("position", 0)) if settings.value("signature") == signature else 0
+        settings.endGroup()
+        return position
+
+    def _set_position(self, signature: str, position: typing.Optional[int]):
+        settings = QtCore.QSettings()
+        settings.beginGroup(self.settings_group)
+        if position is None:
+            settings.remove("")
+        else:
+            settings.setValue("signature", signature)
+            settings.setValue("position", position)
+        settings.endGroup()
+
+    def is_aborted(self) -> bool:
+        return self._progress_dialog is not None and self._progress_dialog.wasCanceled()
+
+    def show_progress(self, current: int, upper: int):
+        if self._progress_dialog is not None:
+            self._progress_dialog.setMaximum(upper)
+            self._progress_dialog.setValue(current)
+            self._progress_dialog.setLabelText(
+                self._translate("ImageReencoder", "Re-encoding images... {} of {}").format(current, upper))
+            QtCore.QCoreApplication.processEvents()
+
+    def run(self) -> Result:
+        """
+        Re-encodes the images (starting where an aborted run has stopped)
+
+        Returns:
+            The result
+        """
+
+        encoding = ImageIngestion.configured_encoding()
+        max_size, thumb_height, jpeg_quality = encoding
+        signature = self._signature(encoding)
+        position = self._position(signature)
+        image_table = data.RecipeImage
+
+        ids = [image_id for image_id, in self._session.execute(
+            sql.select([image_table.id]).where(image_table.id > position).order_by(image_table.id))]
+        done = self._session.execute(sql.select([sql.func.count(image_table.id)]).where(
+            image_table.id <= position)).scalar()
+        total = done + len(ids)
+
+        processed = replaced = saved_bytes = 0
+        # Forking a process running Qt's threads isn't safe
+        context = multiprocessing.get_context("spawn")
+        with futures.ProcessPoolExecutor(max_workers=self._processes, mp_context=context) as executor:
+            for start in range(0, len(ids), self._chunk_size):
+                if self.is_aborted():
+                    return self.Result(processed, replaced, saved_bytes, False)
+                self.show_progress(done + processed, total)
+
+                chunk = ids[start:start + self._chunk_size]
+                pending = {}
+                for image_id, image, thumbnail in self._session.execute(
+                        sql.select([image_table.id, image_table.image, image_table.thumbnail]).where(
+                            image_table.id.in_(chunk))).fetchall():
+                    # Stored images might be memory mapped, the processes need plain bytes
+                    image, thumbnail = bytes(image), bytes(thumbnail)
+                    pending[executor.submit(_reencode, image, thumbnail, (max_size.width(), max_size.height()),
+                                            thumb_height, jpeg_quality)] = (image_id, image, thumbnail)
+
+                for future in futures.as_completed(pending):
+                    image_id, image, thumbnail = pending[future]
+                    new_image, new_thumbnail = future.result()
+                    values = {}
+                    if new_image is not None:
+                        values[image_table.image] = new_image
+                        saved_bytes += len(image) - len(new_image)
+                    if new_thumbnail is not None:
+                        values[image_table.thumbnail] = new_thumbnail
+                        saved_bytes += len(thumbnail) - len(new_thumbnail)
+                    if values:
+                        # Query.update() (instead of plain SQL) so the caches are notified
+                        self._session.query(image_table).filter(image_table.id == image_id).update(
+                            values, synchronize_session="evaluate")
+                        replaced += 1
+                self._session.commit()
+                processed += len(chunk)
+                self._set_position(signature, chunk[-1])
+
+        self.show_progress(total, total)
+        self._set_position(signature, None)
+        return self.Result(processed, replaced, saved_bytes, True)
+
+    def vacuum(self) -> bool:
+        """
+        Gives the space freed back to the file system. SQLite only: the database file doesn't shrink otherwise
+
+        Returns:
+            True if the database has been vacuumed
+        """
+
+        engine = self._session.get_bind()
+        if engine.url.get_backend_name() != "sqlite":
+            return False
+        with engine.connect() as connection:
+            connection.execute(sql.text("VACUUM"))
+        return True
@@ -15,16 +15,23 @@
 #  You should have received a copy of the GNU General Public License
 #   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import typing
 
 from PyQt5 import QtCore, QtWidgets
-from sqlalchemy import orm, func
+from sqlalchemy import orm
 
 from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.core.db.trigram_index import TrigramIndex
 
 
 class IngredientCompleter(QtWidgets.QCompleter):
-    """ A completer for the ingredients """
+    """
+    A completer for the ingredients. A fuzzy completer doesn't only offer the ingredients starting with the text
+    entered so far, but also those with similar names ("tomatoe" -> "tomato", "chili" -> "red chilies"). Its matches
+    have to be updated whenever the text changes (see update_matches())
+    """
 
     class _CompleterModel(QtCore.QAbstractListModel):
         """ It's model. For some reasons mulitple inheritance doesn't work here .."""
@@ -32,12 +39,33 @@ class IngredientCompleter(QtWidgets.QCompleter):
         def __init__(self, session: orm.Session):
             self._session = session
             self._ingredient_list = []
+            # All the ingredients, id -> name. Kept for applying changes
+            self._all_names = {}
             self._load_model()
             super().__init__()
 
         def _load_model(self):
-            self._ingredient_list = self._session.query(data.Ingredient).order_by(
-                func.lower(data.Ingredient.name)).all()
+            self._all_names = dict(self._session.query(data.Ingredient.id, data.Ingredient.name))
+            self._ingredient_list = self.all_names
+
+        def apply_changes(self, changes: typing.List[ChangeBus.Change]):
+            """ Applies the changes of the ingredients (see ChangeBus). Only new and renamed ones are read """
+
+            if any(change.kind == ChangeBus.RESET for change in changes):
+                self.reload_model()
+                return
+
+            deleted_ids = set()
+            changed_ids = set()
+            for change in changes:
+                (deleted_ids if change.kind == ChangeBus.DELETE else changed_ids).update(change.ids)
+            for ingredient_id in deleted_ids | changed_ids:
+                self._all_names.pop(ingredient_id, None)
+            changed_ids -= deleted_ids
+            if changed_ids:
+                self._all_names.update(self._session.query(data.Ingredient.id, data.Ingredient.name).filter(
+                    data.Ingredient.id.in_(changed_ids)))
+            self.set_names(self.all_names)
 
         def reload_model(self):
             self.beginResetModel()
@@ -49,15 +77,97 @@ class IngredientCompleter(QtWidgets.QCompleter):
 
         def data(self, index: QtCore.QModelIndex, role: int = ...) -> typing.Any:
             if index.isValid() and role == QtCore.Qt.DisplayRole:
-                return QtCore.QVariant(self._ingredient_list[index.row()].name)
+                return QtCore.QVariant(self._ingredient_list[index.row()])
             return QtCore.QVariant()
 
-    def __init__(self, session: orm.Session):
+        @property
+        def all_names(self) -> typing.List[str]:
+            return sorted(self._all_names.values(), key=str.lower)
+
+        @property
+        def names(self) -> typing.List[str]:
+            return self._ingredient_list
+
+        def set_names(self, names: typing.List[str]):
+            self.beginResetModel()
+            self._ingredient_list = names
+            self.endResetModel()
+
+    match_limit = 20
+    """ The maximum number of ingredients offered by the fuzzy completer """
+
+    def __init__(self, session: orm.Session, fuzzy: bool = False):
         self._session = session
         self._model = self._CompleterModel(self._session)
         super().__init__(self._model, None)
         self.setCompletionRole(QtCore.Qt.DisplayRole)
         self.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
 
+        self.fuzzy = fuzzy
+        self._names = []
+        self._keys = []
+        if fuzzy:
+            # The model contains the matches only, all of them are shown
+            self.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+            self._take_names()
+
+    def _take_names(self):
+        """ Fuzzy: All names (sorted case insensitive) are kept for the prefix matches, the model shows the matches """
+        # Sorted by Python's casefold() (not the database's lower()), otherwise bisect won't work
+        keyed_names = sorted((name.casefold(), name) for name in self._model.all_names)
+        self._keys = [key for key, name in keyed_names]
+        self._names = [name for key, name in keyed_names]
+        self._model.set_names([])
+
+    def apply_changes(self, changes: typing.List[ChangeBus.Change]):
+        """
+        Applies the changes of the ingredients (see ChangeBus)
+
+        Args:
+            changes (): The changes
+
+        Returns:
+
+        """
+
+        self._model.apply_changes(changes)
+        if self.fuzzy:
+            self._take_names()
+
     def reload_model(self):
         self._model.reload_model()
+        if self.fuzzy:
+            self._take_names()
+
+    def update_matches(self, text: str):
+        """
+        Fuzzy: Updates the matches. The ingredients starting with the text first, then the similar ones
+
+        Args:
+            text (): The text entered so far
+
+        Returns:
+
+        """
+
+        if not self.fuzzy:
+            return
+
+        text = text.strip()
+        matches = []
+        if text:
+            prefix = text.casefold()
+            start = bisect.bisect_left(self._keys, prefix)
+            for position in range(start, min(start + self.match_limit, len(self._keys))):
+                if not self._keys[position].startswith(prefix):
+                    break
+                matches.append(self._names[position])
+
+            index = TrigramIndex.for_session(self._session, data.Ingredient)
+            for match in index.search(self._session, text, limit=self.match_limit):
+                if len(matches) >= self.match_limit:
+                    break
+                name = index.text(match.id)
+                if name not in matches:
+                    matches.append(name)
+        self._model.set_names(matches)
@@ -0,0 +1,117 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui
+
+
+class MarkdownCache(object):
+    """
+    The rendered markdown texts (description, instructions, notes), keyed by the hash of the text. Parsing a long text
+    takes a while, copying the rendered document doesn't. Documents can be rendered on any thread (see render()) - the
+    recipe preloader fills the cache in the background.
+
+    There's one cache shared by all windows (see shared()).
+    """
+
+    _shared = None
+
+    def __init__(self, capacity: int = 64):
+        """
+        Init
+
+        Args:
+            capacity (): The maximum number of documents kept
+        """
+
+        self._capacity = capacity
+        self._documents = OrderedDict()
+
+    @classmethod
+    def shared(cls) -> "MarkdownCache":
+        """ The cache shared by all windows """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @staticmethod
+    def key(text: str) -> str:
+        """ The key of the text in the cache """
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    @staticmethod
+    def render(text: str, thread: QtCore.QThread = None) -> QtGui.QTextDocument:
+        """
+        Renders the markdown text. Can be called on any thread
+
+        Args:
+            text (): The text
+            thread (): The thread the document will be used by (the GUI's). None: the current thread
+
+        Returns:
+            The document
+        """
+
+        document = QtGui.QTextDocument()
+        document.setMarkdown(text)
+        if thread is not None:
+            document.moveToThread(thread)
+        return document
+
+    def add(self, text: str, document: QtGui.QTextDocument):
+        """
+        Adds a rendered text. The document must belong to the GUI's thread and mustn't be changed afterwards
+
+        Args:
+            text (): The text
+            document (): The rendered text
+
+        Returns:
+
+        """
+
+        key = self.key(text)
+        self._documents[key] = document
+        self._documents.move_to_end(key)
+        while len(self._documents) > self._capacity:
+            self._documents.popitem(last=False)
+
+    def document(self, text: str, parent: QtCore.QObject = None) -> QtGui.QTextDocument:
+        """
+        The rendered text - a copy, it can be changed. The text is rendered if it isn't in the cache yet
+
+        Args:
+            text (): The text
+            parent (): The copy's parent
+
+        Returns:
+            The document
+        """
+
+        key = self.key(text)
+        document = self._documents.get(key)
+        if document is None:
+            document = self.render(text)
+            self.add(text, document)
+        else:
+            self._documents.move_to_end(key)
+        return document.clone(parent)
+
+    def __contains__(self, text: str) -> bool:
+        return self.key(text) in self._documents
@@ -0,0 +1,134 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import typing
+
+from PyQt5 import QtCore
+from sqlalchemy import orm
+from sqlalchemy.engine import Engine
+
+
+class QueryWorker(QtCore.QThread):
+    """
+    Runs database queries on a thread of its own (with a session of its own), so slow queries don't freeze the GUI.
+
+    A job is a callable taking the worker's session. Only the latest job counts: submitting a new job cancels the
+    pending one and interrupts the running one (if the database driver supports it). The results of outdated jobs are
+    dropped. Since the worker has its own session it only sees committed data.
+    """
+
+    jobFinished = QtCore.pyqtSignal(int, object)
+    """ The job (its ticket) has finished, the result """
+
+    jobFailed = QtCore.pyqtSignal(int, object)
+    """ The job (its ticket) has raised an exception, the exception """
+
+    def __init__(self, engine: Engine, parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self._engine = engine
+        self._condition = threading.Condition()
+        self._ticket = 0
+        self._pending = None
+        self._running_connection = None
+        self._stopped = False
+
+    @staticmethod
+    def supports(engine: Engine) -> bool:
+        """ In memory databases can't be shared - another connection would open another (empty) database """
+        return engine.url.get_backend_name() != "sqlite" or engine.url.database not in (None, "", ":memory:")
+
+    @property
+    def ticket(self) -> int:
+        """ The ticket of the latest job """
+        return self._ticket
+
+    def _interrupt(self):
+        """ Interrupt the running query. Must be called with the lock held """
+        connection = self._running_connection
+        if connection is None:
+            return
+        # sqlite3 and psycopg2 both allow this from another thread
+        for method in ("interrupt", "cancel"):
+            if hasattr(connection, method):
+                try:
+                    getattr(connection, method)()
+                except Exception:
+                    # The query might just have finished
+                    pass
+                return
+
+    def run(self):
+        session = orm.Session(bind=self._engine)
+        try:
+            while True:
+                with self._condition:
+                    while self._pending is None and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                    ticket, job = self._pending
+                    self._pending = None
+                    # The raw DBAPI connection, for interrupting the query
+                    self._running_connection = session.connection().connection.connection
+
+                try:
+                    result = job(session)
+                except Exception as error:
+                    result = error
+                finally:
+                    with self._condition:
+                        self._running_connection = None
+                    # End the (read) transaction, the next job will see the latest data
+                    session.rollback()
+
+                if ticket != self._ticket:
+                    # Outdated (and probably interrupted)
+                    continue
+                if isinstance(result, Exception):
+                    self.jobFailed.emit(ticket, result)
+                else:
+                    self.jobFinished.emit(ticket, result)
+        finally:
+            session.close()
+
+    def stop(self):
+        """ Stops the worker (and waits until it's finished) """
+        with self._condition:
+            self._stopped = True
+            self._pending = None
+            self._interrupt()
+            self._condition.notify()
+        self.wait()
+
+    def submit(self, job: typing.Callable[[orm.Session], typing.Any]) -> int:
+        """
+        Submits a job. Any pending or running job is cancelled
+
+        Args:
+            job (): The job, it's called with the worker's session
+
+        Returns:
+            The job's ticket (see jobFinished/jobFailed)
+        """
+
+        with self._condition:
+            self._ticket += 1
+            self._pending = (self._ticket, job)
+            self._interrupt()
+            self._condition.notify()
+        return self._ticket
@@ -0,0 +1,151 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import typing
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui
+from sqlalchemy import orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.core.db.recipe_loader import load_recipe
+from qisit.qt.misc.markdown_cache import MarkdownCache
+from qisit.qt.misc.query_worker import QueryWorker
+
+
+class RecipePreloader(QtCore.QObject):
+    """
+    Speculatively prepares the recipe selected in the recipe list, so its window opens without waiting for the
+    database: On the worker's thread the recipe graph is read (see load_recipe()), the thumbnails are decoded and the
+    markdown texts are rendered (into the MarkdownCache). The results are kept in a small LRU, keyed by the recipe's
+    id and last_modified.
+
+    The graph is read by the worker's session. It's detached and merged into the GUI's session (without any SQL) when
+    the window opens - but only if the GUI's session has no uncommitted changes: the worker sees committed data only.
+    """
+
+    class Preloaded(typing.NamedTuple):
+        """ A prepared recipe """
+        recipe: data.Recipe
+        """ The recipe (detached until taken) """
+        last_modified: datetime.date
+        thumbnails: typing.List[QtGui.QImage]
+        """ The decoded thumbnails of the recipe's images """
+
+    markdown_attributes = ("description", "instructions", "notes")
+    """ The recipe's texts that are displayed as markdown """
+
+    def __init__(self, session: orm.Session, worker: QueryWorker, capacity: int = 8, parent: QtCore.QObject = None):
+        """
+        Init
+
+        Args:
+            session (): The GUI's session
+            worker (): The (started) worker the recipes are loaded by
+            capacity (): The maximum number of prepared recipes kept
+            parent (): The parent
+        """
+
+        super().__init__(parent)
+        self._session = session
+        self._worker = worker
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._ticket = None
+        self._worker.jobFinished.connect(self.worker_jobFinished)
+        ChangeBus.for_session(session).subscribe(
+            self._data_changed, data.Recipe, data.IngredientListEntry, data.RecipeImage, data.CategoryList,
+            data.Category, data.Ingredient, data.IngredientUnit, data.Author, data.Cuisine, data.YieldUnitName)
+
+    def _data_changed(self, changes: typing.List[ChangeBus.Change]):
+        """ Something a prepared recipe consists of has been changed """
+        if all(change.table is data.Recipe and change.kind != ChangeBus.RESET for change in changes):
+            for change in changes:
+                for recipe_id in change.ids:
+                    self._entries.pop(recipe_id, None)
+        else:
+            self._entries.clear()
+
+    @classmethod
+    def _preload_job(cls, recipe_id: int, gui_thread: QtCore.QThread) -> typing.Callable[[orm.Session], typing.Any]:
+        """ The job run by the worker """
+
+        def job(session_: orm.Session) -> typing.Optional[typing.Tuple[RecipePreloader.Preloaded, dict]]:
+            recipe = load_recipe(session_, recipe_id)
+            if recipe is None:
+                return None
+
+            thumbnails = [QtGui.QImage.fromData(image.thumbnail) for image in recipe.imagelist]
+            # The window will use them
+            documents = {text: MarkdownCache.render(text, gui_thread) for text in
+                         (getattr(recipe, attribute) for attribute in cls.markdown_attributes) if text}
+
+            preloaded = cls.Preloaded(recipe, recipe.last_modified, thumbnails)
+            # Keeps the loaded state, the worker's rollback won't expire it
+            session_.expunge_all()
+            return preloaded, documents
+
+        return job
+
+    def preload(self, recipe_id: int):
+        """
+        Prepares the recipe in the background (cancelling the preparation of the previous one)
+
+        Args:
+            recipe_id (): The recipe's id
+
+        Returns:
+
+        """
+
+        if recipe_id in self._entries:
+            self._entries.move_to_end(recipe_id)
+            return
+        self._ticket = self._worker.submit(self._preload_job(recipe_id, QtCore.QThread.currentThread()))
+
+    def take(self, recipe: data.Recipe) -> typing.Optional[Preloaded]:
+        """
+        Takes the prepared recipe (if there's an up to date one). Its graph is merged into the GUI's session
+
+        Args:
+            recipe (): The recipe (of the GUI's session)
+
+        Returns:
+            The prepared recipe or None
+        """
+
+        preloaded = self._entries.pop(recipe.id, None)
+        if preloaded is None or preloaded.last_modified != recipe.last_modified or \
+                db.has_uncommitted_changes(self._session):
+            return None
+        return preloaded._replace(recipe=self._session.merge(preloaded.recipe, load=False))
+
+    def worker_jobFinished(self, ticket: int, result: typing.Any):
+        if ticket != self._ticket or result is None:
+            # An outdated job or the recipe has been deleted
+            return
+        preloaded, documents = result
+        markdown_cache = MarkdownCache.shared()
+        for text, document in documents.items():
+            markdown_cache.add(text, document)
+        self._entries[preloaded.recipe.id] = preloaded
+        self._entries.move_to_end(preloaded.recipe.id)
+        while len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
@@ -0,0 +1,105 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore
+from sqlalchemy import orm
+from sqlalchemy.engine import Engine
+
+from qisit.core.db.similarity_index import SimilarityIndex
+from qisit.qt.misc.query_worker import QueryWorker
+
+
+class SimilarityLoader(QtCore.QObject):
+    """
+    Loads the session's SimilarityIndex on a worker's thread - loading it takes seconds for large databases, which
+    would freeze the GUI. The worker's session only sees committed data, the index catches up with the changes made
+    by the GUI's session when it's taken over (see SimilarityIndex.start_loading())
+
+    The worker (a thread with a connection of its own) is started when the index is needed for the first time
+    """
+
+    indexLoaded = QtCore.pyqtSignal()
+    """ The index has been loaded """
+
+    indexFailed = QtCore.pyqtSignal(object)
+    """ Loading the index has failed, the exception """
+
+    def __init__(self, session: orm.Session, engine: Engine, parent: QtCore.QObject = None):
+        """
+        Init
+
+        Args:
+            session (): The GUI's session
+            engine (): The engine of the worker the index is loaded by (see QueryWorker.supports())
+            parent (): The parent
+        """
+
+        super().__init__(parent)
+        self._session = session
+        self._engine = engine
+        self._worker = None
+        self._ticket = None
+
+    @property
+    def index(self) -> SimilarityIndex:
+        """ The session's index """
+        return SimilarityIndex.for_session(self._session)
+
+    def load(self) -> bool:
+        """
+        Makes sure the index is loaded. If it isn't, it's loaded in the background (see indexLoaded) - unless the
+        GUI's session has uncommitted changes the index doesn't know about, then it's loaded right away
+
+        Returns:
+            True if the index is loaded, False if it's being loaded in the background
+        """
+
+        index = self.index
+        if not index.stale:
+            return True
+        if self._ticket is not None:
+            return False
+        job = index.start_loading(self._session)
+        if job is None:
+            index.load(self._session)
+            return True
+        if self._worker is None:
+            self._worker = QueryWorker(self._engine)
+            self._worker.jobFinished.connect(self.worker_jobFinished)
+            self._worker.jobFailed.connect(self.worker_jobFailed)
+            self._worker.start()
+        self._ticket = self._worker.submit(job)
+        return False
+
+    def stop(self):
+        """ Stops the worker (if it has been started) """
+        if self._worker is not None:
+            self._worker.stop()
+
+    def worker_jobFinished(self, ticket: int, loaded: SimilarityIndex):
+        if ticket != self._ticket:
+            return
+        self._ticket = None
+        # An outdated index has to be loaded again
+        if self.index.finish_loading(self._session, loaded) or self.load():
+            self.indexLoaded.emit()
+
+    def worker_jobFailed(self, ticket: int, error: Exception):
+        if ticket != self._ticket:
+            return
+        self._ticket = None
+        self.indexFailed.emit(error)
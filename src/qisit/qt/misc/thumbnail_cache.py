@@ -0,0 +1,270 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import tempfile
+import typing
+from collections import OrderedDict
+
+import sqlalchemy as sql
+from PyQt5 import QtCore, QtGui, sip
+from sqlalchemy import orm
+
+from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.qt.misc.image_loader import ImageLoader
+from qisit.qt.misc.query_worker import QueryWorker
+
+
+class ThumbnailCache(QtCore.QObject):
+    """
+    Thumbnails in the sizes actually needed (HiDPI screens, larger views), derived from the full image. The stored
+    thumbnail has a fixed height (preferences/images/thumb_height) - scaling it up looks blurry.
+
+    A thumbnail that isn't there yet is generated in the background: the full image is read by a connection of its
+    own and decoded with QImageReader.setScaledSize. Meanwhile the stored thumbnail should be displayed,
+    thumbnailReady tells when the derived one is available. The derived thumbnails are kept in memory (LRU) and on
+    disk (JPEG, in the cache directory), so they survive restarts.
+
+    The files are named by the image's id, a hash of the stored thumbnail and the height. When an image is changed
+    or deleted (see ChangeBus) its derived thumbnails are removed.
+
+    There's one cache per session, stored in the session's info dictionary.
+    """
+
+    thumbnailReady = QtCore.pyqtSignal(int, int, QtGui.QImage)
+    """ A thumbnail has been generated: the image's id, the height, the thumbnail """
+
+    _jobFinished = QtCore.pyqtSignal(int, int, int, str, QtGui.QImage)
+    """ Internal: image id, height, ticket, the file, the thumbnail. Emitted by the pool's threads """
+
+    _info_key = "qisit_thumbnail_cache"
+    """ The key in session.info """
+
+    jpeg_quality = 90
+    """ The quality of the files """
+
+    class _Job(QtCore.QRunnable):
+        """ Generates a single thumbnail """
+
+        def __init__(self, cache: "ThumbnailCache", image_id: int, height: int, ticket: int, path: str):
+            super().__init__()
+            self._cache = cache
+            self._image_id = image_id
+            self._height = height
+            self._ticket = ticket
+            self._path = path
+
+        def run(self):
+            # Already there (read_file=False)
+            thumbnail = QtGui.QImage(self._path) if os.path.isfile(self._path) else QtGui.QImage()
+            if thumbnail.isNull() and self._cache._engine is not None:
+                try:
+                    with self._cache._engine.connect() as connection:
+                        image = connection.execute(sql.select([data.RecipeImage.image]).where(
+                            data.RecipeImage.id == self._image_id)).scalar()
+                    if image is not None:
+                        # Any width, the height counts
+                        thumbnail = ImageLoader.decode(image, QtCore.QSize(16 * self._height, self._height))
+                    if not thumbnail.isNull():
+                        self._cache._write(self._path, thumbnail)
+                except Exception:
+                    # Not committed yet, the store's file is gone, ... The stored thumbnail will do
+                    thumbnail = QtGui.QImage()
+            self._cache._jobFinished.emit(self._image_id, self._height, self._ticket, self._path, thumbnail)
+
+    def __init__(self, session_: orm.Session, directory: str = None, capacity_bytes: int = 32 * 1024 * 1024,
+                 max_files: int = 4096, parent: QtCore.QObject = None):
+        """
+        Init
+
+        Args:
+            session_ (): The session
+            directory (): Where the thumbnails are kept. Default: "thumbnails" in the cache location
+            capacity_bytes (): The maximum size of the thumbnails kept in memory
+            max_files (): The maximum number of files kept (the oldest are removed when the cache is created)
+            parent (): The parent
+        """
+
+        super().__init__(parent)
+        if directory is None:
+            directory = os.path.join(
+                QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation), "thumbnails")
+        self.directory = directory
+        engine = session_.get_bind()
+        # In memory databases can't be read by another connection
+        self._engine = engine if QueryWorker.supports(engine) else None
+        self._capacity_bytes = capacity_bytes
+        self._thumbnails = OrderedDict()
+        self._cached_bytes = 0
+        # (image id, height) -> the ticket of the job generating it. Jobs whose ticket isn't there anymore are outdated
+        self._pending = {}
+        self._failed = set()
+        self._tickets = 0
+        self._pool = QtCore.QThreadPool(self)
+        self._pool.setMaxThreadCount(2)
+        self._jobFinished.connect(self._job_finished)
+        self._prune(max_files)
+        ChangeBus.for_session(session_).subscribe(self._data_changed, data.RecipeImage)
+
+    @classmethod
+    def for_session(cls, session_: orm.Session) -> "ThumbnailCache":
+        """
+        Returns the session's cache, creating it if necessary
+
+        Args:
+            session_ (): The session
+
+        Returns:
+            The cache
+        """
+
+        cache = session_.info.get(cls._info_key)
+        # Deleted together with the application (tests create a new one)
+        if cache is None or sip.isdeleted(cache):
+            cache = cls(session_)
+            session_.info[cls._info_key] = cache
+        return cache
+
+    @staticmethod
+    def device_pixel_ratio() -> float:
+        """ The application's device pixel ratio (the highest of all screens) """
+        application = QtGui.QGuiApplication.instance()
+        return application.devicePixelRatio() if application is not None else 1.0
+
+    def _path(self, image_id: int, thumbnail: bytes, height: int) -> str:
+        return os.path.join(self.directory, f"{image_id}-{hashlib.sha1(thumbnail).hexdigest()[:16]}-{height}.jpg")
+
+    def _files(self, image_id: int = None) -> typing.List[str]:
+        """ The files (of the image) """
+        if not os.path.isdir(self.directory):
+            return []
+        prefix = None if image_id is None else f"{image_id}-"
+        return [entry.path for entry in os.scandir(self.directory)
+                if entry.name.endswith(".jpg") and (prefix is None or entry.name.startswith(prefix))]
+
+    def _prune(self, max_files: int):
+        """ Removes the oldest files """
+        files = self._files()
+        if len(files) > max_files:
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - max_files]:
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _write(self, path: str, thumbnail: QtGui.QImage):
+        """ Writes the file. Can be called on any thread """
+        os.makedirs(self.directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(file_descriptor)
+        if thumbnail.save(temporary_path, "JPG", self.jpeg_quality):
+            os.replace(temporary_path, path)
+        else:
+            self._remove(temporary_path)
+
+    def _add(self, image_id: int, height: int, thumbnail: QtGui.QImage):
+        self._discard((image_id, height))
+        self._thumbnails[(image_id, height)] = thumbnail
+        self._cached_bytes += thumbnail.sizeInBytes()
+        while self._cached_bytes > self._capacity_bytes and len(self._thumbnails) > 1:
+            evicted_key, evicted = self._thumbnails.popitem(last=False)
+            self._cached_bytes -= evicted.sizeInBytes()
+
+    def _discard(self, key: typing.Tuple[int, int]):
+        """ Removes the thumbnail from memory """
+        thumbnail = self._thumbnails.pop(key, None)
+        if thumbnail is not None:
+            self._cached_bytes -= thumbnail.sizeInBytes()
+
+    def thumbnail(self, image_id: typing.Optional[int], thumbnail: typing.Optional[bytes], height: int,
+                  read_file: bool = True) -> typing.Optional[QtGui.QImage]:
+        """
+        The image's thumbnail in the height. If it isn't available yet it's generated in the background (see
+        thumbnailReady). The latest requests are served first - they're usually the ones currently visible
+
+        Args:
+            image_id (): The image's id
+            thumbnail (): The stored thumbnail (used as part of the key)
+            height (): The height in (device) pixels
+            read_file (): Read an existing file right away. If False, it's read in the background, too
+
+        Returns:
+            The thumbnail or None (use the stored one)
+        """
+
+        if image_id is None or thumbnail is None:
+            return None
+        key = (image_id, height)
+        derived = self._thumbnails.get(key)
+        if derived is not None:
+            self._thumbnails.move_to_end(key)
+            return derived
+        if key in self._pending or key in self._failed:
+            return None
+
+        path = self._path(image_id, thumbnail, height)
+        if read_file and os.path.isfile(path):
+            derived = QtGui.QImage(path)
+            if not derived.isNull():
+                self._add(image_id, height, derived)
+                return derived
+        if self._engine is not None or not read_file:
+            self._tickets += 1
+            self._pending[key] = self._tickets
+            # Priority: the later the request, the sooner it's served
+            self._pool.start(self._Job(self, image_id, height, self._tickets, path), self._tickets % (1 << 30))
+        return None
+
+    def _job_finished(self, image_id: int, height: int, ticket: int, path: str, thumbnail: QtGui.QImage):
+        key = (image_id, height)
+        if self._pending.get(key) != ticket:
+            # The image has been changed meanwhile
+            self._remove(path)
+            return
+        del self._pending[key]
+        if thumbnail.isNull():
+            self._failed.add(key)
+            return
+        self._add(image_id, height, thumbnail)
+        self.thumbnailReady.emit(image_id, height, thumbnail)
+
+    def _data_changed(self, changes: typing.List[ChangeBus.Change]):
+        """ Images have been changed, the derived thumbnails are outdated """
+        for change in changes:
+            if change.kind == ChangeBus.RESET:
+                # The directory is shared by all databases. The files of changed images won't be found anyway (the
+                # stored thumbnail's hash is part of the name), the outdated ones are left to _prune()
+                self._thumbnails.clear()
+                self._cached_bytes = 0
+                self._pending.clear()
+                self._failed.clear()
+                return
+            for image_id in change.ids:
+                for key in [key for key in self._thumbnails if key[0] == image_id]:
+                    self._discard(key)
+                for key in [key for key in self._pending if key[0] == image_id]:
+                    del self._pending[key]
+                self._failed = {key for key in self._failed if key[0] != image_id}
+                for path in self._files(image_id):
+                    self._remove(path)
@@ -0,0 +1,177 @@
+""" The model of the recipe's table """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+
+import typing
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from sqlalchemy import orm
+
+from qisit.qt.misc.thumbnail_cache import ThumbnailCache
+from qisit.qt.recipelistwindow.recipe_table_model import RecipeTableModel
+
+
+class RecipeGalleryDelegate(QtWidgets.QStyledItemDelegate):
+    """
+    Paints a cell of the gallery: a large thumbnail and the recipe's title below.
+
+    Only the visible cells are painted, so only their thumbnails are requested from the thumbnail cache (which
+    generates them in the background). Meanwhile the stored (small) thumbnail is shown, scaled up. Painting has to be
+    fast: the pixmaps, already scaled to the cell, are kept in a LRU cache.
+    """
+
+    margin = 6
+    """ The space around the thumbnail and the title """
+
+    def __init__(self, thumbnail_cache: ThumbnailCache, thumbnail_height: int = 160, cell_width: int = 200,
+                 capacity_bytes: int = 64 * 1024 * 1024, parent: QtCore.QObject = None):
+        """
+        Init
+
+        Args:
+            thumbnail_cache (): Generates the thumbnails
+            thumbnail_height (): The thumbnails' height (logical pixels)
+            cell_width (): The width of a cell
+            capacity_bytes (): The maximum size of the pixmaps kept
+            parent (): The parent
+        """
+
+        super().__init__(parent)
+        self.thumbnail_height = thumbnail_height
+        self.cell_width = cell_width
+        self._thumbnail_cache = thumbnail_cache
+        self._capacity_bytes = capacity_bytes
+        self._pixmaps = OrderedDict()
+        self._cached_bytes = 0
+        self._placeholder = QtGui.QIcon(":/icons/picture.png")
+
+    def _cached_pixmap(self, key: typing.Hashable, create: typing.Callable[[], QtGui.QPixmap]) -> QtGui.QPixmap:
+        """ The pixmap of the key, created (and cached) if necessary """
+        pixmap = self._pixmaps.get(key)
+        if pixmap is None:
+            pixmap = self._pixmaps[key] = create()
+            self._cached_bytes += self._size_in_bytes(pixmap)
+            while self._cached_bytes > self._capacity_bytes and len(self._pixmaps) > 1:
+                evicted_key, evicted = self._pixmaps.popitem(last=False)
+                self._cached_bytes -= self._size_in_bytes(evicted)
+        else:
+            self._pixmaps.move_to_end(key)
+        return pixmap
+
+    @staticmethod
+    def _size_in_bytes(pixmap: QtGui.QPixmap) -> int:
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def pixmap(self, index: QtCore.QModelIndex, pixel_ratio: float) -> typing.Optional[QtGui.QPixmap]:
+        """
+        The thumbnail of the cell, scaled to fit
+
+        Args:
+            index (): The cell
+            pixel_ratio (): The device's pixel ratio
+
+        Returns:
+            The derived thumbnail, the stored one (while the other is generated) or None (no image)
+        """
+
+        thumbnail_data = index.data(RecipeTableModel.thumbnail_role)
+        if not thumbnail_data or thumbnail_data[1] is None:
+            return None
+        image_id, stored = thumbnail_data
+        size = QtCore.QSize(self.cell_width - 2 * self.margin, self.thumbnail_height) * pixel_ratio
+
+        def scaled(pixmap: QtGui.QPixmap) -> QtGui.QPixmap:
+            if not pixmap.isNull():
+                pixmap = pixmap.scaled(size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+            pixmap.setDevicePixelRatio(pixel_ratio)
+            return pixmap
+
+        derived = self._thumbnail_cache.thumbnail(image_id, stored, size.height(), read_file=False)
+        if derived is not None:
+            return self._cached_pixmap((derived.cacheKey(), size.width(), size.height()),
+                                       lambda: scaled(QtGui.QPixmap.fromImage(derived)))
+
+        def placeholder() -> QtGui.QPixmap:
+            pixmap = QtGui.QPixmap()
+            pixmap.loadFromData(stored)
+            return scaled(pixmap)
+
+        return self._cached_pixmap((stored, size.width(), size.height()), placeholder)
+
+    def paint(self, painter: QtGui.QPainter, option: QtWidgets.QStyleOptionViewItem, index: QtCore.QModelIndex):
+        option = QtWidgets.QStyleOptionViewItem(option)
+        self.initStyleOption(option, index)
+        widget = option.widget
+        style = widget.style() if widget is not None else QtWidgets.QApplication.style()
+        # Background, selection, focus - no text or icon
+        option.text = ""
+        option.icon = QtGui.QIcon()
+        style.drawControl(QtWidgets.QStyle.CE_ItemViewItem, option, painter, widget)
+
+        rect = option.rect.adjusted(self.margin, self.margin, -self.margin, -self.margin)
+        image_rect = QtCore.QRect(rect.left(), rect.top(), rect.width(), self.thumbnail_height)
+        pixmap = self.pixmap(index, painter.device().devicePixelRatioF())
+        if pixmap is None or pixmap.isNull():
+            self._placeholder.paint(painter, image_rect, QtCore.Qt.AlignCenter, QtGui.QIcon.Disabled)
+        else:
+            pixmap_size = pixmap.size() / pixmap.devicePixelRatio()
+            painter.drawPixmap(QtCore.QRect(QtCore.QPoint(
+                image_rect.left() + (image_rect.width() - pixmap_size.width()) // 2,
+                image_rect.top() + (image_rect.height() - pixmap_size.height()) // 2), pixmap_size), pixmap)
+
+        title = index.siblingAtColumn(RecipeTableModel.RecipeColumns.TITLE).data(QtCore.Qt.DisplayRole)
+        if title:
+            text_rect = QtCore.QRect(rect.left(), image_rect.bottom() + self.margin, rect.width(),
+                                     option.fontMetrics.height())
+            painter.save()
+            if option.state & QtWidgets.QStyle.State_Selected:
+                painter.setPen(option.palette.color(QtGui.QPalette.HighlightedText))
+            painter.drawText(text_rect, QtCore.Qt.AlignCenter,
+                             option.fontMetrics.elidedText(title, QtCore.Qt.ElideRight, rect.width()))
+            painter.restore()
+
+    def sizeHint(self, option: QtWidgets.QStyleOptionViewItem, index: QtCore.QModelIndex) -> QtCore.QSize:
+        # All cells have the same size, the view doesn't have to ask the model for every row
+        return QtCore.QSize(self.cell_width, self.thumbnail_height + option.fontMetrics.height() + 3 * self.margin)
+
+
+class RecipeGalleryView(QtWidgets.QListView):
+    """
+    The recipe list as a grid of large thumbnails. Shows the recipe table model's thumbnail column - the same recipes
+    in the same order as the table, selection shared.
+    """
+
+    def __init__(self, session_: orm.Session, parent: QtWidgets.QWidget = None):
+        super().__init__(parent)
+        self.setViewMode(QtWidgets.QListView.IconMode)
+        self.setMovement(QtWidgets.QListView.Static)
+        self.setResizeMode(QtWidgets.QListView.Adjust)
+        # Laying out 50k cells of different sizes would take ages
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QtWidgets.QListView.Batched)
+        self.setBatchSize(1000)
+        self.setSpacing(4)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.gallery_delegate = RecipeGalleryDelegate(ThumbnailCache.for_session(session_), parent=self)
+        self.setItemDelegate(self.gallery_delegate)
+
+    def setModel(self, model: QtCore.QAbstractItemModel):
+        super().setModel(model)
+        self.setModelColumn(RecipeTableModel.RecipeColumns.THUMBNAIL)
@@ -17,17 +17,30 @@
 #  You should have received a copy of the GNU General Public License
 #   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
+import typing
+
 from PyQt5 import Qt, QtCore, QtGui, QtWidgets
+from babel.units import format_unit
 from sqlalchemy import create_engine, exc, func, orm
 
 from qisit import translate
-from qisit.core import db
+from qisit.core import db, default_locale
 from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.core.db.reference_data import ReferenceData
+from qisit.core.db.pantry_index import PantryIndex
 from qisit.core.util import nullify
 from qisit.importer import gourmetdb
 from qisit.qt import misc
 from qisit.qt.aboutdialog.aboutdialog_controller import AboutdialogController
 from qisit.qt.dataeditor.data_editor_controller import DataEditorController
+from qisit.qt.misc.image_reencoder import ImageReencoder
+from qisit.qt.misc.query_worker import QueryWorker
+from qisit.qt.misc.recipe_preloader import RecipePreloader
+from qisit.qt.misc.similarity_loader import SimilarityLoader
+from qisit.qt.recipelistwindow.recipe_gallery_view import RecipeGalleryView
+from qisit.qt.recipelistwindow.recipe_scroll_model import RecipeScrollModel
 from qisit.qt.recipelistwindow.recipe_table_model import RecipeTableModel
 from qisit.qt.recipelistwindow.ui import recipe_list
 from qisit.qt.recipewindow import recipe_window_controller
@@ -41,6 +54,9 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
     # Values in the recipe per page combobox
     __COMBOVALUES = (10, 15, 20, 25, 50, 75, 100, 150, 200)
 
+    thumbnail_row_height = 44
+    """ The row height when scrolling continuously (thumbnails are usually 40 px high) """
+
     def __init__(self, session_: orm.Session):
         super().__init__()
         super(QtWidgets.QMainWindow, self).__init__()
@@ -52,7 +68,46 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
         self._translate = translate
         recipes_per_page = int(settings.value("RecipeListWindow/RecipeTableView/main/recipes_per_page", 15))
-        self.table_model = RecipeTableModel(session_, recipes_per_page=recipes_per_page)
+        # No pages, the table grows while the user scrolls down
+        self._continuous_scrolling = settings.value("RecipeListWindow/RecipeTableView/main/continuous_scrolling",
+                                                    False, bool)
+        # Large thumbnails in a grid instead of the table
+        self._gallery = settings.value("RecipeListWindow/RecipeTableView/main/gallery", False, bool)
+
+        # The pantry index is cached on disk, one cache per database
+        cache_directory = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation)
+        if cache_directory and QtCore.QDir().mkpath(cache_directory):
+            database_hash = hashlib.sha1(str(session_.get_bind().url).encode()).hexdigest()[:16]
+            PantryIndex.for_session(session_, cache_path=QtCore.QDir(cache_directory).filePath(
+                f"pantry-{database_hash}.cache"))
+
+        # The recipe list's queries are run in the background (the in-memory test databases can't be shared, though).
+        # The selected recipe is prepared in the background, too, so its window opens at once. The similar recipes
+        # (see the recipe window) need an index which takes a while to load - it's loaded when it's first needed
+        self._query_worker = None
+        self._prefetch_worker = None
+        self._preload_worker = None
+        self._recipe_preloader = None
+        self._similarity_loader = None
+        if QueryWorker.supports(session_.get_bind()):
+            self._query_worker = QueryWorker(session_.get_bind())
+            self._query_worker.start()
+            if self._continuous_scrolling:
+                self._prefetch_worker = QueryWorker(session_.get_bind())
+                self._prefetch_worker.start()
+            self._preload_worker = QueryWorker(session_.get_bind())
+            self._preload_worker.start()
+            self._recipe_preloader = RecipePreloader(session_, self._preload_worker, parent=self)
+            self._similarity_loader = SimilarityLoader(session_, session_.get_bind(), parent=self)
+
+        if self._continuous_scrolling:
+            self.table_model = RecipeScrollModel(session_, query_worker=self._query_worker,
+                                                 prefetch_worker=self._prefetch_worker)
+        else:
+            self.table_model = RecipeTableModel(session_, recipes_per_page=recipes_per_page,
+                                                query_worker=self._query_worker)
+        self.table_model.entriesUpdated.connect(self.table_model_entriesUpdated)
+        self.table_model.entriesFailed.connect(self.table_model_entriesFailed)
         self.setupUi(self)
 
         self._data_editor = None
@@ -70,6 +125,26 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
             filter_menu.addMenu(self._filter_menus[filter_table])
 
+        # How the ingredient filter treats optional and alternative ingredients
+        filter_menu.addSeparator()
+        self._action_ingredient_usage = {}
+        for menu_entry, usage in ((_translate("RecipeListWindow", "Count optional ingredients"), "optional"),
+                                  (_translate("RecipeListWindow", "Count alternative ingredients"), "alternatives")):
+            usage_action = QtWidgets.QAction(menu_entry, filter_menu)
+            usage_action.setCheckable(True)
+            usage_action.setChecked(getattr(self.table_model.ingredient_filter, usage))
+            usage_action.toggled.connect(
+                lambda checked, my_usage=usage: self.actionIngredientUsage_toggled(my_usage, checked))
+            filter_menu.addAction(usage_action)
+            self._action_ingredient_usage[usage] = usage_action
+
+        filter_menu.addSeparator()
+        self._action_pantry = QtWidgets.QAction(_translate("RecipeListWindow", "Ingredients on Hand..."), filter_menu)
+        self._action_pantry.setCheckable(True)
+        self._action_pantry.triggered.connect(self.actionPantry_triggered)
+        filter_menu.addAction(self._action_pantry)
+        self._pantry_text = ""
+
         self.actionFilter.setMenu(filter_menu)
 
         self._action_filters = {
@@ -87,8 +162,54 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         self._update_page_buttons()
         self._update_page_slider()
 
+        # The list window subscribes first: the recipe windows rely on the updated unit dictionary
+        ChangeBus.for_session(self._session).subscribe(self._data_changed)
+
         self.init_ui()
 
+    def _data_changed(self, changes: typing.List[ChangeBus.Change]):
+        """
+        Something has been committed (see ChangeBus). Only the filter menus of the changed tables are rebuilt, only
+        the changed recipes are read again (see RecipeTableModel.apply_changes())
+
+        Args:
+            changes (): The changes
+
+        Returns:
+
+        """
+
+        tables = {change.table for change in changes}
+        if data.IngredientUnit in tables:
+            data.IngredientUnit.update_unit_dict(self._session)
+
+        filter_tables = tables & set(self._filter_menus)
+        for table in filter_tables:
+            self._update_filter_menu(table, self._action_filters[table])
+        if filter_tables != set(self._filter_menus) and tables & {data.Recipe, data.CategoryList}:
+            self._update_filter_counts()
+
+        if tables & {data.Recipe, data.IngredientListEntry, data.RecipeImage, data.CategoryList, data.Author,
+                     data.Category, data.Cuisine, data.YieldUnitName}:
+            self.table_model.apply_changes()
+
+    def _ingredient_ids(self, names: typing.Iterable[str]) -> typing.Dict[str, int]:
+        """
+        Looks up the ingredients (case insensitive)
+
+        Args:
+            names (): The names (lower case)
+
+        Returns:
+            name -> id of the existing ingredients
+        """
+
+        names = set(names)
+        if not names:
+            return {}
+        return dict(self._session.query(func.lower(data.Ingredient.name), data.Ingredient.id).filter(
+            func.lower(data.Ingredient.name).in_(names), data.Ingredient.is_group.is_(False)))
+
     def _load_ui_states(self):
         """
         Restores the states of the widgets
@@ -127,16 +248,15 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
     def _reload_model(self):
         """
-        Update the model (after filters or sorting order have changed) and change/update/enable/disable the UI
-        elements  accordingly
+        Update the model (after filters or sorting order have changed). The UI elements are updated as soon as the
+        model's entries are there (see table_model_entriesUpdated)
 
         Returns:
 
         """
         self.table_model.update_model()
-        self._update_page_slider()
-        self._update_page_buttons()
-        self._update_status_bar()
+        if self.table_model.updating:
+            self.statusBar().showMessage(self._translate("RecipeListWindow", "Searching..."), 0)
 
     def _save_ui_states(self):
         """
@@ -158,7 +278,10 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
         settings.beginGroup("RecipeListWindow/RecipeTableView")
         settings.setValue("main/geometry", self.recipeTableView.saveGeometry())
-        settings.setValue("main/recipes_per_page", str(self.table_model.recipes_per_page))
+        if not self._continuous_scrolling:
+            settings.setValue("main/recipes_per_page", str(self.table_model.recipes_per_page))
+        settings.setValue("main/continuous_scrolling", self._action_continuous_scrolling.isChecked())
+        settings.setValue("main/gallery", self._action_gallery.isChecked())
         settings.setValue("header/state", self.recipeTableView.horizontalHeader().saveState())
         settings.setValue("header/geometry", self.recipeTableView.horizontalHeader().saveGeometry())
         settings.endGroup()
@@ -205,6 +328,23 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         index = self.recipesPerPagecomboBox.findData(self.table_model.recipes_per_page)
         self.recipesPerPagecomboBox.setCurrentIndex(index)
 
+    def _show_gallery(self, gallery: bool) -> bool:
+        """
+        Shows either the gallery or the table
+
+        Args:
+            gallery (): Show the gallery
+
+        Returns:
+            True, if the model has to be reloaded (to fetch the thumbnails)
+        """
+
+        self.recipeGalleryView.setVisible(gallery)
+        self.recipeTableView.setVisible(not gallery)
+        thumbnail_column = self.table_model.RecipeColumns.THUMBNAIL
+        return self.table_model.set_column_visible(thumbnail_column,
+                                                   gallery or not self.recipeTableView.isColumnHidden(thumbnail_column))
+
     def _update_filter_menu(self, table: db.Base, parent_action: QtWidgets.QAction):
         """
         Setup / update filter menu for the given table. Assumes that the table has got a property called name and a
@@ -217,7 +357,8 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         Returns:
 
         """
-        items = self._session.query(table).order_by(func.lower(table.name)).all()
+        items = ReferenceData.for_session(self._session).entries(self._session, table)
+        counts = self.table_model.filter_counts(table)
 
         if len(items) == 0:
             # Empty database
@@ -230,7 +371,8 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
             filter_active = False
             for item in items:
                 filter_action = QtWidgets.QAction(parent_action)
-                filter_action.setText(f"{item.name} ({len(item.recipes)})")
+                filter_action.setData((item.id, item.name))
+                filter_action.setText(self._filter_text(item.name, counts.get(item.id)))
                 filter_action.setCheckable(True)
 
                 # Note: After an item has been deleted but it's id is still in the model's filter it will  remain
@@ -252,6 +394,39 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
                 self.table_model.filters[table].clear()
                 self._action_filters[table].setChecked(False)
 
+    def _filter_text(self, name: str, counts: typing.Tuple[int, int]) -> str:
+        """
+        The text of a filter menu entry
+
+        Args:
+            name (): The item's name
+            counts (): (Number of recipes under the current filters, total number of recipes), see
+                RecipeTableModel.filter_counts(). None: No recipes at all
+
+        Returns:
+            The text, for example "Indian (12 of 340)"
+        """
+
+        _translate = self._translate
+        filtered, total = counts if counts else (0, 0)
+        if filtered == total:
+            return f"{name} ({total})"
+        return _translate("RecipeWindow", "{} ({} of {})").format(name, filtered, total)
+
+    def _update_filter_counts(self):
+        """
+        Updates the number of recipes in the filter menus after the filters have been changed
+
+        Returns:
+
+        """
+
+        for table, menu in self._filter_menus.items():
+            counts = self.table_model.filter_counts(table)
+            for filter_action in menu.actions():
+                item_id, name = filter_action.data()
+                filter_action.setText(self._filter_text(name, counts.get(item_id)))
+
     def _update_page_buttons(self):
         """
         Enable/disable page buttons (first, last, next..)
@@ -311,6 +486,9 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         offset = self.table_model.offset
         number_of_filtered_recipes = self.table_model.number_of_filtered_recipes
         number_of_total_recipes = self.table_model.total_number_of_recipes
+        if self._continuous_scrolling:
+            # One single page
+            recipes_per_page = number_of_filtered_recipes
 
         lower_bound = offset + 1
         upper_bound = lower_bound + recipes_per_page - 1
@@ -344,6 +522,28 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         self.menuHelp.insertAction(self.actionAbout, misc.whats_this_action)
         self.menuHelp.insertSeparator(self.actionAbout)
 
+        # -------------------- Settings Menu --------------------
+        self._action_continuous_scrolling = QtWidgets.QAction(
+            _translate("RecipeListWindow", "Continuous Scrolling (after Restart)"), self)
+        self._action_continuous_scrolling.setCheckable(True)
+        self._action_continuous_scrolling.setChecked(self._continuous_scrolling)
+        self._action_continuous_scrolling.setToolTip(
+            _translate("RecipeListWindow", "Show all recipes in one list instead of pages"))
+        self.menuSettings.addAction(self._action_continuous_scrolling)
+
+        self._action_gallery = QtWidgets.QAction(_translate("RecipeListWindow", "Gallery"), self)
+        self._action_gallery.setCheckable(True)
+        self._action_gallery.setToolTip(_translate("RecipeListWindow", "Show the recipes as a grid of pictures"))
+        self.menuSettings.insertAction(self.actionData_editor, self._action_gallery)
+        self.menuSettings.insertSeparator(self.actionData_editor)
+
+        self._action_reencode_images = QtWidgets.QAction(_translate("RecipeListWindow", "Re-encode Images..."), self)
+        self._action_reencode_images.setToolTip(
+            _translate("RecipeListWindow", "Apply the image preferences (size, thumbnail height, JPEG quality) to all "
+                                           "stored images"))
+        self._action_reencode_images.triggered.connect(self.actionReencode_Images_triggered)
+        self.menuSettings.addAction(self._action_reencode_images)
+
         # -------------------- Actions --------------------
         self.actionAbout.triggered.connect(self.actionAbout_triggered)
         self.actionData_editor.triggered.connect(self.actionData_editor_triggered)
@@ -380,6 +580,17 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         self.search_recipe.setClearButtonEnabled(True)
         self.search_recipe.textChanged.connect(self.search_recipe_textChanged)
         self.toolBar.addWidget(self.search_recipe)
+        self.toolBar.addSeparator()
+        self.search_ingredients_label = QtWidgets.QLabel(text=_translate("RecipeListWindow", "Ingredients:"))
+        self.toolBar.addWidget(self.search_ingredients_label)
+        self.search_ingredients = QtWidgets.QLineEdit()
+        self.search_ingredients.setClearButtonEnabled(True)
+        self.search_ingredients.setPlaceholderText(_translate("RecipeListWindow", "onion, garlic, -cilantro"))
+        self.search_ingredients.setToolTip(_translate("RecipeListWindow",
+                                                      "Recipes containing all of these ingredients. Ingredients "
+                                                      "prefixed with \"-\" must not be contained"))
+        self.search_ingredients.editingFinished.connect(self.search_ingredients_editingFinished)
+        self.toolBar.addWidget(self.search_ingredients)
 
         # -------------------- TableView --------------------
         self.recipeTableView.horizontalHeader().setSectionsMovable(True)
@@ -389,12 +600,31 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
         self.recipeTableView.doubleClicked.connect(self.recipeTableView_doubleclicked)
         self.recipeTableView.selectionModel().selectionChanged.connect(self.recipeTableView_selectionChanged)
-        self.recipeTableView.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        if self._continuous_scrolling:
+            # Resizing to the contents would read every row. All rows have the same height anyway
+            self.recipeTableView.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+            self.recipeTableView.verticalHeader().setDefaultSectionSize(self.thumbnail_row_height)
+            for widget in (self.recipesPerPagelabel, self.recipesPerPagecomboBox, self.recipesSlider,
+                           self.firstPageButton, self.previousPageButton, self.nextPageButton, self.lastPageButton):
+                widget.hide()
+        else:
+            self.recipeTableView.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
         self.recipeTableView.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
 
         self.recipeTableView.addAction(self.actionDelete_Recipe_s)
         self.recipeTableView.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
 
+        # -------------------- Gallery --------------------
+        # Same model, same selection - just another view
+        self.recipeGalleryView = RecipeGalleryView(self._session, self.centralwidget)
+        self.recipeGalleryView.setModel(self.table_model)
+        self.recipeGalleryView.setSelectionModel(self.recipeTableView.selectionModel())
+        self.recipeGalleryView.doubleClicked.connect(self.recipeTableView_doubleclicked)
+        self.recipeGalleryView.addAction(self.actionDelete_Recipe_s)
+        self.recipeGalleryView.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+        self.recipeGalleryView.hide()
+        self.verticalLayout.addWidget(self.recipeGalleryView)
+
         # -------------------- Buttons --------------------
         self.firstPageButton.clicked.connect(self.firstPageButton_clicked)
         self.lastPageButton.clicked.connect(self.lastPageButton_clicked)
@@ -411,6 +641,15 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         self.update_filters()
         self.setWindowIcon(QtGui.QIcon(":/logos/qisit_128x128.png"))
         self._load_ui_states()
+
+        # Don't query the columns the user has hidden
+        for column in self.table_model.RecipeColumns:
+            if column != self.table_model.RecipeColumns.ID and self.recipeTableView.isColumnHidden(column):
+                self.table_model.set_column_visible(column, False)
+        self._action_gallery.setChecked(self._gallery)
+        self._show_gallery(self._gallery)
+        self._action_gallery.toggled.connect(self.actionGallery_toggled)
+        self._reload_model()
         self._setup_columns_menu()
         self._update_status_bar()
         self.show()
@@ -453,6 +692,11 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
         """
         self.recipeTableView.setColumnHidden(column, not checked)
+        # The gallery needs the thumbnails
+        if column == self.table_model.RecipeColumns.THUMBNAIL and self._action_gallery.isChecked():
+            return
+        if self.table_model.set_column_visible(column, checked):
+            self._reload_model()
 
     def actionData_editor_triggered(self, checked: bool = False):
         """
@@ -492,7 +736,8 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
             self._session.delete(recipe)
 
         self.modified = True
-        self._reload_model()
+        self.table_model.apply_changes()
+        self._update_filter_counts()
 
     def actionFilterMenu_triggered(self, my_table, my_id: int, checked: bool):
         """
@@ -522,6 +767,103 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
                 self._action_filters[my_table].setCheckable(False)
         self.table_model.offset = 0
         self._reload_model()
+        self._update_filter_counts()
+
+    def actionIngredientUsage_toggled(self, usage: str, checked: bool):
+        """
+        The user changed how optional/alternative ingredients are treated by the ingredient filter
+
+        Args:
+            usage (): "optional" or "alternatives"
+            checked (): Count them or not
+
+        Returns:
+
+        """
+
+        setattr(self.table_model.ingredient_filter, usage, checked)
+        if self.table_model.ingredient_filter.active:
+            self.table_model.offset = 0
+            self._reload_model()
+
+    def actionPantry_triggered(self, checked: bool = False):
+        """
+        The user wants to enter the ingredients on hand. The recipes will be ranked by how many of their ingredients
+        are available
+
+        Args:
+            checked (): ignored
+
+        Returns:
+
+        """
+
+        _translate = self._translate
+        text, ok = QtWidgets.QInputDialog.getText(self, _translate("RecipeListWindow", "Ingredients on Hand"),
+                                                  _translate("RecipeListWindow",
+                                                             "Ingredients (separated by commas). Leave empty to "
+                                                             "disable the ranking:"),
+                                                  text=self._pantry_text)
+        if ok:
+            self._pantry_text = text
+            names = [name.lower() for name in (nullify(token) for token in text.split(",")) if name is not None]
+            if names:
+                self.table_model.pantry = set(self._ingredient_ids(names).values())
+            else:
+                self.table_model.pantry = None
+            self.table_model.offset = 0
+            self._reload_model()
+
+        self._action_pantry.setChecked(self.table_model.pantry is not None)
+
+    def actionReencode_Images_triggered(self, checked: bool = False):
+        """
+        Re-encodes all stored images with the current preferences, reports the bytes saved and offers to compact the
+        database
+
+        Args:
+            checked (): ignored
+
+        Returns:
+
+        """
+
+        _translate = self._translate
+        if db.has_uncommitted_changes(self._session):
+            Qt.QMessageBox.information(self, _translate("RecipeListWindow", "Re-encode Images"),
+                                       _translate("RecipeListWindow",
+                                                  "Please save (or revert) all changes first."))
+            return
+
+        progress_dialog = QtWidgets.QProgressDialog(self)
+        progress_dialog.setWindowTitle(_translate("RecipeListWindow", "Re-encode Images"))
+        progress_dialog.setCancelButtonText(_translate("RecipeListWindow", "Abort"))
+        progress_dialog.setModal(True)
+        reencoder = ImageReencoder(self._session, progress_dialog)
+        result = reencoder.run()
+        progress_dialog.close()
+
+        if result.finished:
+            message = _translate("RecipeListWindow", "Re-encoded {} images, replaced {}. Saved {}.")
+        else:
+            message = _translate("RecipeListWindow", "Aborted after {} images (replaced {}, saved {}). The next run "
+                                                     "will continue where this one stopped.")
+        message = message.format(result.processed, result.replaced,
+                                 format_unit(result.saved_bytes / 1000000, "digital-megabyte", length="short",
+                                             format="#,##0.0", locale=default_locale))
+        if result.saved_bytes > 0 and self._session.get_bind().url.get_backend_name() == "sqlite":
+            answer = Qt.QMessageBox.question(
+                self, _translate("RecipeListWindow", "Re-encode Images"),
+                message + "\n\n" + _translate("RecipeListWindow", "Compact the database file now (VACUUM)? This "
+                                                                  "might take a while."))
+            if answer == Qt.QMessageBox.Yes:
+                QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+                try:
+                    reencoder.vacuum()
+                finally:
+                    QtWidgets.QApplication.restoreOverrideCursor()
+        else:
+            Qt.QMessageBox.information(self, _translate("RecipeListWindow", "Re-encode Images"), message)
 
     def actionNew_triggered(self, checked=False):
         """
@@ -549,15 +891,31 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
             recipe_window = self._recipe_windows[new_recipe_id]
         else:
             recipe_window = recipe_window_controller.RecipeWindow(session=self._session, recipe=new_recipe,
-                                                                  new_recipe=True)
+                                                                  new_recipe=True,
+                                                                  similarity_loader=self._similarity_loader)
             self._recipe_windows[new_recipe_id] = recipe_window
             recipe_window.destroyed.connect(lambda: self._recipe_window_closed(new_recipe_id))
             recipe_window.recipeChanged.connect(self.recipe_commited)
+            recipe_window.similarRecipeSelected.connect(self.open_recipe)
 
         recipe_window.setEnabled(True)
         recipe_window.show()
         recipe_window.raise_()
 
+    def actionGallery_toggled(self, checked: bool):
+        """
+        The user switched between gallery and table
+
+        Args:
+            checked (): Show the gallery
+
+        Returns:
+
+        """
+
+        if self._show_gallery(checked):
+            self._reload_model()
+
     def actionGourmnet_DB_triggered(self, checked=False):
         """
         Import Gourmet's DB
@@ -670,6 +1028,7 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
             self._action_filters[table].setChecked(False)
             self._action_filters[table].setCheckable(False)
             self._reload_model()
+            self._update_filter_counts()
 
     def closeEvent(self, event: QtGui.QCloseEvent) -> None:
         """
@@ -693,15 +1052,17 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
             self.modified = False
 
         self._save_ui_states()
+        for worker in (self._query_worker, self._prefetch_worker, self._preload_worker):
+            if worker is not None:
+                worker.stop()
+        if self._similarity_loader is not None:
+            self._similarity_loader.stop()
         QtCore.QCoreApplication.quit()
         event.accept()
 
     def dataeditor_commited(self):
+        # The filters, the recipe list and the units are updated by the change bus (see _data_changed())
         self.modified = True
-        self.update_filters()
-        self._reload_model()
-        # The user might have added some units which are no longer available after the rollback
-        data.IngredientUnit.update_unit_dict(self._session)
 
         # Note: This will create some surprising results if the recipe has been altered (and not saved) - the data
         # concerning the recipe will be reset in the data editor. This is because of different transactions and
@@ -762,10 +1123,14 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         if recipe.id in self._recipe_windows:
             recipe_window = self._recipe_windows[recipe.id]
         else:
-            recipe_window = recipe_window_controller.RecipeWindow(session=self._session, recipe=recipe)
+            preloaded = self._recipe_preloader.take(recipe) if self._recipe_preloader else None
+            recipe_window = recipe_window_controller.RecipeWindow(session=self._session, recipe=recipe,
+                                                                  preloaded=preloaded,
+                                                                  similarity_loader=self._similarity_loader)
             self._recipe_windows[recipe.id] = recipe_window
             recipe_window.destroyed.connect(lambda: self._recipe_window_closed(recipe.id))
             recipe_window.recipeChanged.connect(self.recipe_commited)
+            recipe_window.similarRecipeSelected.connect(self.open_recipe)
 
         recipe_window.setEnabled(True)
         recipe_window.show()
@@ -779,10 +1144,8 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
         """
 
-        # TODO: Propagate this to all other Recipes
+        # The filters and the recipe list are updated by the change bus (see _data_changed())
         self.modified = True
-        self.update_filters()
-        self._reload_model()
         if self._data_editor:
             self._data_editor.recipe_changed(recipe)
 
@@ -843,7 +1206,7 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
 
     def recipeTableView_selectionChanged(self, selected: QtCore.QItemSelection, deselected: QtCore.QItemSelection):
         """
-        Enable/Disable the delete action
+        Enable/Disable the delete action, prepare the selected recipe for opening
 
         Args:
             selected ():
@@ -854,6 +1217,11 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         """
         self.actionDelete_Recipe_s.setEnabled(len(self.recipeTableView.selectedIndexes()) > 0)
 
+        if self._recipe_preloader is not None and not selected.isEmpty():
+            recipe_id = self.table_model.recipe_id_at_row(selected.indexes()[0].row())
+            if recipe_id is not None:
+                self._recipe_preloader.preload(recipe_id)
+
     def recipeTableView_sortIndicatorChanged(self, index, sort):
         """
         if a column ist not sortable (for example, it makes no sense trying to sort by thumbnails) reject
@@ -869,6 +1237,42 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
         """
         self.recipeTableView.horizontalHeader().setSortIndicatorShown(index in RecipeTableModel.sortable_columns)
 
+    def search_ingredients_editingFinished(self):
+        """
+        The user entered a list of ingredients ("onion, garlic, -cilantro")
+
+        Returns:
+
+        """
+
+        names = {}
+        for token in self.search_ingredients.text().split(","):
+            name = nullify(token)
+            excluded = name is not None and name.startswith("-")
+            if excluded:
+                name = nullify(name[1:])
+            if name is not None:
+                names[name.lower()] = excluded
+
+        ingredient_ids = self._ingredient_ids(names)
+
+        include = set()
+        exclude = set()
+        for name, excluded in names.items():
+            if excluded:
+                if name in ingredient_ids:
+                    exclude.add(ingredient_ids[name])
+            else:
+                # No recipe contains an unknown ingredient - and there's no ingredient with the id 0
+                include.add(ingredient_ids.get(name, 0))
+
+        ingredient_filter = self.table_model.ingredient_filter
+        if (include, exclude) != (ingredient_filter.include, ingredient_filter.exclude):
+            ingredient_filter.include = include
+            ingredient_filter.exclude = exclude
+            self.table_model.offset = 0
+            self._reload_model()
+
     def search_recipe_textChanged(self, text: str):
         """
         The user entered some input in the search recipe LineEdit
@@ -887,3 +1291,26 @@ class RecipeListWindow(recipe_list.Ui_RecipeListWindow, QtWidgets.QMainWindow):
             self._current_search_text = search_text
             self.table_model.search_title = search_text
             self._reload_model()
+
+    def table_model_entriesFailed(self, error: Exception):
+        """
+        Reading the model's entries has failed, the previous ones are still shown
+
+        Args:
+            error (): The exception
+
+        Returns:
+
+        """
+        self.statusBar().showMessage(self._translate("RecipeListWindow", "Searching failed: {}").format(error), 0)
+
+    def table_model_entriesUpdated(self):
+        """
+        The model's entries have been (re)read
+
+        Returns:
+
+        """
+        self._update_page_slider()
+        self._update_page_buttons()
+        self._update_status_bar()
@@ -0,0 +1,189 @@
+""" The model of the recipe's table """
+
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+
+import typing
+
+from PyQt5 import QtCore
+from sqlalchemy import orm
+
+from qisit.core import db
+from qisit.qt.misc.query_worker import QueryWorker
+from qisit.qt.recipelistwindow.recipe_table_model import RecipeTableModel
+
+
+class RecipeScrollModel(RecipeTableModel):
+    """
+    Recipe's table model without pages: The table grows (fetchMore) while the user scrolls down. The rows are read in
+    windows of window_size rows. Only the windows near the one currently viewed are kept, the others are evicted (and
+    read again if the user scrolls back). The neighbouring windows are read in the background by the prefetch worker
+    (if there's one) - the user shouldn't notice a window being read.
+    """
+
+    def __init__(self, db_session: orm.Session, window_size: int = 200, max_windows: int = 5,
+                 query_worker: QueryWorker = None, prefetch_worker: QueryWorker = None):
+        """
+        Init
+
+        Args:
+            db_session (): The session
+            window_size (): The number of rows read at once
+            max_windows (): The maximum number of windows kept in memory
+            query_worker (): Reads the first window after filters or the sort order have been changed
+            prefetch_worker (): Reads the neighbouring windows
+        """
+
+        # The windows currently in memory: window number -> the rows
+        self._windows = {}
+        # The rows the view knows about (see fetchMore)
+        self._row_count = 0
+        # The window the user is currently viewing
+        self._current_window = 0
+        self._prefetch_ticket = None
+        self.window_size = window_size
+        self.max_windows = max_windows
+        self.prefetch_worker = prefetch_worker
+        super().__init__(db_session, recipes_per_page=window_size, query_worker=query_worker)
+        if prefetch_worker is not None:
+            prefetch_worker.jobFinished.connect(self.prefetch_worker_jobFinished)
+            prefetch_worker.jobFailed.connect(self.prefetch_worker_jobFailed)
+
+    def __evict(self):
+        """ Forget the windows far away from the current one """
+        distance = self.max_windows // 2
+        for window in [window for window in self._windows if abs(window - self._current_window) > distance]:
+            del self._windows[window]
+
+    def __prefetch(self):
+        """ Read the current and the neighbouring windows in the background """
+
+        if not self.__prefetching():
+            return
+        wanted = [window for window in (self._current_window, self._current_window + 1, self._current_window - 1)
+                  if 0 <= window * self.window_size < self.number_of_filtered_recipes and window not in self._windows]
+        if wanted:
+            self._prefetch_ticket = self.prefetch_worker.submit(self.__windows_job(wanted))
+
+    def __prefetching(self) -> bool:
+        """ Are the windows read in the background? The worker can't see uncommitted changes """
+        return self.prefetch_worker is not None and not self.updating and \
+            not db.has_uncommitted_changes(self._session)
+
+    def __set_windows(self, windows: typing.Dict[int, list]):
+        """ Sets the windows that have been read (unless the user has scrolled away meanwhile) """
+
+        for window, rows in windows.items():
+            if abs(window - self._current_window) > self.max_windows // 2:
+                continue
+            self._windows[window] = rows
+            first_row = window * self.window_size
+            last_row = min(first_row + self.window_size, self._row_count) - 1
+            if first_row <= last_row:
+                self.dataChanged.emit(self.index(first_row, 0), self.index(last_row, self.columnCount() - 1))
+
+    def __windows_job(self, windows: typing.Iterable[int]) -> typing.Callable[[orm.Session], dict]:
+        """ The job reading the windows: session -> {window number: rows} """
+
+        jobs = {window: self._entries_job(window * self.window_size, self.window_size, count=False)
+                for window in windows}
+
+        def job(session_: orm.Session) -> dict:
+            return {window: window_job(session_)[1] for window, window_job in jobs.items()}
+
+        return job
+
+    def _entry(self, row: int) -> typing.Optional[RecipeTableModel.RecipeRow]:
+        window, position = divmod(row, self.window_size)
+        if window != self._current_window:
+            self._current_window = window
+            self.__evict()
+            self.__prefetch()
+
+        rows = self._windows.get(window)
+        if rows is None and not self.updating and self._prefetch_ticket is None:
+            # Nothing to wait for, read it right away
+            rows = self._windows[window] = self.__windows_job([window])(self._session)[window]
+        if rows is None or position >= len(rows):
+            # Not yet there, the view is notified (dataChanged) as soon as it is
+            return None
+        return rows[position]
+
+    def _loaded_entries(self) -> typing.Iterator[typing.Tuple[int, typing.List[RecipeTableModel.RecipeRow]]]:
+        for window, rows in self._windows.items():
+            yield window * self.window_size, rows
+
+    def _set_entries(self, result: tuple):
+        super()._set_entries(result)
+        self._windows = {0: self._entries}
+        self._row_count = min(self.window_size, self.number_of_filtered_recipes)
+        self._current_window = 0
+        # An outdated prefetch's result will be dropped
+        self._prefetch_ticket = None
+
+    def canFetchMore(self, parent: QtCore.QModelIndex) -> bool:
+        return not parent.isValid() and self._row_count < self.number_of_filtered_recipes
+
+    def fetchMore(self, parent: QtCore.QModelIndex) -> None:
+        """
+        The view has been scrolled to the end. The new rows' data is read when the view asks for it (it has
+        probably been prefetched already)
+
+        Args:
+            parent ():
+
+        Returns:
+
+        """
+
+        row_count = min(self._row_count + self.window_size, self.number_of_filtered_recipes)
+        if parent.isValid() or row_count <= self._row_count:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self._row_count, row_count - 1)
+        self._row_count = row_count
+        self.endInsertRows()
+
+    def prefetch_worker_jobFailed(self, ticket: int, error: Exception):
+        if ticket != self._prefetch_ticket:
+            return
+        self._prefetch_ticket = None
+        # The windows are read on demand (see _entry)
+        self.entriesFailed.emit(error)
+
+    def prefetch_worker_jobFinished(self, ticket: int, windows: dict):
+        if ticket != self._prefetch_ticket:
+            # Outdated
+            return
+        self._prefetch_ticket = None
+        self.__set_windows(windows)
+
+    def recipe_id_at_row(self, row: int) -> int:
+        """
+        Returns the recipe's id at the given row (reading the row's window if necessary)
+
+        Args:
+            row (): the row
+
+        Returns: The id or None if there's no such row
+
+        """
+
+        window = row // self.window_size
+        if 0 <= row < self._row_count and window not in self._windows and not self.updating:
+            self._windows.update(self.__windows_job([window])(self._session))
+        return super().recipe_id_at_row(row)
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:
+        return self._row_count
@@ -17,17 +17,27 @@
 #  You should have received a copy of the GNU General Public License
 #   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
 
+import datetime
 import typing
 from enum import IntEnum
 
+import sqlalchemy as sql
 from PyQt5 import QtCore, QtGui
 from babel.dates import format_timedelta, format_date
-from babel.numbers import format_decimal
+from babel.numbers import format_decimal, format_percent
 from sqlalchemy import func, orm
 
 from qisit import translate
-from qisit.core import db, default_locale
+from qisit.core import default_locale
+from qisit.core import db
 from qisit.core.db import data
+from qisit.core.db.facet_index import FacetIndex
+from qisit.core.db.ingredient_index import IngredientFilter, IngredientIndex
+from qisit.core.db.pantry_index import PantryIndex
+from qisit.core.db.recipe_changes import RecipeChanges
+from qisit.core.db.trigram_index import TrigramIndex
+from qisit.qt.misc.query_worker import QueryWorker
+from qisit.qt.misc.thumbnail_cache import ThumbnailCache
 
 
 class RecipeTableModel(QtCore.QAbstractTableModel):
@@ -49,6 +59,27 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
         LAST_COOKED = 11
         LAST_MODIFIED = 12
 
+    class RecipeRow(typing.NamedTuple):
+        """
+        A single row of the table. Only the values that are actually displayed - no ORM objects (which would end up
+        in the session's identity map and load the large text columns like instructions)
+        """
+        id: int
+        thumbnail: bytes
+        thumbnail_id: int
+        title: str
+        categories: str
+        cuisine: str
+        author: str
+        yields: float
+        yield_unit_name: str
+        rating: int
+        preparation_time: int
+        cooking_time: int
+        total_time: int
+        last_cooked: datetime.date
+        last_modified: datetime.date
+
     sortable_columns = (
         int(RecipeColumns.TITLE), int(RecipeColumns.CATEGORIES), int(RecipeColumns.AUTHOR), int(RecipeColumns.CUISINE),
         int(RecipeColumns.YIELD), int(RecipeColumns.RATING), int(RecipeColumns.PREPARATION_TIME),
@@ -56,7 +87,35 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
         int(RecipeColumns.LAST_MODIFIED))
     """ Which columns are sortable? For example, there's no meaningful sort order for thumbnails. """
 
-    def __init__(self, db_session: orm.Session, offset: int = 0, recipes_per_page: int = 10):
+    sort_aspects = {
+        RecipeColumns.TITLE: "title",
+        RecipeColumns.CATEGORIES: "categories",
+        RecipeColumns.CUISINE: "cuisine",
+        RecipeColumns.AUTHOR: "author",
+        RecipeColumns.YIELD: "yields",
+        RecipeColumns.RATING: "rating",
+        RecipeColumns.PREPARATION_TIME: "preparation_time",
+        RecipeColumns.COOK_TIME: "cooking_time",
+        RecipeColumns.TOTAL_TIME: "total_time",
+        RecipeColumns.LAST_COOKED: "last_cooked",
+        RecipeColumns.LAST_MODIFIED: "last_modified"
+    }
+    """ The aspect of a recipe's change (see RecipeChanges) affecting the sort order of the column """
+
+    entriesUpdated = QtCore.pyqtSignal()
+    """ The entries have been (re)read """
+
+    entriesFailed = QtCore.pyqtSignal(object)
+    """ Reading the entries in the background has failed (the exception). The previous entries are kept """
+
+    thumbnail_role = QtCore.Qt.UserRole + 1
+    """ The thumbnail column's (image id, stored thumbnail) - for views deriving larger thumbnails """
+
+    fuzzy_search_limit = 100
+    """ The maximum number of recipes found by the typo tolerant search (in addition to the exact matches) """
+
+    def __init__(self, db_session: orm.Session, offset: int = 0, recipes_per_page: int = 10,
+                 query_worker: QueryWorker = None):
         super().__init__()
         self._translate = translate
         self.column_headers = {}
@@ -65,15 +124,6 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
         self.__setup_sort_criteria()
         self._session = db_session
 
-        # The "base" query (i.e. the query without any limits, order_by or filters)
-        self._base_query = self._session.query(data.Recipe, data.Author, data.Cuisine,
-                                               db.group_concat(data.Category.name)) \
-            .join(data.Author, isouter=True) \
-            .join(data.Cuisine, isouter=True) \
-            .join(data.CategoryList, isouter=True) \
-            .join(data.Category, isouter=True) \
-            .group_by(data.Recipe.id, data.Author.id, data.Cuisine.id)
-
         # There are four values relevant for displaying/filtering/paging:
 
         # The total number of recipes. Relatively constant, changes only when the user adds (either manually or
@@ -102,16 +152,50 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
             data.Author: set()
         }
 
+        # Filter by ingredients ("onion and garlic, but no cilantro")
+        self.ingredient_filter = IngredientFilter()
+        self._ingredient_index = IngredientIndex.for_session(self._session)
+
+        # The ids of the ingredients on hand. If set, the recipes are ranked by their coverage (instead of the sort
+        # order)
+        self.pantry = None
+        self._pantry_index = PantryIndex.for_session(self._session)
+        self._coverage = {}
+
+        # Bitsets of the recipes for every filter item (for counting)
+        self._facet_index = FacetIndex.for_session(self._session)
+
         # Used when one column has been selected for sorting
         self.__order_by = None
+        self.__sort_column = None
+
+        # The columns currently shown in the view. Hidden columns won't be queried (especially the thumbnails)
+        self.visible_columns = set(self.RecipeColumns)
 
         # The entry in the search text field
         self.search_title = None
+        self._title_index = TrigramIndex.for_session(self._session, data.Recipe)
+        self._fuzzy_title_ids = set()
+
+        # The recipes changed since the entries have been read (see apply_changes())
+        self._recipe_changes = RecipeChanges.for_session(self._session)
+
+        # Sharper thumbnails on HiDPI screens, generated in the background
+        self._thumbnail_cache = ThumbnailCache.for_session(self._session)
+        self._thumbnail_cache.thumbnailReady.connect(self.thumbnail_cache_thumbnailReady)
 
         # The entries currently shown
         self._entries = []
         self.__setup_entries()
 
+        # Reads the entries in the background. The ticket of the job currently running (if any)
+        self.query_worker = query_worker
+        self._ticket = None
+        self._job = None
+        if query_worker is not None:
+            query_worker.jobFinished.connect(self.query_worker_jobFinished)
+            query_worker.jobFailed.connect(self.query_worker_jobFailed)
+
     def __setup_column_headers(self):
         """ Setup translations and icons for the headers """
         _translate = self._translate
@@ -135,13 +219,62 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
                 _translate("RecipeTableWindow", "Last Modified"), ":/icons/calendar-day.png")
         }
 
-    def __setup_entries(self):
-        the_query = self._base_query
+    def __build_query(self) -> sql.sql.Select:
+        """
+        Builds the "base" query (i.e. the query without any limits, order_by or filters). A plain projection of the
+        displayed columns, see RecipeRow. Everything is read from the (denormalized) recipe summary, the only join
+        left is the one for the thumbnail - and only if it's visible. Hidden columns will be NULL.
+
+        Returns:
+            The query
+        """
+
+        summary = data.RecipeSummary
+
+        def needed(column: RecipeTableModel.RecipeColumns) -> bool:
+            return column in self.visible_columns or column == self.__sort_column
+
+        def column_or_null(column: RecipeTableModel.RecipeColumns, database_column):
+            return database_column if needed(column) else sql.literal_column("NULL")
+
+        the_join = summary.__table__
+        if needed(self.RecipeColumns.THUMBNAIL):
+            the_join = the_join.outerjoin(data.RecipeImage.__table__, data.RecipeImage.id == summary.thumbnail_id)
+
+        return sql.select([summary.recipe_id,
+                           column_or_null(self.RecipeColumns.THUMBNAIL, data.RecipeImage.thumbnail),
+                           column_or_null(self.RecipeColumns.THUMBNAIL, summary.thumbnail_id),
+                           summary.title,
+                           column_or_null(self.RecipeColumns.CATEGORIES, summary.categories),
+                           column_or_null(self.RecipeColumns.CUISINE, summary.cuisine),
+                           column_or_null(self.RecipeColumns.AUTHOR, summary.author),
+                           summary.yields,
+                           column_or_null(self.RecipeColumns.YIELD, summary.yield_unit_name),
+                           summary.rating, summary.preparation_time, summary.cooking_time,
+                           summary.total_time, summary.last_cooked,
+                           summary.last_modified]).select_from(the_join)
+
+    def __filter_query(self, the_query: sql.sql.Select) -> sql.sql.Select:
+        """ Applies all active filters and the search text """
+
+        summary = data.RecipeSummary
 
-        # Let's construct the final query. First apply all active filters
-        for table in (data.Category, data.Cuisine, data.Author):
+        if len(self.filters[data.Category]):
+            the_query = the_query.where(summary.recipe_id.in_(
+                sql.select([data.CategoryList.recipe_id]).where(
+                    data.CategoryList.category_id.in_(self.filters[data.Category]))))
+
+        for table, foreign_key in ((data.Cuisine, summary.cuisine_id), (data.Author, summary.author_id)):
             if len(self.filters[table]):
-                the_query = the_query.filter(table.id.in_(self.filters[table]))
+                the_query = the_query.where(foreign_key.in_(self.filters[table]))
+
+        if self.ingredient_filter.active:
+            recipe_ids, excluded_ids = self._ingredient_index.matching(self._session, self.ingredient_filter)
+            id_column = summary.__table__.c.recipe_id
+            if recipe_ids is not None:
+                the_query = the_query.where(self.__id_list_clause(id_column, recipe_ids))
+            elif excluded_ids:
+                the_query = the_query.where(self.__id_list_clause(id_column, excluded_ids, negate=True))
 
         # Search by recipe's title
         if self.search_title is not None:
@@ -151,43 +284,211 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
             contains_wildcards = "%" in self.search_title or "_" in self.search_title
             if contains_wildcards:
                 filter_clause = self.search_title
-            the_query = the_query.filter(data.Recipe.title.like(filter_clause))
+                the_query = the_query.where(summary.title.like(filter_clause))
+            else:
+                # Typos ("vindalo") are forgiven
+                the_query = the_query.where(sql.or_(summary.title.like(filter_clause), self.__id_list_clause(
+                    summary.__table__.c.recipe_id, self._fuzzy_title_ids)))
+
+        return the_query
 
-        self.number_of_filtered_recipes = the_query.count()
+    @staticmethod
+    def __id_list_clause(column, ids: typing.Collection[int], negate: bool = False):
+        """
+        column IN (ids) with the ids rendered inline. There might be thousands of them, way more than SQLite
+        allows bind parameters - and they are just integers
+
+        Args:
+            column (): The column
+            ids (): The ids
+            negate (): NOT IN
+
+        Returns:
+            The clause
+        """
+
+        if not ids:
+            return sql.true() if negate else sql.false()
+
+        id_list = ",".join(str(int(id_)) for id_ in sorted(ids))
+        operator = "NOT IN" if negate else "IN"
+        return sql.text(f"{column.table.name}.{column.name} {operator} ({id_list})")
+
+    def __pantry_job(self, offset: int, limit: int) -> typing.Callable[[orm.Session], tuple]:
+        """ The job reading the entries ranked by the coverage of the pantry's ingredients """
+
+        ranking = self._pantry_index.coverage(self._session, self.pantry)
+        coverage = {recipe_coverage.recipe_id: recipe_coverage for recipe_coverage in ranking}
+        ranked_ids = [recipe_coverage.recipe_id for recipe_coverage in ranking]
+
+        # The filters still apply - but the order is the ranking's
+        filter_query = None
+        if any(self.filters.values()) or self.ingredient_filter.active or self.search_title is not None:
+            filter_query = self.__filter_query(sql.select([data.RecipeSummary.recipe_id]))
+
+        base_query = self.__build_query()
+
+        def job(session_: orm.Session) -> tuple:
+            recipe_ids = ranked_ids
+            if filter_query is not None:
+                filtered_ids = {row[0] for row in session_.execute(filter_query)}
+                recipe_ids = [recipe_id for recipe_id in ranked_ids if recipe_id in filtered_ids]
+
+            page_ids = recipe_ids[offset:offset + limit]
+            rows = {row[0]: self.RecipeRow(*row) for row in session_.execute(base_query.where(
+                self.__id_list_clause(data.RecipeSummary.__table__.c.recipe_id, page_ids)))}
+            return len(recipe_ids), [rows[recipe_id] for recipe_id in page_ids if recipe_id in rows], coverage
+
+        return job
+
+    def __flush(self):
+        """ The queries are core statements, they don't autoflush. Added, changed or deleted recipes must be there """
+        session_ = self._session
+        if session_.new or session_.dirty or session_.deleted:
+            session_.flush()
+
+    def __search_titles(self):
+        """ The typo tolerant title search. Searched only once per update - the filter is applied to every query """
+        self._fuzzy_title_ids = set()
+        if self.search_title is not None:
+            self._fuzzy_title_ids = {match.id for match in self._title_index.search(
+                self._session, self.search_title, limit=self.fuzzy_search_limit)}
+
+    def _entries_job(self, offset: int, limit: int, count: bool = True) -> typing.Callable[[orm.Session], tuple]:
+        """
+        Returns the job reading the entries. Everything that needs the model's session (the in-memory indexes) is done
+        right away, the job just runs the queries - so the query worker can run it with a session of its own.
+
+        Args:
+            offset (): The first entry
+            limit (): The (maximum) number of entries
+            count (): Count the filtered recipes, too
+
+        Returns:
+            The job: session -> (number of filtered recipes (None if not counted), entries, coverage)
+        """
+
+        if self.pantry is not None:
+            return self.__pantry_job(offset, limit)
+
+        # The count doesn't need any of the displayed columns
+        count_query = None
+        if count:
+            count_query = self.__filter_query(sql.select([func.count()]).select_from(data.RecipeSummary.__table__))
+
+        the_query = self.__filter_query(self.__build_query())
 
         # Then the sort order
         if self.__order_by is not None:
             the_query = the_query.order_by(self.__order_by)
 
         # Finally pagination
-        the_query = the_query.limit(self.recipes_per_page).offset(self.offset)
+        the_query = the_query.limit(limit).offset(offset)
+
+        def job(session_: orm.Session) -> tuple:
+            number_of_filtered_recipes = None
+            if count_query is not None:
+                number_of_filtered_recipes = session_.execute(count_query).scalar()
+            return number_of_filtered_recipes, [self.RecipeRow(*row) for row in session_.execute(the_query)], {}
+
+        return job
+
+    def _entry(self, row: int) -> typing.Optional[RecipeRow]:
+        """ The entry of the row (None if there's none) """
+        return self._entries[row] if row < len(self._entries) else None
+
+    def _loaded_entries(self) -> typing.Iterator[typing.Tuple[int, typing.List[RecipeRow]]]:
+        """ The entries read so far: (row of the first entry, entries) """
+        yield 0, self._entries
 
-        self._entries = the_query.all()
+    def _set_entries(self, result: tuple):
+        """ Sets the result of an entries job """
+        self.number_of_filtered_recipes, self._entries, self._coverage = result
+
+    def __setup_entries(self):
+        self.__flush()
+        self._recipe_changes.take()
+        self.__search_titles()
+        self._set_entries(self._entries_job(self.offset, self.recipes_per_page)(self._session))
 
     def __setup_sort_criteria(self):
         """
-        Sort criteria for the columns. This has to be done dynamically at __init__, because otherwise
-        db.group_concat might not be properly set when using PostgreSQL
+        Sort criteria for the columns. The summary table has an (indexed) lower case key for every string column
 
         Returns:
 
         """
 
-        # Title, database field, string?
+        summary = data.RecipeSummary
         self.__sort_criteria = {
-            self.RecipeColumns.TITLE: (data.Recipe.title, True),
-            self.RecipeColumns.CATEGORIES: (db.group_concat(data.Category.name), True),
-            self.RecipeColumns.CUISINE: (data.Cuisine.name, True),
-            self.RecipeColumns.AUTHOR: (data.Author.name, True),
-            self.RecipeColumns.YIELD: (data.Recipe.yields, False),
-            self.RecipeColumns.RATING: (data.Recipe.rating, False),
-            self.RecipeColumns.PREPARATION_TIME: (data.Recipe.preparation_time, False),
-            self.RecipeColumns.COOK_TIME: (data.Recipe.cooking_time, False),
-            self.RecipeColumns.TOTAL_TIME: (data.Recipe.total_time, False),
-            self.RecipeColumns.LAST_COOKED: (data.Recipe.last_cooked, False),
-            self.RecipeColumns.LAST_MODIFIED: (data.Recipe.last_modified, False)
+            self.RecipeColumns.TITLE: summary.title_key,
+            self.RecipeColumns.CATEGORIES: summary.categories_key,
+            self.RecipeColumns.CUISINE: summary.cuisine_key,
+            self.RecipeColumns.AUTHOR: summary.author_key,
+            self.RecipeColumns.YIELD: summary.yields,
+            self.RecipeColumns.RATING: summary.rating,
+            self.RecipeColumns.PREPARATION_TIME: summary.preparation_time,
+            self.RecipeColumns.COOK_TIME: summary.cooking_time,
+            self.RecipeColumns.TOTAL_TIME: summary.total_time,
+            self.RecipeColumns.LAST_COOKED: summary.last_cooked,
+            self.RecipeColumns.LAST_MODIFIED: summary.last_modified
         }
 
+    def __relevant_aspects(self) -> typing.Set[str]:
+        """ The aspects of a recipe deciding whether it's displayed (and where) """
+
+        aspects = {RecipeChanges.NEW, RecipeChanges.DELETED}
+        for table, aspect in ((data.Category, "categories"), (data.Cuisine, "cuisine"), (data.Author, "author")):
+            if self.filters[table]:
+                aspects.add(aspect)
+        if self.ingredient_filter.active or self.pantry is not None:
+            aspects.add(RecipeChanges.INGREDIENTS)
+        if self.search_title is not None:
+            aspects.add("title")
+        if self.__sort_column is not None:
+            aspects.add(self.sort_aspects[self.__sort_column])
+        return aspects
+
+    def __refresh_entries(self, recipe_ids: typing.Set[int]):
+        """ Reads the entries of the recipes again (if they are loaded) and tells the views """
+
+        loaded = [(first_row + position, entries, position) for first_row, entries in self._loaded_entries()
+                  for position, entry in enumerate(entries) if entry.id in recipe_ids]
+        if not loaded:
+            return
+
+        the_query = self.__build_query().where(self.__id_list_clause(
+            data.RecipeSummary.__table__.c.recipe_id, {entries[position].id for row, entries, position in loaded}))
+        rows = {row[0]: self.RecipeRow(*row) for row in self._session.execute(the_query)}
+        last_column = self.columnCount() - 1
+        for row, entries, position in loaded:
+            entry = rows.get(entries[position].id)
+            if entry is not None:
+                entries[position] = entry
+                self.dataChanged.emit(self.index(row, 0), self.index(row, last_column))
+
+    def apply_changes(self):
+        """
+        Recipes have been saved, deleted... If the changes might affect which recipes are displayed (or their
+        order), the model is updated. Otherwise just the changed rows are read again.
+
+        Returns:
+
+        """
+
+        self.__flush()
+        changes = self._recipe_changes.take()
+        if changes is None or self.updating:
+            # A running update might have read the recipes before they were changed
+            self.update_model()
+            return
+
+        relevant_aspects = self.__relevant_aspects()
+        if any(aspects & relevant_aspects for aspects in changes.values()):
+            self.update_model()
+        elif changes:
+            self.__refresh_entries(set(changes))
+
     def columnCount(self, parent: QtCore.QModelIndex = ...) -> int:
         return self.RecipeColumns.LAST_MODIFIED + 1
 
@@ -196,17 +497,21 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
         column = index.column()
         row = index.row()
 
-        recipe = self._entries[row][0]
+        entry = self._entry(row)
+        if entry is None:
+            return None
 
         # Special consideration for the thumbnail column
         if column == self.RecipeColumns.THUMBNAIL:
+            if role == self.thumbnail_role:
+                return (entry.thumbnail_id, entry.thumbnail)
             if role == QtCore.Qt.SizeHintRole or role == QtCore.Qt.DecorationRole:
 
                 thumbnail = None
 
-                if len(recipe.imagelist) != 0:
+                if entry.thumbnail is not None:
                     thumbnail = QtGui.QPixmap()
-                    thumbnail.loadFromData(recipe.imagelist[data.RecipeImage.main_image_pos].thumbnail)
+                    thumbnail.loadFromData(entry.thumbnail)
                 else:
                     return None
 
@@ -215,42 +520,55 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
                     return thumbnail.size()
 
                 if role == QtCore.Qt.DecorationRole:
+                    # On HiDPI screens the stored thumbnail would be scaled up (blurry). Use one derived from the
+                    # image instead, as soon as it's available
+                    pixel_ratio = ThumbnailCache.device_pixel_ratio()
+                    if pixel_ratio > 1.0:
+                        derived = self._thumbnail_cache.thumbnail(entry.thumbnail_id, entry.thumbnail,
+                                                                  round(thumbnail.height() * pixel_ratio))
+                        if derived is not None:
+                            thumbnail = QtGui.QPixmap.fromImage(derived)
+                            thumbnail.setDevicePixelRatio(pixel_ratio)
                     return QtCore.QVariant(thumbnail)
                 else:
                     return None
             else:
                 return None
 
+        if role == QtCore.Qt.ToolTipRole and column == self.RecipeColumns.TITLE and self.pantry is not None:
+            coverage = self._coverage.get(entry.id)
+            if coverage is not None:
+                return QtCore.QVariant(self._translate("RecipeTableWindow", "{} of the ingredients on hand, {} missing")
+                                       .format(format_percent(coverage.coverage, locale=default_locale),
+                                               coverage.missing))
+
         if role != QtCore.Qt.DisplayRole:
             return None
 
-        # Maybe replace the "magic" numbers [0], [1] with more symbolic names?
         if column == self.RecipeColumns.ID:
-            return QtCore.QVariant(recipe.id)
+            return QtCore.QVariant(entry.id)
 
         if column == self.RecipeColumns.TITLE:
-            return QtCore.QVariant(recipe.title)
+            return QtCore.QVariant(entry.title)
 
         if column == self.RecipeColumns.CATEGORIES:
-            return QtCore.QVariant(self._entries[row][3])
+            return QtCore.QVariant(entry.categories)
 
         if column == self.RecipeColumns.CUISINE:
-            cuisine = self._entries[row][2]
-            if cuisine:
-                return QtCore.QVariant(str(cuisine))
+            if entry.cuisine:
+                return QtCore.QVariant(entry.cuisine)
             else:
                 return None
 
         if column == self.RecipeColumns.AUTHOR:
-            author = self._entries[row][1]
-            if author:
-                return QtCore.QVariant(str(author))
+            if entry.author:
+                return QtCore.QVariant(entry.author)
             else:
                 return None
 
         if column == self.RecipeColumns.YIELD:
-            yields = recipe.yields
-            yield_unit_name = recipe.yield_unit_name
+            yields = entry.yields
+            yield_unit_name = entry.yield_unit_name
             yield_string = None
             if yields > 0:
                 if yield_unit_name:
@@ -260,8 +578,8 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
             return QtCore.QVariant(yield_string)
 
         if column == self.RecipeColumns.RATING:
-            if recipe.rating:
-                return QtCore.QVariant(f"{recipe.rating}/10")
+            if entry.rating:
+                return QtCore.QVariant(f"{entry.rating}/10")
             else:
                 return None
 
@@ -269,11 +587,11 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
                       self.RecipeColumns.TOTAL_TIME):
             value = None
             if column == self.RecipeColumns.PREPARATION_TIME:
-                value = recipe.preparation_time
+                value = entry.preparation_time
             elif column == self.RecipeColumns.COOK_TIME:
-                value = recipe.cooking_time
+                value = entry.cooking_time
             elif column == self.RecipeColumns.TOTAL_TIME:
-                value = recipe.total_time
+                value = entry.total_time
 
             if value:
                 return QtCore.QVariant(format_timedelta(value, threshold=2, format="narrow", locale=default_locale))
@@ -283,9 +601,9 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
         if column in (self.RecipeColumns.LAST_COOKED, self.RecipeColumns.LAST_MODIFIED):
             value = None
             if column == self.RecipeColumns.LAST_COOKED:
-                value = recipe.last_cooked
+                value = entry.last_cooked
             elif column == self.RecipeColumns.LAST_MODIFIED:
-                value = recipe.last_modified
+                value = entry.last_modified
             if value:
                 return QtCore.QVariant(format_date(value, format="short", locale=default_locale))
             else:
@@ -293,6 +611,19 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
 
         return None
 
+    def filter_counts(self, table) -> typing.Dict[int, typing.Tuple[int, int]]:
+        """
+        The number of recipes for every filter item of the table, considering the filters of the other tables
+
+        Args:
+            table (): data.Category, data.Cuisine or data.Author
+
+        Returns:
+            item id -> (number of recipes under the current filters, total number of recipes)
+        """
+
+        return self._facet_index.counts(self._session, table, self.filters)
+
     def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int = ...) -> typing.Any:
         """ Header data """
         if role == QtCore.Qt.DecorationRole and orientation == QtCore.Qt.Horizontal:
@@ -312,7 +643,8 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
 
     def recipe_at_row(self, row: int):
         """
-        Returns the recipe at the given row
+        Returns the recipe at the given row. The table itself only holds plain rows, the (ORM) recipe will be loaded
+        on demand
 
         Args:
             row (): the row
@@ -321,9 +653,26 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
 
         """
 
-        if row > self.recipes_per_page:
+        recipe_id = self.recipe_id_at_row(row)
+        if recipe_id is None:
+            return None
+        return self._session.query(data.Recipe).get(recipe_id)
+
+    def recipe_id_at_row(self, row: int) -> int:
+        """
+        Returns the recipe's id at the given row
+
+        Args:
+            row (): the row
+
+        Returns: The id or None if there's no such row
+
+        """
+
+        if row < 0 or row >= self.rowCount():
             return None
-        return self._entries[row][0]
+        entry = self._entry(row)
+        return entry.id if entry is not None else None
 
     def rowCount(self, parent: QtCore.QModelIndex = ...) -> int:
         if self.number_of_filtered_recipes < self.recipes_per_page:
@@ -346,15 +695,12 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
         if column not in self.sortable_columns:
             return
 
-        sort_entry = None
         if column in self.__sort_criteria:
-            crit, is_string = self.__sort_criteria[column]
-            sort_entry = crit
-            if is_string:
-                sort_entry = func.lower(crit)
+            sort_entry = self.__sort_criteria[column]
         else:
             return
 
+        self.__sort_column = column
         if order == QtCore.Qt.AscendingOrder:
             self.__order_by = sort_entry.asc()
         elif order == QtCore.Qt.DescendingOrder:
@@ -362,13 +708,82 @@ class RecipeTableModel(QtCore.QAbstractTableModel):
 
         self.update_model()
 
+    def set_column_visible(self, column: int, visible: bool) -> bool:
+        """
+        The view shows (or hides) a column. Hidden columns won't be queried
+
+        Args:
+            column (): The column
+            visible (): Shown or hidden
+
+        Returns:
+            True, if the model has to be reloaded to fetch the column's data
+        """
+
+        column = self.RecipeColumns(column)
+        if visible:
+            reload = column not in self.visible_columns
+            self.visible_columns.add(column)
+        else:
+            # No need to reload, the data is just not displayed anymore. The next query won't fetch it
+            reload = False
+            self.visible_columns.discard(column)
+        return reload
+
+    def query_worker_jobFailed(self, ticket: int, error: Exception):
+        if ticket != self._ticket:
+            return
+        # Not run again on the model's session: it would probably fail again - inside a slot
+        self._ticket = None
+        self._job = None
+        self.entriesFailed.emit(error)
+
+    def query_worker_jobFinished(self, ticket: int, result: tuple):
+        if ticket != self._ticket:
+            # Outdated
+            return
+        self._ticket = None
+        self.beginResetModel()
+        self._set_entries(result)
+        self.endResetModel()
+        self.entriesUpdated.emit()
+
+    def thumbnail_cache_thumbnailReady(self, image_id: int, height: int, thumbnail: QtGui.QImage):
+        """ Repaint the rows showing the image """
+        for first_row, entries in self._loaded_entries():
+            for position, entry in enumerate(entries):
+                if entry.thumbnail_id == image_id:
+                    index = self.index(first_row + position, self.RecipeColumns.THUMBNAIL)
+                    self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    @property
+    def updating(self) -> bool:
+        """ Are the entries being read in the background? """
+        return self._ticket is not None
+
     def update_model(self):
         """
         A new filter has been applied, sort order has been changed..
 
+        The queries are run by the query worker (if there's one). The current entries stay until the new ones have
+        been read, entriesUpdated is emitted as soon as they're there. Changes the worker's session wouldn't see yet
+        (not committed) force the queries to be run on the model's session.
+
         Returns:
 
         """
+
+        self.__flush()
+        self._recipe_changes.take()
+        self.__search_titles()
+        self._job = self._entries_job(self.offset, self.recipes_per_page)
+        if self.query_worker is not None and not db.has_uncommitted_changes(self._session):
+            self._ticket = self.query_worker.submit(self._job)
+            return
+
+        # An outdated background job's result will be dropped
+        self._ticket = None
         self.beginResetModel()
-        self.__setup_entries()
+        self._set_entries(self._job(self._session))
         self.endResetModel()
+        self.entriesUpdated.emit()
@@ -20,11 +20,12 @@
 import typing
 
 from PyQt5 import Qt, QtCore
-from sqlalchemy import func, orm
+from sqlalchemy import orm
 
 from qisit import translate
 from qisit.core import db
 from qisit.core.db import data
+from qisit.core.db.reference_data import ReferenceData
 from qisit.core.util import nullify
 
 
@@ -47,18 +48,34 @@ class DBComboBoxModel(QtCore.QAbstractListModel):
         self._session = db_session
         self._database_table = table
         self._items = []
+        # The items' names. After a commit the items are expired, reading their names would cost one query per item
+        self._names = []
+        # The version of the reference data displayed
+        self._version = None
 
         # This is a hack to allow NULL/None values in the combobox (i.e. let the user delete cuisine or author)
         # The first value in the combobox's list is the "empty the box/set index=1-value"
         _translate = translate
         self._text_none = [(_translate("QisitComboBoxModel", "- None -")), ]
 
+    def _take_entries(self):
+        """ Takes the table's list from the reference data """
+        reference_data = ReferenceData.for_session(self._session)
+        entries = reference_data.entries(self._session, self._database_table)
+        self._items = self._text_none + [entry.item for entry in entries]
+        self._names = self._text_none + [entry.name for entry in entries]
+        self._version = reference_data.version(self._database_table)
+
+    def _is_current(self) -> bool:
+        """ True if the model displays the current version of the table """
+        return self._version == ReferenceData.for_session(self._session).version(self._database_table)
+
     def data(self, index: QtCore.QModelIndex, role: int = ...) -> typing.Any:
         row = index.row()
         if role not in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
             return
         else:
-            return str(self._items[row])
+            return self._names[row]
 
     def index_of_item(self, item: db.Base):
         """
@@ -99,14 +116,16 @@ class DBComboBoxModel(QtCore.QAbstractListModel):
 
     def reload_model(self):
         """
-        Reloads the model
+        Reloads the model - if the table has changed since it has been loaded
 
         Returns:
 
         """
+
+        if self._is_current():
+            return
         super().beginResetModel()
-        self._items = self._text_none + self._session.query(self._database_table).order_by(
-            func.lower(self._database_table.name)).all()
+        self._take_entries()
         super().endResetModel()
 
     def rowCount(self, parent: QtCore.QModelIndex = ...) -> int:
@@ -126,6 +145,27 @@ class DBComboBoxModel(QtCore.QAbstractListModel):
         self.reload_model()
         return True
 
+    def update_model(self):
+        """
+        Updates the (loaded) model if the table has changed. Instead of resetting the model (which would make the
+        combobox lose its current item) the layout is changed, moving the persistent indexes along
+
+        Returns:
+
+        """
+
+        if not self._items or self._is_current():
+            return
+
+        self.layoutAboutToBeChanged.emit()
+        old_items = self._items
+        self._take_entries()
+        rows = {id(item): row for row, item in enumerate(self._items)}
+        for index in self.persistentIndexList():
+            row = rows.get(id(old_items[index.row()]), -1) if index.row() < len(old_items) else -1
+            self.changePersistentIndex(index, self.index(row, 0) if row >= 0 else QtCore.QModelIndex())
+        self.layoutChanged.emit()
+
 
 class UnitComboBoxModel(QtCore.QStringListModel):
     """ The Unit's ComboBox model """
@@ -142,6 +182,8 @@ class UnitComboBoxModel(QtCore.QStringListModel):
         """
 
         self.session = db_session
+        # The version of the reference data displayed
+        self._version = None
 
         super(UnitComboBoxModel, self).__init__()
         # self.reload_model()
@@ -154,11 +196,11 @@ class UnitComboBoxModel(QtCore.QStringListModel):
 
         """
 
-        if len(data.IngredientUnit.unit_dict) == 0:
-            data.IngredientUnit.update_unit_dict(self.session)
-
-        units = sorted(data.IngredientUnit.unit_dict, key=str.casefold)
-        super().setStringList(units)
+        reference_data = ReferenceData.for_session(self.session)
+        if self._version == reference_data.version(data.IngredientUnit):
+            return
+        super().setStringList(reference_data.unit_names(self.session))
+        self._version = reference_data.version(data.IngredientUnit)
 
     def setData(self, index: QtCore.QModelIndex, value: typing.Any, role: int = ...) -> bool:
         unitname = nullify(value)
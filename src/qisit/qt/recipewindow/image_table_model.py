@@ -26,6 +26,7 @@ from sqlalchemy import orm
 from qisit import translate
 from qisit.core.db import data
 from qisit.core.util import nullify
+from qisit.qt.misc.thumbnail_cache import ThumbnailCache
 
 
 class ImageTableModel(QtGui.QStandardItemModel):
@@ -37,11 +38,16 @@ class ImageTableModel(QtGui.QStandardItemModel):
     beginReordering = QtCore.pyqtSignal()
     """ Emitted when a drop took place """
 
+    image_id_role = QtCore.Qt.UserRole + 1
+    """ The image's id (for replacing the thumbnail by a sharper one) """
+
     def __init__(self, session: orm.Session, recipe: data.Recipe):
         super().__init__()
         self._session = session
         self._recipe = recipe
         self.__editable = False
+        self._thumbnail_cache = ThumbnailCache.for_session(session)
+        self._thumbnail_cache.thumbnailReady.connect(self.thumbnail_cache_thumbnailReady)
 
     @property
     def editable(self) -> bool:
@@ -87,10 +93,13 @@ class ImageTableModel(QtGui.QStandardItemModel):
                 return QtCore.QVariant(__translate("RecipeWindow", "Description"))
         return None
 
-    def load_model(self):
+    def load_model(self, thumbnails: typing.List[QtGui.QImage] = None):
         """
         (Re)loads the model
 
+        Args:
+            thumbnails (): The already decoded thumbnails of the recipe's images (see RecipePreloader)
+
         Returns:
 
         """
@@ -98,7 +107,8 @@ class ImageTableModel(QtGui.QStandardItemModel):
 
         imagelist_row = 0
         for imagelist_entry in self._recipe.imagelist:
-            new_row = self.setup_row(imagelist_entry)
+            thumbnail = thumbnails[imagelist_row] if thumbnails and imagelist_row < len(thumbnails) else None
+            new_row = self.setup_row(imagelist_entry, thumbnail)
             new_row[self.ImageTableColumns.IMAGE].setData(imagelist_row, QtCore.Qt.UserRole)
             self.appendRow(new_row)
             imagelist_row += 1
@@ -143,12 +153,14 @@ class ImageTableModel(QtGui.QStandardItemModel):
 
         return super().setData(index, value, role)
 
-    def setup_row(self, imagelist_entry: data.RecipeImage) -> typing.List[QtGui.QStandardItem]:
+    def setup_row(self, imagelist_entry: data.RecipeImage, thumbnail: QtGui.QImage = None) -> \
+            typing.List[QtGui.QStandardItem]:
         """
         Sets up a new row and fills most of the data
 
         Args:
             imagelist_entry (): The entry
+            thumbnail (): The entry's thumbnail, if it's already been decoded
 
         Returns:
 
@@ -157,11 +169,25 @@ class ImageTableModel(QtGui.QStandardItemModel):
         new_row = [QtGui.QStandardItem() for column in self.ImageTableColumns]
         defaultflags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsDragEnabled
 
-        image = QtGui.QPixmap()
-        image.loadFromData(imagelist_entry.thumbnail)
+        if thumbnail is not None:
+            image = QtGui.QPixmap.fromImage(thumbnail)
+        else:
+            image = QtGui.QPixmap()
+            image.loadFromData(imagelist_entry.thumbnail)
+
+        size = image.size()
+        # HiDPI screens: a thumbnail derived from the image, if it's already available
+        pixel_ratio = ThumbnailCache.device_pixel_ratio()
+        if pixel_ratio > 1.0:
+            derived = self._thumbnail_cache.thumbnail(imagelist_entry.id, imagelist_entry.thumbnail,
+                                                      round(size.height() * pixel_ratio))
+            if derived is not None:
+                image = QtGui.QPixmap.fromImage(derived)
+                image.setDevicePixelRatio(pixel_ratio)
 
         new_row[self.ImageTableColumns.IMAGE].setData(image, QtCore.Qt.DecorationRole)
-        new_row[self.ImageTableColumns.IMAGE].setData(image.size(), QtCore.Qt.SizeHintRole)
+        new_row[self.ImageTableColumns.IMAGE].setData(size, QtCore.Qt.SizeHintRole)
+        new_row[self.ImageTableColumns.IMAGE].setData(imagelist_entry.id, self.image_id_role)
         new_row[self.ImageTableColumns.IMAGE].setFlags(defaultflags | QtCore.Qt.ItemIsDropEnabled)
 
         new_row[self.ImageTableColumns.DESCRIPTION].setData(imagelist_entry.description, QtCore.Qt.DisplayRole)
@@ -171,3 +197,14 @@ class ImageTableModel(QtGui.QStandardItemModel):
             new_row[self.ImageTableColumns.DESCRIPTION].setFlags(defaultflags)
 
         return new_row
+
+    def thumbnail_cache_thumbnailReady(self, image_id: int, height: int, thumbnail: QtGui.QImage):
+        """ Replace the image's thumbnail by the sharper one """
+        pixel_ratio = ThumbnailCache.device_pixel_ratio()
+        for row in range(0, self.rowCount(self.invisibleRootItem().index())):
+            image_item = self.item(row, self.ImageTableColumns.IMAGE)
+            if image_item.data(self.image_id_role) == image_id and \
+                    round(image_item.data(QtCore.Qt.SizeHintRole).height() * pixel_ratio) == height:
+                image = QtGui.QPixmap.fromImage(thumbnail)
+                image.setDevicePixelRatio(pixel_ratio)
+                image_item.setData(image, QtCore.Qt.DecorationRole)
@@ -16,19 +16,31 @@
 #   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
 
 import math
+import typing
 from datetime import datetime
 
 from PyQt5 import Qt, QtCore, QtGui, QtWidgets
 from babel.dates import format_timedelta
-from sqlalchemy import func, orm
+from babel.numbers import format_percent
+from sqlalchemy import orm
 
 from qisit import translate
 from qisit.core import default_locale
 from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.core.db.recipe_loader import load_recipe
+from qisit.core.db.reference_data import ReferenceData
+from qisit.core.db.similarity_index import SimilarityIndex
 from qisit.core.util import nullify, zero_to_none
 from qisit.qt import misc
+from qisit.qt.misc.image_ingestion import ImageIngestion
+from qisit.qt.misc.image_loader import ImageLoader
 from qisit.qt.misc.ingredient_completer import IngredientCompleter
 from qisit.qt.misc.lstrip_validator import LStripValidator
+from qisit.qt.misc.markdown_cache import MarkdownCache
+from qisit.qt.misc.recipe_preloader import RecipePreloader
+from qisit.qt.misc.similarity_loader import SimilarityLoader
+from qisit.qt.misc.thumbnail_cache import ThumbnailCache
 from qisit.qt.recipewindow.combobox_model import DBComboBoxModel, UnitComboBoxModel
 from qisit.qt.recipewindow.delegate import AmountDelegate, EditorDelegate
 from qisit.qt.recipewindow.image_table_model import ImageTableModel
@@ -66,7 +78,17 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
     recipeChanged = QtCore.pyqtSignal(data.Recipe)
     """ Emitted after the recipe has been saved so the recipe list (and categories, cuisine, and so on) can reload  """
 
-    def __init__(self, session: orm.Session, recipe: data.Recipe, new_recipe: bool = False):
+    similarRecipeSelected = QtCore.pyqtSignal(data.Recipe)
+    """ Emitted when one of the similar recipes has been selected - the recipe list opens it """
+
+    similar_recipes_limit = 10
+    """ How many similar recipes are offered """
+
+    window_icon_height = 128
+    """ The height of the (larger) window icon """
+
+    def __init__(self, session: orm.Session, recipe: data.Recipe, new_recipe: bool = False,
+                 preloaded: RecipePreloader.Preloaded = None, similarity_loader: SimilarityLoader = None):
         """
         Init.
 
@@ -74,12 +96,24 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
             session (): The database session
             recipe (): The recipe
             new_recipe (): The recipe in question is new. This is important when closing the window.
+            preloaded (): The recipe prepared in the background (see RecipePreloader), if any
+            similarity_loader (): Loads the index of the similar recipes in the background. If None it's loaded when
+                the similar recipes are needed
 
         """
         super().__init__()
         super(QtWidgets.QMainWindow, self).__init__()
         self._recipe = recipe
         self._session = session
+        self._similarity_loader = similarity_loader
+        if preloaded is None and not new_recipe:
+            # Everything the window displays at once, instead of lazy loading relationship after relationship
+            load_recipe(self._session, recipe.id)
+
+        # The preloaded thumbnails are used once, when the window opens
+        self._preloaded_thumbnails = preloaded.thumbnails if preloaded else None
+        # The texts the markdown TextEdits display
+        self._markdown_texts = {}
         self._translate = translate
         self.__editable = False
         # Workaround for saving UI elements (yes, really)
@@ -103,14 +137,27 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
 
         self._lstrip_validator = LStripValidator()
         self._category_button_menu = QtWidgets.QMenu()
+        self._similar_recipes_menu = QtWidgets.QMenu()
 
         self._image_table_model = ImageTableModel(session=self._session, recipe=self._recipe)
+        # Added images are scaled and encoded in the background
+        self._image_ingestion = ImageIngestion(self)
+        # The image label's image is decoded in the background, only as large as the label
+        self._image_loader = ImageLoader.shared()
+        self._image_label_data = None
+        self._image_label_key = None
+        self._image_label_size = None
+        # The label of the full size view (see actionFull_Size_triggered)
+        self._full_size_label = None
+        # A larger thumbnail for the window icon (task bar, window switcher)
+        self._thumbnail_cache = ThumbnailCache.for_session(self._session)
+        self._thumbnail_cache.thumbnailReady.connect(self.thumbnail_cache_thumbnailReady)
         self._ingredient_treeview_model = IngredientTreeViewModel(self._recipe)
 
         self.setupUi(self)
 
         self._amount_delegate = AmountDelegate()
-        self._popup_completer = IngredientCompleter(self._session)
+        self._popup_completer = IngredientCompleter(self._session, fuzzy=True)
         self._inline_completer = IngredientCompleter(self._session)
         self._inline_completer.setCompletionMode(QtWidgets.QCompleter.InlineCompletion)
 
@@ -122,6 +169,9 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         self.load_data()
         self.editable = self.__new_recipe
 
+        ChangeBus.for_session(self._session).subscribe(self._data_changed, data.Author, data.Category, data.Cuisine,
+                                                       data.YieldUnitName, data.IngredientUnit, data.Ingredient)
+
     def _clear_new_ingredient(self):
         """
         Clears the new ingredient input fields
@@ -134,6 +184,46 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         self.newIngredientAmountEditor.unitComboBox.setCurrentIndex(0)
         self.isGroupCheckBox.setChecked(False)
 
+    def _data_changed(self, changes: typing.List[ChangeBus.Change]):
+        """
+        Authors, cuisines, units... have been changed (by this or another window, see ChangeBus). The comboboxes
+        take the updated lists from the reference data, the completers apply the changes
+
+        Args:
+            changes (): The changes
+
+        Returns:
+
+        """
+
+        tables = {change.table for change in changes}
+        for table, model, combobox, attribute in (
+                (data.Author, self._author_combobox_model, self.authorComboBox, "author"),
+                (data.Cuisine, self._cuisine_combobox_model, self.cuisineComboBox, "cuisine"),
+                (data.YieldUnitName, self._yield_combobox_model, self.yieldsComboBox, "yield_unit_name")):
+            if table not in tables:
+                continue
+            # The recipe doesn't change, so the combobox mustn't tell it otherwise
+            combobox.blockSignals(True)
+            model.update_model()
+            if any(change.table is table and change.kind == ChangeBus.RESET for change in changes):
+                # The model has been reset, the current item is lost
+                item = getattr(self._recipe, attribute)
+                index = model.index_of_item(item) if item else None
+                combobox.setCurrentIndex(-1 if index is None else index)
+            combobox.blockSignals(False)
+
+        if data.Category in tables:
+            self._set_category_button_menu()
+
+        if data.IngredientUnit in tables:
+            self._unit_combobox_model.reload_model()
+
+        if data.Ingredient in tables:
+            ingredient_changes = [change for change in changes if change.table is data.Ingredient]
+            self._inline_completer.apply_changes(ingredient_changes)
+            self._popup_completer.apply_changes(ingredient_changes)
+
     def _enable_comboboxes(self, enabled: bool = True):
         """
         Activates/Deactivates the ComboBoxes
@@ -225,7 +315,7 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
     def _load_image_group(self):
         """ Set up the image group """
 
-        self._image_table_model.load_model()
+        self._image_table_model.load_model(self._preloaded_thumbnails)
         number_of_images = len(self._recipe.imagelist)
 
         # No images - nothing to do
@@ -246,7 +336,15 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         for plain_edit, markdown_edit in ((self.descriptionPlainTextEdit, self.descriptionMarkDownTextEdit),
                                           (self.instructionsPlainTextEdit, self.instructionsMarkdownTextEdit),
                                           (self.notesPlainTextEdit, self.notesMarkdownTextEdit)):
-            markdown_edit.setMarkdown(plain_edit.toPlainText())
+            text = plain_edit.toPlainText()
+            # Only changed texts are rendered again
+            if self._markdown_texts.get(markdown_edit) == text:
+                continue
+            # The edit becomes the document's owner (and deletes its previous one)
+            document = MarkdownCache.shared().document(text, markdown_edit)
+            document.setDefaultFont(markdown_edit.document().defaultFont())
+            markdown_edit.setDocument(document)
+            self._markdown_texts[markdown_edit] = text
 
     def _load_ui_states(self):
         """
@@ -313,23 +411,72 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
 
         """
 
-        categories = self._session.query(data.Category).order_by(func.lower(data.Category.name)).all()
+        categories = ReferenceData.for_session(self._session).entries(self._session, data.Category)
         menu = self._category_button_menu
 
         menu.clear()
         # The top action is adding a new category. After that all existing categories will be added to the menu
         menu.addAction(self.actionNew_Category)
         menu.addSeparator()
-        for category in categories:
+        recipe_categories = set(self._recipe.categories)
+        for category, name in ((entry.item, entry.name) for entry in categories):
             category_action = QtWidgets.QAction(parent=self.catgoriesButton)
-            category_action.setText(str(category))
+            category_action.setText(name)
             category_action.setCheckable(True)
             category_action.setEnabled(True)
             category_action.triggered.connect(lambda enabled, cat=category: self.actionCategory_triggered(cat, enabled))
-            if category in self._recipe.categories:
+            if category in recipe_categories:
                 category_action.setChecked(True)
             menu.addAction(category_action)
 
+    def _set_similar_recipes_menu(self):
+        """
+        Sets the menu of the recipes similar to this one. It's computed each time the menu is shown - the other
+        recipes might have been changed in the meantime
+
+        Returns:
+
+        """
+
+        menu = self._similar_recipes_menu
+        menu.clear()
+
+        if self._similarity_loader is not None and not self._similarity_loader.load():
+            # The menu is filled once the index has been loaded
+            searching_action = menu.addAction(self._translate("RecipeWindow", "Searching for similar recipes..."))
+            searching_action.setEnabled(False)
+            return
+
+        similar = SimilarityIndex.for_session(self._session).similar(self._session, self._recipe.id,
+                                                                     limit=self.similar_recipes_limit)
+        recipes = {recipe.id: recipe for recipe in self._session.query(data.Recipe).filter(
+            data.Recipe.id.in_([the_similar.recipe_id for the_similar in similar]))} if similar else {}
+
+        for the_similar in similar:
+            the_recipe = recipes.get(the_similar.recipe_id)
+            if the_recipe is None:
+                continue
+            recipe_action = QtWidgets.QAction(parent=menu)
+            recipe_action.setText(self._translate("RecipeWindow", "{} ({} similar)").format(
+                the_recipe.title, format_percent(the_similar.score, locale=default_locale)))
+            recipe_action.triggered.connect(
+                lambda checked, similar_recipe=the_recipe: self.similarRecipeSelected.emit(similar_recipe))
+            menu.addAction(recipe_action)
+
+        if menu.isEmpty():
+            no_recipes_action = menu.addAction(self._translate("RecipeWindow", "No similar recipes"))
+            no_recipes_action.setEnabled(False)
+
+    def similarity_loader_indexLoaded(self):
+        if self._similar_recipes_menu.isVisible():
+            self._set_similar_recipes_menu()
+
+    def similarity_loader_indexFailed(self, error: Exception):
+        menu = self._similar_recipes_menu
+        menu.clear()
+        failed_action = menu.addAction(self._translate("RecipeWindow", "Searching failed: {}").format(error))
+        failed_action.setEnabled(False)
+
     def _set_category_line_edit(self):
         if len(self._recipe.categories) > 0:
             self.categoriesLineEdit.setText(", ".join([category.name for category in self._recipe.categories]))
@@ -382,14 +529,51 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         Returns:
 
         """
+        self._image_label_data = image
+        self._action_full_size.setEnabled(image is not None)
         if image is None:
+            self._image_label_key = None
             self.imageLabel.setPixmap(QtGui.QPixmap(":/icons/image-32.png"))
             self.imageLabel.setStatusTip(None)
         else:
-            pixmap = QtGui.QPixmap()
-            if pixmap.loadFromData(image):
-                self.imageLabel.setPixmap(pixmap)
-                self.imageLabel.setText(None)
+            self._image_label_size = self.imageLabel.maximumSize() * self.devicePixelRatioF()
+            self._image_label_key, decoded = self._image_loader.load(image, self._image_label_size)
+            if decoded is not None:
+                self._show_image_label(decoded)
+
+    def _show_full_size(self, image: typing.Optional[QtGui.QImage]):
+        """
+        Displays the image in the full size view
+
+        Args:
+            image (): The image (or None)
+
+        Returns:
+
+        """
+
+        if self._full_size_label is None or image is None or image.isNull():
+            return
+        self._full_size_label.setPixmap(QtGui.QPixmap.fromImage(image))
+        self._full_size_label.adjustSize()
+
+    def _show_image_label(self, image: QtGui.QImage):
+        """
+        Displays the decoded image in the image label
+
+        Args:
+            image (): The image
+
+        Returns:
+
+        """
+
+        if image.isNull():
+            return
+        pixmap = QtGui.QPixmap.fromImage(image)
+        pixmap.setDevicePixelRatio(self.devicePixelRatioF())
+        self.imageLabel.setPixmap(pixmap)
+        self.imageLabel.setText(None)
 
     def _set_recipe_title(self):
         """
@@ -410,10 +594,18 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         """
 
         if len(self._recipe.imagelist) > 0:
-            the_image = self._recipe.imagelist[data.RecipeImage.main_image_pos]
-            pixmap = QtGui.QPixmap()
-            pixmap.loadFromData(the_image.thumbnail)
-            self.setWindowIcon(QtGui.QIcon(pixmap))
+            if self._preloaded_thumbnails:
+                pixmap = QtGui.QPixmap.fromImage(self._preloaded_thumbnails[data.RecipeImage.main_image_pos])
+            else:
+                the_image = self._recipe.imagelist[data.RecipeImage.main_image_pos]
+                pixmap = QtGui.QPixmap()
+                pixmap.loadFromData(the_image.thumbnail)
+            icon = QtGui.QIcon(pixmap)
+            main_image = self._recipe.imagelist[data.RecipeImage.main_image_pos]
+            larger = self._thumbnail_cache.thumbnail(main_image.id, main_image.thumbnail, self.window_icon_height)
+            if larger is not None:
+                icon.addPixmap(QtGui.QPixmap.fromImage(larger))
+            self.setWindowIcon(icon)
         else:
             self.setWindowIcon(QtGui.QIcon(":/logos/qisit_128x128.png"))
 
@@ -664,6 +856,9 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
 
     def closeEvent(self, event: QtGui.QCloseEvent) -> None:
 
+        # The pool's threads mustn't outlive the window
+        self._image_ingestion.cancel(wait=True)
+
         # TODO: Ask
         if self.modified:
             # TODO: Ask!
@@ -708,6 +903,21 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
                              (self.actionSave, self.actionSave_triggered)):
             action.triggered.connect(slot)
 
+        # -------------------- Similar recipes --------------------
+        self._action_similar_recipes = QtWidgets.QAction(self)
+        self._action_similar_recipes.setText(self._translate("RecipeWindow", "Similar Recipes"))
+        self._action_similar_recipes.setToolTip(
+            self._translate("RecipeWindow", "Recipes with similar ingredients, categories and cuisine"))
+        self._action_similar_recipes.setMenu(self._similar_recipes_menu)
+        self._similar_recipes_menu.aboutToShow.connect(self._set_similar_recipes_menu)
+        if self._similarity_loader is not None:
+            self._similarity_loader.indexLoaded.connect(self.similarity_loader_indexLoaded)
+            self._similarity_loader.indexFailed.connect(self.similarity_loader_indexFailed)
+        self.menuRecipe.addSeparator()
+        self.menuRecipe.addAction(self._action_similar_recipes)
+        self.toolBar.addAction(self._action_similar_recipes)
+        self.toolBar.widgetForAction(self._action_similar_recipes).setPopupMode(QtWidgets.QToolButton.InstantPopup)
+
         # -------------------- Author /Cuisine --------------------
         for model, combobox in (
                 (self._author_combobox_model, self.authorComboBox),
@@ -729,6 +939,9 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         self.imageLabel.setMaximumSize(max_width, max_height)
 
         self.addImagesButton.clicked.connect(self.actionAdd_Image_s_triggered)
+        self._image_ingestion.imageReady.connect(self.image_ingestion_imageReady)
+        self._image_ingestion.imageFailed.connect(self.image_ingestion_imageFailed)
+        self._image_ingestion.progress.connect(self.image_ingestion_progress)
         self.deleteImagesButton.clicked.connect(self.actionDelete_Image_s_triggered)
 
         self._image_description_delegate.beginEditing.connect(self.set_modified)
@@ -738,6 +951,13 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         self.imageTableView.setItemDelegateForColumn(ImageTableModel.ImageTableColumns.DESCRIPTION,
                                                      self._image_description_delegate)
         self.imageTableView.doubleClicked.connect(self.imageTableView_doubleClicked)
+        self._image_loader.imageLoaded.connect(self.image_loader_imageLoaded)
+        self._action_full_size = QtWidgets.QAction(self._translate("RecipeWindow", "Full Size..."), self)
+        self._action_full_size.setToolTip(self._translate("RecipeWindow", "Show the image in full resolution"))
+        self._action_full_size.setEnabled(False)
+        self._action_full_size.triggered.connect(self.actionFull_Size_triggered)
+        self.imageLabel.addAction(self._action_full_size)
+        self.imageLabel.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
         self.imageTableView.selectionModel().selectionChanged.connect(self.imageTableView_selectionChanged)
         self.imageTableView.addAction(self.actionAdd_Image_s)
         self.imageTableView.addAction(self.actionDelete_Image_s)
@@ -770,6 +990,7 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         self.newIngredientAmountEditor.unitComboBox.setModel(self._unit_combobox_model)
         self.newIngredientLineEdit.setValidator(self._lstrip_validator)
         self.newIngredientLineEdit.setCompleter(self._popup_completer)
+        self.newIngredientLineEdit.textEdited.connect(self._popup_completer.update_matches)
         for checkbox in (self.isGroupCheckBox, self.optionalCheckbox, self.alternativeCheckBox):
             checkbox.clicked.connect(self.addNewIngredientCheckboxes_clicked)
 
@@ -916,6 +1137,7 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
 
         for widget in blocked_widgets:
             widget.blockSignals(False)
+        self._preloaded_thumbnails = None
 
     def revert_data(self):
         """
@@ -925,11 +1147,12 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
 
         """
 
+        self._image_ingestion.cancel()
         if self._transaction_started:
             self._session.rollback()
         self.modified = False
         self._transaction_started = False
-        self._session.refresh(self._recipe)
+        load_recipe(self._session, self._recipe.id, refresh=True)
         self._unit_combobox_model.reload_model()
         self._inline_completer.reload_model()
         self._popup_completer.reload_model()
@@ -984,7 +1207,6 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         self._transaction_started = False
         self.recipeChanged.emit(self._recipe)
 
-    @_Decorators.change
     def set_image(self, image: Qt.QImage):
         """
         Scales and sets the image (thumbnail, image)
@@ -996,47 +1218,37 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
 
         """
 
-        max_width, max_height = self.max_image_size
-
-        settings = QtCore.QSettings()
-        settings.beginGroup("preferences/images")
-        thumb_height = settings.value("thumb_height", 40)
-        jpeg_quality = settings.value("jpeg_quality", 80)
-        settings.endGroup()
+        self._append_image(ImageIngestion.encode(image, *ImageIngestion.configured_encoding()))
 
-        # 1. Scale the images
-        scaled_image = image.scaled(max_width, max_height, QtCore.Qt.KeepAspectRatio)
-        scaled_thumb = image.scaledToHeight(thumb_height)
-
-        # 2. Export the images to jpeg byte format
-        image_buffer = QtCore.QBuffer()
-        image_buffer.open(QtCore.QIODevice.ReadWrite)
-        scaled_image.save(image_buffer, "JPG", jpeg_quality)
+    @_Decorators.change
+    def _append_image(self, encoded: ImageIngestion.Encoded):
+        """
+        Appends the (scaled and encoded) image to the recipe's images
 
-        image = image_buffer.data()
+        Args:
+            encoded (): The image
 
-        # Unfortunately the buffer cannot be reused, therefore it has to be recreated
-        image_buffer.close()
+        Returns:
 
-        # Same procedure for the thumbnail
-        image_buffer = QtCore.QBuffer()
-        image_buffer.open(QtCore.QIODevice.ReadWrite)
-        scaled_thumb.save(image_buffer, "JPG", jpeg_quality)
-        thumbnail = image_buffer.data()
-        image_buffer.close()
+        """
 
-        # 3. Save the images
         position = 0
 
         if len(self._recipe.imagelist) > 0:
             last_position = self._recipe.imagelist[len(self._recipe.imagelist) - 1].position
             position = last_position + 1
 
-        new_image = data.RecipeImage(recipe=self._recipe, position=position, image=image, thumbnail=thumbnail)
+        # Workaround similar to ingredient tree: When the first image has been added to the image list
+        # The image table will behave oddly - 2 more columns and so on. This is a workaround
+        was_empty = self._image_table_model.rowCount() == 0
+        new_image = data.RecipeImage(recipe=self._recipe, position=position, image=encoded.image,
+                                     thumbnail=encoded.thumbnail)
         self._recipe.imagelist.append(new_image)
-        new_row = self._image_table_model.setup_row(new_image)
+        new_row = self._image_table_model.setup_row(new_image, encoded.thumbnail_image)
         new_row[self._image_table_model.ImageTableColumns.IMAGE].setData(position, QtCore.Qt.UserRole)
         self._image_table_model.appendRow(new_row)
+        if was_empty:
+            self._restore_image_columns()
 
     @_Decorators.change
     def set_modified(self):
@@ -1044,7 +1256,7 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         pass
 
     def actionAdd_Image_s_triggered(self, enabled: bool = False):
-        """ Open a file requester, add the images """
+        """ Open a file requester, add the images (in the background) """
 
         _translate = self._translate
         # TODO: settings / last directory
@@ -1054,21 +1266,7 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
         filenames, filter_ = Qt.QFileDialog.getOpenFileNames(self, _translate("RecipeWindow", "Select new Image"),
                                                              filter=misc.image_filter, options=options)
         if filenames:
-            # Workaround similar to ingredient tree: When the first image has been added to the image list
-            # The image table will behave oddly - 2 more columns and so on. This is a workaround
-            was_empty = self._image_table_model.rowCount() == 0
-            for the_filename in filenames:
-                image_reader = Qt.QImageReader(the_filename)
-                image = image_reader.read()
-                if image.isNull():
-                    Qt.QMessageBox.critical(self, _translate("RecipeWindow", "Error loading file"),
-                                            _translate("RecipeWindow", "Unable to read {}: {}")
-                                            .format(the_filename, image_reader.errorString()))
-                else:
-                    # modified will be handled by the method below
-                    self.set_image(image)
-            if was_empty:
-                self._restore_image_columns()
+            self._image_ingestion.add_files(filenames, *ImageIngestion.configured_encoding())
 
     @_Decorators.change
     def actionCategory_triggered(self, category: data.Category, enabled: bool):
@@ -1169,6 +1367,39 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
     def actionEdit_toggled(self, enabled: bool):
         self.editable = enabled
 
+    def actionFull_Size_triggered(self, checked: bool = False):
+        """
+        Zoom: Shows the image label's image in full resolution. It's decoded in the background, meanwhile the label's
+        image is displayed
+
+        Args:
+            checked (): ignored
+
+        Returns:
+
+        """
+
+        if self._image_label_data is None:
+            return
+
+        dialog = QtWidgets.QDialog(self)
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        dialog.setWindowTitle(self.windowTitle().replace("[*]", ""))
+        scroll_area = QtWidgets.QScrollArea(dialog)
+        scroll_area.setAlignment(QtCore.Qt.AlignCenter)
+        self._full_size_label = QtWidgets.QLabel(scroll_area)
+        scroll_area.setWidget(self._full_size_label)
+        layout = QtWidgets.QVBoxLayout(dialog)
+        layout.addWidget(scroll_area)
+        dialog.finished.connect(self.full_size_dialog_finished)
+
+        key, decoded = self._image_loader.load(self._image_label_data)
+        if decoded is None:
+            decoded = self._image_loader.cached(key, self._image_label_size)
+        self._show_full_size(decoded)
+        dialog.resize(self.size())
+        dialog.show()
+
     def actionNew_Category_triggered(self, checked: bool = False):
         """
         Add a new category
@@ -1423,6 +1654,38 @@ class RecipeWindow(recipe.Ui_RecipeWindow, QtWidgets.QMainWindow):
             self._ingredient_treeview_model.scale_amounts(factor)
             self._update_ingredient_widgets()
 
+    def image_ingestion_imageFailed(self, filename: str, error: str):
+        _translate = self._translate
+        Qt.QMessageBox.critical(self, _translate("RecipeWindow", "Error loading file"),
+                                _translate("RecipeWindow", "Unable to read {}: {}").format(filename, error))
+
+    def image_ingestion_imageReady(self, filename: str, encoded: ImageIngestion.Encoded):
+        # modified will be handled by the method below
+        self._append_image(encoded)
+
+    def image_ingestion_progress(self, done: int, total: int):
+        if done < total:
+            self.statusbar.showMessage(self._translate("RecipeWindow", "Adding images... {} of {}").format(done, total))
+        else:
+            self.statusbar.clearMessage()
+
+    def full_size_dialog_finished(self, result: int):
+        self._full_size_label = None
+
+    def image_loader_imageLoaded(self, key: str, size: typing.Optional[QtCore.QSize], image: QtGui.QImage):
+        if key != self._image_label_key:
+            # Another window's image
+            return
+        if size is None:
+            self._show_full_size(image)
+        elif size == self._image_label_size:
+            self._show_image_label(image)
+
+    def thumbnail_cache_thumbnailReady(self, image_id: int, height: int, thumbnail: QtGui.QImage):
+        if height == self.window_icon_height and self._recipe.imagelist and \
+                self._recipe.imagelist[data.RecipeImage.main_image_pos].id == image_id:
+            self._set_windowicon()
+
     def imageTableView_doubleClicked(self, index: QtCore.QModelIndex):
         """
         User has double clicked on an image
@@ -18,6 +18,11 @@
 #  You should have received a copy of the GNU General Public License
 #   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
 
+from qisit.core.db import data
+
+Entry = data.IngredientListEntry
+
+
 def cleanup(session, table_class):
     """ Empty the table """
     session.query(table_class).delete()
@@ -50,3 +55,52 @@ def add_integrity(session, test_object, exception_expected):
         session.rollback()
 
     return error
+
+
+def ingredient_position(ingredient: int, alternative: int = 0, grouped: int = 0) -> int:
+    """ The position of an ingredient in the global group (of one of its alternatives, of a grouped ingredient) """
+    return Entry.GROUP_GLOBAL * Entry.GROUP_FACTOR + ingredient * Entry.GROUP_INGREDIENT_FACTOR + alternative * \
+           Entry.GROUP_INGREDIENT_ALTERNATIVE_FACTOR + grouped
+
+
+def add_recipe(session, title: str, ingredients: list = (), categories: list = (), cuisine: data.Cuisine = None,
+               instructions: str = None) -> data.Recipe:
+    """
+    Adds a recipe (and commits)
+
+    Args:
+        session (): The session
+        title (): The title
+        ingredients (): The ingredients' names (one after the other) or tuples (name, position, optional)
+        categories (): The categories
+        cuisine (): The cuisine
+        instructions (): The instructions
+
+    Returns:
+        The recipe
+    """
+
+    recipe = data.Recipe(title=title, instructions=instructions)
+    recipe.cuisine = cuisine
+    recipe.categories.extend(categories)
+    session.add(recipe)
+    session.flush()
+    for number, ingredient in enumerate(ingredients, start=1):
+        name, position, optional = (ingredient, ingredient_position(number), False) if isinstance(
+            ingredient, str) else ingredient
+        session.add(Entry(recipe=recipe, unit=data.IngredientUnit.unit_group,
+                          ingredient=data.Ingredient.get_or_add_ingredient(session, name), optional=optional,
+                          position=position))
+    session.commit()
+    return recipe
+
+
+def add_images(session, title: str, images: list) -> data.Recipe:
+    """ Adds a recipe with the images (the first bytes are the thumbnails) and commits """
+    recipe = data.Recipe(title=title)
+    session.add(recipe)
+    session.flush()
+    for position, image in enumerate(images):
+        recipe.imagelist.append(data.RecipeImage(recipe, position=position, image=image, thumbnail=image[:4]))
+    session.commit()
+    return recipe
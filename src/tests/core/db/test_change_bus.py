@@ -0,0 +1,115 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from . import cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    yield
+    db_session.info.pop(ChangeBus._info_key, None)
+    for table in (data.Recipe, data.Author, data.Cuisine):
+        cleanup(db_session, table)
+
+
+class Subscriber(object):
+    def __init__(self):
+        self.changes = []
+
+    def notify(self, changes: list):
+        self.changes.extend(changes)
+
+    def take(self) -> set:
+        changes = {(change.table, change.kind, change.ids) for change in self.changes}
+        self.changes = []
+        return changes
+
+
+def test_publish(db_session):
+    bus = ChangeBus.for_session(db_session)
+    authors = Subscriber()
+    bus.subscribe(authors.notify, data.Author)
+    everything = Subscriber()
+    bus.subscribe(everything.notify)
+
+    author = data.Author(name="Grandma")
+    db_session.add_all([author, data.Cuisine(name="Indian")])
+    db_session.flush()
+    bus.deliver()
+    # Not yet committed
+    assert authors.take() == set()
+
+    db_session.commit()
+    bus.deliver()
+    assert authors.take() == {(data.Author, ChangeBus.INSERT, frozenset([author.id]))}
+    assert {change[0] for change in everything.take()} == {data.Author, data.Cuisine}
+
+    author.name = "Granny"
+    db_session.commit()
+    db_session.delete(author)
+    db_session.commit()
+    bus.deliver()
+    assert authors.take() == {(data.Author, ChangeBus.UPDATE, frozenset([author.id])),
+                              (data.Author, ChangeBus.DELETE, frozenset([author.id]))}
+
+    # Gone subscribers are forgotten
+    del everything
+    assert len(bus._subscribers) == 2
+    bus.add(data.Author, ChangeBus.RESET)
+    db_session.commit()
+    bus.deliver()
+    assert len(bus._subscribers) == 1
+
+
+def test_rollback(db_session):
+    bus = ChangeBus.for_session(db_session)
+    authors = Subscriber()
+    bus.subscribe(authors.notify, data.Author)
+
+    # A savepoint is committed, then the transaction is rolled back
+    db_session.begin_nested()
+    db_session.add(data.Author(name="Grandma"))
+    db_session.commit()
+    bus.deliver()
+    assert {kind for table, kind, ids in authors.take()} == {ChangeBus.INSERT}
+
+    db_session.rollback()
+    bus.deliver()
+    assert authors.take() == {(data.Author, ChangeBus.RESET, frozenset())}
+
+    # Nothing to reset
+    db_session.rollback()
+    bus.deliver()
+    assert authors.take() == set()
+
+
+def test_scheduler(db_session):
+    scheduled = []
+    ChangeBus.scheduler = scheduled.append
+    try:
+        bus = ChangeBus.for_session(db_session)
+        db_session.add(data.Author(name="Grandma"))
+        db_session.commit()
+        db_session.add(data.Author(name="Granny"))
+        db_session.commit()
+        assert scheduled == [bus.deliver]
+    finally:
+        ChangeBus.scheduler = None
@@ -0,0 +1,124 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.duplicate_finder import DuplicateFinder
+from . import add_recipe, cleanup
+
+_INSTRUCTIONS = "Preheat the oven to 180 degrees. Mix the flour, the sugar and the eggs, add the melted butter " \
+                "and the cocoa. Pour the batter into a greased pan and bake for 40 minutes."
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    # Other tests might have detached the group unit
+    data.IngredientUnit.update_unit_dict(db_session)
+    yield
+    for table in (data.Recipe, data.Ingredient, data.IngredientListEntry, data.Category):
+        cleanup(db_session, table)
+
+
+def _signatures(session) -> dict:
+    return {recipe_id: signature for recipe_id, signature in
+            session.query(data.RecipeSignature.recipe_id, data.RecipeSignature.signature)}
+
+
+def test_signature():
+    """ Equal sets have equal signatures, the similarity estimates the Jaccard similarity """
+
+    shingles = DuplicateFinder.shingles("Chocolate Cake", ["flour", "sugar", "eggs", "butter", "cocoa"],
+                                        _INSTRUCTIONS)
+    assert "t:chocolate" in shingles
+    assert "i:eggs" in shingles
+    assert "x:preheat the oven" in shingles
+
+    signature = DuplicateFinder.signature(shingles)
+    assert len(signature) == DuplicateFinder.signature_size * 4
+    assert DuplicateFinder.signature(set(shingles)) == signature
+    assert DuplicateFinder.similarity(signature, signature) == 1.0
+    assert DuplicateFinder.similarity(signature, DuplicateFinder.signature({"t:pizza"})) < 0.2
+    assert DuplicateFinder.signature(set()) is None
+
+
+def test_clusters(db_session):
+    """ Re-imported recipes with small changes end up in the same cluster """
+
+    ingredients = ["flour", "sugar", "eggs", "butter", "cocoa"]
+    cake = add_recipe(db_session, "Chocolate Cake", ingredients, instructions=_INSTRUCTIONS)
+    reimported = add_recipe(db_session, "Chocolate cake!", ingredients, instructions=_INSTRUCTIONS)
+    edited = add_recipe(db_session, "Chocolate Cake", ingredients,
+                        instructions=_INSTRUCTIONS.replace("40", "45"))
+    add_recipe(db_session, "Pizza", ["flour", "yeast", "tomatoes", "cheese"],
+               instructions="Knead the dough, let it rise.")
+
+    finder = DuplicateFinder()
+    assert finder.clusters(db_session) == [[cake.id, reimported.id, edited.id]]
+    assert len(_signatures(db_session)) == 4
+    assert finder.update_signatures(db_session) == 0
+
+
+def test_invalidation(db_session):
+    """ Changes of title, instructions or ingredients delete the signature """
+
+    cake = add_recipe(db_session, "Chocolate Cake", ["flour", "sugar"], instructions=_INSTRUCTIONS)
+    pizza = add_recipe(db_session, "Pizza", ["flour", "yeast"], instructions="Knead the dough")
+    finder = DuplicateFinder()
+    finder.update_signatures(db_session)
+
+    cake.rating = 5
+    db_session.commit()
+    assert set(_signatures(db_session)) == {cake.id, pizza.id}
+
+    cake.instructions = "Buy one"
+    db_session.commit()
+    assert set(_signatures(db_session)) == {pizza.id}
+
+    finder.update_signatures(db_session)
+    yeast = db_session.query(data.Ingredient).filter(data.Ingredient.name == "yeast").one()
+    yeast.name = "dry yeast"
+    db_session.commit()
+    assert set(_signatures(db_session)) == {cake.id}
+
+
+def test_merge(db_session):
+    """ The target gets the categories and images of the merged recipes """
+
+    cake, other_cake, third_cake = (add_recipe(db_session, title, ["flour", "sugar"], instructions=_INSTRUCTIONS)
+                                    for title in ("Cake", "Cake!", "Chocolate Cake"))
+    baking, dessert, chocolate = (data.Category(name=name) for name in ("Baking", "Dessert", "Chocolate"))
+    cake.categories.append(baking)
+    other_cake.categories.extend([baking, dessert, chocolate])
+    third_cake.categories.extend([dessert, chocolate])
+    db_session.add(data.RecipeImage(cake, position=0, image=b"cake", thumbnail=b"cake"))
+    db_session.add(data.RecipeImage(other_cake, position=0, image=b"other", thumbnail=b"other"))
+    for position in range(2):
+        db_session.add(data.RecipeImage(third_cake, position=position, image=b"third", thumbnail=b"third"))
+    db_session.commit()
+    cake_id, other_cake_id, third_cake_id = cake.id, other_cake.id, third_cake.id
+
+    DuplicateFinder.merge(db_session, cake_id, [third_cake_id, other_cake_id, cake_id])
+    db_session.commit()
+
+    assert [recipe.id for recipe in db_session.query(data.Recipe)] == [cake_id]
+    cake = db_session.query(data.Recipe).get(cake_id)
+    assert sorted(category.name for category in cake.categories) == ["Baking", "Chocolate", "Dessert"]
+    assert [(image.position, image.image) for image in cake.imagelist] == [
+        (0, b"cake"), (1, b"third"), (2, b"third"), (3, b"other")]
+    assert db_session.query(data.IngredientListEntry).filter(
+        data.IngredientListEntry.recipe_id != cake_id).count() == 0
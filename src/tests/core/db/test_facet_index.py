@@ -0,0 +1,115 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.facet_index import FacetIndex, bitset, popcount
+from . import cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    yield
+    for table in (data.Recipe, data.Category, data.Author, data.Cuisine):
+        cleanup(db_session, table)
+
+
+def _setup_recipes(session) -> list:
+    """ 10 recipes, two categories, every third recipe is Indian """
+    recipes = []
+    for number in range(10):
+        recipe = data.Recipe(title=f"Recipe {number}")
+        recipe.categories.append(data.Category.get_or_add_category(session, f"Category {number % 2}"))
+        if number % 3 == 0:
+            recipe.cuisine = data.Cuisine.get_or_add_cusine(session, "Indian")
+        session.add(recipe)
+        recipes.append(recipe)
+    session.commit()
+    return recipes
+
+
+def _id(session, table, name: str) -> int:
+    return session.query(table.id).filter(table.name == name).scalar()
+
+
+def test_bitset():
+    assert bitset([]) == 0
+    assert bitset([0, 3, 9]) == 0b1000001001
+    assert popcount(bitset(range(100, 200))) == 100
+
+
+def test_counts(db_session):
+    """ Counts under the current filters """
+
+    _setup_recipes(db_session)
+    index = FacetIndex.for_session(db_session)
+    indian = _id(db_session, data.Cuisine, "Indian")
+    category_0 = _id(db_session, data.Category, "Category 0")
+    category_1 = _id(db_session, data.Category, "Category 1")
+
+    assert index.counts(db_session, data.Cuisine) == {indian: (4, 4)}
+
+    filters = {data.Category: {category_0}, data.Cuisine: set(), data.Author: set()}
+    assert index.counts(db_session, data.Cuisine, filters) == {indian: (2, 4)}
+    # The category's own filter is ignored
+    assert index.counts(db_session, data.Category, filters) == {category_0: (5, 5), category_1: (5, 5)}
+    assert index.count(db_session, filters) == 5
+
+    filters[data.Cuisine].add(indian)
+    assert index.count(db_session, filters) == 2
+    assert index.counts(db_session, data.Category, filters) == {category_0: (2, 5), category_1: (2, 5)}
+
+
+def test_incremental_update(db_session):
+    """ The index follows the flushes without being reloaded """
+
+    recipes = _setup_recipes(db_session)
+    index = FacetIndex.for_session(db_session)
+    index.load(db_session)
+    indian = _id(db_session, data.Cuisine, "Indian")
+
+    recipes[1].cuisine = recipes[0].cuisine
+    db_session.delete(recipes[0])
+    new_recipe = data.Recipe(title="New")
+    new_recipe.cuisine = recipes[1].cuisine
+    db_session.add(new_recipe)
+    db_session.commit()
+
+    assert not index.stale
+    assert index.counts(db_session, data.Cuisine) == {indian: (5, 5)}
+    assert index.count(db_session) == 10
+
+    db_session.delete(recipes[1].cuisine)
+    db_session.commit()
+    assert index.counts(db_session, data.Cuisine) == {}
+
+
+def test_stale(db_session):
+    """ Bulk updates can't be tracked, the index will be reloaded """
+
+    _setup_recipes(db_session)
+    index = FacetIndex.for_session(db_session)
+    index.load(db_session)
+    author = data.Author.get_or_add_author(db_session, "Grandma")
+    db_session.commit()
+
+    db_session.query(data.Recipe).update({data.Recipe.author_id: author.id}, synchronize_session=False)
+    db_session.commit()
+    assert index.stale
+    assert index.counts(db_session, data.Author) == {author.id: (10, 10)}
+    assert not index.stale
@@ -0,0 +1,115 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+
+import pytest
+import sqlalchemy as sql
+
+from qisit.core.db import data
+from qisit.core.db.image_store import ImageStore
+from . import add_images, cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    # The recipes' ids are reused
+    db_session.expunge_all()
+    yield
+    ImageStore.active = None
+    cleanup(db_session, data.Recipe)
+
+
+def test_store(db_session, tmp_path):
+    store = ImageStore(str(tmp_path), mmap_threshold=8)
+    ImageStore.active = store
+    curry = add_images(db_session, "Curry", [b"large image", b"another image"])
+    soup = add_images(db_session, "Soup", [b"large image"])
+
+    # Identical images are stored once. The database holds the references
+    assert len(store.digests()) == 4
+    raw = db_session.execute(sql.select([sql.type_coerce(data.RecipeImage.image, sql.LargeBinary)])).fetchall()
+    assert all(ImageStore.is_reference(image) for image, in raw)
+    assert ImageStore.reference_counts(db_session)[ImageStore.digest(store.put(b"large image"))] == 2
+
+    db_session.expire_all()
+    image = soup.imagelist[0].image
+    assert isinstance(image, memoryview) and image == b"large image"
+    assert curry.imagelist[0].thumbnail == b"larg"
+
+    # No longer referenced blobs are removed
+    db_session.delete(curry)
+    db_session.commit()
+    assert len(store.digests()) == 2
+    db_session.delete(soup)
+    db_session.commit()
+    assert store.digests() == set()
+
+
+def test_migrate(db_session, tmp_path):
+    add_images(db_session, "Curry", [b"large image", b"another image"])
+    add_images(db_session, "Soup", [b"large image"])
+
+    store = ImageStore(str(tmp_path))
+    ImageStore.active = store
+    assert store.migrate(db_session, batch_size=2) == (6, 3 * 4 + 2 * 11 + 13)
+    assert len(store.digests()) == 4
+    assert os.path.isfile(store.path(ImageStore.digest(store.put(b"another image"))))
+    # Nothing left
+    assert store.migrate(db_session) == (0, 0)
+
+    db_session.expire_all()
+    assert sorted(bytes(image.image) for image in db_session.query(data.RecipeImage)) == \
+           [b"another image", b"large image", b"large image"]
+
+
+def test_collect_dereferenced(db_session, tmp_path):
+    """ After a transaction only the blobs it no longer references are checked """
+
+    def digest(blob: bytes) -> str:
+        return hashlib.sha256(blob).hexdigest()
+
+    store = ImageStore(str(tmp_path))
+    ImageStore.active = store
+    curry = add_images(db_session, "Curry", [b"curry image"])
+    soup = add_images(db_session, "Soup", [b"soup image", b"shared image"])
+    stew = add_images(db_session, "Stew", [b"shared image"])
+    # Not referenced by any row, but no transaction has dereferenced it
+    orphan = ImageStore.digest(store.put(b"orphan"))
+
+    # Query.update() of the blobs
+    db_session.query(data.RecipeImage).filter(data.RecipeImage.recipe_id == curry.id).update(
+        {data.RecipeImage.image: b"new curry image"}, synchronize_session=False)
+    db_session.commit()
+    assert digest(b"curry image") not in store.digests()
+    assert {digest(b"new curry image"), digest(b"curr"), orphan} <= store.digests()
+
+    # Query.delete() of the recipe, the database deletes the images
+    db_session.query(data.Recipe).filter(data.Recipe.id == soup.id).delete(synchronize_session=False)
+    db_session.commit()
+    assert not {digest(b"soup image"), digest(b"soup")} & store.digests()
+    assert {digest(b"shared image"), digest(b"shar"), orphan} <= store.digests()
+
+    # Rolled back blobs can't be told, all of them are checked
+    db_session.begin_nested()
+    stew.imagelist.append(data.RecipeImage(stew, position=1, image=b"stew image", thumbnail=b"stew"))
+    db_session.flush()
+    db_session.rollback()
+    db_session.commit()
+    assert not {digest(b"stew image"), orphan} & store.digests()
+    assert digest(b"shared image") in store.digests()
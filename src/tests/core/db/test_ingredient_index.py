@@ -0,0 +1,114 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.ingredient_index import IngredientFilter, IngredientIndex
+from . import add_recipe, cleanup, ingredient_position
+
+Usage = IngredientIndex.Usage
+Entry = data.IngredientListEntry
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    # Other tests might have detached the group unit
+    data.IngredientUnit.update_unit_dict(db_session)
+    yield
+    for table in (data.Recipe, data.Ingredient, data.IngredientListEntry):
+        cleanup(db_session, table)
+
+
+def _ingredient_id(session, name: str) -> int:
+    return session.query(data.Ingredient.id).filter(data.Ingredient.name == name).scalar()
+
+
+def test_recipe_usages():
+    """ Optional and alternative ingredients """
+
+    usages = IngredientIndex.recipe_usages([
+        (1, Entry.GROUP_GLOBAL * Entry.GROUP_FACTOR, False),  # A group, ignored
+        (2, ingredient_position(1), False),  # Milk
+        (3, ingredient_position(1, 1), False),  # or cream
+        (4, ingredient_position(1, 2), False),  # or powdered milk
+        (5, ingredient_position(1, 2, 1), False),  # and water
+        (6, ingredient_position(2), False),
+        (7, ingredient_position(3), True),
+        (6, ingredient_position(4), True),  # Used twice
+    ])
+
+    assert usages == {2: Usage.ALTERNATIVE, 3: Usage.ALTERNATIVE, 4: Usage.ALTERNATIVE, 5: Usage.ALTERNATIVE,
+                      6: Usage.REQUIRED, 7: Usage.OPTIONAL}
+
+
+def test_matching(db_session):
+    """ Include/exclude, optional and alternative ingredients """
+
+    curry = add_recipe(db_session, "Curry", [("onion", ingredient_position(1), False),
+                                             ("garlic", ingredient_position(2), False),
+                                             ("cilantro", ingredient_position(3), True)])
+    soup = add_recipe(db_session, "Soup", [("onion", ingredient_position(1), False),
+                                           ("cream", ingredient_position(2), False),
+                                           ("milk", ingredient_position(2, 1), False)])
+    salad = add_recipe(db_session, "Salad", [("garlic", ingredient_position(1), False),
+                                             ("cilantro", ingredient_position(2), False)])
+
+    index = IngredientIndex.for_session(db_session)
+    onion, garlic, cilantro, milk = (_ingredient_id(db_session, name) for name in ("onion", "garlic", "cilantro",
+                                                                                    "milk"))
+    ingredient_filter = IngredientFilter()
+    ingredient_filter.include = {onion}
+    assert index.matching(db_session, ingredient_filter) == ({curry.id, soup.id}, set())
+
+    ingredient_filter.include = {onion, garlic}
+    assert index.matching(db_session, ingredient_filter) == ({curry.id}, set())
+
+    # Cilantro is optional in the curry
+    ingredient_filter.include = {garlic}
+    ingredient_filter.exclude = {cilantro}
+    assert index.matching(db_session, ingredient_filter) == (set(), {curry.id, salad.id})
+    ingredient_filter.optional = False
+    assert index.matching(db_session, ingredient_filter) == ({curry.id}, {salad.id})
+
+    # The milk can be replaced by cream
+    ingredient_filter.include = set()
+    ingredient_filter.exclude = {milk}
+    assert index.matching(db_session, ingredient_filter) == (None, {soup.id})
+    ingredient_filter.alternatives = False
+    assert index.matching(db_session, ingredient_filter) == (None, set())
+
+
+def test_incremental_update(db_session):
+    """ The index follows changes of the ingredient lists """
+
+    curry = add_recipe(db_session, "Curry", [("onion", ingredient_position(1), False)])
+    index = IngredientIndex.for_session(db_session)
+    index.load(db_session)
+    onion = _ingredient_id(db_session, "onion")
+
+    soup = add_recipe(db_session, "Soup", [("onion", ingredient_position(1), True)])
+    assert index.containing(db_session, onion) == {curry.id, soup.id}
+    assert index.containing(db_session, onion, optional=False) == {curry.id}
+
+    entry = db_session.query(data.IngredientListEntry).filter(data.IngredientListEntry.recipe_id == soup.id).one()
+    entry.optional = False
+    db_session.delete(curry)
+    db_session.commit()
+
+    assert not index.stale
+    assert index.containing(db_session, onion, optional=False) == {soup.id}
@@ -0,0 +1,157 @@
+""" Tests for the cached get_or_add_item/get_or_add_items """
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from sqlalchemy import event
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.core.db.reference_data import ReferenceData
+from qisit.core.db.trigram_index import TrigramIndex
+from . import cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    yield
+    for key in (ChangeBus._info_key, ReferenceData._info_key, TrigramIndex._info_key(data.Ingredient)):
+        db_session.info.pop(key, None)
+    cleanup(db_session, data.Category)
+    cleanup(db_session, data.Ingredient)
+    cleanup(db_session, data.Author)
+
+
+@pytest.fixture()
+def statements():
+    """ Records the SQL statements executed """
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    yield executed
+    event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_cached_item(db_session, statements):
+    """ The second lookup of an item shouldn't touch the database """
+
+    category = data.Category.get_or_add_category(db_session, "Curry")
+    assert category.id is not None
+    assert not any(statement.startswith("SELECT") for statement in statements)
+
+    statements.clear()
+    assert data.Category.get_or_add_category(db_session, "Curry") is category
+    assert len(statements) == 0
+    assert db_session.query(data.Category).count() == 1
+
+
+def test_natural_key(db_session):
+    """ An ingredient and a group with the same name are different items """
+
+    ingredient = data.Ingredient.get_or_add_ingredient(db_session, "Cream", False)
+    group = data.Ingredient.get_or_add_ingredient(db_session, "Cream", True)
+    assert ingredient is not group
+    assert group.is_group
+    assert data.Ingredient.get_or_add_ingredient(db_session, "Cream", True) is group
+
+
+def test_rollback(db_session, statements):
+    """ A rollback removes the created items - the cache has to be cleared """
+
+    db_session.begin_nested()
+    data.Category.get_or_add_category(db_session, "Cookies")
+    db_session.rollback()
+    assert db_session.query(data.Category).count() == 0
+
+    statements.clear()
+    new_category = data.Category.get_or_add_category(db_session, "Cookies")
+    assert len(statements) > 0
+    db_session.commit()
+    assert db_session.query(data.Category).count() == 1
+    assert new_category.name == "Cookies"
+
+
+def test_rename_delete(db_session):
+    """ Renamed or deleted items have to be evicted """
+
+    category = data.Category.get_or_add_category(db_session, "Cake")
+    db_session.commit()
+    category.name = "Cakes"
+    db_session.commit()
+
+    assert data.Category.get_or_add_category(db_session, "Cakes") is category
+    cake = data.Category.get_or_add_category(db_session, "Cake")
+    assert cake is not category
+
+    db_session.delete(cake)
+    db_session.commit()
+    assert data.Category.get_or_add_category(db_session, "Cake") is not cake
+    db_session.commit()
+    assert db_session.query(data.Category).count() == 2
+
+
+def test_batch(db_session, statements):
+    """ Resolve many items at once """
+
+    existing_id = data.Category.get_or_add_category(db_session, "Soup").id
+    db_session.commit()
+    db_session.expunge_all()
+    statements.clear()
+
+    categories = data.Category.get_or_add_categories(db_session, ["Soup", "Bread", "Pie", "Bread"])
+    assert list(categories) == ["Soup", "Bread", "Pie"]
+    assert categories["Soup"].id == existing_id
+    assert len([statement for statement in statements if statement.startswith("SELECT")]) == 1
+    db_session.commit()
+    assert db_session.query(data.Category).count() == 3
+
+    statements.clear()
+    assert data.Category.get_or_add_categories(db_session, ["Pie", "Bread"]) == {"Pie": categories["Pie"],
+                                                                                 "Bread": categories["Bread"]}
+    assert len(statements) == 0
+
+
+def test_insert_notifications(db_session):
+    """ The core INSERT bypasses the flush - the session's caches have to be told anyway """
+
+    changes = []
+
+    def notify(published: list):
+        changes.extend(published)
+
+    bus = ChangeBus.for_session(db_session)
+    bus.subscribe(notify, data.Author)
+    reference_data = ReferenceData.for_session(db_session)
+    assert reference_data.entries(db_session, data.Author) == []
+    version = reference_data.version(data.Author)
+    trigram_index = TrigramIndex.for_session(db_session, data.Ingredient)
+    assert trigram_index.search(db_session, "potato") == []
+
+    author = data.Author.get_or_add_author(db_session, "Alice")
+    potato = data.Ingredient.get_or_add_ingredient(db_session, "Potato")
+    db_session.commit()
+    bus.deliver()
+
+    assert [(change.table, change.kind, change.ids) for change in changes] == \
+           [(data.Author, ChangeBus.INSERT, frozenset([author.id]))]
+    assert reference_data.version(data.Author) > version
+    assert [entry.item for entry in reference_data.entries(db_session, data.Author)] == [author]
+    assert [match.id for match in trigram_index.search(db_session, "potato")] == [potato.id]
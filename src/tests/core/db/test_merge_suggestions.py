@@ -0,0 +1,75 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.merge_suggestions import MergeSuggestions
+from . import add_recipe, cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    # Other tests might have detached the group unit
+    data.IngredientUnit.update_unit_dict(db_session)
+    yield
+    for table in (data.Recipe, data.Ingredient, data.IngredientListEntry, data.Author):
+        cleanup(db_session, table)
+
+
+def _names(groups: list) -> list:
+    return [[item.name for item in group] for group in groups]
+
+
+def test_normalized_key():
+    assert MergeSuggestions.normalized_key("Onions, Red") == "onion red"
+    assert MergeSuggestions.normalized_key("red onion") == "onion red"
+    assert MergeSuggestions.normalized_key("Tomatoes") == "tomato"
+    assert MergeSuggestions.normalized_key("Crème fraîche") == "creme fraiche"
+    assert MergeSuggestions.normalized_key("Swiss") == "swiss"
+    assert MergeSuggestions.edit_distance("tomatoe", "tomato", 1) == 1
+    assert MergeSuggestions.edit_distance("tomato", "potato", 1) == 2
+
+
+def test_groups(db_session):
+    add_recipe(db_session, "Salad", ["onions", "Onion", "red onion", "tomato"])
+    add_recipe(db_session, "Soup", ["onion", "tomatoe", "Onion, red", "potato"])
+
+    suggestions = MergeSuggestions()
+    assert _names(suggestions.groups(db_session, data.Ingredient)) == [["Onion", "onion", "onions"],
+                                                                          ["red onion", "Onion, red"],
+                                                                          ["tomato", "tomatoe"]]
+
+    db_session.add_all([data.Author(name="Julia Child"), data.Author(name="Child, Julia"),
+                        data.Author(name="James Beard")])
+    db_session.commit()
+    assert _names(suggestions.groups(db_session, data.Author)) == [["Julia Child", "Child, Julia"]]
+
+
+def test_merge(db_session):
+    salad = add_recipe(db_session, "Salad", ["onions", "tomato"])
+    soup = add_recipe(db_session, "Soup", ["onion", "tomatoe"])
+
+    suggestions = MergeSuggestions()
+    for group in suggestions.groups(db_session, data.Ingredient):
+        suggestions.merge(db_session, data.Ingredient, group[0].id, [item.id for item in group[1:]])
+    db_session.commit()
+
+    assert db_session.query(data.Ingredient).count() == 2
+    assert {entry.ingredient.name for entry in salad.ingredientlist} == \
+           {entry.ingredient.name for entry in soup.ingredientlist}
+    assert suggestions.groups(db_session, data.Ingredient) == []
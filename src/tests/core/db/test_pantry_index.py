@@ -0,0 +1,162 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.pantry_index import PantryIndex
+from . import add_recipe, cleanup, ingredient_position
+
+Entry = data.IngredientListEntry
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    # Other tests might have detached the group unit
+    data.IngredientUnit.update_unit_dict(db_session)
+    yield
+    db_session.info.pop(PantryIndex._info_key, None)
+    for table in (data.Recipe, data.Ingredient, data.IngredientListEntry):
+        cleanup(db_session, table)
+
+
+def _ids(session, *names) -> set:
+    return {ingredient_id for ingredient_id, in session.query(data.Ingredient.id).filter(
+        data.Ingredient.name.in_(names))}
+
+
+def _setup_recipes(session) -> tuple:
+    soup = add_recipe(session, "Soup", [("onion", ingredient_position(1), False),
+                                        ("milk", ingredient_position(2), False),
+                                        ("cream", ingredient_position(2, 1), False),
+                                        ("powder", ingredient_position(2, 2), False),
+                                        ("water", ingredient_position(2, 2, 1), False),
+                                        ("parsley", ingredient_position(3), True)])
+    salad = add_recipe(session, "Salad", [("lettuce", ingredient_position(1), False),
+                                          ("onion", ingredient_position(2), False)])
+    return soup, salad
+
+
+def test_recipe_slots():
+    """ Groups and optional ingredients don't count, alternatives are options of the same slot """
+
+    slots = PantryIndex.recipe_slots([
+        (1, Entry.GROUP_GLOBAL * Entry.GROUP_FACTOR, False),
+        (2, ingredient_position(1), False),
+        (3, ingredient_position(1, 1), False),
+        (4, ingredient_position(1, 2), False),
+        (5, ingredient_position(1, 2, 1), False),
+        (6, ingredient_position(2), True),
+        (7, ingredient_position(2, 1), False),
+        (8, ingredient_position(3), False)
+    ])
+
+    assert slots == (((2,), (3,), (4, 5)), ((8,),))
+
+
+def test_coverage(db_session):
+    """ Alternatives satisfy the slot, "and" items are needed as a whole """
+
+    soup, salad = _setup_recipes(db_session)
+    index = PantryIndex.for_session(db_session)
+
+    ranking = index.coverage(db_session, _ids(db_session, "onion", "cream"))
+    assert ranking == [PantryIndex.Coverage(soup.id, 1.0, 0), PantryIndex.Coverage(salad.id, 0.5, 1)]
+
+    ranking = index.coverage(db_session, _ids(db_session, "onion", "powder", "lettuce"))
+    assert ranking == [PantryIndex.Coverage(salad.id, 1.0, 0), PantryIndex.Coverage(soup.id, 0.5, 1)]
+
+    ranking = index.coverage(db_session, _ids(db_session, "onion", "powder", "water", "lettuce"))
+    assert [coverage.coverage for coverage in ranking] == [1.0, 1.0]
+
+
+def test_incremental_update(db_session):
+    """ Changed ingredient lists are taken into account """
+
+    soup, salad = _setup_recipes(db_session)
+    index = PantryIndex.for_session(db_session)
+    onion = _ids(db_session, "onion")
+    assert PantryIndex.Coverage(salad.id, 0.5, 1) in index.coverage(db_session, onion)
+
+    entry = db_session.query(Entry).filter(Entry.recipe_id == salad.id, Entry.position == ingredient_position(1)).one()
+    entry.optional = True
+    db_session.delete(soup)
+    db_session.commit()
+
+    assert not index.stale
+    assert index.coverage(db_session, onion) == [PantryIndex.Coverage(salad.id, 1.0, 0)]
+
+
+def test_disk_cache(db_session, tmp_path):
+    """ The cache is used as long as the ingredient lists haven't been changed """
+
+    soup, salad = _setup_recipes(db_session)
+    cache_path = str(tmp_path / "pantry.cache")
+    index = PantryIndex.for_session(db_session, cache_path=cache_path)
+    expected = index.coverage(db_session, _ids(db_session, "onion"))
+    assert (tmp_path / "pantry.cache").exists()
+
+    # A new index (the next start of the application) will use the cache
+    index = PantryIndex()
+    index.cache_path = cache_path
+    index.load(db_session)
+    assert index._saved
+    assert index.coverage(db_session, _ids(db_session, "onion")) == expected
+
+    # But not if it's outdated
+    add_recipe(db_session, "Onion Rings", [("onion", ingredient_position(1), False)])
+    index = PantryIndex()
+    index.cache_path = cache_path
+    index.load(db_session)
+    assert not index._saved
+    assert len(index.coverage(db_session, _ids(db_session, "onion"))) == 3
+
+
+def test_fingerprint(db_session):
+    """ Moving values between the entries changes the fingerprint """
+
+    soup, salad = _setup_recipes(db_session)
+    fingerprint = PantryIndex.fingerprint(db_session)
+    lettuce, onion = sorted(salad.ingredientlist, key=lambda entry: entry.position)
+    lettuce.ingredient, onion.ingredient = onion.ingredient, lettuce.ingredient
+    db_session.commit()
+    assert PantryIndex.fingerprint(db_session) != fingerprint
+
+
+def test_disk_cache_append(db_session, tmp_path):
+    """ Changed recipes are appended to the cache """
+
+    soup, salad = _setup_recipes(db_session)
+    cache_path = tmp_path / "pantry.cache"
+    index = PantryIndex.for_session(db_session, cache_path=str(cache_path))
+    index.coverage(db_session, _ids(db_session, "onion"))
+    size = cache_path.stat().st_size
+
+    entry = db_session.query(Entry).filter(Entry.recipe_id == salad.id, Entry.position == ingredient_position(1)).one()
+    entry.optional = True
+    db_session.delete(soup)
+    db_session.commit()
+    expected = index.coverage(db_session, _ids(db_session, "onion"))
+    assert expected == [PantryIndex.Coverage(salad.id, 1.0, 0)]
+    # The salad's and the soup's records
+    assert cache_path.stat().st_size == size + 8 * (2 + 1 + 1 + 1 + 2)
+
+    index = PantryIndex()
+    index.cache_path = str(cache_path)
+    index.load(db_session)
+    assert index._saved
+    assert index.coverage(db_session, _ids(db_session, "onion")) == expected
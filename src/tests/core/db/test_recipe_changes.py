@@ -0,0 +1,59 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.recipe_changes import RecipeChanges
+from . import cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    yield
+    db_session.info.pop(RecipeChanges._info_key, None)
+    for table in (data.Recipe, data.Author):
+        cleanup(db_session, table)
+
+
+def test_changes(db_session):
+    changes = RecipeChanges.for_session(db_session)
+    recipe = data.Recipe(title="Lamb Vindaloo")
+    other_recipe = data.Recipe(title="Apple Pie")
+    db_session.add_all([recipe, other_recipe])
+    db_session.commit()
+    assert changes.take() == {recipe.id: {RecipeChanges.NEW}, other_recipe.id: {RecipeChanges.NEW}}
+    assert changes.take() == {}
+
+    recipe.rating = 8
+    recipe.instructions = "Stir"
+    recipe.author = data.Author(name="Grandma")
+    db_session.delete(other_recipe)
+    db_session.commit()
+    assert changes.take() == {recipe.id: {"rating", "author"}, other_recipe.id: {RecipeChanges.DELETED}}
+
+    # Renaming the author changes every recipe displaying it
+    recipe.author.name = "Granny"
+    db_session.commit()
+    assert changes.take() == {recipe.id: {"author"}}
+
+    db_session.delete(recipe.author)
+    db_session.commit()
+    assert changes.take() == {recipe.id: {"author"}}
+
+    db_session.query(data.Author).delete()
+    assert changes.take() is None
@@ -0,0 +1,84 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from sqlalchemy import event
+
+from qisit.core.db import data
+from qisit.core.db.recipe_loader import load_recipe
+from . import cleanup
+
+Entry = data.IngredientListEntry
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    # Other tests might have detached the group unit
+    data.IngredientUnit.update_unit_dict(db_session)
+    yield
+    for table in (data.Recipe, data.Ingredient, data.IngredientListEntry, data.Author, data.Category):
+        cleanup(db_session, table)
+
+
+def _add_recipe(session) -> int:
+    recipe = data.Recipe(title="Curry")
+    session.add(recipe)
+    session.flush()
+    recipe.author = data.Author.get_or_add_author(session, "Madhur Jaffrey")
+    recipe.categories.append(data.Category.get_or_add_category(session, "Main dish"))
+    for number in range(1, 31):
+        session.add(Entry(recipe=recipe, unit=data.IngredientUnit.unit_group,
+                          ingredient=data.Ingredient.get_or_add_ingredient(session, f"Spice {number}"),
+                          position=Entry.GROUP_GLOBAL * Entry.GROUP_FACTOR + number * Entry.GROUP_INGREDIENT_FACTOR))
+    for position in range(3):
+        session.add(data.RecipeImage(recipe, position=position, image=b"image", thumbnail=b"thumbnail"))
+    session.commit()
+    return recipe.id
+
+
+def _read_graph(recipe: data.Recipe):
+    for entry in recipe.ingredientlist:
+        _ = entry.ingredient.name, entry.ingredient.icon, entry.unit.name
+    for image in recipe.imagelist:
+        _ = image.thumbnail
+    _ = recipe.categories, recipe.author.name, recipe.cuisine, recipe.yield_unit_name
+
+
+def test_load_recipe(db_session):
+    recipe_id = _add_recipe(db_session)
+    db_session.expire_all()
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db_session.get_bind()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        recipe = load_recipe(db_session, recipe_id)
+        _read_graph(recipe)
+        assert len(statements) == 4
+        assert len(recipe.ingredientlist) == 30
+
+        # After a rollback everything has to be read again
+        db_session.rollback()
+        statements.clear()
+        _read_graph(load_recipe(db_session, recipe_id, refresh=True))
+        assert len(statements) == 4
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
@@ -0,0 +1,127 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from . import cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    yield
+    for table in (data.Recipe, data.Category, data.Author, data.Cuisine):
+        cleanup(db_session, table)
+
+
+def _summary(session, recipe: data.Recipe) -> data.RecipeSummary:
+    return session.query(data.RecipeSummary).get(recipe.id)
+
+
+def _rows(session) -> list:
+    return [tuple(row) for row in session.execute(
+        data.RecipeSummary.__table__.select().order_by(data.RecipeSummary.recipe_id))]
+
+
+def test_new_recipe(db_session):
+    """ New recipes (including categories and the main image) show up in the summary """
+
+    recipe = data.Recipe(title="Pizza Margherita", yields=2)
+    recipe.author = data.Author.get_or_add_author(db_session, "Grandma")
+    recipe.categories.append(data.Category.get_or_add_category(db_session, "Main"))
+    db_session.add(recipe)
+    db_session.flush()
+    image = data.RecipeImage(recipe, position=data.RecipeImage.main_image_pos, image=b"image", thumbnail=b"thumb")
+    db_session.add(image)
+    db_session.commit()
+
+    summary = _summary(db_session, recipe)
+    assert summary.title == "Pizza Margherita"
+    assert summary.title_key == "pizza margherita"
+    assert summary.author == "Grandma"
+    assert summary.author_key == "grandma"
+    assert summary.author_id == recipe.author.id
+    assert summary.categories == "Main"
+    assert summary.cuisine is None
+    assert summary.thumbnail_id == image.id
+    assert summary.yields == 2
+
+
+def test_changes(db_session):
+    """ Changes of the recipe or of the lookup items are propagated """
+
+    recipe = data.Recipe(title="Curry")
+    recipe.cuisine = data.Cuisine.get_or_add_cusine(db_session, "Indian")
+    category = data.Category.get_or_add_category(db_session, "Spicy")
+    recipe.categories.append(category)
+    db_session.add(recipe)
+    db_session.commit()
+
+    recipe.title = "Chicken Curry"
+    recipe.rating = 8
+    db_session.commit()
+    db_session.expire_all()
+    summary = _summary(db_session, recipe)
+    assert (summary.title, summary.rating) == ("Chicken Curry", 8)
+
+    recipe.cuisine.name = "Bengali"
+    category.name = "Hot"
+    db_session.commit()
+    db_session.expire_all()
+    summary = _summary(db_session, recipe)
+    assert (summary.cuisine, summary.categories) == ("Bengali", "Hot")
+
+    db_session.delete(category)
+    db_session.commit()
+    db_session.expire_all()
+    assert _summary(db_session, recipe).categories is None
+
+    db_session.delete(recipe)
+    db_session.commit()
+    assert db_session.query(data.RecipeSummary).count() == 0
+
+
+def test_bulk_update(db_session):
+    """ Query.update() (merging authors in the data editor) rebuilds the summary """
+
+    recipe = data.Recipe(title="Stew")
+    recipe.author = data.Author.get_or_add_author(db_session, "Anonymous")
+    db_session.add(recipe)
+    target = data.Author.get_or_add_author(db_session, "Grandpa")
+    db_session.commit()
+
+    db_session.query(data.Recipe).filter(data.Recipe.author_id == recipe.author_id).update(
+        {data.Recipe.author_id: target.id}, synchronize_session='evaluate')
+    db_session.commit()
+    db_session.expire_all()
+    assert _summary(db_session, recipe).author == "Grandpa"
+
+
+def test_rebuild(db_session):
+    """ The incrementally maintained summary is identical to a freshly computed one """
+
+    for number in range(5):
+        recipe = data.Recipe(title=f"Recipe {number}", yields=number)
+        recipe.categories.append(data.Category.get_or_add_category(db_session, f"Category {number % 2}"))
+        db_session.add(recipe)
+    db_session.commit()
+
+    incremental = _rows(db_session)
+    assert len(incremental) == 5
+    data.RecipeSummary.rebuild(db_session)
+    db_session.commit()
+    assert _rows(db_session) == incremental
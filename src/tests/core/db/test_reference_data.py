@@ -0,0 +1,75 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.reference_data import ReferenceData
+from . import cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    yield
+    for table in (data.Cuisine, data.Author):
+        cleanup(db_session, table)
+
+
+def _names(reference_data: ReferenceData, session) -> list:
+    return [entry.name for entry in reference_data.entries(session, data.Cuisine)]
+
+
+def test_entries(db_session):
+    db_session.add_all([data.Cuisine(name=name) for name in ("indian", "French", "Italian")])
+    db_session.commit()
+
+    reference_data = ReferenceData.for_session(db_session)
+    assert _names(reference_data, db_session) == ["French", "indian", "Italian"]
+    version = reference_data.version(data.Cuisine)
+
+    # Changes are applied by the flushes
+    thai = data.Cuisine(name="Thai")
+    db_session.add(thai)
+    db_session.query(data.Cuisine).filter_by(name="French").one().name = "Provencal"
+    db_session.commit()
+    assert _names(reference_data, db_session) == ["indian", "Italian", "Provencal", "Thai"]
+    assert reference_data.version(data.Cuisine) > version
+
+    # Only the tables in question bump the version
+    version = reference_data.version(data.Cuisine)
+    db_session.add(data.Author(name="Julia Child"))
+    db_session.flush()
+    assert reference_data.version(data.Cuisine) == version
+
+    db_session.delete(thai)
+    db_session.commit()
+    assert _names(reference_data, db_session) == ["indian", "Italian", "Provencal"]
+
+
+def test_rollback(db_session):
+    reference_data = ReferenceData.for_session(db_session)
+    assert _names(reference_data, db_session) == []
+
+    db_session.begin_nested()
+    db_session.add(data.Cuisine(name="Greek"))
+    db_session.flush()
+    assert _names(reference_data, db_session) == ["Greek"]
+    version = reference_data.version(data.Cuisine)
+
+    db_session.rollback()
+    assert reference_data.version(data.Cuisine) > version
+    assert _names(reference_data, db_session) == []
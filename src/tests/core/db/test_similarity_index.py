@@ -0,0 +1,103 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.similarity_index import SimilarityIndex
+from . import add_recipe, cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    # Other tests might have detached the group unit
+    data.IngredientUnit.update_unit_dict(db_session)
+    yield
+    db_session.info.pop(SimilarityIndex._info_key, None)
+    for table in (data.Recipe, data.Ingredient, data.IngredientListEntry, data.Category, data.Cuisine):
+        cleanup(db_session, table)
+
+
+def test_similar(db_session):
+    """ Rare ingredients weigh more than common ones, categories and cuisine break ties """
+
+    italian = data.Cuisine(name="Italian")
+    soup = data.Category(name="Soup")
+    minestrone = add_recipe(db_session, "Minestrone", ["salt", "beans", "celery", "pasta"], [soup], italian)
+    bean_soup = add_recipe(db_session, "Bean Soup", ["salt", "beans", "celery"], [soup], italian)
+    bean_stew = add_recipe(db_session, "Bean Stew", ["salt", "beans", "celery"])
+    salted_pasta = add_recipe(db_session, "Pasta", ["salt", "pasta"])
+    add_recipe(db_session, "Salted Water", ["salt"])
+    add_recipe(db_session, "Tea", ["tea"])
+
+    index = SimilarityIndex.for_session(db_session)
+    similar = index.similar(db_session, minestrone.id)
+    assert similar[0].recipe_id == bean_soup.id
+    assert {the_similar.recipe_id for the_similar in similar[1:3]} == {bean_stew.id, salted_pasta.id}
+    assert similar[0].score > similar[1].score >= similar[2].score > similar[3].score
+    # The tea doesn't share a single ingredient
+    assert len(similar) == 4
+
+    assert len(index.similar(db_session, minestrone.id, limit=2)) == 2
+
+
+def test_incremental_update(db_session):
+    """ The index follows changes of the ingredient lists """
+
+    curry = add_recipe(db_session, "Curry", ["rice", "curry"])
+    index = SimilarityIndex.for_session(db_session)
+    assert index.similar(db_session, curry.id) == []
+
+    pilaf = add_recipe(db_session, "Pilaf", ["rice", "raisins"])
+    assert not index.stale
+    assert [the_similar.recipe_id for the_similar in index.similar(db_session, curry.id)] == [pilaf.id]
+
+    db_session.delete(pilaf)
+    db_session.commit()
+    assert index.similar(db_session, curry.id) == []
+
+
+def test_background_load(db_session):
+    """ Loaded by another session, the changes made in the meantime are re-read when the index is taken over """
+
+    curry = add_recipe(db_session, "Curry", ["rice", "curry"])
+    index = SimilarityIndex.for_session(db_session)
+    job = index.start_loading(db_session)
+    # The other session's snapshot, taken before the pilaf has been added
+    loaded = job(db_session)
+    pilaf = add_recipe(db_session, "Pilaf", ["rice", "raisins"])
+    assert index.stale
+    assert index.finish_loading(db_session, loaded)
+    assert not index.stale
+    assert [the_similar.recipe_id for the_similar in index.similar(db_session, curry.id)] == [pilaf.id]
+
+    # Bulk operations make the loaded index outdated
+    index.invalidate()
+    job = index.start_loading(db_session)
+    loaded = job(db_session)
+    db_session.query(data.CategoryList).delete()
+    assert not index.finish_loading(db_session, loaded)
+    assert index.stale
+
+    # Changes made before the index has been created are unknown
+    db_session.commit()
+    db_session.info.pop(SimilarityIndex._info_key)
+    db_session.begin_nested()
+    curry.title = "Hot Curry"
+    db_session.flush()
+    assert SimilarityIndex.for_session(db_session).start_loading(db_session) is None
+    db_session.rollback()
@@ -0,0 +1,83 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from qisit.core.db import data
+from qisit.core.db.trigram_index import TrigramIndex
+from . import cleanup
+
+
+@pytest.fixture(autouse=True)
+def cleanup_after_tests(db_session):
+    yield
+    for table in (data.Recipe, data.Ingredient):
+        cleanup(db_session, table)
+
+
+def _titles(index: TrigramIndex, matches: list) -> list:
+    return [index.text(match.id) for match in matches]
+
+
+def test_trigrams():
+    assert TrigramIndex.trigrams("Vindaloo") == {"  v", " vi", "vin", "ind", "nda", "dal", "alo", "loo", "oo "}
+    assert TrigramIndex.trigrams("Crème brûlée") == TrigramIndex.trigrams("creme, BRULEE")
+    assert TrigramIndex.trigrams("!!") == set()
+
+
+def test_search(db_session):
+    db_session.add_all([data.Recipe(title=title) for title in ("Lamb Vindaloo", "Chicken Vindaloo with Rice",
+                                                               "Vinaigrette", "Apple Pie", "Soup 1", "Soup 2")])
+    db_session.commit()
+
+    index = TrigramIndex.for_session(db_session, data.Recipe)
+    matches = index.search(db_session, "vindalo")
+    assert _titles(index, matches) == ["Lamb Vindaloo", "Chicken Vindaloo with Rice"]
+    assert matches[0].similarity == pytest.approx(7 / 8)
+    assert _titles(index, index.search(db_session, "vindalo", limit=1)) == ["Lamb Vindaloo"]
+    assert index.search(db_session, "pizza") == []
+
+    # Numbers have to match
+    assert _titles(index, index.search(db_session, "soupe 2")) == ["Soup 2"]
+
+
+def test_incremental_update(db_session):
+    vindaloo = data.Recipe(title="Lamb Vindaloo")
+    pie = data.Recipe(title="Apple Pie")
+    db_session.add_all([vindaloo, pie])
+    db_session.commit()
+
+    index = TrigramIndex.for_session(db_session, data.Recipe)
+    assert not index.search(db_session, "korma")
+
+    vindaloo.title = "Lamb Korma"
+    db_session.add(data.Recipe(title="Chicken Korma"))
+    db_session.delete(pie)
+    db_session.commit()
+    assert not index.stale
+    assert _titles(index, index.search(db_session, "korm")) == ["Lamb Korma", "Chicken Korma"]
+    assert index.search(db_session, "vindaloo") == []
+    assert index.search(db_session, "apple pie") == []
+
+    # Merging ingredients in the data editor deletes them with a bulk operation
+    ingredient_index = TrigramIndex.for_session(db_session, data.Ingredient)
+    db_session.add(data.Ingredient(name="tomato"))
+    db_session.commit()
+    assert _titles(ingredient_index, ingredient_index.search(db_session, "tomatoe")) == ["tomato"]
+    db_session.query(data.Ingredient).delete()
+    assert ingredient_index.stale
+    assert ingredient_index.search(db_session, "tomatoe") == []
@@ -15,3 +15,15 @@
 #  You should have received a copy of the GNU General Public License
 #   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
 
+
+from PyQt5 import QtCore, QtGui
+
+
+def jpeg(width: int, height: int, quality: int = -1) -> bytes:
+    """ A plain red JPEG image """
+    image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+    image.fill(QtCore.Qt.red)
+    image_buffer = QtCore.QBuffer()
+    image_buffer.open(QtCore.QIODevice.ReadWrite)
+    image.save(image_buffer, "JPG", quality)
+    return bytes(image_buffer.data())
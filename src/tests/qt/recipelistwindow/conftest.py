@@ -0,0 +1,52 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import session
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.core.util import initialize_db
+
+
+@pytest.fixture(scope="module")
+def db_session():
+    db.engine = create_engine("sqlite:///:memory:", echo=False)
+
+    db.Session.configure(bind=db.engine)
+    the_session = db.Session()
+    initialize_db(the_session, load_data=False)
+
+    # A small recipe library
+    for number in range(25):
+        recipe = data.Recipe(title=f"Recipe {number:02d}", instructions="Stir. " * 1000, yields=number,
+                             rating=number % 10)
+        the_session.add(recipe)
+        recipe.categories.append(data.Category.get_or_add_category(the_session, f"Category {number % 3}"))
+        if number % 2:
+            recipe.author = data.Author.get_or_add_author(the_session, "Grandma")
+            recipe.cuisine = data.Cuisine.get_or_add_cusine(the_session, "Indian")
+        the_session.flush()
+        if number % 5 == 0:
+            the_session.add(data.RecipeImage(recipe, position=data.RecipeImage.main_image_pos, image=b"image",
+                                             thumbnail=b"thumb"))
+    the_session.commit()
+    the_session.expunge_all()
+
+    yield the_session
+    session.close_all_sessions()
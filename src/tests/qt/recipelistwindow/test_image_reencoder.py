@@ -0,0 +1,93 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from sqlalchemy import create_engine, orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.qt.misc.image_reencoder import ImageReencoder
+from .. import jpeg
+
+
+def test_reencode(tmp_path):
+    """ Oversized images are scaled down, thumbnails regenerated. A second run doesn't change anything """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    QtCore.QSettings.setDefaultFormat(QtCore.QSettings.IniFormat)
+    QtCore.QSettings.setPath(QtCore.QSettings.IniFormat, QtCore.QSettings.UserScope, str(tmp_path))
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    db.Base.metadata.create_all(engine)
+    the_session = orm.Session(bind=engine)
+    recipe = data.Recipe(title="Curry")
+    the_session.add(recipe)
+    the_session.flush()
+    large = data.RecipeImage(recipe, position=0, image=jpeg(1600, 1000, quality=100),
+                             thumbnail=jpeg(96, 60, quality=100))
+    broken = data.RecipeImage(recipe, position=1, image=b"not an image", thumbnail=b"thumbnail")
+    the_session.add_all([large, broken])
+    the_session.commit()
+    try:
+        # Aborted after the first chunk
+        aborted = [True, False]
+        aborting = ImageReencoder(the_session, processes=1, chunk_size=1)
+        aborting.is_aborted = aborted.pop
+        result = aborting.run()
+        assert not result.finished and result.processed == 1 and result.replaced == 1
+        assert QtGui.QImage.fromData(large.image).size() == QtCore.QSize(320, 200)
+
+        # The next run continues
+        result = ImageReencoder(the_session, processes=1, chunk_size=1).run()
+        assert result.finished and result.processed == 1 and result.replaced == 0
+        assert QtGui.QImage.fromData(large.thumbnail).height() == 40
+        assert broken.image == b"not an image"
+
+        # Starts all over again, nothing left to do
+        result = ImageReencoder(the_session, processes=1).run()
+        assert result.processed == 2 and result.replaced == 0 and result.saved_bytes == 0
+        assert ImageReencoder(the_session).vacuum()
+    finally:
+        the_session.close()
+    del application
+
+
+def test_small_image(tmp_path):
+    """ Images smaller than the maximum size aren't scaled up """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    QtCore.QSettings.setDefaultFormat(QtCore.QSettings.IniFormat)
+    QtCore.QSettings.setPath(QtCore.QSettings.IniFormat, QtCore.QSettings.UserScope, str(tmp_path))
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    db.Base.metadata.create_all(engine)
+    the_session = orm.Session(bind=engine)
+    recipe = data.Recipe(title="Soup")
+    the_session.add(recipe)
+    the_session.flush()
+    small_image = jpeg(100, 50, quality=100)
+    small = data.RecipeImage(recipe, position=0, image=small_image, thumbnail=jpeg(80, 40, quality=100))
+    the_session.add(small)
+    the_session.commit()
+    try:
+        result = ImageReencoder(the_session, processes=1).run()
+        assert result.processed == 1 and result.saved_bytes >= 0
+        assert QtGui.QImage.fromData(small.image).size() == QtCore.QSize(100, 50)
+        assert len(small.image) <= len(small_image)
+    finally:
+        the_session.close()
+    del application
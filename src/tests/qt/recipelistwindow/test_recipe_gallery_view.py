@@ -0,0 +1,70 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore, QtTest, QtWidgets
+from sqlalchemy import create_engine, orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.qt.misc.thumbnail_cache import ThumbnailCache
+from qisit.qt.recipelistwindow.recipe_gallery_view import RecipeGalleryView
+from qisit.qt.recipelistwindow.recipe_table_model import RecipeTableModel
+from .. import jpeg
+
+Columns = RecipeTableModel.RecipeColumns
+
+
+def test_gallery(tmp_path):
+    """ The stored thumbnail is shown until the larger one has been generated (only for the cells painted) """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    db.Base.metadata.create_all(engine)
+    the_session = orm.Session(bind=engine)
+    curry = data.Recipe(title="Curry")
+    soup = data.Recipe(title="Soup")
+    the_session.add_all([curry, soup])
+    the_session.flush()
+    the_session.add(data.RecipeImage(curry, position=0, image=jpeg(1600, 1000), thumbnail=jpeg(64, 40)))
+    the_session.commit()
+    try:
+        ThumbnailCache.for_session(the_session).directory = str(tmp_path / "thumbnails")
+        model = RecipeTableModel(the_session, recipes_per_page=10)
+        model.sort(Columns.TITLE, QtCore.Qt.AscendingOrder)
+        view = RecipeGalleryView(the_session)
+        view.setModel(model)
+        assert view.modelColumn() == Columns.THUMBNAIL
+        delegate = view.gallery_delegate
+
+        curry_index = model.index(0, Columns.THUMBNAIL)
+        placeholder = delegate.pixmap(curry_index, 1.0)
+        assert placeholder.size() == QtCore.QSize(188, 117)
+        # Recipes without pictures
+        assert delegate.pixmap(model.index(1, Columns.THUMBNAIL), 1.0) is None
+
+        spy = QtTest.QSignalSpy(model.dataChanged)
+        assert spy.wait(5000)
+        assert spy[0][0].row() == 0
+        derived = delegate.pixmap(curry_index, 1.0)
+        assert derived.size() == placeholder.size() and derived.cacheKey() != placeholder.cacheKey()
+        assert delegate.pixmap(curry_index, 1.0).cacheKey() == derived.cacheKey()
+
+        view.resize(500, 400)
+        view.grab()
+    finally:
+        the_session.close()
+    del application
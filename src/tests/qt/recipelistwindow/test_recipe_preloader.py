@@ -0,0 +1,78 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtTest, QtWidgets
+from sqlalchemy import create_engine, event, orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.qt.misc.markdown_cache import MarkdownCache
+from qisit.qt.misc.query_worker import QueryWorker
+from qisit.qt.misc.recipe_preloader import RecipePreloader
+
+
+def test_preload(tmp_path):
+    """ The recipe is prepared in the background and merged into the session without any SQL """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    the_session = orm.Session(bind=engine)
+    db.Base.metadata.create_all(engine)
+    recipe = data.Recipe(title="Curry", instructions="# Stir\n\n*Slowly*")
+    recipe.author = data.Author(name="Madhur Jaffrey")
+    the_session.add(recipe)
+    the_session.flush()
+    the_session.add(data.RecipeImage(recipe, position=0, image=b"image", thumbnail=b"thumbnail"))
+    the_session.commit()
+    recipe_id = recipe.id
+    the_session.expire_all()
+
+    worker = QueryWorker(engine)
+    worker.start()
+    try:
+        preloader = RecipePreloader(the_session, worker, capacity=1)
+        spy = QtTest.QSignalSpy(worker.jobFinished)
+        preloader.preload(recipe_id)
+        assert spy.wait(5000)
+
+        recipe = the_session.query(data.Recipe).get(recipe_id)
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        preloaded = preloader.take(recipe)
+        assert preloaded.recipe is recipe
+        assert recipe.author.name == "Madhur Jaffrey"
+        assert len(recipe.imagelist) == 1 and recipe.imagelist[0].thumbnail == b"thumbnail"
+        assert len(preloaded.thumbnails) == 1
+        # The markdown has been rendered in the background
+        assert "# Stir\n\n*Slowly*" in MarkdownCache.shared()
+        assert MarkdownCache.shared().document("# Stir\n\n*Slowly*").toPlainText() == "Stir\nSlowly"
+        assert statements == []
+        # Taken
+        assert preloader.take(recipe) is None
+
+        # Changed recipes are dropped
+        preloader.preload(recipe_id)
+        assert spy.wait(5000)
+        recipe.title = "Chicken Curry"
+        the_session.commit()
+        ChangeBus.for_session(the_session).deliver()
+        assert preloader.take(recipe) is None
+    finally:
+        worker.stop()
+        the_session.close()
+    del application
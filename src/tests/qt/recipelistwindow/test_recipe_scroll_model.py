@@ -0,0 +1,87 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore, QtTest
+from sqlalchemy import create_engine, orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.qt.misc.query_worker import QueryWorker
+from qisit.qt.recipelistwindow.recipe_scroll_model import RecipeScrollModel
+
+Columns = RecipeScrollModel.RecipeColumns
+
+
+def _title(model: RecipeScrollModel, row: int):
+    return model.data(model.index(row, Columns.TITLE), QtCore.Qt.DisplayRole)
+
+
+def test_fetch_more(db_session):
+    """ The table grows while scrolling, only the windows near the current one are kept """
+
+    model = RecipeScrollModel(db_session, window_size=10, max_windows=1)
+    model.sort(Columns.TITLE, QtCore.Qt.AscendingOrder)
+    root = QtCore.QModelIndex()
+    assert model.rowCount() == 10
+    assert model.canFetchMore(root)
+
+    model.fetchMore(root)
+    model.fetchMore(root)
+    assert model.rowCount() == 25
+    assert not model.canFetchMore(root)
+
+    assert _title(model, 24) == "Recipe 24"
+    assert list(model._windows) == [2]
+    assert _title(model, 0) == "Recipe 00"
+    assert list(model._windows) == [0]
+    assert model.recipe_at_row(13).title == "Recipe 13"
+
+    # A new filter starts at the top again
+    model.search_title = "Recipe 2"
+    model.update_model()
+    assert model.rowCount() == 5
+    assert not model.canFetchMore(root)
+    assert _title(model, 4) == "Recipe 24"
+
+
+def test_prefetch(tmp_path):
+    """ The neighbouring windows are read in the background """
+
+    application = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    db.Base.metadata.create_all(engine)
+    the_session = orm.Session(bind=engine)
+    the_session.add_all([data.Recipe(title=f"Recipe {number:02d}") for number in range(25)])
+    the_session.commit()
+
+    worker = QueryWorker(engine)
+    worker.start()
+    try:
+        model = RecipeScrollModel(the_session, window_size=10, prefetch_worker=worker)
+        model.sort(Columns.TITLE, QtCore.Qt.AscendingOrder)
+        spy = QtTest.QSignalSpy(model.dataChanged)
+        model.fetchMore(QtCore.QModelIndex())
+
+        assert _title(model, 10) is None
+        assert spy.wait(5000)
+        assert _title(model, 10) == "Recipe 10"
+        # The next window is there, too
+        assert set(model._windows) == {0, 1, 2}
+    finally:
+        worker.stop()
+        the_session.close()
+    del application
@@ -0,0 +1,229 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore, QtTest
+from sqlalchemy import create_engine, orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.qt.misc.query_worker import QueryWorker
+from qisit.qt.recipelistwindow.recipe_table_model import RecipeTableModel
+
+Columns = RecipeTableModel.RecipeColumns
+
+
+def _display(model: RecipeTableModel, row: int, column: int):
+    return model.data(model.index(row, column), QtCore.Qt.DisplayRole)
+
+
+def test_no_orm_entities(db_session):
+    """ The table holds plain rows, the recipes won't end up in the session """
+
+    model = RecipeTableModel(db_session, recipes_per_page=10)
+    assert model.rowCount() == 10
+    assert model.number_of_filtered_recipes == 25
+    assert not any(isinstance(item, data.Recipe) for item in db_session.identity_map.values())
+
+    model.sort(Columns.TITLE, QtCore.Qt.AscendingOrder)
+    assert _display(model, 0, Columns.TITLE) == "Recipe 00"
+    assert _display(model, 1, Columns.AUTHOR) == "Grandma"
+    assert _display(model, 1, Columns.CUISINE) == "Indian"
+    assert _display(model, 2, Columns.CATEGORIES) == "Category 2"
+    assert model._entries[0].thumbnail == b"thumb"
+    assert model._entries[1].thumbnail is None
+
+    # The ORM object will be loaded on demand
+    recipe = model.recipe_at_row(1)
+    assert isinstance(recipe, data.Recipe)
+    assert recipe.title == "Recipe 01"
+    assert model.recipe_at_row(10) is None
+
+
+def test_filter(db_session):
+    """ Filters and search """
+
+    model = RecipeTableModel(db_session, recipes_per_page=10)
+    author_id = db_session.query(data.Author.id).scalar()
+    model.filters[data.Author].add(author_id)
+    model.update_model()
+    assert model.number_of_filtered_recipes == 12
+
+    model.search_title = "Recipe 1"
+    model.update_model()
+    assert model.number_of_filtered_recipes == 5
+
+
+def test_hidden_columns(db_session):
+    """ Hidden columns won't be queried """
+
+    model = RecipeTableModel(db_session, recipes_per_page=10)
+    for column in (Columns.CATEGORIES, Columns.THUMBNAIL, Columns.AUTHOR):
+        assert not model.set_column_visible(column, False)
+
+    category_id = db_session.query(data.Category.id).filter(data.Category.name == "Category 1").scalar()
+    model.filters[data.Category].add(category_id)
+    model.sort(Columns.TITLE, QtCore.Qt.AscendingOrder)
+
+    assert model.number_of_filtered_recipes == 8
+    assert _display(model, 0, Columns.TITLE) == "Recipe 01"
+    assert _display(model, 0, Columns.CUISINE) == "Indian"
+    assert model._entries[0].categories is None
+    assert _display(model, 0, Columns.AUTHOR) is None
+    assert all(entry.thumbnail is None for entry in model._entries)
+
+    # Sorting by a hidden column still works
+    model.sort(Columns.CATEGORIES, QtCore.Qt.DescendingOrder)
+    assert model.number_of_filtered_recipes == 8
+
+    assert model.set_column_visible(Columns.AUTHOR, True)
+    model.update_model()
+    assert _display(model, 0, Columns.AUTHOR) == "Grandma"
+
+
+def test_ingredient_filter(db_session):
+    """ The ingredient filter is applied to the query """
+
+    model = RecipeTableModel(db_session, recipes_per_page=10)
+    model.ingredient_filter.include = {0}
+    model.update_model()
+    assert model.number_of_filtered_recipes == 0
+
+    model.ingredient_filter.clear()
+    model.update_model()
+    assert model.number_of_filtered_recipes == 25
+
+
+def test_query_worker(tmp_path):
+    """ The queries are run in the background, uncommitted changes force them to be run in the foreground """
+
+    application = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    assert QueryWorker.supports(engine)
+    assert not QueryWorker.supports(create_engine("sqlite:///:memory:"))
+
+    the_session = orm.Session(bind=engine)
+    db.Base.metadata.create_all(engine)
+    the_session.add_all([data.Recipe(title=f"Recipe {number:02d}") for number in range(25)])
+    the_session.commit()
+
+    worker = QueryWorker(engine)
+    worker.start()
+    try:
+        model = RecipeTableModel(the_session, recipes_per_page=10, query_worker=worker)
+        spy = QtTest.QSignalSpy(model.entriesUpdated)
+
+        model.search_title = "Recipe 1"
+        model.update_model()
+        assert model.updating
+        # The old entries are shown until the new ones are there
+        assert model.number_of_filtered_recipes == 25
+
+        # Only the latest job counts
+        model.search_title = "Recipe 2"
+        model.update_model()
+        assert spy.wait(5000)
+        assert not model.updating
+        assert model.number_of_filtered_recipes == 5
+        assert all(entry.title.startswith("Recipe 2") for entry in model._entries)
+        assert not spy.wait(200)
+        assert len(spy) == 1
+
+        # The worker can't see the new recipe yet
+        the_session.begin_nested()
+        the_session.add(data.Recipe(title="Recipe 26"))
+        the_session.flush()
+        assert db.has_uncommitted_changes(the_session)
+        model.update_model()
+        assert not model.updating
+        assert model.number_of_filtered_recipes == 6
+        # The savepoint and the (outer) transaction
+        the_session.rollback()
+        the_session.rollback()
+        assert not db.has_uncommitted_changes(the_session)
+
+        # A failing query is reported, the entries are kept
+        failed = QtTest.QSignalSpy(model.entriesFailed)
+        model._entries_job = lambda offset, limit: lambda session_: session_.execute("SELECT * FROM no_such_table")
+        model.update_model()
+        assert failed.wait(5000)
+        assert not model.updating
+        assert model.number_of_filtered_recipes == 6
+    finally:
+        worker.stop()
+        the_session.close()
+    del application
+
+
+def test_apply_changes(db_session):
+    """ Changed recipes are read again, the model is only updated if their position might have changed """
+
+    model = RecipeTableModel(db_session, recipes_per_page=10)
+    model.sort(Columns.TITLE, QtCore.Qt.AscendingOrder)
+    updated = QtTest.QSignalSpy(model.entriesUpdated)
+    changed = QtTest.QSignalSpy(model.dataChanged)
+
+    recipe = model.recipe_at_row(1)
+    rating = recipe.rating
+    recipe.rating = 9
+    db_session.commit()
+    model.apply_changes()
+    assert len(updated) == 0
+    assert [(signal[0].row(), signal[1].row()) for signal in changed] == [(1, 1)]
+    assert _display(model, 1, Columns.RATING) == "9/10"
+
+    # The title is the sort order
+    recipe.title = "Recipe 99"
+    db_session.commit()
+    model.apply_changes()
+    assert len(updated) == 1
+    assert _display(model, 1, Columns.TITLE) == "Recipe 02"
+
+    recipe.title = "Recipe 01"
+    recipe.rating = rating
+    db_session.commit()
+
+
+def test_delete(db_session):
+    """ The queries don't autoflush - a deleted recipe mustn't be listed anymore """
+
+    model = RecipeTableModel(db_session, recipes_per_page=10)
+    db_session.begin_nested()
+    try:
+        recipe = model.recipe_at_row(0)
+        db_session.delete(recipe)
+        model.update_model()
+        assert model.number_of_filtered_recipes == 24
+        assert recipe.id not in [model.recipe_id_at_row(row) for row in range(model.rowCount())]
+    finally:
+        db_session.rollback()
+
+
+def test_apply_changes_delete(db_session):
+    """ Deleting recipes (in the recipe list) - the list and the filter counts are updated at once """
+
+    model = RecipeTableModel(db_session, recipes_per_page=10)
+    db_session.begin_nested()
+    try:
+        recipe = next(recipe for recipe in map(model.recipe_at_row, range(model.rowCount())) if recipe.author)
+        author_id = recipe.author.id
+        counts = model.filter_counts(data.Author)[author_id]
+        db_session.delete(recipe)
+        model.apply_changes()
+        assert model.number_of_filtered_recipes == 24
+        assert model.filter_counts(data.Author)[author_id] == (counts[0] - 1, counts[1] - 1)
+    finally:
+        db_session.rollback()
@@ -0,0 +1,66 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore
+
+from qisit.core.db import data
+from qisit.qt.recipewindow.combobox_model import DBComboBoxModel
+
+
+def _names(model: DBComboBoxModel) -> list:
+    return [str(model.item_at(row)) for row in range(1, model.rowCount())]
+
+
+def test_update_model(db_session):
+    model = DBComboBoxModel(db_session, data.Author)
+    for name in ("Child, Julia", "Beard, James", "Madhur Jaffrey"):
+        db_session.add(data.Author(name=name))
+    db_session.commit()
+
+    model.reload_model()
+    assert _names(model) == ["Beard, James", "Child, Julia", "Madhur Jaffrey"]
+    # The combobox's current item
+    current = QtCore.QPersistentModelIndex(model.index(model.index_of_item(
+        db_session.query(data.Author).filter_by(name="Madhur Jaffrey").one())))
+    resets = []
+    model.modelReset.connect(lambda: resets.append(True))
+
+    db_session.query(data.Author).filter_by(name="Beard, James").one().name = "Julia's neighbour"
+    db_session.delete(db_session.query(data.Author).filter_by(name="Child, Julia").one())
+    db_session.add(data.Author(name="Ali, Monica"))
+    db_session.commit()
+    model.update_model()
+
+    assert _names(model) == ["Ali, Monica", "Julia's neighbour", "Madhur Jaffrey"]
+    assert not resets
+    assert current.row() == 3
+
+
+def test_set_data(db_session):
+    """ The user enters a new name into the combobox """
+
+    db_session.add(data.Cuisine(name="Thai"))
+    db_session.commit()
+    model = DBComboBoxModel(db_session, data.Cuisine)
+    model.reload_model()
+    assert _names(model) == ["Thai"]
+
+    row = model.rowCount()
+    model.insertRows(row, 1, QtCore.QModelIndex())
+    assert model.setData(model.index(row), " Indian ", QtCore.Qt.EditRole)
+    assert _names(model) == ["Indian", "Thai"]
+    assert model.item_at(1) is db_session.query(data.Cuisine).filter_by(name="Indian").one()
@@ -0,0 +1,58 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore, QtGui, QtTest, QtWidgets
+
+from qisit.qt.misc.image_ingestion import ImageIngestion
+from .. import jpeg
+
+
+def test_add_files(tmp_path):
+    """ The images are read scaled down, encoded in the background and delivered one by one """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    filename = str(tmp_path / "photo.jpg")
+    with open(filename, "wb") as file:
+        file.write(jpeg(4000, 3000))
+
+    max_size = QtCore.QSize(320, 200)
+    image, error = ImageIngestion.read(filename, max_size, 40)
+    # Never decoded in full resolution
+    assert image.size() == QtCore.QSize(266, 200)
+
+    ingestion = ImageIngestion()
+    ready = QtTest.QSignalSpy(ingestion.imageReady)
+    failed = QtTest.QSignalSpy(ingestion.imageFailed)
+    progress = QtTest.QSignalSpy(ingestion.progress)
+    ingestion.add_files([filename, str(tmp_path / "missing.jpg")], max_size, 40, 80)
+    while ingestion.busy:
+        assert progress.wait(5000)
+
+    assert len(ready) == 1 and len(failed) == 1
+    assert failed[0][0].endswith("missing.jpg")
+    encoded = ready[0][1]
+    assert QtGui.QImage.fromData(encoded.image).size() == QtCore.QSize(266, 200)
+    assert QtGui.QImage.fromData(encoded.thumbnail).height() == 40
+    assert encoded.thumbnail_image.height() == 40
+    assert list(progress[-1]) == [2, 2]
+
+    # Cancelled files are dropped
+    ingestion.add_files([filename] * 4, max_size, 40, 80)
+    ingestion.cancel(wait=True)
+    application.processEvents()
+    assert len(ready) == 1 and not ingestion.busy
+    del application
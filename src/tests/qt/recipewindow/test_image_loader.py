@@ -0,0 +1,53 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtCore, QtTest, QtWidgets
+
+from qisit.qt.misc.image_loader import ImageLoader
+from .. import jpeg
+
+
+def test_load():
+    """ Images are decoded in the background as large as needed, the full resolution only when asked for """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    photo = jpeg(3200, 2000)
+    label_size = QtCore.QSize(320, 200)
+    # Room for a single full resolution image
+    loader = ImageLoader(capacity_bytes=3200 * 2000 * 4)
+    spy = QtTest.QSignalSpy(loader.imageLoaded)
+
+    key, image = loader.load(photo, label_size)
+    assert image is None
+    assert spy.wait(5000)
+    assert spy[0][0] == key and spy[0][1] == label_size and spy[0][2].size() == label_size
+    assert loader.load(photo, label_size)[1].size() == label_size
+
+    # Zoom
+    assert loader.load(photo)[1] is None
+    assert spy.wait(5000)
+    assert spy[1][1] is None and spy[1][2].size() == QtCore.QSize(3200, 2000)
+    assert loader.cached(key).size() == QtCore.QSize(3200, 2000)
+    # The smaller image has been evicted
+    assert loader.cached(key, label_size) is None
+
+    # Small images aren't scaled up
+    small = jpeg(100, 50)
+    loader.load(small, label_size)
+    assert spy.wait(5000)
+    assert spy[2][2].size() == QtCore.QSize(100, 50)
+    del application
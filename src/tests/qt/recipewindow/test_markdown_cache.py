@@ -0,0 +1,96 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtWidgets
+
+from qisit.core.db import data
+from qisit.qt.misc.markdown_cache import MarkdownCache
+from qisit.qt.recipewindow.recipe_window_controller import RecipeWindow
+
+
+class CountingCache(MarkdownCache):
+    """ Counts the rendered texts """
+
+    def __init__(self, capacity: int = 64):
+        super().__init__(capacity)
+        self.rendered = []
+
+    def render(self, text: str, thread=None):
+        self.rendered.append(text)
+        return super().render(text, thread)
+
+
+def test_document():
+    """ Every caller gets a copy of its own, the text is rendered only once """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    cache = CountingCache()
+    document = cache.document("# Curry\n\n*Stir*")
+    assert document.toPlainText() == "Curry\nStir"
+    assert "# Curry\n\n*Stir*" in cache
+
+    document.setPlainText("Changed")
+    other_document = cache.document("# Curry\n\n*Stir*")
+    assert other_document is not document
+    assert other_document.toPlainText() == "Curry\nStir"
+    assert cache.rendered == ["# Curry\n\n*Stir*"]
+    del application
+
+
+def test_capacity():
+    """ The least recently used documents are dropped """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    cache = CountingCache(capacity=2)
+    cache.document("Rice")
+    cache.document("Curry")
+    # Rice is used again, Curry is the oldest now
+    cache.document("Rice")
+    cache.document("Naan")
+    assert "Rice" in cache and "Naan" in cache
+    assert "Curry" not in cache
+
+    cache.document("Curry")
+    assert cache.rendered == ["Rice", "Curry", "Naan", "Curry"]
+    assert "Rice" not in cache
+    del application
+
+
+def test_recipe_window(db_session):
+    """ The recipe window renders only the texts that have been changed """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    recipe = data.Recipe(title="Pilaf", description="*Rice*", instructions="# Stir\n\nwell")
+    db_session.add(recipe)
+    db_session.commit()
+
+    window = RecipeWindow(db_session, recipe)
+    description = window.descriptionMarkDownTextEdit.document()
+    instructions = window.instructionsMarkdownTextEdit.document()
+    assert description.toPlainText() == "Rice"
+    assert instructions.toPlainText() == "Stir\nwell"
+
+    window.instructionsPlainTextEdit.setPlainText("# Stir\n\nagain")
+    window._load_markdown_textedits()
+    assert window.descriptionMarkDownTextEdit.document() is description
+    assert window.instructionsMarkdownTextEdit.document() is not instructions
+    assert window.instructionsMarkdownTextEdit.toPlainText() == "Stir\nagain"
+
+    window.deleteLater()
+    db_session.delete(recipe)
+    db_session.commit()
+    del application
@@ -0,0 +1,68 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+from PyQt5 import QtTest, QtWidgets
+from sqlalchemy import create_engine, orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.core.db.similarity_index import SimilarityIndex
+from qisit.qt.misc.similarity_loader import SimilarityLoader
+
+
+def _add_recipe(session, title: str, ingredients: list) -> data.Recipe:
+    recipe = data.Recipe(title=title)
+    unit = session.query(data.IngredientUnit).first() or data.IngredientUnit(
+        name="g", type_=data.IngredientUnit.UnitType.MASS)
+    session.add_all([recipe, unit])
+    session.flush()
+    for number, name in enumerate(ingredients, start=1):
+        ingredient = session.query(data.Ingredient).filter_by(name=name).first() or data.Ingredient(name=name)
+        session.add(ingredient)
+        session.flush()
+        session.add(data.IngredientListEntry(recipe=recipe, unit=unit, ingredient=ingredient,
+                                             position=number * data.IngredientListEntry.GROUP_INGREDIENT_FACTOR))
+    session.flush()
+    return recipe
+
+
+def test_load(tmp_path):
+    """ The index is loaded in the background and catches up with the uncommitted changes """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    the_session = orm.Session(bind=engine)
+    db.Base.metadata.create_all(engine)
+    curry = _add_recipe(the_session, "Curry", ["rice", "curry"])
+    the_session.commit()
+
+    loader = SimilarityLoader(the_session, engine)
+    try:
+        # Nothing is started until the index is needed
+        assert loader._worker is None
+        spy = QtTest.QSignalSpy(loader.indexLoaded)
+        assert not loader.load()
+        # Not committed - the worker doesn't see the pilaf
+        pilaf = _add_recipe(the_session, "Pilaf", ["rice", "raisins"])
+        assert spy.wait(5000)
+        assert loader.load()
+        index = SimilarityIndex.for_session(the_session)
+        assert [the_similar.recipe_id for the_similar in index.similar(the_session, curry.id)] == [pilaf.id]
+    finally:
+        loader.stop()
+        the_session.close()
+    del application
@@ -0,0 +1,83 @@
+#  Copyright (c) 2020 by Mark Nowiasz
+#
+#  This file is part of Qisit (https://github.com/mnowiasz/qisit)
+#
+#  Qisit is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Qisit is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#   along with qisit.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+from PyQt5 import QtCore, QtTest, QtWidgets
+from sqlalchemy import create_engine, orm
+
+from qisit.core import db
+from qisit.core.db import data
+from qisit.core.db.change_bus import ChangeBus
+from qisit.qt.misc.thumbnail_cache import ThumbnailCache
+from .. import jpeg
+
+
+def test_thumbnail(tmp_path):
+    """ Thumbnails are generated in the background, kept on disk and removed when the image changes """
+
+    application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    engine = create_engine(f"sqlite:///{tmp_path / 'recipes.db'}")
+    db.Base.metadata.create_all(engine)
+    the_session = orm.Session(bind=engine)
+    recipe = data.Recipe(title="Curry")
+    the_session.add(recipe)
+    the_session.flush()
+    image = data.RecipeImage(recipe, position=0, image=jpeg(1600, 1000), thumbnail=jpeg(64, 40))
+    the_session.add(image)
+    the_session.commit()
+    directory = str(tmp_path / "thumbnails")
+    try:
+        cache = ThumbnailCache(the_session, directory=directory)
+        spy = QtTest.QSignalSpy(cache.thumbnailReady)
+        assert cache.thumbnail(image.id, image.thumbnail, 80) is None
+        assert spy.wait(5000)
+        assert spy[0][0] == image.id and spy[0][1] == 80 and spy[0][2].size() == QtCore.QSize(128, 80)
+        assert cache.thumbnail(image.id, image.thumbnail, 80).height() == 80
+        assert len(os.listdir(directory)) == 1
+
+        # Another session (the next start) uses the file
+        other_cache = ThumbnailCache(the_session, directory=directory)
+        assert other_cache.thumbnail(image.id, image.thumbnail, 80).height() == 80
+
+        # A bulk update only clears the memory. The directory is shared with the other databases
+        other_database = os.path.join(directory, "1-0123456789abcdef-80.jpg")
+        open(other_database, "wb").close()
+        the_session.query(data.RecipeImage).update({data.RecipeImage.position: 1}, synchronize_session=False)
+        the_session.commit()
+        ChangeBus.for_session(the_session).deliver()
+        assert len(os.listdir(directory)) == 2
+        assert not cache._thumbnails
+        assert cache.thumbnail(image.id, image.thumbnail, 80).height() == 80
+        os.unlink(other_database)
+
+        # A new image: the derived thumbnails are outdated
+        image.image = jpeg(800, 800)
+        image.thumbnail = jpeg(40, 40)
+        the_session.commit()
+        ChangeBus.for_session(the_session).deliver()
+        assert os.listdir(directory) == []
+        assert cache.thumbnail(image.id, image.thumbnail, 80) is None
+        assert spy.wait(5000)
+        assert spy[1][2].size() == QtCore.QSize(80, 80)
+
+        # Not too many files
+        ThumbnailCache(the_session, directory=directory, max_files=0)
+        assert os.listdir(directory) == []
+    finally:
+        the_session.close()
+    del application